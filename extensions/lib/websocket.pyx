@@ -295,5 +295,5 @@ cdef class FrameParser:
 
     cdef bytes _chunk(self, int length):
         cdef bytes chunk = bytes(self.buffer[:length])
-        self.buffer = self.buffer[length:]
+        del self.buffer[:length]
         return chunk
@@ -25,6 +25,13 @@ Redis Pipeline
 .. autoclass:: pulsar.apps.data.redis.client.Pipeline
    :members:
    :member-order: bysource
+
+Client Cache
+~~~~~~~~~~~~~~~
+
+.. autoclass:: pulsar.apps.data.redis.cache.ClientCache
+   :members:
+   :member-order: bysource
 '''
 from pulsar.utils.config import Global
 from pulsar.apps.data import register_store
@@ -33,11 +40,12 @@ from pulsar.apps.ds import RedisError, NoScriptError, redis_parser
 from .store import RedisStore, RedisStoreConnection
 from .client import ResponseError, Consumer, Pipeline
 from .lock import RedisScript, LockError
+from .cache import ClientCache
 
 
 __all__ = ['RedisStore', 'RedisError', 'NoScriptError', 'redis_parser',
            'RedisStoreConnection', 'Consumer', 'Pipeline', 'ResponseError',
-           'RedisScript', 'LockError']
+           'RedisScript', 'LockError', 'ClientCache']
 
 
 class RedisServer(Global):
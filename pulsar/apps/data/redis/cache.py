@@ -0,0 +1,197 @@
+'''Client side caching for :class:`.RedisStore`.
+
+Replies of read commands on a single key are kept in a local LRU cache.
+Connections of the store pool enable ``CLIENT TRACKING`` and redirect
+invalidation messages to a dedicated connection subscribed to the
+``__redis__:invalidate`` channel, which removes the entries of modified
+keys. The cache is cleared when this connection is lost.
+'''
+from collections import OrderedDict, deque
+from functools import partial
+
+from pulsar.utils.string import to_bytes, to_string
+from pulsar.apps.ds import COMMANDS_INFO
+
+from .pubsub import PubsubProtocol
+
+
+INVALIDATE_CHANNEL = b'__redis__:invalidate'
+# read commands on a single key with immutable replies
+CACHED_COMMANDS = frozenset(('exists', 'get', 'getrange', 'hexists', 'hget',
+                             'hlen', 'lindex', 'llen', 'scard', 'sismember',
+                             'strlen', 'type', 'zcard', 'zrank', 'zscore'))
+
+
+class InvalidationProtocol(PubsubProtocol):
+    '''Connection receiving invalidation messages.
+
+    Commands wait for their reply, which the server sends in order.
+    '''
+    def __init__(self, handler, **kw):
+        super().__init__(handler, **kw)
+        self._waiters = deque()
+        self.bind_event('connection_lost', self._cancel_waiters)
+
+    async def execute(self, *args):
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        self._transport.write(self.parser.multi_bulk(args))
+        return await waiter
+
+    def reply(self, response):
+        if not self._waiters:
+            return super().reply(response)
+        waiter = self._waiters.popleft()
+        if waiter.done():
+            pass
+        elif isinstance(response, Exception):
+            waiter.set_exception(response)
+        else:
+            waiter.set_result(response)
+
+    def _cancel_waiters(self, connection, exc=None):
+        while self._waiters:
+            self._waiters.popleft().cancel()
+
+
+class ClientCache:
+    '''LRU cache of replies invalidated by the server.
+
+    .. attribute:: size
+
+        Maximum number of replies in the cache.
+    '''
+    def __init__(self, store, size):
+        self.store = store
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # replies by command and arguments, and cache entries by key
+        self._data = OrderedDict()
+        self._keys = {}
+        # incremented by each invalidation, replies received after an
+        # invalidation of their request are not cached
+        self._epoch = 0
+        self._connection = None
+        self._client_id = None
+        self._starting = None
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def _loop(self):
+        return self.store._loop
+
+    async def execute(self, args, options):
+        command = to_string(args[0]).lower()
+        if command not in CACHED_COMMANDS or len(args) < 2:
+            info = COMMANDS_INFO.get(command)
+            # do not wait for the server to read our own writes
+            if command in ('flushall', 'flushdb'):
+                self.clear()
+            elif info and info.write:
+                self._invalidate_args(args[1:])
+            return await self.store._execute(args, options)
+        try:
+            entry = (command,) + tuple(args[1:]) + tuple(
+                sorted(options.items()))
+            value = self._data.get(entry, self)
+        except TypeError:
+            return await self.store._execute(args, options)
+        if value is not self:
+            self.hits += 1
+            self._data.move_to_end(entry)
+            return value
+        self.misses += 1
+        client_id = await self._tracking_id()
+        epoch = self._epoch
+        connection = await self.store._pool.connect()
+        with connection:
+            if connection.tracking_redirect != client_id:
+                await connection.execute('CLIENT', 'TRACKING', 'ON',
+                                         'REDIRECT', client_id)
+                connection.tracking_redirect = client_id
+            value = await connection.execute(*args, **options)
+        if epoch == self._epoch and client_id == self._client_id:
+            self._set(entry, to_bytes(args[1]), value)
+        return value
+
+    def clear(self):
+        self._epoch += 1
+        self._data.clear()
+        self._keys.clear()
+
+    def close(self):
+        if self._connection:
+            return self._connection.close()
+
+    def broadcast(self, response):
+        '''Invalidation message received'''
+        channel, keys = response
+        if channel == INVALIDATE_CHANNEL:
+            if keys is None:
+                self.clear()
+            else:
+                self._invalidate(keys)
+
+    #    INTERNALS
+    async def _tracking_id(self):
+        # The id of the connection receiving invalidation messages, which
+        # is opened once by concurrent requests
+        if self._client_id is None:
+            if self._starting is None:
+                self._starting = self._loop.create_task(self._start())
+            try:
+                await self._starting
+            except Exception:
+                self._starting = None
+                raise
+        return self._client_id
+
+    async def _start(self):
+        protocol_factory = partial(InvalidationProtocol, self,
+                                   producer=self.store)
+        connection = await self.store.connect(protocol_factory)
+        self._connection = connection
+        connection.bind_event('connection_lost', self._connection_lost)
+        client_id = await connection.execute('CLIENT', 'ID')
+        await connection.execute('SUBSCRIBE', INVALIDATE_CHANNEL)
+        self._client_id = client_id
+
+    def _set(self, entry, key, value):
+        data = self._data
+        data[entry] = value
+        entries = self._keys.get(key)
+        if entries is None:
+            self._keys[key] = entries = set()
+        entries.add(entry)
+        while len(data) > self.size:
+            entry, _ = data.popitem(last=False)
+            self._forget(entry)
+
+    def _forget(self, entry):
+        key = to_bytes(entry[1])
+        entries = self._keys.get(key)
+        if entries:
+            entries.discard(entry)
+            if not entries:
+                self._keys.pop(key)
+
+    def _invalidate(self, keys):
+        self._epoch += 1
+        data = self._data
+        for key in keys:
+            for entry in self._keys.pop(key, ()):
+                data.pop(entry, None)
+
+    def _invalidate_args(self, args):
+        keys = self._keys
+        self._invalidate([key for key in map(to_bytes, args) if key in keys])
+
+    def _connection_lost(self, connection, exc=None):
+        # Invalidation messages can be lost, start again
+        self._connection = None
+        self._client_id = None
+        self._starting = None
+        self.clear()
@@ -1,4 +1,5 @@
 from itertools import chain
+from functools import partial
 import datetime
 
 import pulsar
@@ -90,6 +91,27 @@ def values_to_zset(response, withscores=False, **kw):
         return response
 
 
+def scan_callback(response, factory=None):
+    cursor, values = response
+    return int(cursor), factory(values) if factory else values
+
+
+def zscan_pairs(values):
+    it = iter(values)
+    return [(member, float(score)) for member, score in zip(it, it)]
+
+
+def scan_args(match, count, type=None):
+    pieces = []
+    if match is not None:
+        pieces.extend((b'MATCH', match))
+    if count is not None:
+        pieces.extend((b'COUNT', count))
+    if type is not None:
+        pieces.extend((b'TYPE', type))
+    return pieces
+
+
 def sort_return_tuples(response, groups=None, **options):
     """
     If ``groups`` is specified, return the response as a list of
@@ -136,7 +158,11 @@ class Consumer(pulsar.ProtocolConsumer):
             'TIME': lambda x: (int(float(x[0])), int(float(x[1]))),
             'HGETALL': pairs_to_object,
             'HMGET': values_to_object,
-            'TYPE': lambda r: r.decode('utf-8')
+            'TYPE': lambda r: r.decode('utf-8'),
+            'SCAN': scan_callback,
+            'SSCAN': scan_callback,
+            'HSCAN': partial(scan_callback, factory=pairs_to_object),
+            'ZSCAN': partial(scan_callback, factory=zscan_pairs)
         }
     )
 
@@ -227,6 +253,15 @@ class RedisClient:
 
     # special commands
 
+    # KEYS
+    def scan(self, cursor=0, match=None, count=None, type=None):
+        '''Incrementally iterate over the keys of the database.
+
+        Return a two elements tuple with the cursor for the next call,
+        ``0`` once the iteration is complete, and the list of keys.
+        '''
+        return self.execute('scan', cursor, *scan_args(match, count, type))
+
     # STRINGS
     def decrby(self, key, ammount=None):
         if ammount is None:
@@ -285,6 +320,9 @@ class RedisClient:
         [args.extend(pair) for pair in mapping_iterator(iterable)]
         return self.execute('hmset', key, *args)
 
+    def hscan(self, key, cursor=0, match=None, count=None):
+        return self.execute('hscan', key, cursor, *scan_args(match, count))
+
     # LISTS
     def blpop(self, keys, timeout=0):
         if timeout is None:
@@ -311,6 +349,10 @@ class RedisClient:
             timeout = 0
         return self.execute_command('BRPOPLPUSH', src, dst, timeout)
 
+    # SETS
+    def sscan(self, key, cursor=0, match=None, count=None):
+        return self.execute('sscan', key, cursor, *scan_args(match, count))
+
     # SORTED SETS
     def zadd(self, name, *args, **kwargs):
         """
@@ -401,6 +443,9 @@ class RedisClient:
         return self.execute_command('ZREVRANGEBYSCORE', key, min, max, *pieces,
                                     withscores=withscores)
 
+    def zscan(self, key, cursor=0, match=None, count=None):
+        return self.execute('zscan', key, cursor, *scan_args(match, count))
+
     def eval(self, script, keys=None, args=None):
         return self._eval('eval', script, keys, args)
 
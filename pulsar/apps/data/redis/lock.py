@@ -2,6 +2,7 @@ import uuid
 from asyncio import sleep
 
 from pulsar import isawaitable, LockError, LockBase
+from pulsar.apps.ds import NoScriptError
 
 
 class RedisScript:
@@ -15,15 +16,24 @@ class RedisScript:
         '''Execute the script, passing any required ``args``
         '''
         if self.sha not in client.store.loaded_scripts:
-            sha = await client.immediate_execute('SCRIPT', 'LOAD', self.script)
-            self.sha = sha.decode('utf-8')
-            client.store.loaded_scripts.add(self.sha)
-
-        result = client.evalsha(self.sha, keys, args)
-        if isawaitable(result):
-            result = await result
+            await self._load(client)
+        try:
+            result = client.evalsha(self.sha, keys, args)
+            if isawaitable(result):
+                result = await result
+        except NoScriptError:
+            # the script cache of the server was flushed
+            await self._load(client)
+            result = client.evalsha(self.sha, keys, args)
+            if isawaitable(result):
+                result = await result
         return result
 
+    async def _load(self, client):
+        sha = await client.immediate_execute('SCRIPT', 'LOAD', self.script)
+        self.sha = sha.decode('utf-8')
+        client.store.loaded_scripts.add(self.sha)
+
 
 class Lock(LockBase):
     """Asynchronous locking primitive for distributing computing
@@ -22,19 +22,20 @@ class PubsubProtocol(Protocol):
         parser.feed(data)
         response = parser.get()
         while response is not False:
-            if not isinstance(response, Exception):
-                if isinstance(response, list):
-                    command = response[0]
-                    if command == b'message':
-                        response = response[1:3]
-                        self.handler.broadcast(response)
-                    elif command == b'pmessage':
-                        response = response[2:4]
-                        self.handler.broadcast(response)
+            command = response[0] if isinstance(response, list) else None
+            if command == b'message':
+                self.handler.broadcast(response[1:3])
+            elif command == b'pmessage':
+                self.handler.broadcast(response[2:4])
             else:
-                raise response
+                self.reply(response)
             response = parser.get()
 
+    def reply(self, response):
+        '''Reply to a command, errors are raised'''
+        if isinstance(response, Exception):
+            raise response
+
 
 class RedisPubSub(PubSub):
     '''Asynchronous Publish/Subscriber handler for pulsar and redis stores.
@@ -7,9 +7,12 @@ from pulsar.apps.ds import redis_parser
 
 from .client import RedisClient, Pipeline, Consumer, ResponseError
 from .pubsub import RedisPubSub, RedisChannels
+from .cache import ClientCache
 
 
 class RedisStoreConnection(Connection):
+    # client id receiving the invalidation messages of this connection
+    tracking_redirect = None
 
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
@@ -34,12 +37,17 @@ class RedisStoreConnection(Connection):
 
 class RedisStore(RemoteStore):
     '''Redis :class:`.Store` implementation.
+
+    When ``client_cache`` is a positive number, up to that number of
+    replies of read commands on single keys, such as ``GET`` and
+    ``HGET``, are cached in process and invalidated by the server with
+    ``CLIENT TRACKING``, see :class:`.ClientCache`.
     '''
     protocol_factory = partial(RedisStoreConnection, Consumer)
     supported_queries = frozenset(('filter', 'exclude'))
 
     def _init(self, namespace=None, parser_class=None, pool_size=50,
-              decode_responses=False, **kwargs):
+              decode_responses=False, client_cache=0, **kwargs):
         self._decode_responses = decode_responses
         if not parser_class:
             actor = get_actor()
@@ -48,6 +56,11 @@ class RedisStore(RemoteStore):
         self._parser_class = parser_class
         if namespace:
             self._urlparams['namespace'] = namespace
+        client_cache = int(client_cache)
+        self._cache = None
+        if client_cache > 0:
+            self._urlparams['client_cache'] = client_cache
+            self._cache = ClientCache(self, client_cache)
         self._pool = Pool(self.connect, pool_size=pool_size, loop=self._loop)
         if self._database is None:
             self._database = 0
@@ -58,6 +71,11 @@ class RedisStore(RemoteStore):
     def pool(self):
         return self._pool
 
+    @property
+    def cache(self):
+        '''The :class:`.ClientCache` or ``None``'''
+        return self._cache
+
     @property
     def namespace(self):
         '''The prefix namespace to append to all transaction on keys
@@ -86,6 +104,11 @@ class RedisStore(RemoteStore):
         return self.client().ping()
 
     async def execute(self, *args, **options):
+        if self._cache is not None:
+            return await self._cache.execute(args, options)
+        return await self._execute(args, options)
+
+    async def _execute(self, args, options):
         connection = await self._pool.connect()
         with connection:
             result = await connection.execute(*args, **options)
@@ -117,6 +140,8 @@ class RedisStore(RemoteStore):
 
     def close(self):
         '''Close all open connections.'''
+        if self._cache is not None:
+            self._cache.close()
         return self._pool.close()
 
     def has_query(self, query_type):
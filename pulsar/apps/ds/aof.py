@@ -0,0 +1,317 @@
+'''Append only file persistence for pulsar-ds.
+
+Write commands which changed the dataset are appended to the file using
+the redis protocol, the same encoding clients use to send commands.
+On startup the file is replayed, command by command, to rebuild the
+databases. A background rewrite replaces the log with the shortest
+sequence of commands which recreates the current dataset.
+'''
+import os
+import time
+from itertools import chain
+
+from .client import ClientMixin, COMMANDS_INFO
+from .utils import ForkSave, format_stream_id
+
+
+# Number of elements in a single command when rewriting collections
+REWRITE_ITEMS_PER_COMMAND = 64
+# Do not rewrite automatically files smaller than this
+REWRITE_MIN_SIZE = 64*1024*1024
+# Size of the chunks read from the file when loading
+LOAD_CHUNK_SIZE = 64*1024
+
+
+class AppendOnlyFile:
+    '''The append only file of a :class:`.Storage`.
+
+    .. attribute:: fsync
+
+        When to call :func:`os.fsync` on the file: ``always`` after
+        every write command, ``everysec`` at most once a second in a
+        thread of the default executor, ``no`` leave it to the operative
+        system.
+    '''
+    def __init__(self, store, filename, fsync):
+        self.store = store
+        self.filename = filename
+        self.fsync = fsync
+        self.logger = store.logger
+        self._loop = store._loop
+        self._pack = store._parser.pack_command
+        self._buffer = []
+        self._db = None
+        self._file = None
+        self._fsync_pending = False
+        self._last_fsync = time.time()
+        self._unsynced = False
+        self._rewriter = None
+        self._rewrite_buffer = None
+        self._rewrite_started = None
+        self._last_rewrite_duration = -1
+        self._last_rewrite_status = 'ok'
+        self._base_size = 0
+
+    @property
+    def size(self):
+        return self._file.tell() if self._file else 0
+
+    def load(self):
+        '''Replay the file into the databases of :attr:`store`.
+        '''
+        count = 0
+        if os.path.isfile(self.filename):
+            self.logger.info('loading data from "%s"', self.filename)
+            client = LoadingClient(self.store)
+            parser = self.store._parser
+            with open(self.filename, 'rb') as file:
+                chunk = file.read(LOAD_CHUNK_SIZE)
+                while chunk:
+                    parser.feed(chunk)
+                    request = parser.get()
+                    while request is not False:
+                        client.execute(request)
+                        count += 1
+                        request = parser.get()
+                    chunk = file.read(LOAD_CHUNK_SIZE)
+            self.logger.info('replayed %d commands from "%s"', count,
+                             self.filename)
+        self._file = open(self.filename, 'ab')
+        self._base_size = self.size
+        return count
+
+    def feed(self, num, request):
+        '''Append ``request`` executed against database ``num``.
+        '''
+        if not self._buffer and self.fsync != 'always':
+            self._loop.call_soon(self.flush)
+        if num != self._db:
+            self._db = num
+            self._append(self._pack((b'select', num)))
+        self._append(self._pack(request))
+        if self.fsync == 'always':
+            self.flush()
+
+    def flush(self):
+        '''Write the buffer to the file and fsync according to policy.
+        '''
+        if self._file is None:
+            return
+        if self._buffer:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._file.write(data)
+            self._file.flush()
+            self._unsynced = True
+        if self._unsynced:
+            if self.fsync == 'always':
+                os.fsync(self._file.fileno())
+                self._unsynced = False
+            elif (self.fsync == 'everysec' and not self._fsync_pending and
+                    time.time() - self._last_fsync >= 1):
+                self._fsync_pending = True
+                self._unsynced = False
+                fut = self._loop.run_in_executor(None, os.fsync,
+                                                 self._file.fileno())
+                fut.add_done_callback(self._fsync_done)
+
+    def close(self):
+        if self._file:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def cron(self):
+        '''Invoked periodically by the :class:`.Storage` cron task.
+        '''
+        self.flush()
+        rewriter = self._rewriter
+        if rewriter:
+            if not rewriter.is_alive():
+                self._rewrite_done(rewriter.exitcode)
+        elif self.size > max(REWRITE_MIN_SIZE, 2*self._base_size):
+            self.logger.info('Starting automatic rewriting of append only '
+                             'file')
+            self.rewrite()
+
+    def rewrite(self):
+        '''Rewrite the file in the background.
+
+        Return ``False`` if a rewrite is already in progress.
+        '''
+        if self._rewriter:
+            return False
+        self._rewrite_started = time.time()
+        self._rewrite_buffer = []
+        # make sure the rewrite buffer starts with a select command
+        self._db = None
+        if hasattr(os, 'fork'):
+            self._rewriter = ForkSave(self._write_dataset)
+            self._rewriter.start()
+        else:   # pragma    nocover
+            self._write_dataset()
+            self._rewrite_done(0)
+        return True
+
+    def info(self):
+        rewriting = self._rewrite_started is not None
+        current = (int(time.time() - self._rewrite_started) if rewriting
+                   else -1)
+        return {'aof_enabled': 1,
+                'aof_fsync': self.fsync,
+                'aof_rewrite_in_progress': int(rewriting),
+                'aof_last_rewrite_time_sec': self._last_rewrite_duration,
+                'aof_current_rewrite_time_sec': current,
+                'aof_last_bgrewrite_status': self._last_rewrite_status,
+                'aof_current_size': self.size,
+                'aof_base_size': self._base_size,
+                'aof_buffer_length': sum((len(b) for b in self._buffer))}
+
+    # INTERNALS
+    def _append(self, data):
+        self._buffer.append(data)
+        if self._rewrite_buffer is not None:
+            self._rewrite_buffer.append(data)
+
+    def _fsync_done(self, fut):
+        self._fsync_pending = False
+        self._last_fsync = time.time()
+        if fut.exception():
+            self.logger.error('Could not fsync append only file: %s',
+                              fut.exception())
+
+    def _temp_filename(self):
+        path, name = os.path.split(self.filename)
+        return os.path.join(path, 'temp-rewrite-%s' % name)
+
+    def _write_dataset(self):
+        pack = self._pack
+        with open(self._temp_filename(), 'wb') as file:
+            for db in self.store.databases.values():
+                if len(db):
+                    file.write(pack((b'select', db._num)))
+                    for request in rewrite_requests(self.store, db):
+                        file.write(pack(request))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _rewrite_done(self, exitcode):
+        self._rewriter = None
+        self._last_rewrite_duration = int(time.time() -
+                                          self._rewrite_started)
+        self._rewrite_started = None
+        buffer, self._rewrite_buffer = self._rewrite_buffer, None
+        temp = self._temp_filename()
+        if exitcode:
+            self._last_rewrite_status = 'err'
+            self.logger.error('Background append only file rewriting failed '
+                              'with exit code %s', exitcode)
+            if os.path.isfile(temp):
+                os.remove(temp)
+            return
+        self.flush()
+        with open(temp, 'ab') as file:
+            file.write(b''.join(buffer))
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(temp, self.filename)
+        self._file = open(self.filename, 'ab')
+        self._base_size = self.size
+        self._last_rewrite_status = 'ok'
+        self.logger.info('Background append only file rewriting completed')
+
+
+class LoadingClient(ClientMixin):
+    '''A client executing commands read from an append only file.
+    '''
+    _forwarding = False
+    _readonly = False
+    # commands were accepted under the memory limit when first executed
+    _memory_limited = False
+    _monitored = False
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._loop = store._loop
+        self.password = store._password
+        self.channels = ()
+        self.patterns = ()
+        self.watched_keys = None
+
+    def execute(self, request):
+        request[0] = command = request[0].decode('utf-8').lower()
+        info = COMMANDS_INFO.get(command)
+        handle = getattr(self.store, info.method_name) if info else None
+        self._execute_command(handle, request)
+
+    def reply_error(self, value, prefix=None):
+        self.store.logger.warning('Error while loading append only file: '
+                                  '%s', value)
+
+    def _noop(self, *args):
+        pass
+
+    reply_ok = reply_status = reply_wrongtype = reply_int = _noop
+    reply_one = reply_zero = reply_bulk = reply_multi_bulk = _noop
+    reply_multi_bulk_len = _send = _noop
+
+
+def rewrite_requests(store, db):
+    '''Generator of commands which recreate the data in ``db``.
+    '''
+    n = REWRITE_ITEMS_PER_COMMAND
+    for key, value in chain(db._data.items(), db._expires.items()):
+        name = store._type_name_map[type(value)]
+        if name == 'string':
+            yield (b'set', key, bytes(value))
+        elif name == 'list':
+            items = list(value)
+            for i in range(0, len(items), n):
+                yield (b'rpush', key) + tuple(items[i:i+n])
+        elif name == 'set':
+            items = list(value)
+            for i in range(0, len(items), n):
+                yield (b'sadd', key) + tuple(items[i:i+n])
+        elif name == 'hash':
+            items = list(value.flat())
+            for i in range(0, len(items), 2*n):
+                yield (b'hmset', key) + tuple(items[i:i+2*n])
+        elif name == 'zset':
+            items = []
+            for score, member in value.items():
+                items.extend((repr(score), member))
+            for i in range(0, len(items), 2*n):
+                yield (b'zadd', key) + tuple(items[i:i+2*n])
+        elif name == 'stream':
+            for request in rewrite_stream(key, value):
+                yield request
+        when = db._deadlines.get(key)
+        if when is not None:
+            yield (b'pexpireat', key, store._unix_time_ms(when))
+
+
+def rewrite_stream(key, value):
+    '''Generator of commands which recreate the stream ``value``, its
+    consumer groups and their pending entries.
+    '''
+    for id, fields in value:
+        yield (b'xadd', key, format_stream_id(id)) + tuple(fields)
+    if not value:
+        # an empty stream is created by adding an entry trimmed right away
+        yield (b'xadd', key, b'maxlen', b'0',
+               format_stream_id(max(value.last_id, (0, 1))), b'x', b'y')
+    yield (b'xsetid', key, format_stream_id(value.last_id),
+           b'entriesadded', value.entries_added,
+           b'maxdeletedid', format_stream_id(value.max_deleted_id))
+    for name, group in value.groups.items():
+        yield (b'xgroup', b'create', key, name,
+               format_stream_id(group.last_id),
+               b'entriesread', group.entries_read)
+        for consumer in group.consumers.values():
+            yield (b'xgroup', b'createconsumer', key, name, consumer.name)
+            for id, pe in consumer.pending.items():
+                yield (b'xclaim', key, name, consumer.name, 0,
+                       format_stream_id(id), b'time', pe.delivery_time,
+                       b'retrycount', pe.delivery_count, b'force',
+                       b'justid')
@@ -0,0 +1,142 @@
+'''Bitmap operations on pulsar-ds strings for ``BITCOUNT``, ``BITOP``,
+``BITPOS`` and ``BITFIELD``.
+
+Strings are ``bytearray`` and bit ``0`` is the most significant bit of
+the first byte, as in redis. Rather than looping over single bytes in
+python, operations convert chunks of :data:`CHUNK_SIZE` bytes into
+python integers, so that counting, combining and searching bits run in
+C over machine words. Chunks bound the size of the temporary integers
+for large bitmaps.
+'''
+from functools import reduce
+from operator import and_, or_, xor
+
+
+CHUNK_SIZE = 1 << 16
+OPERATORS = {b'and': and_, b'or': or_, b'xor': xor}
+OVERFLOWS = (b'wrap', b'sat', b'fail')
+
+
+if hasattr(int, 'bit_count'):
+    def popcount(value):
+        '''Number of bits set in the non negative integer ``value``'''
+        return value.bit_count()
+else:   # pragma    nocover
+    def popcount(value):
+        '''Number of bits set in the non negative integer ``value``'''
+        return bin(value).count('1')
+
+
+def chunks(data, start, end):
+    '''Iterator over the chunks of ``data`` from byte ``start`` to byte
+    ``end`` excluded, as integers and their size in bits'''
+    with memoryview(data) as view:
+        for i in range(start, end, CHUNK_SIZE):
+            chunk = view[i:min(i + CHUNK_SIZE, end)]
+            yield int.from_bytes(chunk, 'big'), 8*len(chunk)
+
+
+def bit_count(data, start=0, end=None):
+    '''Number of bits set in ``data`` from bit ``start`` to bit ``end``
+    excluded'''
+    end = 8*len(data) if end is None else min(end, 8*len(data))
+    if start >= end:
+        return 0
+    first, last = start >> 3, (end + 7) >> 3
+    count = sum(popcount(value) for value, _ in chunks(data, first, last))
+    # remove the bits of the first and last bytes outside the range
+    if start & 7:
+        count -= popcount(data[first] >> (8 - (start & 7)))
+    if end & 7:
+        count -= popcount(data[last - 1] & ((1 << (8 - (end & 7))) - 1))
+    return count
+
+
+def bit_pos(data, bit, start=0, end=None):
+    '''Position of the first bit equal to ``bit`` in ``data`` from bit
+    ``start`` to bit ``end`` excluded, ``-1`` when there is none'''
+    end = 8*len(data) if end is None else min(end, 8*len(data))
+    if start >= end:
+        return -1
+    first, last = start >> 3, (end + 7) >> 3
+    pos = first << 3
+    for value, size in chunks(data, first, last):
+        if not bit:
+            value ^= (1 << size) - 1
+        if pos < start:
+            value &= (1 << (size + pos - start)) - 1
+        if value:
+            pos += size - value.bit_length()
+            return pos if pos < end else -1
+        pos += size
+    return -1
+
+
+def bit_op(op, values):
+    '''The ``bytearray`` result of the bitwise operation ``op``, one of
+    ``and``, ``or``, ``xor`` and ``not``, on byte ``values``.
+
+    Values shorter than the longest one are padded with zero bytes.
+    '''
+    size = max(len(value) for value in values)
+    result = bytearray(size)
+    views = [memoryview(value) for value in values]
+    try:
+        for i in range(0, size, CHUNK_SIZE):
+            n = min(CHUNK_SIZE, size - i)
+            ints = []
+            for view in views:
+                chunk = view[i:i + n]
+                ints.append(int.from_bytes(chunk, 'big') <<
+                            8*(n - len(chunk)))
+            if op == b'not':
+                value = ints[0] ^ ((1 << 8*n) - 1)
+            else:
+                value = reduce(OPERATORS[op], ints)
+            result[i:i + n] = value.to_bytes(n, 'big')
+    finally:
+        for view in views:
+            view.release()
+    return result
+
+
+def get_field(data, offset, bits, signed=False):
+    '''The integer of ``bits`` bits at bit ``offset`` of ``data``, bits
+    past the end of ``data`` are zero'''
+    first, last = offset >> 3, (offset + bits + 7) >> 3
+    chunk = data[first:last]
+    value = int.from_bytes(chunk, 'big') << 8*(last - first - len(chunk))
+    value = (value >> (8*last - offset - bits)) & ((1 << bits) - 1)
+    if signed and value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def set_field(data, offset, bits, value):
+    '''Set the ``bits`` bits at bit ``offset`` of the ``bytearray``
+    ``data`` to the integer ``value``, growing ``data`` when needed'''
+    first, last = offset >> 3, (offset + bits + 7) >> 3
+    if last > len(data):
+        data.extend(bytes(last - len(data)))
+    shift = 8*last - offset - bits
+    mask = ((1 << bits) - 1) << shift
+    current = int.from_bytes(data[first:last], 'big')
+    current = (current & ~mask) | ((value << shift) & mask)
+    data[first:last] = current.to_bytes(last - first, 'big')
+
+
+def overflow(value, bits, signed, behaviour):
+    '''Fit ``value`` into a field of ``bits`` bits with the ``OVERFLOW``
+    ``behaviour``, ``None`` when it does not fit and ``behaviour`` is
+    ``fail``'''
+    if signed:
+        low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    else:
+        low, high = 0, (1 << bits) - 1
+    if low <= value <= high:
+        return value
+    elif behaviour == b'wrap':
+        value &= (1 << bits) - 1
+        return value - (1 << bits) if value > high else value
+    elif behaviour == b'sat':
+        return high if value > high else low
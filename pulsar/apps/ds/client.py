@@ -1,3 +1,4 @@
+import re
 import time
 from functools import partial
 
@@ -42,6 +43,14 @@ class command:
 
 
 class ClientMixin:
+    # requests on keys owned by other shards are forwarded to them
+    _forwarding = True
+    # write commands are refused by replicas
+    _readonly = True
+    # write commands evict keys, or are refused, above the memory limit
+    _memory_limited = True
+    # commands are recorded in the command statistics and the slow log
+    _monitored = True
 
     def __init__(self, store):
         self.store = store
@@ -50,6 +59,7 @@ class ClientMixin:
         self.last_command = ''
         self.flag = 0
         self.blocked = None
+        self.tracking = None
 
     @property
     def db(self):
@@ -72,7 +82,7 @@ class ClientMixin:
                 return self.reply_error('Blocked client cannot request')
             if self.transaction is not None and command not in 'exec':
                 self.transaction.append((handle, request))
-                return self._transport.write(self.store.QUEUED)
+                return self._send(self.store.QUEUED)
         self._execute_command(handle, request)
 
     def _execute_command(self, handle, request):
@@ -82,11 +92,38 @@ class ClientMixin:
                 if not handle:
                     self._loop.logger.info("unknown command '%s'" % command)
                     return self.reply_error("unknown command '%s'" % command)
-                if self.store._password != self.password:
+                store = self.store
+                info = handle._info
+                if store._password != self.password:
                     if command != 'auth':
                         return self.reply_error(
                             'Authentication required', 'NOAUTH')
-                handle(self, request, len(request) - 1)
+                if (store._shards is not None and self._forwarding and
+                        store._shards.route(self, info, request)):
+                    return
+                if (info.write and self._readonly and
+                        store._replication.master is not None):
+                    return self.reply_error(store.READONLY, 'READONLY')
+                if store._loading and store._is_loading(self, info):
+                    return self.reply_error(store.LOADING, 'LOADING')
+                if (store._maxmemory and info.write and
+                        self._memory_limited and
+                        not store._free_memory() and
+                        command not in store.FREE_COMMANDS):
+                    return self.reply_error(store.OOM, 'OOM')
+                dirty = store._dirty
+                if self._monitored:
+                    start = time.perf_counter()
+                    try:
+                        handle(self, request, len(request) - 1)
+                    finally:
+                        store._command_executed(self, info.name, request,
+                                                time.perf_counter() - start)
+                else:
+                    handle(self, request, len(request) - 1)
+                if self.tracking is not None and not info.write:
+                    store._track(self, info, request)
+                store._propagate(self.db, info, request, dirty)
             else:
                 command = ''
                 return self.reply_error("no command")
@@ -102,6 +139,12 @@ class ClientMixin:
     def reply_ok(self):
         raise NotImplementedError
 
+    def _send(self, data):
+        raise NotImplementedError
+
+    def _wait(self, future):
+        raise NotImplementedError
+
     def reply_status(self, status):
         raise NotImplementedError
 
@@ -136,6 +179,8 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
     def __init__(self, cfg, *args, **kw):
         super().__init__(*args, **kw)
         ClientMixin.__init__(self, self._producer._key_value_store)
+        self.id = next(self.store._client_ids)
+        self.store._clients[self.id] = self
         self.cfg = cfg
         self.parser = self._producer._parser_class()
         self.started = time.time()
@@ -143,6 +188,10 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
         self.patterns = set()
         self.watched_keys = None
         self.password = b''
+        # replies waiting to be written, while processing received data
+        self._buffer = None
+        # reply of a request executed by another shard
+        self._waiting = None
         self.bind_event('connection_lost',
                         partial(self.store._remove_connection, self))
 
@@ -186,69 +235,126 @@ class PulsarStoreClient(pulsar.Protocol, ClientMixin):
     # Protocol Implementaton
     def data_received(self, data):
         self.parser.feed(data)
-        request = self.parser.get()
-        while request is not False:
-            if self.store._monitors:
-                self.store._write_to_monitors(self, request)
-            self.execute(request)
-            request = self.parser.get()
+        if self._waiting is None:
+            self._execute_requests()
+
+    def close(self):
+        # Pending replies are written before closing
+        buffer = self._buffer
+        if buffer:
+            self._transport.write(b''.join(buffer))
+            del buffer[:]
+        return super().close()
 
     # Internals
+    def _execute_requests(self):
+        # Replies to all requests received are written in one go. Requests
+        # following one executed by another shard stay in the parser until
+        # its reply is available
+        request = self.parser.get()
+        self._buffer = buffer = []
+        try:
+            while request is not False:
+                if self.store._monitors:
+                    self.store._write_to_monitors(self, request)
+                self.execute(request)
+                if self._waiting is not None:
+                    break
+                request = self.parser.get()
+        finally:
+            self._buffer = None
+            if buffer:
+                self._send(buffer[0] if len(buffer) == 1 else
+                           b''.join(buffer))
+
+    def _wait(self, future):
+        self._waiting = future
+        future.add_done_callback(self._resume)
+
+    def _resume(self, future):
+        self._waiting = None
+        try:
+            self._write(future.result())
+        except Exception:
+            self._loop.logger.exception("Server error on '%s' command",
+                                        self.last_command)
+            self.reply_error('Server Error')
+        if not self._transport._closing:
+            self._execute_requests()
+
     def _write(self, response):
         if self.transaction is not None:
             self.transaction.append(response)
+        else:
+            self._send(response)
+
+    def _send(self, data):
+        if self._buffer is not None:
+            self._buffer.append(data)
         elif not self._transport._closing:
-            self._transport.write(response)
+            self._transport.write(data)
 
 
 class Blocked:
-    '''Handle blocked keys for a client
+    '''Handle blocked keys for a client.
+
+    The client waits in the queue of each of its keys, an ordered
+    dictionary of clients in arrival order, so that pushes serve clients
+    first come first served. Timeouts are deadlines in the store
+    :class:`.ExpiryHeap` of blocked clients, checked by the store cron task.
+    Stream reads keep their options in ``data``.
     '''
-    def __init__(self, client, command, keys, timeout, dest=None):
+    def __init__(self, client, command, keys, timeout, dest=None, data=None):
         self.command = command
         self.keys = set(keys)
         self.dest = dest
+        self.data = data
         self._called = False
+        store = client.store
         db = client.db
         for key in self.keys:
-            clients = db._blocking_keys.get(key)
-            if clients is None:
-                db._blocking_keys[key] = clients = set()
-            clients.add(client)
-        client.store._bpop_blocked_clients += 1
+            waiters = db._blocking_keys.get(key)
+            if waiters is None:
+                db._blocking_keys[key] = waiters = OrderedDict()
+            waiters[client] = None
+        store._bpop_blocked_clients += 1
+        # the sequence number keeps clients with the same deadline ordered
+        self.deadline_key = (next(store._bpop_sequence), client)
         if timeout:
-            self.handle = client._loop.call_later(
-                timeout, self.unblock, client)
-        else:
-            self.handle = None
+            store._bpop_deadlines.set(self.deadline_key,
+                                      store._loop.time() + timeout)
 
     def unblock(self, client, key=None, value=None):
         if not self._called:
-            self._called = True
-            if self.handle:
-                self.handle.cancel()
             store = client.store
-            client.blocked = None
-            store._bpop_blocked_clients -= 1
-            #
-            # make sure to remove the client from the set of blocked
-            # clients in the database associated with key
-            if key is None:
-                bkeys = client.db._blocking_keys
-                for key in self.keys:
-                    clients = bkeys.get(key)
-                    if clients:
-                        clients.discard(client)
-                        if not clients:
-                            bkeys.pop(key)
+            self.cancel(client)
             #
             # send the response
             if value is None:
                 client._write(store.NULL_ARRAY)
+            elif self.data is not None:
+                store._stream_callback(client, self, key, value)
             else:
                 store._block_callback(client, self.command, key,
                                       value, self.dest)
 
+    def cancel(self, client):
+        '''Remove the client from the queues of its keys without replying
+        '''
+        if not self._called:
+            self._called = True
+            store = client.store
+            store._bpop_deadlines.discard(self.deadline_key)
+            client.blocked = None
+            store._bpop_blocked_clients -= 1
+            bkeys = client.db._blocking_keys
+            for key in self.keys:
+                waiters = bkeys.get(key)
+                if waiters:
+                    waiters.pop(client, None)
+                    if not waiters:
+                        bkeys.pop(key)
+
 
 def redis_to_py_pattern(pattern):
     return ''.join(_redis_to_py_pattern(pattern))
@@ -259,7 +365,12 @@ def _redis_to_py_pattern(pattern):
     s, q, op, cp, e = '*', '?', '[', ']', '\\'
 
     for v in pattern:
-        if v == s and not esc:
+        if clear:
+            clear = False
+            yield re.escape(v)
+        elif v == e:
+            clear = True
+        elif v == s and not esc:
             yield '(.*)'
         elif v == q and not esc:
             yield '.'
@@ -269,12 +380,6 @@ def _redis_to_py_pattern(pattern):
         elif v == cp and esc:
             esc = False
             yield v
-        elif v == e:
-            clear, esc = True
-            yield v
-        elif clear:
-            clear, esc = False, False
-            yield v
         else:
-            yield v
+            yield v if esc else re.escape(v)
     yield '$'
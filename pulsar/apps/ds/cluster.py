@@ -0,0 +1,489 @@
+'''Partition of the key space of pulsar-ds among several workers.
+
+Keys are mapped to one of ``SLOTS`` hash slots with the same function
+used by redis cluster: the CRC16 of the key, or of the part of the key
+between the first ``{`` and the following ``}`` when not empty, so that
+related keys can be forced into the same slot. Each worker owns a
+contiguous range of slots.
+
+Workers share the listening socket, therefore a connection is served by
+whichever worker accepted it. Requests on keys owned by a different worker
+are forwarded to it via the actor mailbox and the reply is relayed to the
+client. Commands on keys owned by several workers, such as ``MGET`` and
+``SUNION``, are split into one request per owner and the replies merged.
+'''
+import asyncio
+from random import randrange
+
+import pulsar
+from pulsar.utils.string import gen_unique_id
+
+from .client import ClientMixin, PulsarStoreClient
+
+
+SLOTS = 16384
+# Commands whose keys are not just the first argument, as
+# (first key, last key, step). A negative last key counts from the end
+KEY_SPECS = {'bitop': (2, -1, 1),
+             'blpop': (1, -2, 1),
+             'brpop': (1, -2, 1),
+             'brpoplpush': (1, 2, 1),
+             'del': (1, -1, 1),
+             'mget': (1, -1, 1),
+             'mset': (1, -1, 2),
+             'msetnx': (1, -1, 2),
+             'object': (2, 2, 1),
+             'rename': (1, 2, 1),
+             'renamenx': (1, 2, 1),
+             'rpoplpush': (1, 2, 1),
+             'sdiff': (1, -1, 1),
+             'sdiffstore': (1, -1, 1),
+             'sinter': (1, -1, 1),
+             'sinterstore': (1, -1, 1),
+             'smove': (1, 2, 1),
+             'sunion': (1, -1, 1),
+             'sunionstore': (1, -1, 1),
+             'watch': (1, -1, 1),
+             'xgroup': (2, 2, 1),
+             'xinfo': (2, 2, 1)}
+# Commands with the number of keys as argument, and its position
+NUMKEYS_COMMANDS = {'eval': 2, 'evalsha': 2,
+                    'zinterstore': 2, 'zunionstore': 2}
+KEY_GROUPS = ('Keys', 'Strings', 'Hashes', 'Lists', 'Sets', 'Sorted Sets',
+              'Streams', 'Transactions', 'Scripting')
+# Commands executed by every shard
+BROADCAST_COMMANDS = ('bgrewriteaof', 'bgsave', 'dbsize', 'flushall',
+                      'flushdb', 'keys', 'publish', 'save', 'script')
+# Commands which cannot be forwarded to another shard
+LOCAL_COMMANDS = ('blpop', 'brpop', 'brpoplpush', 'watch', 'xread',
+                  'xreadgroup')
+CROSSSLOT = "Keys in request don't hash to the same shard"
+LOCAL_ONLY = 'Keys of %s must be owned by the worker serving the connection'
+CLUSTERDOWN = b'-CLUSTERDOWN The shard owning the keys is not available\r\n'
+
+CRC16_TABLE = []
+for _byte in range(256):
+    _crc = _byte << 8
+    for _ in range(8):
+        _crc = ((_crc << 1) ^ 0x1021) if _crc & 0x8000 else (_crc << 1)
+    CRC16_TABLE.append(_crc & 0xffff)
+
+
+def crc16(data):
+    '''CRC16 (XMODEM) of ``data``, as in redis cluster'''
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xffff) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def key_slot(key):
+    '''The hash slot of ``key``'''
+    start = key.find(b'{')
+    if start > -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start+1:end]
+    return crc16(key) % SLOTS
+
+
+def slot_range(index, number):
+    '''The first and last slot owned by shard ``index`` of ``number``'''
+    return (-(-index*SLOTS // number),
+            -(-(index + 1)*SLOTS // number) - 1)
+
+
+def shard_filename(filename, index):
+    '''The persistence file of shard ``index``'''
+    name, ext = filename.rsplit('.', 1) if '.' in filename else (filename, '')
+    return '%s-%s.%s' % (name, index, ext) if ext else '%s-%s' % (name, index)
+
+
+def command_keys(info, request):
+    '''The list of keys in ``request`` for command ``info``'''
+    name = info.name
+    if info.group not in KEY_GROUPS:
+        return ()
+    elif name in NUMKEYS_COMMANDS:
+        pos = NUMKEYS_COMMANDS[name]
+        try:
+            numkeys = int(request[pos])
+        except (IndexError, ValueError):
+            return ()
+        keys = request[pos+1:pos+1+numkeys]
+        return keys if name.startswith('eval') else request[1:2] + keys
+    elif name == 'sort':
+        keys = request[1:2]
+        for i, value in enumerate(request[2:-1], 2):
+            if value.lower() == b'store':
+                keys.append(request[i+1])
+        return keys
+    elif name in ('xread', 'xreadgroup'):
+        # the keys are the first half of the arguments following STREAMS
+        for i, value in enumerate(request[1:], 1):
+            if value.lower() == b'streams':
+                keys = request[i+1:]
+                return keys[:len(keys) // 2]
+        return ()
+    elif name in ('keys', 'randomkey', 'scan', 'multi', 'exec', 'discard',
+                  'unwatch', 'script'):
+        return ()
+    first, last, step = KEY_SPECS.get(name, (1, 1, 1))
+    last = len(request) + last + 1 if last < 0 else last + 1
+    return request[first:last:step]
+
+
+def shard_peers(monitor):
+    '''The ``index: aid`` dictionary of shards alive in ``monitor``'''
+    managed = monitor.managed_actors
+    return dict(((index, aid) for index, aid in monitor.app.shards.items()
+                 if aid in managed))
+
+
+def execute_requests(worker, name, database, requests):
+    '''Execute ``requests`` forwarded to ``worker`` by another shard of
+    application ``name``, and return the list of replies.
+    '''
+    store = worker.servers[name]._key_value_store
+    return store._shards.execute(database, requests)
+
+
+class ShardClient(ClientMixin):
+    '''A client executing requests forwarded by another shard.
+    '''
+    _forwarding = False
+    _monitored = False
+
+    def __init__(self, store, database):
+        super().__init__(store)
+        self.database = database
+        self._loop = store._loop
+        self.password = store._password
+        self.channels = ()
+        self.patterns = ()
+        self.watched_keys = None
+        self._buffer = []
+
+    def reply(self):
+        '''The reply of the last request'''
+        data = b''.join(self._buffer)
+        self._buffer = []
+        return data
+
+    def _send(self, data):
+        self._buffer.append(data)
+
+    reply_ok = PulsarStoreClient.reply_ok
+    reply_status = PulsarStoreClient.reply_status
+    reply_int = PulsarStoreClient.reply_int
+    reply_one = PulsarStoreClient.reply_one
+    reply_zero = PulsarStoreClient.reply_zero
+    reply_error = PulsarStoreClient.reply_error
+    reply_wrongtype = PulsarStoreClient.reply_wrongtype
+    reply_bulk = PulsarStoreClient.reply_bulk
+    reply_multi_bulk = PulsarStoreClient.reply_multi_bulk
+    reply_multi_bulk_len = PulsarStoreClient.reply_multi_bulk_len
+    _write = PulsarStoreClient._write
+
+
+class Shards:
+    '''The shards of the key space, as seen by one of them.
+
+    .. attribute:: index
+
+        The index of the shard owning the keys of the store, ``None``
+        when the store only routes requests to the other shards.
+
+    .. attribute:: peers
+
+        Dictionary of actor ids of shards, by index, updated from the
+        application monitor when a shard is not known or not available.
+    '''
+    def __init__(self, store, index, number):
+        self.store = store
+        self.index = index
+        self.number = number
+        self.name = store.cfg.name
+        self.peers = {}
+
+    def owner(self, key):
+        '''The index of the shard owning ``key``'''
+        return key_slot(key)*self.number // SLOTS
+
+    def info(self):
+        info = {'shards': self.number,
+                'shard_index': -1 if self.index is None else self.index}
+        if self.index is not None:
+            info['shard_slots'] = '%s-%s' % slot_range(self.index,
+                                                       self.number)
+        return info
+
+    def route(self, client, info, request):
+        '''Forward ``request`` to the shards owning its keys.
+
+        Return ``True`` if the request is served by other shards,
+        ``False`` if it is executed by this one.
+        '''
+        name = info.name
+        if name in BROADCAST_COMMANDS:
+            return self._wait(client, self._broadcast(client.database,
+                                                      request))
+        elif name == 'exec':
+            return self._exec(client)
+        elif name == 'scan':
+            return self._wait(client, self._scan(client.database, request))
+        elif name == 'randomkey':
+            index = randrange(self.number)
+            if index == self.index:
+                return False
+            return self._wait(client, self._forward(index, client.database,
+                                                    request))
+        keys = command_keys(info, request)
+        if not keys:
+            return False
+        owners = set(map(self.owner, keys))
+        if len(owners) == 1:
+            index = owners.pop()
+            if index == self.index:
+                return False
+            elif name in LOCAL_COMMANDS:
+                client.reply_error(LOCAL_ONLY % name.upper(), 'CROSSSLOT')
+                return True
+            return self._wait(client, self._forward(index, client.database,
+                                                    request))
+        merge = getattr(self, '_%s' % name, None)
+        if merge:
+            return self._wait(client, merge(client.database, request))
+        client.reply_error(CROSSSLOT, 'CROSSSLOT')
+        return True
+
+    def execute(self, database, requests):
+        '''Execute ``requests`` in this shard and return their replies'''
+        client = ShardClient(self.store, database)
+        replies = []
+        for request in requests:
+            client.execute(list(request))
+            replies.append(client.reply())
+        return replies
+
+    async def call(self, index, database, requests):
+        '''Execute ``requests`` in shard ``index`` and return the replies
+        '''
+        if index == self.index:
+            return self.execute(database, requests)
+        for _ in range(2):
+            aid = self.peers.get(index)
+            if aid:
+                replies = await pulsar.send(aid, 'run', execute_requests,
+                                            self.name, database, requests)
+                if replies is not None:
+                    return replies
+            # The shard is not known or it is not available
+            self.peers = await pulsar.send(self.name, 'run', shard_peers)
+        return [CLUSTERDOWN]*len(requests)
+
+    # INTERNALS
+    def _wait(self, client, coro):
+        client._wait(pulsar.ensure_future(coro, loop=self.store._loop))
+        return True
+
+    def _decode(self, reply):
+        parser = self.store._server._parser_class()
+        parser.feed(reply)
+        return parser.get()
+
+    def _split(self, keys):
+        # Positions of keys by shard index
+        owners = {}
+        for pos, key in enumerate(keys):
+            owners.setdefault(self.owner(key), []).append(pos)
+        return owners
+
+    async def _gather(self, database, requests):
+        # Execute requests, a dictionary of lists of requests by shard,
+        # and return a dictionary of lists of replies
+        indexes = list(requests)
+        replies = await asyncio.gather(
+            *[self.call(index, database, requests[index])
+              for index in indexes], loop=self.store._loop)
+        return dict(zip(indexes, replies))
+
+    async def _forward(self, index, database, request):
+        replies = await self.call(index, database, [request])
+        return replies[0]
+
+    async def _broadcast(self, database, request):
+        indexes = range(self.number)
+        replies = await self._gather(database, dict(((index, [request])
+                                                     for index in indexes)))
+        replies = [replies[index][0] for index in indexes]
+        if self.index is None and request[0] == 'publish':
+            # local subscribers of a routing store
+            replies.extend(self.execute(database, [request]))
+        for reply in replies:
+            if reply[:1] == b'-':
+                return reply
+        name = request[0]
+        if name == 'keys':
+            keys = []
+            for reply in replies:
+                keys.extend(self._decode(reply))
+            return self.store._parser.multi_bulk(keys)
+        elif name == 'dbsize' or name == 'publish':
+            total = sum((self._decode(reply) for reply in replies))
+            return (':%d\r\n' % total).encode('utf-8')
+        else:
+            return replies[0]
+
+    def _exec(self, client):
+        # A transaction is executed by the shard owning all its keys
+        transaction = client.transaction
+        if transaction is None:
+            return False
+        owners = set()
+        for handle, request in transaction:
+            if handle:
+                owners.update(map(self.owner,
+                                  command_keys(handle._info, request)))
+        if not owners or owners == set((self.index,)):
+            return False
+        self.store._close_transaction(client)
+        if len(owners) > 1:
+            client.reply_error('Transaction discarded because of: %s' %
+                               CROSSSLOT, 'EXECABORT')
+            return True
+        requests = [['multi']]
+        requests.extend((request for _, request in transaction))
+        requests.append(['exec'])
+        return self._wait(client, self._exec_in(owners.pop(),
+                                                client.database, requests))
+
+    async def _exec_in(self, index, database, requests):
+        replies = await self.call(index, database, requests)
+        return replies[-1]
+
+    async def _scan(self, database, request):
+        # The cursor includes the index of the shard being scanned
+        try:
+            cursor = int(request[1])
+        except (IndexError, ValueError):
+            cursor = 0
+        index = cursor % self.number
+        request = list(request)
+        request[1] = str(cursor // self.number).encode('utf-8')
+        reply = await self._forward(index, database, request)
+        if reply[:1] == b'-':
+            return reply
+        cursor, keys = self._decode(reply)
+        cursor = int(cursor)
+        if cursor:
+            cursor = cursor*self.number + index
+        elif index + 1 < self.number:
+            cursor = index + 1
+        return self.store._parser.multi_bulk((str(cursor), keys))
+
+    async def _del(self, database, request):
+        owners = self._split(request[1:])
+        keys = request[1:]
+        replies = await self._gather(database, dict(
+            ((index, [['del'] + [keys[p] for p in positions]])
+             for index, positions in owners.items())))
+        total = 0
+        for reply, in replies.values():
+            if reply[:1] == b'-':
+                return reply
+            total += self._decode(reply)
+        return (':%d\r\n' % total).encode('utf-8')
+
+    async def _mget(self, database, request):
+        owners = self._split(request[1:])
+        keys = request[1:]
+        replies = await self._gather(database, dict(
+            ((index, [['mget'] + [keys[p] for p in positions]])
+             for index, positions in owners.items())))
+        values = [None]*len(keys)
+        for index, (reply,) in replies.items():
+            if reply[:1] == b'-':
+                return reply
+            for pos, value in zip(owners[index], self._decode(reply)):
+                values[pos] = value
+        return self.store._parser.multi_bulk(values)
+
+    async def _mset(self, database, request):
+        owners = self._split(request[1::2])
+        pairs = request[1:]
+        replies = await self._gather(database, dict(
+            ((index, [['mset'] + [v for p in positions
+                                  for v in pairs[2*p:2*p+2]]])
+             for index, positions in owners.items())))
+        for reply, in replies.values():
+            if reply[:1] == b'-':
+                return reply
+        return self.store.OK
+
+    async def _setoper(self, database, op, keys, dest=None):
+        owners = self._split(keys)
+        replies = await self._gather(database, dict(
+            ((index, [['smembers', keys[p]] for p in positions])
+             for index, positions in owners.items())))
+        sets = [None]*len(keys)
+        for index, replies in replies.items():
+            for pos, reply in zip(owners[index], replies):
+                if reply[:1] == b'-':
+                    return reply
+                sets[pos] = set(self._decode(reply))
+        result = getattr(sets[0], op)(*sets[1:])
+        if dest is None:
+            return self.store._parser.multi_bulk(tuple(result))
+        requests = [['del', dest]]
+        if result:
+            requests.append(['sadd', dest] + list(result))
+        replies = await self.call(self.owner(dest), database, requests)
+        for reply in replies:
+            if reply[:1] == b'-':
+                return reply
+        return (':%d\r\n' % len(result)).encode('utf-8')
+
+    def _sdiff(self, database, request):
+        return self._setoper(database, 'difference', request[1:])
+
+    def _sdiffstore(self, database, request):
+        return self._setoper(database, 'difference', request[2:], request[1])
+
+    def _sinter(self, database, request):
+        return self._setoper(database, 'intersection', request[1:])
+
+    def _sinterstore(self, database, request):
+        return self._setoper(database, 'intersection', request[2:],
+                             request[1])
+
+    def _sunion(self, database, request):
+        return self._setoper(database, 'union', request[1:])
+
+    def _sunionstore(self, database, request):
+        return self._setoper(database, 'union', request[2:], request[1])
+
+
+def create_shards(store, cfg):
+    '''The :class:`Shards` of ``store``, or ``None`` when the key space is
+    not partitioned.
+    '''
+    if cfg.key_value_shards and cfg.workers:
+        return Shards(store, getattr(cfg, 'shard', None), cfg.workers)
+
+
+def new_shard(app, monitor, cfg):
+    '''Assign a shard to a worker being spawned by ``monitor`` and return
+    the worker actor id.
+    '''
+    alive = shard_peers(monitor)
+    index = min(set(range(cfg.workers)) - set(alive))
+    aid = gen_unique_id()[:8]
+    app.shards = alive
+    alive[index] = aid
+    cfg.shard = index
+    cfg.set('key_value_filename',
+            shard_filename(cfg.key_value_filename, index))
+    cfg.set('key_value_appendfilename',
+            shard_filename(cfg.key_value_appendfilename, index))
+    return aid
@@ -0,0 +1,265 @@
+'''Memory accounting and eviction of keys for pulsar-ds.
+
+The memory used by a key is estimated when the key is written and stored,
+together with the access information needed by the eviction policies, in
+a single 64 bits integer::
+
+    size:32 | lfu counter:8 | clock:24
+
+``clock`` is the time of the last access, in seconds, modulo 2**24.
+The ``lfu counter`` is a logarithmic access counter, incremented with
+probability inversely proportional to its value and decremented by one
+for every minute the key is not accessed.
+
+When the memory limit is reached, keys are evicted by sampling a few of
+them and picking the best candidate for the eviction policy, in the same
+way redis does.
+'''
+from array import array
+from bisect import insort
+from itertools import islice
+from random import random, randrange
+from sys import getsizeof
+
+from pulsar.utils.structures import Hash, Set, Stream
+
+
+POLICIES = ('noeviction', 'allkeys-lru', 'allkeys-lfu', 'allkeys-random',
+            'volatile-lru', 'volatile-lfu', 'volatile-random', 'volatile-ttl')
+CLOCK_MAX = (1 << 24) - 1
+SIZE_MAX = (1 << 32) - 1
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+# Minutes of inactivity which decrement the lfu counter by one
+LFU_DECAY_TIME = 1
+# Number of elements used to estimate the size of a collection
+SIZE_SAMPLES = 5
+# Memory used by a member of a sorted set besides the member itself and
+# its entry in the dictionary of scores, by encoding
+ZSET_ENTRY_SIZE = {'skiplist': 160, 'blocklist': 16}
+# Memory used by the score of a member of a sorted set in a listpack
+ZSET_SCORE_SIZE = getsizeof(0.0)
+# Memory used by an entry of a stream besides its field values: the two
+# parts of the id and the tuple of values
+STREAM_ENTRY_SIZE = 16 + getsizeof(())
+EVICTION_POOL_SIZE = 16
+
+
+def estimate_size(key, value):
+    '''Estimated number of bytes used by ``key`` and its ``value``.
+
+    The size of collections is extrapolated from a few of their elements.
+    Compact collections include their flat list in ``getsizeof``.
+    '''
+    size = getsizeof(key) + getsizeof(value)
+    if isinstance(value, (bytes, bytearray)):
+        return size
+    N = len(value)
+    if N:
+        if isinstance(value, (dict, Hash)):
+            sample = [getsizeof(k) + getsizeof(v) for k, v
+                      in islice(value.items(), SIZE_SAMPLES)]
+        elif isinstance(value, Set) and value.encoding == 'intset':
+            # members are included in getsizeof(value)
+            return size
+        elif isinstance(value, Stream):
+            sample = [STREAM_ENTRY_SIZE + sum(map(getsizeof, fields[1::2]))
+                      for _, fields in islice(value, SIZE_SAMPLES)]
+        elif isinstance(value, (set, list, Set)) or hasattr(value, 'popleft'):
+            sample = [getsizeof(v) for v in islice(value, SIZE_SAMPLES)]
+        elif value.encoding == 'listpack':
+            # the size of the flat list is included in getsizeof(value)
+            sample = [ZSET_SCORE_SIZE + getsizeof(v) for v
+                      in islice(value, SIZE_SAMPLES)]
+        else:
+            entry = ZSET_ENTRY_SIZE[value.encoding]
+            sample = [entry + getsizeof(v) for v
+                      in islice(value, SIZE_SAMPLES)]
+        size += N*sum(sample)//len(sample)
+    return size
+
+
+def lru_clock(now):
+    return int(now) & CLOCK_MAX
+
+
+def idle_time(meta, clock):
+    '''Seconds since the last access to the key with metadata ``meta``'''
+    return (clock - (meta & CLOCK_MAX)) & CLOCK_MAX
+
+
+def lfu_counter(meta, clock):
+    '''The lfu counter of ``meta`` after decay'''
+    counter = (meta >> 24) & 255
+    periods = idle_time(meta, clock) // (60*LFU_DECAY_TIME)
+    return max(0, counter - periods) if periods else counter
+
+
+def access(meta, clock, size=None):
+    '''Return ``meta`` updated for an access at ``clock``.
+
+    :param size: optional new size of the key.
+    '''
+    if meta is None:
+        counter = LFU_INIT_VAL
+        size = size or 0
+    else:
+        counter = lfu_counter(meta, clock)
+        if counter < 255:
+            base = max(0, counter - LFU_INIT_VAL)
+            if random() < 1.0/(base*LFU_LOG_FACTOR + 1):
+                counter += 1
+        if size is None:
+            size = meta >> 32
+    return min(size, SIZE_MAX) << 32 | counter << 24 | clock
+
+
+class KeyTable:
+    '''Metadata of the keys in a database.
+
+    Keys are stored in a list and metadata in an ``array`` of unsigned
+    64 bits integers, so that keys can be sampled at random and the
+    metadata of a key takes eight bytes. A dictionary maps keys to their
+    position in the list. Removing a key moves the last key into its
+    position.
+
+    .. attribute:: used_memory
+
+        The sum of the sizes of all keys.
+    '''
+    __slots__ = ('_index', '_keys', '_meta', 'used_memory')
+
+    def __init__(self):
+        self._index = {}
+        self._keys = []
+        self._meta = array('Q')
+        self.used_memory = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key):
+        pos = self._index.get(key)
+        return None if pos is None else self._meta[pos]
+
+    def set(self, key, meta):
+        pos = self._index.get(key)
+        if pos is None:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._meta.append(meta)
+        else:
+            self.used_memory -= self._meta[pos] >> 32
+            self._meta[pos] = meta
+        self.used_memory += meta >> 32
+
+    def remove(self, key):
+        pos = self._index.pop(key, None)
+        if pos is not None:
+            self.used_memory -= self._meta[pos] >> 32
+            key = self._keys.pop()
+            meta = self._meta.pop()
+            if pos < len(self._keys):
+                self._keys[pos] = key
+                self._meta[pos] = meta
+                self._index[key] = pos
+
+    def clear(self):
+        self._index.clear()
+        self._keys = []
+        self._meta = array('Q')
+        self.used_memory = 0
+
+    def keys(self, start, end):
+        '''The list of keys between positions ``start`` and ``end``'''
+        return self._keys[start:end]
+
+    def sample(self, count):
+        '''Return ``count`` random ``(key, meta)`` pairs'''
+        keys = self._keys
+        meta = self._meta
+        pairs = []
+        if keys:
+            for _ in range(count):
+                pos = randrange(len(keys))
+                pairs.append((keys[pos], meta[pos]))
+        return pairs
+
+
+class EvictionPool:
+    '''The best candidates for eviction found by sampling databases.
+
+    Candidates are kept across evictions, ordered by score: the idle time
+    for ``lru`` policies, the inverse of the access frequency for ``lfu``
+    policies, the inverse of the deadline for ``volatile-ttl`` and a
+    random number for ``random`` policies.
+    '''
+    def __init__(self, policy, samples):
+        self.policy = policy
+        self.samples = samples
+        self._pool = []
+
+    def populate(self, db, clock):
+        '''Sample keys of ``db`` and add the candidates to the pool.'''
+        policy = self.policy
+        pool = self._pool
+        if policy.startswith('volatile'):
+            sample = db._deadlines.sample(self.samples)
+            if policy == 'volatile-ttl':
+                sample = [(key, -when) for key, when in sample]
+            else:
+                get = db._keys_meta.get
+                sample = [(key, get(key) or 0) for key, _ in sample]
+        else:
+            sample = db._keys_meta.sample(self.samples)
+        num = db._num
+        for key, meta in sample:
+            if policy == 'volatile-ttl':
+                score = meta
+            else:
+                score = self._score(meta, clock, None)
+            candidate = (score, num, key)
+            if candidate not in pool:
+                if len(pool) < EVICTION_POOL_SIZE:
+                    insort(pool, candidate)
+                elif candidate > pool[0]:
+                    pool.pop(0)
+                    insort(pool, candidate)
+
+    def pop(self, databases, clock):
+        '''Remove and return the best ``(num, key)`` candidate.
+
+        Candidates are scored again first, they may have been accessed,
+        persisted or removed since they were sampled.
+        '''
+        policy = self.policy
+        pool = []
+        for score, num, key in self._pool:
+            db = databases[num]
+            if policy.startswith('volatile'):
+                when = db._deadlines.get(key)
+                if when is None:
+                    continue
+                if policy == 'volatile-ttl':
+                    pool.append((-when, num, key))
+                    continue
+            meta = db._keys_meta.get(key)
+            if meta is not None:
+                pool.append((self._score(meta, clock, score), num, key))
+        pool.sort()
+        self._pool = pool
+        if pool:
+            _, num, key = pool.pop()
+            return num, key
+
+    def _score(self, meta, clock, score):
+        if self.policy.endswith('lru'):
+            return idle_time(meta, clock)
+        elif self.policy.endswith('lfu'):
+            return 255 - lfu_counter(meta, clock)
+        else:
+            # random policies keep their score
+            return random() if score is None else score
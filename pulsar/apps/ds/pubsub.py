@@ -0,0 +1,123 @@
+import re
+
+from .client import redis_to_py_pattern
+
+
+GLOB_CHARS = frozenset(b'*?[\\')
+
+
+class Pattern:
+    '''A pattern subscribed by ``clients`` with ``PSUBSCRIBE``'''
+    __slots__ = ('pattern', 'prefix', 'match', 'clients')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.prefix = literal_prefix(pattern)
+        if len(self.prefix) == len(pattern):
+            self.match = None
+        else:
+            # latin-1 maps bytes to the first 256 code points and back
+            pre = redis_to_py_pattern(pattern.decode('latin-1'))
+            self.match = re.compile(pre.encode('latin-1'), re.DOTALL).match
+        self.clients = set()
+
+    def __repr__(self):
+        return self.pattern.decode('utf-8', 'replace')
+    __str__ = __repr__
+
+
+class PatternIndex:
+    '''Patterns of ``PSUBSCRIBE`` indexed by their literal prefix.
+
+    A channel can only match patterns whose literal prefix, the part
+    before the first glob character, is a prefix of the channel. Matching
+    a channel looks up its prefixes of the lengths of the indexed literal
+    prefixes and tests the glob of the few patterns found, rather than
+    the regular expressions of all the patterns.
+    '''
+    def __init__(self):
+        self._patterns = {}
+        # patterns by literal prefix
+        self._prefixes = {}
+        # number of literal prefixes by length
+        self._lengths = {}
+        # total number of pattern subscriptions
+        self.subscriptions = 0
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __contains__(self, pattern):
+        return pattern in self._patterns
+
+    def get(self, pattern, default=None):
+        return self._patterns.get(pattern, default)
+
+    def add(self, pattern, client):
+        '''Subscribe ``client`` to ``pattern``.
+
+        Return ``True`` if the client was not already subscribed.
+        '''
+        p = self._patterns.get(pattern)
+        if p is None:
+            self._patterns[pattern] = p = Pattern(pattern)
+            group = self._prefixes.get(p.prefix)
+            if group is None:
+                self._prefixes[p.prefix] = group = {}
+                N = len(p.prefix)
+                self._lengths[N] = self._lengths.get(N, 0) + 1
+            group[pattern] = p
+        if client in p.clients:
+            return False
+        p.clients.add(client)
+        self.subscriptions += 1
+        return True
+
+    def discard(self, pattern, client):
+        '''Unsubscribe ``client`` from ``pattern``.
+
+        Return ``True`` if the client was subscribed.
+        '''
+        p = self._patterns.get(pattern)
+        if p is None or client not in p.clients:
+            return False
+        p.clients.remove(client)
+        self.subscriptions -= 1
+        if not p.clients:
+            self._patterns.pop(pattern)
+            group = self._prefixes[p.prefix]
+            group.pop(pattern)
+            if not group:
+                self._prefixes.pop(p.prefix)
+                N = len(p.prefix)
+                if self._lengths[N] == 1:
+                    self._lengths.pop(N)
+                else:
+                    self._lengths[N] -= 1
+        return True
+
+    def match(self, channel):
+        '''Generator of :class:`Pattern` matching ``channel``'''
+        prefixes = self._prefixes
+        size = len(channel)
+        for N in self._lengths:
+            if N <= size:
+                group = prefixes.get(channel[:N])
+                if group:
+                    for p in group.values():
+                        if p.match is None:
+                            if N == size:
+                                yield p
+                        elif p.match(channel):
+                            yield p
+
+
+def literal_prefix(pattern):
+    '''The part of ``pattern`` before its first glob character'''
+    for i, c in enumerate(pattern):
+        if c in GLOB_CHARS:
+            return pattern[:i]
+    return pattern
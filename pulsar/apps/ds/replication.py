@@ -0,0 +1,493 @@
+'''Primary/replica replication for pulsar-ds.
+
+A replica connects to its primary and sends ``PSYNC <replid> <offset>``,
+where ``replid`` identifies the replication stream it was following and
+``offset`` the next byte it needs. When the primary still has the bytes
+in its backlog, it replies with ``+CONTINUE`` and resumes the stream from
+there (partial resynchronization). Otherwise it replies with
+``+FULLRESYNC <replid> <offset>`` followed by a snapshot of its databases,
+sent as a bulk string in the :mod:`~pulsar.apps.ds.snapshot` format.
+The snapshot is written into a temporary file by a forked child, as
+``BGSAVE`` does, and streamed to the replica in chunks. The replica
+stores it into a temporary file and loads it a few keys at a time.
+
+The stream consists of the write commands which changed the dataset,
+encoded as the append only file does. It is written to all replicas and
+appended to the backlog, a circular buffer of ``key_value_repl_backlog_size``
+bytes created when the first replica connects. Replicas acknowledge
+the offset they processed every ``ACK_INTERVAL`` seconds with
+``REPLCONF ACK <offset>``.
+'''
+import os
+import time
+import signal
+import asyncio
+import binascii
+import tempfile
+
+from pulsar.utils.internet import parse_address
+
+from .aof import LoadingClient
+from .parser import RedisError
+from .snapshot import SnapshotReader
+from .utils import write_snapshot, ForkSave
+
+
+# Seconds between attempts to connect to the primary
+RECONNECT_INTERVAL = 1
+# Seconds between two acknowledgements of the replication offset
+ACK_INTERVAL = 1
+# Size of the chunks read from the primary and of the snapshot chunks
+# sent to replicas
+READ_SIZE = 64*1024
+# Number of keys loaded from a snapshot in one event loop iteration
+LOAD_KEYS_PER_ITERATION = 1000
+
+
+class ReplicationError(RedisError):
+    pass
+
+
+def replication_id():
+    '''A random 40 characters replication id'''
+    return binascii.hexlify(os.urandom(20)).decode('utf-8')
+
+
+def request_size(request):
+    '''Number of bytes of ``request`` encoded with the redis protocol'''
+    size = len(str(len(request))) + 3
+    for value in request:
+        size += len(str(len(value))) + len(value) + 5
+    return size
+
+
+class Backlog:
+    '''Circular buffer with the last ``size`` bytes of the replication
+    stream.
+
+    .. attribute:: offset
+
+        The total number of bytes appended, the replication offset.
+    '''
+    __slots__ = ('size', 'offset', '_buffer', '_index', '_length')
+
+    def __init__(self, size, offset=0):
+        self.size = size
+        self.offset = offset
+        self._buffer = bytearray(size)
+        self._index = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, data):
+        size = self.size
+        n = len(data)
+        self.offset += n
+        if n >= size:
+            self._buffer[:] = data[n-size:]
+            self._index = 0
+            self._length = size
+            return
+        end = self._index + n
+        if end <= size:
+            self._buffer[self._index:end] = data
+        else:
+            split = size - self._index
+            self._buffer[self._index:] = data[:split]
+            self._buffer[:n-split] = data[split:]
+        self._index = end % size
+        self._length = min(size, self._length + n)
+
+    def since(self, offset):
+        '''The bytes appended after ``offset``, ``None`` if not available
+        '''
+        n = self.offset - offset
+        if n < 0 or n > self._length:
+            return None
+        start = (self._index - n) % self.size
+        end = start + n
+        if end <= self.size:
+            return bytes(self._buffer[start:end])
+        return bytes(self._buffer[start:]) + bytes(
+            self._buffer[:end-self.size])
+
+
+class Replication:
+    '''The replication state of a :class:`.Storage`.
+
+    .. attribute:: replid
+
+        The id of the replication stream of the store.
+
+    .. attribute:: replicas
+
+        Dictionary of connected replicas, with the last offset they
+        acknowledged.
+
+    .. attribute:: master
+
+        The :class:`MasterLink` with the primary when the store is a
+        replica, otherwise ``None``.
+    '''
+    def __init__(self, store, backlog_size):
+        self.store = store
+        self.replid = replication_id()
+        self.backlog_size = backlog_size
+        self.backlog = None
+        self.replicas = {}
+        self.master = None
+        self.sync_full = 0
+        self.sync_partial_ok = 0
+        self.sync_partial_err = 0
+        self._syncs = {}
+        self._db = None
+        self._pack = store._parser.pack_command
+
+    @property
+    def offset(self):
+        return self.backlog.offset if self.backlog is not None else 0
+
+    def feed(self, num, request):
+        '''Send ``request`` executed against database ``num`` to replicas
+        '''
+        if num != self._db:
+            self._db = num
+            data = self._pack((b'select', num)) + self._pack(request)
+        else:
+            data = self._pack(request)
+        self.backlog.append(data)
+        for client in self.replicas:
+            client._send(data)
+        for sync in self._syncs.values():
+            sync.buffer.append(data)
+
+    def sync(self, client, replid=None, offset=None):
+        '''Add ``client`` to the replicas.
+
+        :param replid: the replication id requested by ``PSYNC``, ``None``
+            for the ``SYNC`` command.
+        :param offset: the next byte requested by ``PSYNC``.
+        '''
+        if self.backlog is None:
+            self.backlog = Backlog(self.backlog_size)
+        if replid == self.replid:
+            data = self.backlog.since(offset - 1)
+            if data is not None:
+                self.sync_partial_ok += 1
+                client._send(('+CONTINUE %s\r\n' % self.replid).encode(
+                    'utf-8'))
+                if data:
+                    client._send(data)
+                self.replicas[client] = offset - 1
+                return
+        if replid is not None and replid != '?':
+            self.sync_partial_err += 1
+        self.sync_full += 1
+        if replid is not None:
+            client._send(('+FULLRESYNC %s %s\r\n' % (
+                self.replid, self.offset)).encode('utf-8'))
+        # the stream of the new replica starts with a select
+        self._db = None
+        self._syncs[client] = FullSync(self, client)
+
+    def cron(self):
+        '''Invoked periodically by the :class:`.Storage` cron task, start
+        streaming the snapshots written.
+        '''
+        for sync in list(self._syncs.values()):
+            sync.check()
+
+    def remove(self, client):
+        '''Remove ``client`` from the replicas'''
+        self.replicas.pop(client, None)
+        sync = self._syncs.pop(client, None)
+        if sync is not None:
+            sync.close()
+
+    def replicaof(self, address):
+        '''Replicate the primary at ``address``, stop replicating when
+        ``address`` is ``None``
+        '''
+        if self.master is not None:
+            self.master.close()
+            self.master = None
+        if address is not None:
+            self.master = MasterLink(self.store, address)
+
+    def reset(self):
+        '''Start a new replication stream, replicas are disconnected
+        and will resynchronize.
+        '''
+        self.replid = replication_id()
+        self.backlog = None
+        self._db = None
+        for client in list(self.replicas) + list(self._syncs):
+            client.close()
+        self.replicas.clear()
+        for sync in self._syncs.values():
+            sync.close()
+        self._syncs.clear()
+
+    def info(self):
+        info = {'role': 'master' if self.master is None else 'slave',
+                'connected_slaves': len(self.replicas),
+                'master_replid': self.replid,
+                'master_repl_offset': self.offset,
+                'repl_backlog_active': int(self.backlog is not None),
+                'repl_backlog_size': self.backlog_size,
+                'sync_full': self.sync_full,
+                'sync_partial_ok': self.sync_partial_ok,
+                'sync_partial_err': self.sync_partial_err}
+        for n, (client, ack) in enumerate(self.replicas.items()):
+            host, port = client._transport.get_extra_info('peername')[:2]
+            info['slave%d' % n] = 'ip=%s,port=%s,offset=%s' % (
+                host, port, ack)
+        if self.master is not None:
+            info.update(self.master.info())
+        return info
+
+    def close(self):
+        if self.master is not None:
+            self.master.close()
+        for sync in self._syncs.values():
+            sync.close()
+
+
+class FullSync:
+    '''The full resynchronization of the replica ``client``.
+
+    The snapshot is written into a temporary file, by a forked child when
+    available, and then streamed to the replica in chunks, waiting for
+    the transport buffer to drain. The replication stream is buffered
+    until the replica has received the snapshot.
+    '''
+    def __init__(self, replication, client):
+        self.replication = replication
+        self.client = client
+        self.offset = replication.offset
+        self.buffer = []
+        self._task = None
+        fd, self.filename = tempfile.mkstemp(prefix='pulsar-ds-sync-')
+        os.close(fd)
+        if hasattr(os, 'fork'):
+            self._writer = ForkSave(self._write_snapshot)
+            self._writer.start()
+        else:   # pragma    nocover
+            self._writer = None
+            self._write_snapshot()
+            self._start(0)
+
+    def check(self):
+        writer = self._writer
+        if writer and not writer.is_alive():
+            self._writer = None
+            self._start(writer.exitcode)
+
+    def close(self):
+        writer, self._writer = self._writer, None
+        if writer and writer.is_alive():
+            # the snapshot is not needed anymore
+            try:
+                os.kill(writer.pid, signal.SIGKILL)
+                os.waitpid(writer.pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        if self._task is not None:
+            self._task.cancel()
+        elif os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def _write_snapshot(self):
+        with open(self.filename, 'wb') as file:
+            write_snapshot(file, self.replication.store._dbs())
+
+    def _start(self, exitcode):
+        if exitcode:
+            self.replication.store.logger.error(
+                'Snapshot for replica failed with exit code %s', exitcode)
+            self.client.close()
+        else:
+            self._task = asyncio.ensure_future(self._send(),
+                                               loop=self.client._loop)
+
+    async def _send(self):
+        client = self.client
+        try:
+            with open(self.filename, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                client._send(('$%d\r\n' % size).encode('utf-8'))
+                data = file.read(READ_SIZE)
+                while data:
+                    if client._transport._closing:
+                        return
+                    waiter = client.write(data)
+                    if waiter:
+                        await waiter
+                    data = file.read(READ_SIZE)
+        finally:
+            os.remove(self.filename)
+        replication = self.replication
+        if replication._syncs.pop(client, None) is self:
+            if self.buffer:
+                client._send(b''.join(self.buffer))
+            replication.replicas[client] = self.offset
+
+
+class ReplicaClient(LoadingClient):
+    '''A client executing the commands streamed by the primary.
+    '''
+    _readonly = False
+
+    def reply_error(self, value, prefix=None):
+        self.store.logger.warning('Error while executing a command from '
+                                  'the primary: %s', value)
+
+
+class MasterLink:
+    '''The connection of a replica with its primary at ``address``.
+
+    It reconnects when the connection drops and asks for a partial
+    resynchronization from the last offset processed.
+    '''
+    def __init__(self, store, address):
+        self.store = store
+        self.address = parse_address(address)
+        self.status = 'connect'
+        self.replid = '?'
+        # offset of the last byte processed
+        self.offset = -1
+        self.last_io = None
+        # the same client across reconnections, it keeps the database
+        # selected by the stream
+        self.client = ReplicaClient(store)
+        self._writer = None
+        self._closed = False
+        self._task = asyncio.ensure_future(self._run(), loop=store._loop)
+
+    def info(self):
+        host, port = self.address
+        last_io = self.last_io
+        last_io = -1 if last_io is None else int(time.time() - last_io)
+        return {'master_host': host,
+                'master_port': port,
+                'master_link_status': ('up' if self.status == 'connected'
+                                       else 'down'),
+                'master_last_io_seconds_ago': last_io,
+                'master_sync_in_progress': int(self.status == 'sync'),
+                'slave_repl_offset': self.offset}
+
+    def close(self):
+        self._closed = True
+        if self._writer is not None:
+            self._writer.close()
+        self._task.cancel()
+
+    async def _run(self):
+        loop = self.store._loop
+        logger = self.store.logger
+        while not self._closed:
+            self.status = 'connecting'
+            try:
+                reader, self._writer = await asyncio.open_connection(
+                    *self.address, loop=loop)
+                await self._sync(reader, self._writer)
+            except asyncio.CancelledError:
+                break
+            except (OSError, RedisError) as exc:
+                logger.warning('Replication with %s:%s failed: %s',
+                               self.address[0], self.address[1], exc)
+            except Exception:
+                logger.exception('Replication with %s:%s failed',
+                                 self.address[0], self.address[1])
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+            if not self._closed:
+                self.status = 'connect'
+                await asyncio.sleep(RECONNECT_INTERVAL, loop=loop)
+
+    async def _sync(self, reader, writer):
+        store = self.store
+        pack = store._parser.pack_command
+        self.status = 'sync'
+        writer.write(pack(('psync', self.replid, self.offset + 1)))
+        line = (await reader.readline()).decode('utf-8').strip()
+        if line.startswith('+FULLRESYNC'):
+            _, replid, offset = line.split()
+            size = (await reader.readline()).decode('utf-8').strip()
+            if not size.startswith('$'):
+                raise ReplicationError('Bad snapshot size %s' % size)
+            await self._load(reader, int(size[1:]))
+            self.replid = replid
+            self.offset = int(offset)
+            store.logger.info('Full resynchronization with %s:%s',
+                              *self.address)
+        elif line.startswith('+CONTINUE'):
+            store.logger.info('Partial resynchronization with %s:%s',
+                              *self.address)
+        elif not line:
+            raise ReplicationError('Connection closed by the primary')
+        else:
+            raise ReplicationError(line)
+        self.status = 'connected'
+        self.last_io = time.time()
+        parser = store._server._parser_class()
+        client = self.client
+        ack = asyncio.ensure_future(self._ack(writer), loop=store._loop)
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                self.last_io = time.time()
+                parser.feed(data)
+                request = parser.get()
+                while request is not False:
+                    self.offset += request_size(request)
+                    client.execute(request)
+                    request = parser.get()
+        finally:
+            ack.cancel()
+
+    async def _ack(self, writer):
+        # Acknowledge the offset processed to the primary
+        pack = self.store._parser.pack_command
+        while True:
+            writer.write(pack(('replconf', 'ack', self.offset)))
+            await asyncio.sleep(ACK_INTERVAL, loop=self.store._loop)
+
+    async def _load(self, reader, size):
+        # Receive a snapshot of ``size`` bytes into a temporary file and
+        # replace the databases with it, a few keys at a time. Databases
+        # in the snapshot reply to clients with a loading error meanwhile
+        store = self.store
+        with tempfile.TemporaryFile() as file:
+            while size > 0:
+                data = await reader.read(min(size, READ_SIZE))
+                if not data:
+                    raise ReplicationError('Connection closed by the primary')
+                self.last_io = time.time()
+                file.write(data)
+                size -= len(data)
+            file.seek(0)
+            snapshot = SnapshotReader(file, store._types)
+            store._replication.reset()
+            for db in store.databases.values():
+                db.flush()
+            store._loading.update(snapshot.databases)
+            try:
+                now = time.time()
+                for n, (num, key, value, expire) in enumerate(snapshot, 1):
+                    if key is None:
+                        store._loading.discard(num)
+                    else:
+                        store._load_record(num, key, value, expire, now)
+                    if not n % LOAD_KEYS_PER_ITERATION:
+                        await asyncio.sleep(0, loop=store._loop)
+                        now = time.time()
+            finally:
+                store._loading.clear()
+        self.client.database = 0
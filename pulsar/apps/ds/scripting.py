@@ -0,0 +1,442 @@
+'''Server side scripting for pulsar-ds.
+
+Scripts sent with ``EVAL`` or ``SCRIPT LOAD`` are compiled once and cached
+by the SHA1 of their source, so that ``EVALSHA`` runs them without sending
+the source again. A script is executed atomically: no other command runs
+until it returns. Scripts access the data store via ``redis.call`` and
+``redis.pcall``, which execute commands with the same handlers used for
+clients, therefore write commands are propagated to the append only file
+and to replicas one by one, as if clients had sent them.
+
+Scripts are written in lua, with the same api as redis, and require
+lupa_. Without it scripting is disabled, unless the ``python`` engine is
+selected explicitly with the ``key_value_scripting`` setting. Python
+scripts are functions bodies, receiving ``KEYS`` and ``ARGV`` lists
+(indexed from zero) and a ``redis`` object with the same methods
+available to lua scripts. They can only use a limited set of builtins and
+cannot import modules or access private attributes, frames, generators
+and tracebacks. This is not a sandbox, python scripts run with the
+privileges of the server and should be trusted as much as the clients
+allowed to run them.
+
+.. _lupa: https://pypi.python.org/pypi/lupa
+'''
+import ast
+import hashlib
+import textwrap
+
+try:
+    import lupa
+except ImportError:     # pragma    nocover
+    lupa = None
+
+from pulsar.utils.pep import to_string
+
+from .client import ClientMixin, COMMANDS_INFO
+from .parser import CommandError, ResponseError
+
+
+LUA_SANDBOX = '''
+local call, sha1hex = ...
+redis = {}
+function redis.call(...)
+    local reply = call(...)
+    if type(reply) == 'table' and reply.err then
+        error(reply.err, 0)
+    end
+    return reply
+end
+redis.pcall = call
+redis.sha1hex = sha1hex
+function redis.error_reply(err)
+    return {err=err}
+end
+function redis.status_reply(ok)
+    return {ok=ok}
+end
+local load = load
+for _, name in ipairs({'collectgarbage', 'dofile', 'load', 'loadfile',
+                       'loadstring', 'module', 'require', 'debug', 'io',
+                       'os', 'package', 'python'}) do
+    _G[name] = nil
+end
+return function(script, name)
+    local fn, err = load(script, '@' .. name, 't')
+    return fn, err
+end
+'''
+
+DISABLED = ('Scripting is disabled, lupa is not installed. Install it or '
+            'set key_value_scripting to python to run trusted python '
+            'scripts')
+SAFE_BUILTINS = dict(((f.__name__, f) for f in (
+    abs, all, any, bool, bytes, dict, divmod, enumerate, filter, float,
+    int, isinstance, len, list, map, max, min, range, reversed, round, set,
+    sorted, str, sum, tuple, zip)))
+# Attributes of frames, generators, coroutines and tracebacks which give
+# access to the globals and builtins of the server
+UNSAFE_ATTRIBUTES = frozenset((
+    'ag_await', 'ag_code', 'ag_frame', 'cr_await', 'cr_code', 'cr_frame',
+    'cr_origin', 'f_back', 'f_builtins', 'f_code', 'f_globals', 'f_locals',
+    'f_trace', 'gi_code', 'gi_frame', 'gi_yieldfrom', 'tb_frame',
+    'tb_next'))
+
+
+class ScriptError(CommandError):
+    '''Error raised by a script'''
+    pass
+
+
+class Status:
+    '''A status reply, such as ``+OK``'''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Error:
+    '''An error reply'''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def sha1hex(script):
+    '''The SHA1 digest of ``script`` as a string of 40 hex characters'''
+    if isinstance(script, str):
+        script = script.encode('utf-8')
+    return hashlib.sha1(script).hexdigest()
+
+
+def to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    elif isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return str(value).encode('utf-8')
+
+
+def to_native(value):
+    '''Convert the elements of a multi bulk reply as the redis protocol
+    does, without encoding them'''
+    if value is None:
+        return None
+    elif isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    elif isinstance(value, str):
+        return value.encode('utf-8')
+    elif hasattr(value, '__len__'):
+        return [to_native(v) for v in value]
+    else:
+        return str(value).encode('utf-8')
+
+
+def encode_reply(value):
+    '''Encode the result of a script with the redis protocol'''
+    if value is None:
+        return b'$-1\r\n'
+    elif isinstance(value, int):
+        return (':%d\r\n' % value).encode('utf-8')
+    elif isinstance(value, bytes):
+        return ('$%d\r\n' % len(value)).encode('utf-8') + value + b'\r\n'
+    elif isinstance(value, Status):
+        return b'+' + value.value + b'\r\n'
+    elif isinstance(value, Error):
+        return b'-' + value.value + b'\r\n'
+    else:
+        return b''.join(chain_replies(value))
+
+
+def chain_replies(values):
+    yield ('*%d\r\n' % len(values)).encode('utf-8')
+    for value in values:
+        yield encode_reply(value)
+
+
+class ScriptClient(ClientMixin):
+    '''The client executing the commands called by scripts.
+    '''
+    _forwarding = False
+    _monitored = False
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._loop = store._loop
+        self.password = store._password
+        self.channels = ()
+        self.patterns = ()
+        self.watched_keys = None
+        self.reply = None
+
+    def reply_ok(self):
+        self.reply = Status(b'OK')
+
+    def reply_status(self, value):
+        self.reply = Status(value.encode('utf-8'))
+
+    def reply_int(self, value):
+        self.reply = value
+
+    def reply_one(self):
+        self.reply = 1
+
+    def reply_zero(self):
+        self.reply = 0
+
+    def reply_error(self, value, prefix=None):
+        self.reply = Error(('%s %s' % (prefix or 'ERR', value)).encode(
+            'utf-8'))
+
+    def reply_wrongtype(self):
+        self.reply = Error(b'WRONGTYPE Operation against a key holding '
+                           b'the wrong kind of value')
+
+    def reply_bulk(self, value=None):
+        self.reply = None if value is None else bytes(value)
+
+    def reply_multi_bulk(self, value=None):
+        self.reply = to_native(value)
+
+    def _write(self, response):
+        self._send(response)
+
+    def _send(self, data):
+        parser = self.store._server._parser_class()
+        parser.feed(data)
+        reply = parser.get()
+        if isinstance(reply, ResponseError):
+            reply = Error(str(reply).encode('utf-8'))
+        self.reply = reply
+
+
+class LuaEngine:
+    '''Run lua scripts in the runtime provided by lupa.
+    '''
+    name = 'lua'
+
+    def __init__(self, call):
+        self._call = call
+        self._runtime = runtime = lupa.LuaRuntime(encoding=None,
+                                                  register_eval=False,
+                                                  unpack_returned_tuples=True)
+        self._globals = runtime.globals()
+        self._load = runtime.execute(
+            LUA_SANDBOX, self._lua_call,
+            lambda script: sha1hex(script).encode('utf-8'))
+
+    def compile(self, script, name):
+        function, error = self._load(script, name.encode('utf-8'))
+        if function is None:
+            raise CommandError('Error compiling script (new function): %s' %
+                               to_string(error))
+        return function
+
+    def run(self, function, keys, args):
+        table = self._runtime.table_from
+        self._globals[b'KEYS'] = table(keys)
+        self._globals[b'ARGV'] = table(args)
+        try:
+            value = function()
+        except lupa.LuaError as exc:
+            raise ScriptError(str(exc).split('\n')[0])
+        if isinstance(value, tuple):
+            value = value[0] if value else None
+        return self._from_lua(value)
+
+    def _lua_call(self, *args):
+        return self._to_lua(self._call(args))
+
+    def _to_lua(self, value):
+        if value is None:
+            return False
+        elif isinstance(value, list):
+            return self._runtime.table_from([self._to_lua(v) for v in value])
+        elif isinstance(value, Status):
+            return self._runtime.table_from({b'ok': value.value})
+        elif isinstance(value, Error):
+            return self._runtime.table_from({b'err': value.value})
+        return value
+
+    def _from_lua(self, value):
+        if value is None or value is False:
+            return None
+        elif value is True:
+            return 1
+        elif isinstance(value, (int, float)):
+            return int(value)
+        elif isinstance(value, bytes):
+            return value
+        elif lupa.lua_type(value) == 'table':
+            if value[b'err'] is not None:
+                return Error(to_bytes(value[b'err']))
+            elif value[b'ok'] is not None:
+                return Status(to_bytes(value[b'ok']))
+            values = []
+            index = 1
+            while True:
+                item = value[index]
+                if item is None:
+                    return values
+                values.append(self._from_lua(item))
+                index += 1
+        return None
+
+
+class PythonRedis:
+    '''The ``redis`` object of python scripts'''
+    __slots__ = ('pcall',)
+
+    def __init__(self, pcall):
+        self.pcall = pcall
+
+    def call(self, *args):
+        reply = self.pcall(*args)
+        if isinstance(reply, Error):
+            raise ResponseError(to_string(reply.value))
+        return reply
+
+    error_reply = staticmethod(lambda err: Error(to_bytes(err)))
+    status_reply = staticmethod(lambda ok: Status(to_bytes(ok)))
+    sha1hex = staticmethod(sha1hex)
+
+
+class PythonEngine:
+    '''Run trusted python scripts with a restricted set of builtins.
+    '''
+    name = 'python'
+
+    def __init__(self, call):
+        self._redis = PythonRedis(lambda *args: call(args))
+
+    def compile(self, script, name):
+        body = textwrap.indent(textwrap.dedent(to_string(script)), '    ')
+        source = 'def %s(KEYS, ARGV):\n%s\n    pass\n' % (name, body)
+        try:
+            tree = ast.parse(source, '@%s' % name)
+        except SyntaxError as exc:
+            raise CommandError('Error compiling script (new function): %s' %
+                               exc)
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                raise CommandError('Error compiling script (new function): '
+                                   'import not allowed')
+            elif ((isinstance(node, ast.Attribute) and
+                   node.attr.startswith('_')) or
+                  (isinstance(node, ast.Name) and node.id.startswith('__'))):
+                raise CommandError('Error compiling script (new function): '
+                                   'private names not allowed')
+            elif (isinstance(node, ast.Attribute) and
+                    node.attr in UNSAFE_ATTRIBUTES):
+                raise CommandError('Error compiling script (new function): '
+                                   'attribute %s not allowed' % node.attr)
+        namespace = {'__builtins__': SAFE_BUILTINS, 'redis': self._redis}
+        exec(compile(tree, '@%s' % name, 'exec'), namespace)
+        return namespace[name]
+
+    def run(self, function, keys, args):
+        try:
+            value = function(list(keys), list(args))
+        except Exception as exc:
+            raise ScriptError(str(exc))
+        return self._from_python(value)
+
+    def _from_python(self, value):
+        if value is None or value is False:
+            return None
+        elif value is True:
+            return 1
+        elif isinstance(value, (int, float)):
+            return int(value)
+        elif isinstance(value, (bytes, bytearray, str)):
+            return to_bytes(value)
+        elif isinstance(value, (list, tuple)):
+            return [self._from_python(v) for v in value]
+        elif isinstance(value, (Status, Error)):
+            return value
+        return str(value).encode('utf-8')
+
+
+class Scripting:
+    '''The scripts of a :class:`.Storage`.
+
+    .. attribute:: engine
+
+        The engine compiling and running scripts, a :class:`LuaEngine`
+        when ``language`` is ``lua`` or a :class:`PythonEngine` when it
+        is ``python``. ``None`` when ``language`` is ``lua`` and lupa is
+        not installed, scripts are refused then.
+
+    .. attribute:: scripts
+
+        Dictionary of compiled scripts by SHA1.
+    '''
+    def __init__(self, store, language):
+        self.store = store
+        if language == 'lua' and lupa is None:
+            store.logger.warning('lupa is not installed, scripting is '
+                                 'disabled')
+            self.engine = None
+        else:
+            engine = LuaEngine if language == 'lua' else PythonEngine
+            self.engine = engine(self.call)
+        self.scripts = {}
+        self.client = ScriptClient(store)
+
+    def load(self, script):
+        '''Compile ``script`` and add it to the cache, return its SHA1
+        '''
+        if self.engine is None:
+            raise CommandError(DISABLED)
+        sha = sha1hex(script)
+        if sha not in self.scripts:
+            self.scripts[sha] = self.engine.compile(script, 'f_%s' % sha)
+        return sha
+
+    def run(self, client, sha, keys, args):
+        '''Run the script ``sha`` and write its result to ``client``
+        '''
+        self.client.database = client.database
+        try:
+            value = self.engine.run(self.scripts[sha], keys, args)
+        except ScriptError as exc:
+            raise ScriptError('Error running script (call to f_%s): %s' %
+                              (sha, exc))
+        client._write(encode_reply(value))
+
+    def call(self, args):
+        '''Execute the command in ``args`` requested by a script and
+        return its reply
+        '''
+        if not args:
+            return Error(b'ERR Please specify at least one argument '
+                         b'for redis.call()')
+        request = []
+        for arg in args:
+            if isinstance(arg, float):
+                arg = ('%.17g' % arg).encode('utf-8')
+            elif isinstance(arg, (int, str)):
+                arg = str(arg).encode('utf-8')
+            elif not isinstance(arg, bytes):
+                return Error(b'ERR Lua redis() command arguments must be '
+                             b'strings or integers')
+            request.append(arg)
+        info = COMMANDS_INFO.get(to_string(request[0]).lower())
+        if info is None:
+            return Error(b'ERR Unknown Redis command called from script')
+        elif not info.script:
+            return Error(b'ERR This Redis command is not allowed from '
+                         b'scripts')
+        client = self.client
+        client.reply = None
+        client.execute(request)
+        return client.reply
+
+    def flush(self):
+        self.scripts.clear()
+
+    def info(self):
+        return {'number_of_cached_scripts': len(self.scripts),
+                'scripting_engine': (self.engine.name if self.engine
+                                     else 'disabled')}
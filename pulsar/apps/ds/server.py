@@ -46,18 +46,34 @@ import time
 import math
 import pickle
 from random import choice
-from itertools import islice, chain
+from heapq import nlargest
+from itertools import islice, chain, count
 from functools import partial, reduce
-from collections import namedtuple
-from itertools import zip_longest
+from collections import deque
 
 import pulsar
 from pulsar.apps.socket import SocketServer
-from pulsar.utils.config import Global
-from pulsar.utils.structures import Dict, Zset, Deque
-
-from .parser import redis_parser
-from .utils import sort_command, count_bytes, and_op, or_op, xor_op, save_data
+from pulsar.utils.config import Global, validate_bool
+from pulsar.utils.system import convert_bytes
+from pulsar.utils.structures import (Hash, Set, Zset, Deque, ExpiryHeap,
+                                     Skiplist, BlockList, Stream, StreamGroup)
+from pulsar.utils.structures.stream import (MIN_ID, MAX_ID, id_after,
+                                            id_before)
+
+from .parser import redis_parser, CommandError
+from .aof import AppendOnlyFile
+from .snapshot import SnapshotReader, SnapshotError
+from .replication import Replication
+from .scripting import Scripting
+from .cluster import create_shards, new_shard, command_keys
+from .pubsub import PatternIndex
+from .stats import CommandStats, SlowLog, LatencyMonitor, LATENCY_PERCENTILES
+from .tracking import Tracking, TrackingTable, INVALIDATE_CHANNEL
+from .eviction import (POLICIES, KeyTable, EvictionPool, estimate_size,
+                       lru_clock, access)
+from .bitmap import (bit_count, bit_op, bit_pos, get_field, set_field,
+                     overflow, OPERATORS, OVERFLOWS)
+from .utils import sort_command, save_data, ForkSave, format_stream_id
 from .client import (command, PulsarStoreClient, Blocked,
                      COMMANDS_INFO, check_input, redis_to_py_pattern)
 
@@ -78,8 +94,32 @@ def pulsards_url(address=None):
 
 # Keyspace changes notification classes
 STRING_LIMIT = 2**32
+# Seconds between two runs of the Storage cron task
+CRON_INTERVAL = 0.1
+# Maximum number of keys expired by one run of the cron task
+ACTIVE_EXPIRE_KEYS = 200
+# Number of keys loaded from a snapshot in one event loop iteration
+LOAD_KEYS_PER_ITERATION = 1000
+# Number of keys with most blocked clients listed by INFO for each database
+BLOCKED_INFO_KEYS = 10
+# Classes of keyspace events, as in the notify-keyspace-events of redis
+NOTIFY_CLASSES = 'g$lshzxet'
+# Keyspace events named differently from the command which fires them
+NOTIFY_EVENT_NAMES = {'getset': 'set', 'hmset': 'hset', 'hsetnx': 'hset',
+                      'mset': 'set', 'msetnx': 'set', 'psetex': 'set',
+                      'setex': 'set', 'setnx': 'set', 'zincrby': 'zincr'}
+# INFO sections only returned when requested by name or with INFO all
+INFO_EXTRA_SECTIONS = ('commandstats', 'latencystats')
+# Groups of the read commands whose keys are remembered for clients with
+# tracking enabled
+TRACKING_GROUPS = ('Keys', 'Strings', 'Hashes', 'Lists', 'Sets',
+                   'Sorted Sets', 'Streams')
 
 nan = float('nan')
+MEMORY_UNITS = {'': 1, 'b': 1, 'k': 1000, 'kb': 1024, 'm': 1000**2,
+                'mb': 1024**2, 'g': 1000**3, 'gb': 1024**3}
+# Data structures of sorted sets in the full encoding
+ZSET_ENGINES = {'blocklist': BlockList, 'skiplist': Skiplist}
 
 
 class RedisParserSetting(Global):
@@ -114,6 +154,24 @@ def validate_list_of_pairs(val):
     return new_val
 
 
+def validate_memory(val):
+    '''A number of bytes, optionally followed by a unit, as in redis
+
+    1k => 1000 bytes, 1kb => 1024 bytes, 1m => 1000000 bytes, and so on.
+    '''
+    if isinstance(val, str):
+        value = val.strip().lower()
+        unit = value.lstrip('0123456789')
+        factor = MEMORY_UNITS.get(unit)
+        if factor is None or unit == value:
+            raise ValueError("Invalid memory value: %s" % val)
+        val = int(value[:len(value)-len(unit)])*factor
+    val = int(val)
+    if val < 0:
+        raise ValueError("Value must be positive: %s" % val)
+    return val
+
+
 # #############################################################################
 # #    CONFIGURATION PARAMETERS
 class KeyValueDatabases(PulsarDsSetting):
@@ -151,6 +209,21 @@ class KeyValueSave(PulsarDsSetting):
     '''
 
 
+class KeyValueSaveMode(PulsarDsSetting):
+    name = "key_value_save_mode"
+    flags = ["--key-value-save-mode"]
+    choices = ('fork', 'process')
+    default = 'fork'
+    desc = '''\
+        How the DB is saved in the background.
+
+        ``fork`` uses :func:`os.fork` so that the child process writes the
+        data straight from the memory pages it shares with the server.
+        ``process`` copies the data into a new :class:`multiprocessing.Process`
+        and it is used when :func:`os.fork` is not available.
+    '''
+
+
 class KeyValueFileName(PulsarDsSetting):
     name = "key_value_filename"
     flags = ["--key-value-filename"]
@@ -158,6 +231,311 @@ class KeyValueFileName(PulsarDsSetting):
     desc = '''The filename where to dump the DB.'''
 
 
+class KeyValueAppendOnly(PulsarDsSetting):
+    name = "key_value_appendonly"
+    flags = ["--key-value-appendonly"]
+    validator = validate_bool
+    action = "store_true"
+    default = False
+    desc = '''\
+        Log every write operation into an append only file.
+
+        The file is replayed when the server starts, in place of the
+        snapshot in ``key_value_filename``.
+    '''
+
+
+class KeyValueAppendFileName(PulsarDsSetting):
+    name = "key_value_appendfilename"
+    flags = ["--key-value-appendfilename"]
+    default = 'pulsards.aof'
+    desc = '''The name of the append only file.'''
+
+
+class KeyValueAppendFsync(PulsarDsSetting):
+    name = "key_value_appendfsync"
+    flags = ["--key-value-appendfsync"]
+    choices = ('always', 'everysec', 'no')
+    default = 'everysec'
+    desc = '''\
+        How often the append only file is flushed to disk.
+
+        ``always`` after every write command, ``everysec`` once a second
+        and ``no`` let the operative system decide.
+    '''
+
+
+class KeyValueMaxMemory(PulsarDsSetting):
+    name = "key_value_maxmemory"
+    flags = ["--key-value-maxmemory"]
+    validator = validate_memory
+    default = 0
+    desc = '''\
+        Memory limit of the data store, 0 for no limit.
+
+        The memory used by keys is estimated when they are written, only
+        when a limit is set, otherwise ``used_memory`` is reported as 0.
+        Once the limit is reached keys are evicted according to
+        ``key_value_maxmemory_policy``. A unit can be used as in redis,
+        for example ``100mb``.
+    '''
+
+
+class KeyValueMaxMemoryPolicy(PulsarDsSetting):
+    name = "key_value_maxmemory_policy"
+    flags = ["--key-value-maxmemory-policy"]
+    choices = POLICIES
+    default = 'noeviction'
+    desc = '''\
+        How to select keys to evict when ``key_value_maxmemory`` is reached.
+
+        ``noeviction`` reply with an error to write commands,
+        ``allkeys-*`` evict any key and ``volatile-*`` evict keys with a
+        time to live. Keys are selected by approximated least recent use
+        (``lru``), approximated least frequent use (``lfu``), at random
+        (``random``) or by shortest time to live (``volatile-ttl``).
+    '''
+
+
+class KeyValueMaxMemorySamples(PulsarDsSetting):
+    name = "key_value_maxmemory_samples"
+    flags = ["--key-value-maxmemory-samples"]
+    type = int
+    default = 5
+    desc = '''\
+        Number of keys sampled in each database when looking for a key to
+        evict. Larger values are more accurate and slower.
+    '''
+
+
+class KeyValueReplicaOf(PulsarDsSetting):
+    name = "key_value_replicaof"
+    flags = ["--key-value-replicaof"]
+    default = ''
+    desc = '''\
+        Address of the primary to replicate, as ``host:port``.
+
+        A replica refuses write commands and can be promoted to primary
+        with the ``SLAVEOF NO ONE`` command.
+    '''
+
+
+class KeyValueReplBacklogSize(PulsarDsSetting):
+    name = "key_value_repl_backlog_size"
+    flags = ["--key-value-repl-backlog-size"]
+    validator = validate_memory
+    default = 1024*1024
+    desc = '''\
+        Size of the replication backlog.
+
+        The backlog keeps the last commands sent to replicas, so that
+        replicas which disconnect for a short time can receive only the
+        commands they missed rather than a full snapshot.
+    '''
+
+
+class KeyValueShards(PulsarDsSetting):
+    name = "key_value_shards"
+    flags = ["--key-value-shards"]
+    type = int
+    default = 0
+    desc = '''\
+        Number of workers partitioning the key space, 0 for a single store.
+
+        Each worker owns a range of the 16384 hash slots keys are mapped
+        to, as in redis cluster. Requests on keys owned by other workers are
+        forwarded to them and commands on keys of several workers, such as
+        ``MGET`` and ``SUNION``, are split among them. Use hash tags, the
+        part of a key between ``{`` and ``}``, to keep related keys in the
+        same worker. Persistence files are suffixed with the worker index.
+    '''
+
+
+class KeyValueNotifyKeyspaceEvents(PulsarDsSetting):
+    name = "key_value_notify_keyspace_events"
+    flags = ["--key-value-notify-keyspace-events"]
+    default = ''
+    desc = '''\
+        Keyspace events published to ``__keyspace@<db>__:<key>`` and
+        ``__keyevent@<db>__:<event>`` channels, as in redis.
+
+        A string of the ``K`` (keyspace) and ``E`` (keyevent) channel types
+        and of the ``g`` (generic), ``$`` (string), ``l`` (list), ``s``
+        (set), ``h`` (hash), ``z`` (sorted set), ``x`` (expired) and ``e``
+        (evicted) event classes, ``A`` for all classes. Empty to disable
+        notifications, which can also be changed with
+        ``CONFIG SET notify-keyspace-events``.
+    '''
+
+
+class KeyValueSlowlogLogSlowerThan(PulsarDsSetting):
+    name = "key_value_slowlog_log_slower_than"
+    flags = ["--key-value-slowlog-log-slower-than"]
+    type = int
+    default = 10000
+    desc = '''\
+        Commands taking longer than this number of microseconds are
+        recorded in the slow log.
+
+        0 records all commands, a negative value disables the slow log.
+    '''
+
+
+class KeyValueSlowlogMaxLen(PulsarDsSetting):
+    name = "key_value_slowlog_max_len"
+    flags = ["--key-value-slowlog-max-len"]
+    type = int
+    default = 128
+    desc = '''\
+        Number of entries of the slow log, older entries are dropped
+        when it is full.
+    '''
+
+
+class KeyValueLatencyMonitorThreshold(PulsarDsSetting):
+    name = "key_value_latency_monitor_threshold"
+    flags = ["--key-value-latency-monitor-threshold"]
+    type = int
+    default = 0
+    desc = '''\
+        Commands taking at least this number of milliseconds are sampled
+        by the latency monitor, see ``LATENCY LATEST``. 0 disables it.
+    '''
+
+
+class KeyValueTrackingTableMaxKeys(PulsarDsSetting):
+    name = "key_value_tracking_table_max_keys"
+    flags = ["--key-value-tracking-table-max-keys"]
+    type = int
+    default = 1000000
+    desc = '''\
+        Maximum number of keys remembered for clients with
+        ``CLIENT TRACKING`` enabled, 0 for no limit.
+
+        When the limit is reached the oldest keys are forgotten and their
+        readers receive an invalidation message as if they were modified.
+    '''
+
+
+class KeyValueScripting(PulsarDsSetting):
+    name = "key_value_scripting"
+    flags = ["--key-value-scripting"]
+    choices = ('lua', 'python')
+    default = 'lua'
+    desc = '''\
+        Language of the scripts executed by ``EVAL`` and ``EVALSHA``.
+
+        ``lua`` requires the lupa package, scripts are refused when it is
+        not installed. ``python`` executes scripts as python function
+        bodies, which are not sandboxed: select it only when the clients
+        allowed to run scripts are trusted with the server process.
+    '''
+
+
+class KeyValueHashMaxListpackEntries(PulsarDsSetting):
+    name = "key_value_hash_max_listpack_entries"
+    flags = ["--key-value-hash-max-listpack-entries"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of fields of a hash in the compact encoding.
+
+        Small hashes are stored in a flat list rather than a dictionary and
+        converted once they grow past this number of fields.
+    '''
+
+
+class KeyValueHashMaxListpackValue(PulsarDsSetting):
+    name = "key_value_hash_max_listpack_value"
+    flags = ["--key-value-hash-max-listpack-value"]
+    type = int
+    default = 64
+    desc = '''\
+        Maximum length of fields and values of a hash in the compact
+        encoding.
+    '''
+
+
+class KeyValueSetMaxListpackEntries(PulsarDsSetting):
+    name = "key_value_set_max_listpack_entries"
+    flags = ["--key-value-set-max-listpack-entries"]
+    type = int
+    default = 128
+    desc = 'Maximum number of members of a set in the compact encoding.'
+
+
+class KeyValueSetMaxListpackValue(PulsarDsSetting):
+    name = "key_value_set_max_listpack_value"
+    flags = ["--key-value-set-max-listpack-value"]
+    type = int
+    default = 64
+    desc = 'Maximum length of members of a set in the compact encoding.'
+
+
+class KeyValueSetMaxIntsetEntries(PulsarDsSetting):
+    name = "key_value_set_max_intset_entries"
+    flags = ["--key-value-set-max-intset-entries"]
+    type = int
+    default = 512
+    desc = '''\
+        Maximum number of members of a set of integers in the intset
+        encoding.
+
+        Intsets are sorted arrays of 64 bits integers, they use eight bytes
+        per member and are intersected without hashing. Members are added
+        in amortized constant time, large sets of integers use the intset
+        encoding only when this limit is raised above their size.
+    '''
+
+
+class KeyValueZsetMaxListpackEntries(PulsarDsSetting):
+    name = "key_value_zset_max_listpack_entries"
+    flags = ["--key-value-zset-max-listpack-entries"]
+    type = int
+    default = 128
+    desc = '''\
+        Maximum number of members of a sorted set in the compact encoding.
+    '''
+
+
+class KeyValueZsetMaxListpackValue(PulsarDsSetting):
+    name = "key_value_zset_max_listpack_value"
+    flags = ["--key-value-zset-max-listpack-value"]
+    type = int
+    default = 64
+    desc = '''\
+        Maximum length of members of a sorted set in the compact encoding.
+    '''
+
+
+class KeyValueZsetEngine(PulsarDsSetting):
+    name = "key_value_zset_engine"
+    flags = ["--key-value-zset-engine"]
+    choices = ('blocklist', 'skiplist')
+    default = 'blocklist'
+    desc = '''\
+        Data structure of sorted sets larger than the compact encoding.
+
+        ``blocklist`` keeps scores and members in blocks of sorted arrays,
+        it uses a fraction of the memory of the ``skiplist``, which
+        allocates a node and per level lists for every member, and it is
+        faster for ranges and ranks.
+    '''
+
+
+class KeyValueStreamNodeMaxEntries(PulsarDsSetting):
+    name = "key_value_stream_node_max_entries"
+    flags = ["--key-value-stream-node-max-entries"]
+    type = int
+    default = 100
+    desc = '''\
+        Maximum number of entries in a node of a stream.
+
+        Approximate trimming, with ``MAXLEN ~`` or ``MINID ~``, only
+        removes whole nodes.
+    '''
+
+
 class TcpServer(pulsar.TcpServer):
 
     def __init__(self, cfg, *args, **kwargs):
@@ -165,6 +543,7 @@ class TcpServer(pulsar.TcpServer):
         self.cfg = cfg
         self._parser_class = redis_parser(cfg.redis_py_parser)
         self._key_value_store = Storage(self, cfg)
+        self.bind_event('stop', self._key_value_store._close)
 
     def info(self):
         info = super().info()
@@ -188,13 +567,20 @@ class PulsarDS(SocketServer):
 
     def monitor_start(self, monitor):
         cfg = self.cfg
-        cfg.set('workers', 0)
+        cfg.set('workers', cfg.key_value_shards)
+        # actor ids of workers by shard index
+        self.shards = {}
         return super().monitor_start(monitor)
 
+    def actorparams(self, monitor, params):
+        super().actorparams(monitor, params)
+        cfg = params['cfg']
+        if cfg.key_value_shards:
+            params['aid'] = new_shard(self, monitor, cfg)
+
 
 # #############################################################################
 # #    DATA STORE
-pubsub_patterns = namedtuple('pubsub_patterns', 're clients')
 
 
 class Storage:
@@ -205,17 +591,40 @@ class Storage:
         self._password = cfg.key_value_password.encode('utf-8')
         self._filename = cfg.key_value_filename
         self._writer = None
+        self._aof = None
+        self._also_propagate = []
+        # databases still loading from the snapshot
+        self._loading = set()
         self._server = server
         self._loop = server._loop
         self._parser = server._parser_class()
         self._missed_keys = 0
         self._hit_keys = 0
         self._expired_keys = 0
+        self._evicted_keys = 0
+        self._used_memory = 0
+        self._maxmemory = cfg.key_value_maxmemory
+        self._eviction_pool = EvictionPool(cfg.key_value_maxmemory_policy,
+                                           cfg.key_value_maxmemory_samples)
         self._dirty = 0
+        # value of _dirty when the running save started
+        self._dirty_saving = 0
         self._bpop_blocked_clients = 0
+        self._bpop_timeouts = 0
+        self._bpop_deadlines = ExpiryHeap()
+        self._bpop_sequence = count()
+        # keys with blocked clients which received elements
+        self._ready_keys = deque()
+        self._ready_set = set()
+        self._expire_db = 0
         self._last_save = int(time.time())
+        self._save_started = None
+        self._last_save_duration = -1
+        self._last_save_status = 'ok'
         self._channels = {}
-        self._patterns = {}
+        self._patterns = PatternIndex()
+        # number of subscribed keyspace and keyevent channels
+        self._keyspace_channels = 0
         # The set of clients which are watching keys
         self._watching = set()
         # The set of clients which issued the monitor command
@@ -232,10 +641,12 @@ class Storage:
         self.NOTIFY_ZSET = (1 << 7)
         self.NOTIFY_EXPIRED = (1 << 8)
         self.NOTIFY_EVICTED = (1 << 9)
+        self.NOTIFY_STREAM = (1 << 10)
         self.NOTIFY_ALL = (self.NOTIFY_GENERIC | self.NOTIFY_STRING |
                            self.NOTIFY_LIST | self.NOTIFY_SET |
                            self.NOTIFY_HASH | self.NOTIFY_ZSET |
-                           self.NOTIFY_EXPIRED | self.NOTIFY_EVICTED)
+                           self.NOTIFY_EXPIRED | self.NOTIFY_EVICTED |
+                           self.NOTIFY_STREAM)
 
         self.MONITOR = (1 << 2)
         self.MULTI = (1 << 3)
@@ -247,7 +658,22 @@ class Storage:
                                 self.NOTIFY_SET: self._set_event,
                                 self.NOTIFY_HASH: self._hash_event,
                                 self.NOTIFY_LIST: self._list_event,
-                                self.NOTIFY_ZSET: self._zset_event}
+                                self.NOTIFY_ZSET: self._zset_event,
+                                self.NOTIFY_EXPIRED: self._generic_event,
+                                self.NOTIFY_EVICTED: self._generic_event,
+                                self.NOTIFY_STREAM: self._stream_event}
+        self._notify_flags = 0
+        self._notify_events(cfg.key_value_notify_keyspace_events)
+        # calls, time and latency histogram by command name
+        self._commandstats = {}
+        self._slowlog = SlowLog(cfg.key_value_slowlog_max_len)
+        self._slowlog_slower_than = cfg.key_value_slowlog_log_slower_than
+        self._latency_monitor = LatencyMonitor()
+        self._latency_threshold = cfg.key_value_latency_monitor_threshold
+        # connected clients by id and keys read by clients with tracking
+        self._clients = {}
+        self._client_ids = count(1)
+        self._tracking = TrackingTable(cfg.key_value_tracking_table_max_keys)
         self._set_options = (b'ex', b'px', b'nx', b'xx')
         self.OK = b'+OK\r\n'
         self.QUEUED = b'+QUEUED\r\n'
@@ -259,36 +685,98 @@ class Storage:
         self.PUBSUB_ONLY = ('only (P)SUBSCRIBE / (P)UNSUBSCRIBE / QUIT '
                             'allowed in this context')
         self.INVALID_SCORE = 'Invalid score value'
+        self.INVALID_LEX = 'min or max not valid string range item'
         self.NOT_SUPPORTED = 'Command not yet supported'
         self.OUT_OF_BOUND = 'Out of bound'
         self.SYNTAX_ERROR = 'Syntax error'
+        self.LOADING = 'Pulsar is loading the dataset in memory'
+        self.OOM = "command not allowed when used memory > 'maxmemory'"
+        self.READONLY = "You can't write against a read only replica."
+        self.NOSCRIPT = 'No matching script. Please use EVAL.'
+        self.INVALID_BIT_OFFSET = ('bit offset is not an integer or out '
+                                   'of range')
+        self.INVALID_BITFIELD_TYPE = ('Invalid bitfield type. Use something '
+                                      'like i16 u8. Note that u64 is not '
+                                      'supported but i64 is.')
+        self.INVALID_STREAM_ID = ('Invalid stream ID specified as stream '
+                                  'command argument')
+        self.XGROUP_NO_KEY = ('The XGROUP subcommand requires the key to '
+                              'exist. Note that for CREATE you may want to '
+                              'use the MKSTREAM option to create an empty '
+                              'stream automatically.')
         self.SUBSCRIBE_COMMANDS = ('psubscribe', 'punsubscribe', 'subscribe',
                                    'unsubscribe', 'quit')
+        self.BLOCKING_COMMANDS = ('blpop', 'brpop', 'brpoplpush')
+        # write commands propagated by the commands added with _also
+        self.ALSO_COMMANDS = self.BLOCKING_COMMANDS + ('spop', 'xclaim',
+                                                       'xreadgroup')
+        self.EXPIRE_COMMANDS = ('expire', 'expireat', 'pexpire', 'pexpireat')
+        self.TTL_COMMANDS = ('set', 'setex', 'psetex', 'restore')
+        # commands allowed on a database which is loading
+        self.LOADING_GROUPS = ('Connections', 'Pub/Sub')
+        self.LOADING_COMMANDS = ('client', 'config', 'info', 'lastsave',
+                                 'latency', 'monitor', 'shutdown', 'slowlog',
+                                 'time')
+        # write commands allowed when memory cannot be freed
+        self.FREE_COMMANDS = ('del', 'expire', 'expireat', 'flushall',
+                              'flushdb', 'hdel', 'lpop', 'lrem', 'ltrim',
+                              'pexpire', 'pexpireat', 'rpop', 'spop', 'srem',
+                              'zrem', 'zremrangebyrank', 'zremrangebyscore')
+        # commands not allowed while any database is loading
+        self.LOADING_ALL_COMMANDS = ('bgrewriteaof', 'bgsave', 'flushall',
+                                     'move', 'save', 'sync')
         self.encoder = pickle
-        self.hash_type = Dict
+        # collection types with the encoding limits of this store
+        self.hash_type = self._collection_type(
+            Hash,
+            max_entries=cfg.key_value_hash_max_listpack_entries,
+            max_value=cfg.key_value_hash_max_listpack_value)
         self.list_type = Deque
-        self.zset_type = Zset
-        self.data_types = (bytearray, set, self.hash_type,
-                           self.list_type, self.zset_type)
+        self.set_type = self._collection_type(
+            Set,
+            max_entries=cfg.key_value_set_max_listpack_entries,
+            max_value=cfg.key_value_set_max_listpack_value,
+            max_intset_entries=cfg.key_value_set_max_intset_entries)
+        self.zset_type = self._collection_type(
+            Zset,
+            max_entries=cfg.key_value_zset_max_listpack_entries,
+            max_value=cfg.key_value_zset_max_listpack_value,
+            engine=ZSET_ENGINES[cfg.key_value_zset_engine])
+        self.stream_type = self._collection_type(
+            Stream, node_size=cfg.key_value_stream_node_max_entries)
+        self.data_types = (bytearray, self.set_type, self.hash_type,
+                           self.list_type, self.zset_type, self.stream_type)
+        # store types by library type, for values loaded from snapshots
+        # or restored from DUMP payloads
+        self._types = {Hash: self.hash_type,
+                       Set: self.set_type,
+                       Zset: self.zset_type,
+                       Stream: self.stream_type}
         self.zset_aggregate = {b'min': min,
                                b'max': max,
                                b'sum': sum}
         self._type_event_map = {bytearray: self.NOTIFY_STRING,
                                 self.hash_type: self.NOTIFY_HASH,
                                 self.list_type: self.NOTIFY_LIST,
-                                set: self.NOTIFY_SET,
-                                self.zset_type: self.NOTIFY_ZSET}
+                                self.set_type: self.NOTIFY_SET,
+                                self.zset_type: self.NOTIFY_ZSET,
+                                self.stream_type: self.NOTIFY_STREAM}
         self._type_name_map = {bytearray: 'string',
                                self.hash_type: 'hash',
                                self.list_type: 'list',
-                               set: 'set',
-                               self.zset_type: 'zset'}
+                               self.set_type: 'set',
+                               self.zset_type: 'zset',
+                               self.stream_type: 'stream'}
         self.databases = dict(((num, Db(num, self))
                                for num in range(cfg.key_value_databases)))
-        # Initialise lua
-        self.lua = None
+        self._scripting = Scripting(self, cfg.key_value_scripting)
         self.version = '2.4.10'
-        self._loaddb()
+        self._replication = Replication(self, cfg.key_value_repl_backlog_size)
+        self._shards = create_shards(self, cfg)
+        if self._shards is None or self._shards.index is not None:
+            self._loaddb()
+        if cfg.key_value_replicaof:
+            self._replication.replicaof(cfg.key_value_replicaof)
         self._cron()
 
     # #########################################################################
@@ -328,7 +816,10 @@ class Storage:
             if timeout:
                 if timeout < 0:
                     return client.reply_error(self.INVALID_TIMEOUT)
-                if client.db.expire(request[1], m*timeout):
+                db = client.db
+                if db.expire(request[1], m*timeout):
+                    self._signal(self.NOTIFY_GENERIC, db, 'expire',
+                                 request[1], 1)
                     return client.reply_one()
             client.reply_zero()
 
@@ -344,7 +835,10 @@ class Storage:
                 if timeout < 0:
                     return client.reply_error(self.INVALID_TIMEOUT)
                 timeout = M*timeout - time.time()
-                if client.db.expire(request[1], timeout):
+                db = client.db
+                if db.expire(request[1], timeout):
+                    self._signal(self.NOTIFY_GENERIC, db, 'expire',
+                                 request[1], 1)
                     return client.reply_one()
             client.reply_zero()
 
@@ -386,14 +880,34 @@ class Storage:
         self._signal(self._type_event_map[type(value)], db2, 'set', key, 1)
         client.reply_one()
 
-    @command('Keys', supported=False)
+    @command('Keys', subcommands=['encoding', 'refcount'])
     def object(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N != 2)
+        subcommand = request[1].decode('utf-8').lower()
+        value = client.db.get(request[2])
+        if subcommand == 'encoding':
+            if value is None:
+                client.reply_bulk()
+            elif isinstance(value, bytearray):
+                client.reply_bulk(b'raw')
+            elif isinstance(value, self.list_type):
+                client.reply_bulk(b'quicklist')
+            else:
+                client.reply_bulk(value.encoding.encode('utf-8'))
+        elif subcommand == 'refcount':
+            if value is None:
+                client.reply_bulk()
+            else:
+                client.reply_one()
+        else:
+            client.reply_error("unknown command 'object %s'" % subcommand)
 
     @command('Keys', True)
     def persist(self, client, request, N):
         check_input(request, N != 1)
-        if client.db.persist(request[1]):
+        db = client.db
+        if db.persist(request[1]):
+            self._signal(self.NOTIFY_GENERIC, db, 'persist', request[1], 1)
             client.reply_one()
         else:
             client.reply_zero()
@@ -457,7 +971,7 @@ class Storage:
         key = request[1]
         db = client.db
         try:
-            value = self.encoder.loads(request[3])
+            value = self._adopt(self.encoder.loads(request[3]))
         except Exception:
             value = None
         if not isinstance(value, self.data_types):
@@ -471,6 +985,7 @@ class Storage:
         db._data[key] = value
         if ttl > 0:
             db.expire(key, ttl)
+        self._signal(self._type_event_map[type(value)], db, 'restore', key, 1)
         client.reply_ok()
 
     @command('Keys', True)
@@ -479,16 +994,17 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             value = self.list_type()
-        elif not isinstance(value, (set, self.list_type, self.zset_type)):
+        elif not isinstance(value, (self.set_type, self.list_type,
+                                    self.zset_type)):
             return client.reply_wrongtype()
         sort_command(self, client, request, value)
 
-    @command('Keys', True)
+    @command('Keys')
     def ttl(self, client, request, N):
         check_input(request, N != 1)
         client.reply_int(client.db.ttl(request[1]))
 
-    @command('Keys', True)
+    @command('Keys')
     def type(self, client, request, N):
         check_input(request, N != 1)
         value = client.db.get(request[1])
@@ -498,9 +1014,29 @@ class Storage:
             result = self._type_name_map[type(value)]
         client.reply_status(result)
 
-    @command('Keys', supported=False)
+    @command('Keys')
     def scan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        cursor, match, count, type_name = self._scan_options(request, 2, True)
+        db = client.db
+        table = db._keys_meta
+        # Keys are visited from the end of the key table, towards the
+        # start. Removing a key moves the last key into its slot, so that
+        # keys not yet visited are never moved past the cursor
+        if not cursor or cursor > len(table):
+            cursor = len(table)
+        start = max(cursor - count, 0)
+        result = []
+        for key in table.keys(start, cursor):
+            if match and not match(key.decode('utf-8', 'ignore')):
+                continue
+            if db.exists(key):
+                if (type_name and
+                        self._type_name_map[type(db._peek(key))] !=
+                        type_name):
+                    continue
+                result.append(key)
+        client.reply_multi_bulk((('%d' % start).encode('utf-8'), result))
 
     # #########################################################################
     # #    STRING COMMANDS
@@ -523,7 +1059,7 @@ class Storage:
 
     @command('Strings')
     def bitcount(self, client, request, N):
-        check_input(request, N < 1 or N > 3)
+        check_input(request, N < 1 or N > 4)
         key = request[1]
         db = client.db
         value = db.get(key)
@@ -533,28 +1069,66 @@ class Storage:
             return client.reply_wrongtype()
         else:
             assert value
+            start, end = 0, None
             if N > 1:
-                start = request[2]
-                end = request[3] if N == 3 else -1
-                start, end = self._range_values(value, start, end)
-                value = value[start:end]
-            client.reply_int(count_bytes(value))
+                start, end = self._bit_range(value, request[2:])
+            client.reply_int(bit_count(value, start, end))
+
+    @command('Strings', True)
+    def bitfield(self, client, request, N):
+        check_input(request, N < 1)
+        operations = self._bitfield_operations(request)
+        db = client.db
+        key = request[1]
+        value = db.get(key)
+        if value is not None and not isinstance(value, bytearray):
+            return client.reply_wrongtype()
+        created = value is None
+        if created:
+            value = bytearray()
+        result = []
+        changes = 0
+        for op, bits, signed, offset, arg in operations:
+            old = get_field(value, offset, bits, signed)
+            if op == b'get':
+                result.append(old)
+                continue
+            op, behaviour = op
+            new = overflow(old + arg if op == b'incrby' else arg, bits,
+                           signed, behaviour)
+            if new is None:
+                result.append(None)
+            else:
+                set_field(value, offset, bits, new)
+                result.append(new if op == b'incrby' else old)
+                changes += 1
+        if created and value:
+            db._data[key] = value
+        if changes:
+            self._signal(self.NOTIFY_STRING, db, 'setbit', key, changes)
+        client.reply_multi_bulk(result)
+
+    @command('Strings')
+    def bitfield_ro(self, client, request, N):
+        check_input(request, N < 1)
+        operations = self._bitfield_operations(request, True)
+        value = client.db.get(request[1])
+        if value is None:
+            value = bytearray()
+        elif not isinstance(value, bytearray):
+            return client.reply_wrongtype()
+        client.reply_multi_bulk([get_field(value, offset, bits, signed)
+                                 for _, bits, signed, offset, _
+                                 in operations])
 
     @command('Strings', True)
     def bitop(self, client, request, N):
         check_input(request, N < 3)
         db = client.db
         op = request[1].lower()
-        if op == b'and':
-            reduce_op = and_op
-        elif op == b'or':
-            reduce_op = or_op
-        elif op == b'xor':
-            reduce_op = xor_op
-        elif op == b'not':
-            reduce_op = None
+        if op == b'not':
             check_input(request, N != 3)
-        else:
+        elif op not in OPERATORS:
             return client.reply_error('bad command')
         empty = bytearray()
         keys = []
@@ -566,23 +1140,38 @@ class Storage:
                 keys.append(value)
             else:
                 return client.reply_wrongtype()
-        result = bytearray()
-        if reduce_op is None:
-            for value in keys[0]:
-                result.append(~value & 255)
-        else:
-            for values in zip_longest(*keys, **{'fillvalue': 0}):
-                result.append(reduce(reduce_op, values))
+        result = bit_op(op, keys)
+        dest = request[2]
+        if db.pop(dest) is not None:
+            self._signal(self.NOTIFY_GENERIC, db, 'del', dest)
         if result:
-            dest = request[2]
-            if db.pop(dest):
-                self._signal(self.NOTIFY_GENERIC, db, 'del', dest)
             db._data[dest] = result
             self._signal(self.NOTIFY_STRING, db, 'set', dest, 1)
             client.reply_int(len(result))
         else:
             client.reply_zero()
 
+    @command('Strings')
+    def bitpos(self, client, request, N):
+        check_input(request, N < 2 or N > 5)
+        if request[2] not in (b'0', b'1'):
+            return client.reply_error('The bit argument must be 1 or 0.')
+        bit = int(request[2])
+        value = client.db.get(request[1])
+        if value is None:
+            return client.reply_int(-1 if bit else 0)
+        elif not isinstance(value, bytearray):
+            return client.reply_wrongtype()
+        assert value
+        start, end = 0, 8*len(value)
+        if N > 2:
+            start, end = self._bit_range(value, request[3:])
+        pos = bit_pos(value, bit, start, end)
+        if pos < 0 and not bit and N < 4 and start < end:
+            # without an explicit end the string is padded with zeros
+            pos = end
+        client.reply_int(pos)
+
     @command('Strings', True)
     def decr(self, client, request, N):
         check_input(request, N != 1)
@@ -619,8 +1208,7 @@ class Storage:
             if bitoffset < 0 or bitoffset >= STRING_LIMIT:
                 raise ValueError
         except Exception:
-            return client.reply_error(
-                "bit offset is not an integer or out of range")
+            return client.reply_error(self.INVALID_BIT_OFFSET)
         string = client.db.get(request[1])
         if string is None:
             client.reply_zero()
@@ -785,8 +1373,7 @@ class Storage:
             if bitoffset < 0 or bitoffset >= STRING_LIMIT:
                 raise ValueError
         except Exception:
-            return client.reply_error(
-                "bit offset is not an integer or out of range")
+            return client.reply_error(self.INVALID_BIT_OFFSET)
         try:
             value = int(request[3])
             if value not in (0, 1):
@@ -1036,9 +1623,16 @@ class Storage:
         else:
             client.reply_wrongtype()
 
-    @command('Hashes', supported=False)
+    @command('Hashes')
     def hscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif not isinstance(value, self.hash_type):
+            client.reply_wrongtype()
+        else:
+            self._scan_collection(client, request, value, value.get)
 
     # #########################################################################
     # #    LIST COMMANDS
@@ -1198,7 +1792,7 @@ class Storage:
     def rpushx(self, client, request, N):
         return self.lpushx(client, request, N)
 
-    @command('Lists', True)
+    @command('Lists')
     def lrange(self, client, request, N):
         check_input(request, N != 3)
         db = client.db
@@ -1324,9 +1918,9 @@ class Storage:
         db = client.db
         value = db.get(key)
         if value is None:
-            value = set()
+            value = self.set_type()
             db._data[key] = value
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             return client.reply_wrongtype()
         n = len(value)
         value.update(request[2:])
@@ -1340,7 +1934,7 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             client.reply_int(len(value))
@@ -1371,7 +1965,7 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             client.reply_int(int(request[2] in value))
@@ -1382,7 +1976,7 @@ class Storage:
         value = client.db.get(request[1])
         if value is None:
             client.reply_multi_bulk(())
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             client.reply_multi_bulk(value)
@@ -1397,16 +1991,16 @@ class Storage:
         dest = db.get(key2)
         if orig is None:
             client.reply_zero()
-        elif not isinstance(orig, set):
+        elif not isinstance(orig, self.set_type):
             client.reply_wrongtype()
         else:
             member = request[3]
             if member in orig:
                 # we my be able to move
                 if dest is None:
-                    dest = set()
+                    dest = self.set_type()
                     db._data[request[2]] = dest
-                elif not isinstance(dest, set):
+                elif not isinstance(dest, self.set_type):
                     return client.reply_wrongtype()
                 orig.remove(member)
                 dest.add(member)
@@ -1426,10 +2020,12 @@ class Storage:
         value = db.get(key)
         if value is None:
             client.reply_bulk()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             result = value.pop()
+            # the popped member is random, propagate it
+            self._also(db, (b'srem', key, result))
             self._signal(self.NOTIFY_SET, db, request[0], key, 1)
             if db.pop(key, value) is not None:
                 self._signal(self.NOTIFY_GENERIC, db, 'del', key)
@@ -1439,7 +2035,7 @@ class Storage:
     def srandmember(self, client, request, N):
         check_input(request, N < 1 or N > 2)
         value = client.db.get(request[1])
-        if value is not None and not isinstance(value, set):
+        if value is not None and not isinstance(value, self.set_type):
             return client.reply_wrongtype()
         if N == 2:
             try:
@@ -1451,11 +2047,7 @@ class Storage:
                 if not value:
                     result = (None,) * count
                 else:
-                    result = []
-                    for _ in range(count):
-                        el = value.pop()
-                        result.append(el)
-                        value.add(el)
+                    result = value.random_members(count, False)
             elif count > 0:
                 if not value:
                     result = (None,)
@@ -1463,11 +2055,7 @@ class Storage:
                     result = list(value)
                     result.extend((None,)*(count-len(value)))
                 else:
-                    result = []
-                    for _ in range(count):
-                        el = value.pop()
-                        result.append(el)
-                    value.update(result)
+                    result = value.random_members(count)
             else:
                 result = []
             client.reply_multi_bulk(result)
@@ -1475,8 +2063,7 @@ class Storage:
             if not value:
                 result = None
             else:
-                result = value.pop()
-                value.add(result)
+                result = value.random_members(1)[0]
             client.reply_bulk(result)
 
     @command('Sets', True)
@@ -1487,7 +2074,7 @@ class Storage:
         value = db.get(key)
         if value is None:
             client.reply_zero()
-        elif not isinstance(value, set):
+        elif not isinstance(value, self.set_type):
             client.reply_wrongtype()
         else:
             start = len(value)
@@ -1508,9 +2095,16 @@ class Storage:
         check_input(request, N < 2)
         self._setoper(client, 'union', request[2:], request[1])
 
-    @command('Sets', supported=False)
+    @command('Sets')
     def sscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif not isinstance(value, self.set_type):
+            client.reply_wrongtype()
+        else:
+            self._scan_collection(client, request, value)
 
     # #########################################################################
     # #    SORTED SETS COMMANDS
@@ -1664,6 +2258,52 @@ class Storage:
                                                    include_max=include_max))
             client.reply_multi_bulk(result)
 
+    @command('Sorted Sets')
+    def zrangebylex(self, client, request, N):
+        check_input(request, N != 3 and N != 6)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk(())
+        elif not isinstance(value, self.zset_type):
+            client.reply_wrongtype()
+        else:
+            try:
+                lex = self._lex_values(request[2], request[3])
+            except ValueError:
+                return client.reply_error(self.INVALID_LEX)
+            offset = 0
+            count = None
+            if N == 6:
+                if request[4].lower() != b'limit':
+                    return client.reply_error(self.SYNTAX_ERROR)
+                try:
+                    offset = int(request[5])
+                    count = int(request[6])
+                except Exception:
+                    return client.reply_error(self.SYNTAX_ERROR)
+                if count < 0:
+                    count = None
+            if lex is None or offset < 0:
+                client.reply_multi_bulk(())
+            else:
+                client.reply_multi_bulk(list(value.range_by_lex(
+                    *lex, start=offset, num=count)))
+
+    @command('Sorted Sets')
+    def zlexcount(self, client, request, N):
+        check_input(request, N != 3)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.zset_type):
+            client.reply_wrongtype()
+        else:
+            try:
+                lex = self._lex_values(request[2], request[3])
+            except ValueError:
+                return client.reply_error(self.INVALID_LEX)
+            client.reply_int(0 if lex is None else value.lex_count(*lex))
+
     @command('Sorted Sets')
     def zrank(self, client, request, N):
         check_input(request, N != 2)
@@ -1771,39 +2411,563 @@ class Storage:
     def zunionstore(self, client, request, N):
         self._zsetoper(client, request, N)
 
-    @command('Sorted Sets', supported=False)
+    @command('Sorted Sets')
     def zscan(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk((b'0', ()))
+        elif not isinstance(value, self.zset_type):
+            client.reply_wrongtype()
+        else:
+            self._scan_collection(client, request, value, value.score)
 
     # #########################################################################
-    # #    PUBSUB COMMANDS
-    @command('Pub/Sub', script=0)
-    def psubscribe(self, client, request, N):
-        check_input(request, not N)
-        for pattern in request[1:]:
-            p = self._patterns.get(pattern)
-            if not p:
-                pre = redis_to_py_pattern(pattern.decode('utf-8'))
-                p = pubsub_patterns(re.compile(pre), set())
-                self._patterns[pattern] = p
-            p.clients.add(client)
-            client.patterns.add(pattern)
-            count = reduce(lambda x, y: x + int(client in y.clients),
-                           self._patterns.values())
-            client.reply_multi_bulk((b'psubscribe', pattern, count))
-
-    @command('Pub/Sub')
-    def pubsub(self, client, request, N):
-        check_input(request, not N)
-        subcommand = request[1].decode('utf-8').lower()
-        if subcommand == 'channels':
-            check_input(request, N > 2)
-            if N == 2:
-                pre = re.compile(redis_to_py_pattern(
-                    request[2].decode('utf-8')))
-                channels = []
-                for channel in self._channels:
-                    if pre.match(channel.decode('utf-8', 'ignore')):
+    # #    STREAM COMMANDS
+    @command('Streams', True)
+    def xack(self, client, request, N):
+        check_input(request, N < 3)
+        value = client.db.get(request[1])
+        if value is None:
+            return client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        ids = [self._stream_id(id) for id in request[3:]]
+        group = value.groups.get(request[2])
+        acked = sum((group.ack(id) for id in ids)) if group else 0
+        self._dirty += acked
+        client.reply_int(acked)
+
+    @command('Streams', True)
+    def xadd(self, client, request, N):
+        check_input(request, N < 4)
+        key = request[1]
+        nomkstream = False
+        trim = None
+        j = 2
+        while j < N:
+            option = request[j].lower()
+            if option == b'nomkstream':
+                nomkstream = True
+                j += 1
+            elif option in (b'maxlen', b'minid') and trim is None:
+                trim, j = self._stream_trim_options(request, j)
+            else:
+                break
+        fields = request[j+1:]
+        check_input(request, not fields or len(fields) % 2)
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            if nomkstream:
+                return client.reply_bulk()
+            stream = self.stream_type()
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        else:
+            stream = value
+        id = self._stream_new_id(stream, request[j])
+        if value is None:
+            db._data[key] = stream
+        stream.add(id, fields)
+        self._signal(self.NOTIFY_STREAM, db, 'xadd', key, 1)
+        trim_args = []
+        if trim:
+            removed, trim_args = self._stream_trim(stream, trim)
+            if removed:
+                self._signal(self.NOTIFY_STREAM, db, 'xtrim', key, removed)
+        # propagate the id and an exact trimming
+        id = format_stream_id(id)
+        request[2:] = trim_args + [id] + fields
+        client.reply_bulk(id)
+
+    @command('Streams', True)
+    def xclaim(self, client, request, N):
+        check_input(request, N < 5)
+        key, name, consumer_name = request[1:4]
+        try:
+            min_idle = int(request[4])
+        except ValueError:
+            raise CommandError('Invalid min-idle-time argument for XCLAIM')
+        ids = []
+        j = 5
+        while j <= N:
+            try:
+                ids.append(self._stream_id(request[j]))
+            except CommandError:
+                break
+            j += 1
+        now = self._stream_time()
+        delivery_time = now
+        retry_count = None
+        force = justid = False
+        last_id = None
+        while j <= N:
+            option = request[j].lower()
+            if option == b'force':
+                force = True
+            elif option == b'justid':
+                justid = True
+            elif option == b'lastid' and j < N:
+                j += 1
+                last_id = self._stream_id(request[j])
+            elif option in (b'idle', b'time', b'retrycount') and j < N:
+                j += 1
+                try:
+                    number = int(request[j])
+                except ValueError:
+                    raise CommandError('Invalid %s option argument for '
+                                       'XCLAIM' % option.decode('utf-8'))
+                if option == b'idle':
+                    delivery_time = now - number
+                elif option == b'time':
+                    delivery_time = number
+                else:
+                    retry_count = number
+            else:
+                raise CommandError('Unrecognized XCLAIM option %r' %
+                                   request[j].decode('utf-8', 'replace'))
+            j += 1
+        db = client.db
+        value = db.get(key)
+        if value is not None and not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        group = self._stream_group(client, key, value, name)
+        if group is None:
+            return
+        if last_id is not None and last_id > group.last_id:
+            group.last_id = last_id
+        consumer = group.consumer(consumer_name, now)
+        result = []
+        for id in ids:
+            pe = group.pending.get(id)
+            if pe is None and not force:
+                continue
+            elif pe is not None and now - pe.delivery_time < min_idle:
+                continue
+            fields = value.get(id)
+            if fields is None:
+                # entries deleted from the stream are removed from the PEL
+                group.ack(id)
+                continue
+            count = retry_count
+            if count is None:
+                count = pe.delivery_count if pe else 0
+                if not justid:
+                    count += 1
+            group.claim(id, consumer, delivery_time, count)
+            self._also(db, self._stream_xclaim(key, name, consumer_name, id,
+                                               delivery_time, count))
+            id = format_stream_id(id)
+            result.append(id if justid else (id, fields))
+        self._dirty += len(result)
+        client.reply_multi_bulk(result)
+
+    @command('Streams', True)
+    def xdel(self, client, request, N):
+        check_input(request, N < 2)
+        key = request[1]
+        ids = [self._stream_id(id) for id in request[2:]]
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            return client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        removed = sum((value.remove(id) for id in ids))
+        if removed:
+            self._signal(self.NOTIFY_STREAM, db, 'xdel', key, removed)
+        client.reply_int(removed)
+
+    @command('Streams', True, subcommands=['create', 'createconsumer',
+                                           'delconsumer', 'destroy',
+                                           'setid'])
+    def xgroup(self, client, request, N):
+        check_input(request, N < 3)
+        subcommand = request[1].decode('utf-8', 'ignore').lower()
+        key, name = request[2:4]
+        db = client.db
+        value = db.get(key)
+        if value is not None and not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        mkstream = False
+        if subcommand in ('create', 'setid'):
+            check_input(request, N < 4)
+            entries_read = None
+            j = 5
+            while j <= N:
+                option = request[j].lower()
+                if option == b'mkstream' and subcommand == 'create':
+                    mkstream = True
+                elif option == b'entriesread' and j < N:
+                    j += 1
+                    try:
+                        entries_read = int(request[j])
+                        if entries_read < 0:
+                            raise ValueError
+                    except ValueError:
+                        raise CommandError('value for ENTRIESREAD must be '
+                                           'positive or 0')
+                else:
+                    raise CommandError(self.SYNTAX_ERROR)
+                j += 1
+        elif subcommand in ('createconsumer', 'delconsumer'):
+            check_input(request, N != 4)
+        elif subcommand == 'destroy':
+            check_input(request, N != 3)
+        else:
+            return client.reply_error("unknown command 'xgroup %s'" %
+                                      subcommand)
+        if value is None and not mkstream:
+            return client.reply_error(self.XGROUP_NO_KEY)
+        if subcommand == 'create':
+            last_id = self._stream_group_id(value, request[4])
+            if value is None:
+                value = self.stream_type()
+                db._data[key] = value
+            elif name in value.groups:
+                return client.reply_error('Consumer Group name already '
+                                          'exists', 'BUSYGROUP')
+            if entries_read is None:
+                entries_read = self._stream_entries_read(value, last_id)
+            value.groups[name] = StreamGroup(last_id, entries_read)
+            request[4] = format_stream_id(last_id)
+            self._signal(self.NOTIFY_STREAM, db, 'xgroup', key, 1,
+                         'xgroup-create')
+            return client.reply_ok()
+        group = self._stream_group(client, key, value, name)
+        if group is None:
+            return
+        elif subcommand == 'setid':
+            group.last_id = self._stream_group_id(value, request[4])
+            if entries_read is None:
+                entries_read = self._stream_entries_read(value,
+                                                         group.last_id)
+            group.entries_read = entries_read
+            request[4] = format_stream_id(group.last_id)
+            self._signal(self.NOTIFY_STREAM, db, 'xgroup', key, 1,
+                         'xgroup-setid')
+            client.reply_ok()
+        elif subcommand == 'destroy':
+            value.groups.pop(name)
+            # clients blocked on the group receive an error
+            self._signal(self.NOTIFY_STREAM, db, 'xgroup', key, 1,
+                         'xgroup-destroy')
+            client.reply_one()
+        elif subcommand == 'createconsumer':
+            if request[4] in group.consumers:
+                return client.reply_zero()
+            group.consumer(request[4], self._stream_time())
+            self._signal(self.NOTIFY_STREAM, db, 'xgroup', key, 1,
+                         'xgroup-createconsumer')
+            client.reply_one()
+        else:
+            pending = group.remove_consumer(request[4])
+            if pending is not None:
+                self._signal(self.NOTIFY_STREAM, db, 'xgroup', key, 1,
+                             'xgroup-delconsumer')
+            client.reply_int(pending or 0)
+
+    @command('Streams', subcommands=['consumers', 'groups', 'stream'])
+    def xinfo(self, client, request, N):
+        check_input(request, N < 2)
+        subcommand = request[1].decode('utf-8', 'ignore').lower()
+        key = request[2]
+        value = client.db.get(key)
+        if subcommand not in ('consumers', 'groups', 'stream'):
+            return client.reply_error("unknown command 'xinfo %s'" %
+                                      subcommand)
+        check_input(request, N != (3 if subcommand == 'consumers' else 2))
+        if value is None:
+            return client.reply_error('no such key')
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        if subcommand == 'stream':
+            first, last = value.first(), value.last()
+            # nodes are reported as the radix tree keys of redis
+            client.reply_multi_bulk((
+                b'length', len(value),
+                b'radix-tree-keys', value.nodes,
+                b'radix-tree-nodes', value.nodes,
+                b'last-generated-id', format_stream_id(value.last_id),
+                b'max-deleted-entry-id',
+                format_stream_id(value.max_deleted_id),
+                b'entries-added', value.entries_added,
+                b'recorded-first-entry-id',
+                format_stream_id(first[0] if first else MIN_ID),
+                b'groups', len(value.groups),
+                b'first-entry', self._stream_entries((first,))[0]
+                if first else None,
+                b'last-entry', self._stream_entries((last,))[0]
+                if last else None))
+        elif subcommand == 'groups':
+            client.reply_multi_bulk([
+                (b'name', name,
+                 b'consumers', len(group.consumers),
+                 b'pending', len(group.pending),
+                 b'last-delivered-id', format_stream_id(group.last_id),
+                 b'entries-read', group.entries_read,
+                 b'lag', self._stream_lag(value, group))
+                for name, group in value.groups.items()])
+        else:
+            group = self._stream_group(client, key, value, request[3])
+            if group is not None:
+                now = self._stream_time()
+                client.reply_multi_bulk([
+                    (b'name', consumer.name,
+                     b'pending', len(consumer.pending),
+                     b'idle', max(now - consumer.seen_time, 0))
+                    for consumer in group.consumers.values()])
+
+    @command('Streams')
+    def xlen(self, client, request, N):
+        check_input(request, N != 1)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            client.reply_wrongtype()
+        else:
+            client.reply_int(len(value))
+
+    @command('Streams')
+    def xpending(self, client, request, N):
+        check_input(request, N < 2)
+        key, name = request[1:3]
+        idle = None
+        j = 3
+        if N > 2 and request[3].lower() == b'idle':
+            try:
+                idle = int(request[4])
+            except (IndexError, ValueError):
+                raise CommandError(self.SYNTAX_ERROR)
+            j = 5
+        if N > 2 and N - j not in (2, 3):
+            raise CommandError(self.SYNTAX_ERROR)
+        value = client.db.get(key)
+        if value is not None and not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        group = self._stream_group(client, key, value, name)
+        if group is None:
+            return
+        pending = group.pending
+        if N == 2:
+            if not pending:
+                return client.reply_multi_bulk((0, None, None, None))
+            consumers = [(consumer.name, len(consumer.pending))
+                         for consumer in group.consumers.values()
+                         if consumer.pending]
+            client.reply_multi_bulk((
+                len(pending), format_stream_id(next(iter(pending))),
+                format_stream_id(next(reversed(pending))), consumers))
+        else:
+            start = self._stream_range_id(request[j])
+            end = self._stream_range_id(request[j+1], True)
+            try:
+                count = max(int(request[j+2]), 0)
+            except ValueError:
+                raise CommandError(self.SYNTAX_ERROR)
+            consumer = request[j+3] if N - j == 3 else None
+            now = self._stream_time()
+            client.reply_multi_bulk([
+                (format_stream_id(id), pe.consumer,
+                 max(now - pe.delivery_time, 0), pe.delivery_count)
+                for id, pe in group.pending_range(start, end, count,
+                                                  consumer, idle, now)])
+
+    @command('Streams')
+    def xrange(self, client, request, N):
+        check_input(request, N not in (3, 5))
+        reverse = request[0] == 'xrevrange'
+        start, end = request[3:1:-1] if reverse else request[2:4]
+        start = self._stream_range_id(start)
+        end = self._stream_range_id(end, True)
+        count = None
+        if N == 5:
+            if request[4].lower() != b'count':
+                raise CommandError(self.SYNTAX_ERROR)
+            try:
+                count = max(int(request[5]), 0)
+            except ValueError:
+                raise CommandError(self.SYNTAX_ERROR)
+        value = client.db.get(request[1])
+        if value is None:
+            client.reply_multi_bulk(())
+        elif not isinstance(value, self.stream_type):
+            client.reply_wrongtype()
+        else:
+            client.reply_multi_bulk(self._stream_entries(
+                value.range(start, end, count, reverse)))
+
+    @command('Streams')
+    def xread(self, client, request, N):
+        count, timeout, _, keys, ids = self._stream_read_options(request, 1)
+        db = client.db
+        streams = {}
+        for key, id in zip(keys, ids):
+            value = db.get(key)
+            if value is None:
+                streams[key] = (None, MIN_ID)
+            elif not isinstance(value, self.stream_type):
+                return client.reply_wrongtype()
+            elif id == b'$':
+                streams[key] = (value, value.last_id)
+            else:
+                streams[key] = (value, self._stream_id(id))
+        result = []
+        for key, (value, id) in streams.items():
+            if value:
+                entries = self._stream_entries(value.after(id, count))
+                if entries:
+                    result.append((key, entries))
+        if result or not self._stream_blocking(client, timeout):
+            client.reply_multi_bulk(result or None)
+        else:
+            ids = dict(((key, id) for key, (_, id) in streams.items()))
+            client.blocked = Blocked(client, request[0], keys, timeout,
+                                     data=(count, ids))
+
+    @command('Streams', True)
+    def xreadgroup(self, client, request, N):
+        check_input(request, N < 6)
+        if request[1].lower() != b'group':
+            raise CommandError(self.SYNTAX_ERROR)
+        name, consumer_name = request[2:4]
+        count, timeout, noack, keys, ids = self._stream_read_options(
+            request, 4, True)
+        db = client.db
+        streams = []
+        for key, id in zip(keys, ids):
+            value = db.get(key)
+            if value is not None and not isinstance(value, self.stream_type):
+                return client.reply_wrongtype()
+            if id == b'>':
+                id = None
+            elif id == b'$':
+                raise CommandError('The $ ID is meaningless in the context '
+                                   'of XREADGROUP: you want to read the '
+                                   'history of this consumer by specifying '
+                                   'a proper ID, or use the > ID to get new '
+                                   'messages. The $ ID would just return an '
+                                   'empty result set.')
+            else:
+                id = self._stream_id(id)
+            group = self._stream_group(client, key, value, name)
+            if group is None:
+                return
+            streams.append((key, value, group, id))
+        result = []
+        for key, value, group, id in streams:
+            entries = self._stream_read_group(db, key, value, name, group,
+                                              consumer_name, id, count,
+                                              noack)
+            if entries or id is not None:
+                result.append((key, entries))
+        if (result or not self._stream_blocking(client, timeout) or
+                any((id is not None for _, _, _, id in streams))):
+            client.reply_multi_bulk(result or None)
+        else:
+            client.blocked = Blocked(client, request[0], keys, timeout,
+                                     data=(count, name, consumer_name,
+                                           noack))
+
+    @command('Streams')
+    def xrevrange(self, client, request, N):
+        return self.xrange(client, request, N)
+
+    @command('Streams', True)
+    def xsetid(self, client, request, N):
+        check_input(request, N < 2)
+        key = request[1]
+        last_id = self._stream_id(request[2])
+        entries_added = max_deleted_id = None
+        j = 3
+        while j <= N:
+            option = request[j].lower()
+            if j == N:
+                raise CommandError(self.SYNTAX_ERROR)
+            elif option == b'entriesadded':
+                try:
+                    entries_added = int(request[j+1])
+                    if entries_added < 0:
+                        raise ValueError
+                except ValueError:
+                    raise CommandError('entries_added must be positive')
+            elif option == b'maxdeletedid':
+                max_deleted_id = self._stream_id(request[j+1])
+            else:
+                raise CommandError(self.SYNTAX_ERROR)
+            j += 2
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            return client.reply_error('no such key')
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        last = value.last()
+        if last and last_id < last[0]:
+            return client.reply_error('The ID specified in XSETID is '
+                                      'smaller than the target stream top '
+                                      'item')
+        elif entries_added is not None and entries_added < len(value):
+            return client.reply_error('The entries_added specified in '
+                                      'XSETID is smaller than the target '
+                                      'stream length')
+        elif max_deleted_id is not None and last_id < max_deleted_id:
+            return client.reply_error('The ID specified in XSETID is '
+                                      'smaller than the provided '
+                                      'max_deleted_entry_id')
+        value.last_id = last_id
+        if entries_added is not None:
+            value.entries_added = entries_added
+        if max_deleted_id is not None:
+            value.max_deleted_id = max_deleted_id
+        self._signal(self.NOTIFY_STREAM, db, 'xsetid', key, 1)
+        client.reply_ok()
+
+    @command('Streams', True)
+    def xtrim(self, client, request, N):
+        check_input(request, N < 3)
+        key = request[1]
+        if request[2].lower() not in (b'maxlen', b'minid'):
+            raise CommandError(self.SYNTAX_ERROR)
+        trim, j = self._stream_trim_options(request, 2)
+        if j <= N:
+            raise CommandError(self.SYNTAX_ERROR)
+        db = client.db
+        value = db.get(key)
+        if value is None:
+            return client.reply_zero()
+        elif not isinstance(value, self.stream_type):
+            return client.reply_wrongtype()
+        removed, request[2:] = self._stream_trim(value, trim)
+        if removed:
+            self._signal(self.NOTIFY_STREAM, db, 'xtrim', key, removed)
+        client.reply_int(removed)
+
+    # #########################################################################
+    # #    PUBSUB COMMANDS
+    @command('Pub/Sub', script=0)
+    def psubscribe(self, client, request, N):
+        check_input(request, not N)
+        for pattern in request[1:]:
+            self._patterns.add(pattern, client)
+            client.patterns.add(pattern)
+            client.reply_multi_bulk((b'psubscribe', pattern,
+                                     self._subscriptions(client)))
+
+    @command('Pub/Sub')
+    def pubsub(self, client, request, N):
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand == 'channels':
+            check_input(request, N > 2)
+            if N == 2:
+                pre = re.compile(redis_to_py_pattern(
+                    request[2].decode('utf-8')))
+                channels = []
+                for channel in self._channels:
+                    if pre.match(channel.decode('utf-8', 'ignore')):
                         channels.append(channel)
             else:
                 channels = list(self._channels)
@@ -1816,9 +2980,7 @@ class Storage:
             client.reply_multi_bulk(count)
         elif subcommand == 'numpat':
             check_input(request, N > 1)
-            count = reduce(lambda x, y: x + len(y.clients),
-                           self._patterns.values())
-            client.reply_int(count)
+            client.reply_int(self._patterns.subscriptions)
         else:
             client.reply_error("Unknown command 'pubsub %s'" % subcommand)
 
@@ -1826,27 +2988,15 @@ class Storage:
     def publish(self, client, request, N):
         check_input(request, N != 2)
         channel, message = request[1:]
-        ch = channel.decode('utf-8')
-        msg = self._parser.multi_bulk((b'message', channel, message))
-        count = self._publish_clients(msg, self._channels.get(channel, ()))
-        for pattern in self._patterns.values():
-            g = pattern.re.match(ch)
-            if g:
-                count += self._publish_clients(msg, pattern.clients)
-        client.reply_int(count)
+        client.reply_int(self._publish(channel, message))
 
     @command('Pub/Sub', script=0)
     def punsubscribe(self, client, request, N):
-        patterns = request[1:] if N else list(self._patterns)
+        patterns = request[1:] if N else list(client.patterns)
         for pattern in patterns:
-            if pattern in self._patterns:
-                p = self._patterns[pattern]
-                if client in p.clients:
-                    client.patterns.discard(pattern)
-                    p.clients.remove(client)
-                    if not p.clients:
-                        self._patterns.pop(pattern)
-                    client.reply_multi_bulk((b'punsubscribe', pattern))
+            if self._unsubscribe_pattern(client, pattern):
+                client.reply_multi_bulk((b'punsubscribe', pattern,
+                                         self._subscriptions(client)))
 
     @command('Pub/Sub', script=0)
     def subscribe(self, client, request, N):
@@ -1855,22 +3005,20 @@ class Storage:
             clients = self._channels.get(channel)
             if not clients:
                 self._channels[channel] = clients = set()
+                if channel.startswith(b'__key'):
+                    self._keyspace_channels += 1
             clients.add(client)
             client.channels.add(channel)
-            client.reply_multi_bulk((b'subscribe', channel, len(clients)))
+            client.reply_multi_bulk((b'subscribe', channel,
+                                     self._subscriptions(client)))
 
     @command('Pub/Sub', script=0)
     def unsubscribe(self, client, request, N):
-        channels = request[1:] if N else list(self._channels)
+        channels = request[1:] if N else list(client.channels)
         for channel in channels:
-            if channel in self._channels:
-                clients = self._channels[channel]
-                if client in clients:
-                    client.channels.discard(channel)
-                    clients.remove(client)
-                    if not clients:
-                        self._channels.pop(channel)
-                    client.reply_multi_bulk((b'unsubscribe', channel))
+            if self._unsubscribe_channel(client, channel):
+                client.reply_multi_bulk((b'unsubscribe', channel,
+                                         self._subscriptions(client)))
 
     # #########################################################################
     # #    TRANSACTION COMMANDS
@@ -1931,17 +3079,45 @@ class Storage:
 
     # #########################################################################
     # #    SCRIPTING
-    @command('Scripting', supported=False)
+    @command('Scripting', script=0)
     def eval(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        self._eval(client, self._scripting.load(request[1]), request, N)
 
-    @command('Scripting', supported=False)
+    @command('Scripting', script=0)
     def evalsha(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N < 2)
+        sha = request[1].decode('utf-8').lower()
+        if sha not in self._scripting.scripts:
+            client.reply_error(self.NOSCRIPT, 'NOSCRIPT')
+        else:
+            self._eval(client, sha, request, N)
 
-    @command('Scripting', supported=False)
+    @command('Scripting', script=0,
+             subcommands=['exists', 'flush', 'kill', 'load'])
     def script(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        scripting = self._scripting
+        if subcommand == 'exists':
+            check_input(request, N < 2)
+            client.reply_multi_bulk_len(N - 1)
+            for sha in request[2:]:
+                client.reply_int(sha.decode('utf-8').lower() in
+                                 scripting.scripts)
+        elif subcommand == 'flush':
+            check_input(request, N != 1)
+            scripting.flush()
+            client.reply_ok()
+        elif subcommand == 'kill':
+            check_input(request, N != 1)
+            client.reply_error('No scripts in execution right now.',
+                               'NOTBUSY')
+        elif subcommand == 'load':
+            check_input(request, N != 2)
+            client.reply_bulk(scripting.load(request[2]).encode('utf-8'))
+        else:
+            client.reply_error("unknown command 'script %s'" % subcommand)
 
     # #########################################################################
     # #    CONNECTION COMMANDS
@@ -1987,9 +3163,17 @@ class Storage:
 
     # #########################################################################
     # #    SERVER COMMANDS
-    @command('Server', supported=False)
+    @command('Server')
     def bgrewriteaof(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N)
+        if self._aof is None:
+            client.reply_error('Append only file is not enabled')
+        elif self._aof.rewrite():
+            client.reply_status('Background append only file rewriting '
+                                'started')
+        else:
+            client.reply_error('Background append only file rewriting '
+                               'already in progress')
 
     @command('Server')
     def bgsave(self, client, request, N):
@@ -2005,6 +3189,16 @@ class Storage:
             check_input(request, N != 1)
             value = '\n'.join(self._client_list(client))
             client.reply_bulk(value.encode('utf-8'))
+        elif subcommand == 'id':
+            check_input(request, N != 1)
+            client.reply_int(client.id)
+        elif subcommand == 'tracking':
+            check_input(request, N < 2)
+            self._client_tracking(client, request)
+        elif subcommand == 'getredir':
+            check_input(request, N != 1)
+            tracking = client.tracking
+            client.reply_int(-1 if tracking is None else tracking.redirect)
         else:
             client.reply_error("unknown command 'client %s'" % subcommand)
 
@@ -2017,14 +3211,16 @@ class Storage:
                 client.reply_error("'config get' no argument")
             else:
                 value = self._get_config(request[2].decode('utf-8'))
-                client.reply_bulk(value)
+                client.reply_multi_bulk(() if value is None else
+                                        (request[2], value))
         elif subcommand == 'rewrite':
             client.reply_ok()
         elif subcommand == 'set':
             try:
                 if N != 3:
                     raise ValueError("'config set' no argument")
-                self._set_config(request[2].decode('utf-8'))
+                self._set_config(request[2].decode('utf-8').lower(),
+                                 request[3].decode('utf-8'))
             except Exception as e:
                 client.reply_error(str(e))
             else:
@@ -2033,6 +3229,8 @@ class Storage:
             self._hit_keys = 0
             self._missed_keys = 0
             self._expired_keys = 0
+            self._evicted_keys = 0
+            self._commandstats.clear()
             server = client._producer
             server._received = 0
             server._requests_processed = 0
@@ -2064,8 +3262,9 @@ class Storage:
 
     @command('Server')
     def info(self, client, request, N):
-        check_input(request, N)
-        info = '\n'.join(self._flat_info())
+        check_input(request, N > 1)
+        section = request[1].decode('utf-8').lower() if N else 'default'
+        info = '\n'.join(self._flat_info(section))
         client.reply_bulk(info.encode('utf-8'))
 
     @command('Server')
@@ -2073,6 +3272,39 @@ class Storage:
         check_input(request, N)
         client.reply_int(self._last_save)
 
+    @command('Server', subcommands=['histogram', 'history', 'latest',
+                                    'reset'])
+    def latency(self, client, request, N):
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        monitor = self._latency_monitor
+        if subcommand == 'latest':
+            check_input(request, N != 1)
+            client.reply_multi_bulk(tuple(monitor.latest()))
+        elif subcommand == 'history':
+            check_input(request, N != 2)
+            event = request[2].decode('utf-8')
+            client.reply_multi_bulk(monitor.history(event))
+        elif subcommand == 'reset':
+            events = None
+            if N > 1:
+                events = [e.decode('utf-8') for e in request[2:]]
+            client.reply_int(monitor.reset(events))
+        elif subcommand == 'histogram':
+            names = [n.decode('utf-8').lower() for n in request[2:]]
+            stats = self._commandstats
+            result = []
+            for name in names or sorted(stats):
+                if name in stats:
+                    histogram = []
+                    for usec, calls in stats[name].buckets():
+                        histogram.extend((usec, calls))
+                    result.extend((name, (b'calls', stats[name].calls,
+                                          b'histogram_usec', histogram)))
+            client.reply_multi_bulk(result)
+        else:
+            client.reply_error("'latency %s' not valid" % subcommand)
+
     @command('Server', script=0)
     def monitor(self, client, request, N):
         check_input(request, N)
@@ -2090,17 +3322,89 @@ class Storage:
     def shutdown(self, client, request, N):
         client.reply_error(self.NOT_SUPPORTED)
 
-    @command('Server', supported=False)
+    @command('Server')
+    def psync(self, client, request, N):
+        check_input(request, N != 2)
+        try:
+            offset = int(request[2])
+        except ValueError:
+            raise CommandError('value is not an integer or out of range')
+        self._sync(client, request[1].decode('utf-8'), offset)
+
+    @command('Server')
+    def replconf(self, client, request, N):
+        check_input(request, N % 2 or not N)
+        option = request[1].lower()
+        replicas = self._replication.replicas
+        if option == b'ack':
+            if client in replicas:
+                replicas[client] = int(request[2])
+        else:
+            client.reply_ok()
+
+    @command('Server')
+    def replicaof(self, client, request, N):
+        check_input(request, N != 2)
+        if request[1].lower() == b'no' and request[2].lower() == b'one':
+            self._replication.replicaof(None)
+        else:
+            try:
+                port = int(request[2])
+            except ValueError:
+                raise CommandError('Invalid master port')
+            self._replication.replicaof('%s:%s' % (
+                request[1].decode('utf-8'), port))
+        client.reply_ok()
+
+    @command('Server')
+    def role(self, client, request, N):
+        check_input(request, N)
+        replication = self._replication
+        master = replication.master
+        if master is None:
+            replicas = []
+            for replica, ack in replication.replicas.items():
+                host, port = replica._transport.get_extra_info('peername')[:2]
+                replicas.append((host, str(port), str(ack)))
+            client.reply_multi_bulk((b'master', replication.offset,
+                                     replicas))
+        else:
+            host, port = master.address
+            client.reply_multi_bulk((b'slave', host, port, master.status,
+                                     master.offset))
+
+    @command('Server')
     def slaveof(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        self.replicaof(client, request, N)
 
-    @command('Server', supported=False)
+    @command('Server', subcommands=['get', 'len', 'reset'])
     def slowlog(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, not N)
+        subcommand = request[1].decode('utf-8').lower()
+        if subcommand == 'get':
+            check_input(request, N > 2)
+            num = 10
+            if N == 2:
+                try:
+                    num = int(request[2])
+                except ValueError:
+                    raise CommandError('value is not an integer or out of '
+                                       'range')
+            client.reply_multi_bulk(self._slowlog.get(num))
+        elif subcommand == 'len':
+            check_input(request, N != 1)
+            client.reply_int(len(self._slowlog))
+        elif subcommand == 'reset':
+            check_input(request, N != 1)
+            self._slowlog.reset()
+            client.reply_ok()
+        else:
+            client.reply_error("'slowlog %s' not valid" % subcommand)
 
-    @command('Server', supported=False)
+    @command('Server')
     def sync(self, client, request, N):
-        client.reply_error(self.NOT_SUPPORTED)
+        check_input(request, N)
+        self._sync(client)
 
     @command('Server')
     def time(self, client, request, N):
@@ -2113,6 +3417,12 @@ class Storage:
     # #########################################################################
     # #    INTERNALS
     def _cron(self):
+        self._active_expire()
+        self._bpop_expire()
+        self._check_save()
+        self._replication.cron()
+        if self._aof:
+            self._aof.cron()
         dirty = self._dirty
         if dirty:
             now = time.time()
@@ -2121,7 +3431,63 @@ class Storage:
                 if gap >= interval and dirty >= changes:
                     self._save()
                     break
-        self._loop.call_later(1, self._cron)
+        self._loop.call_later(CRON_INTERVAL, self._cron)
+
+    def _active_expire(self):
+        # Expire at most ACTIVE_EXPIRE_KEYS keys, starting from the database
+        # following the last one visited so that all databases get a turn
+        now = self._loop.time()
+        budget = ACTIVE_EXPIRE_KEYS
+        N = len(self.databases)
+        for i in range(N):
+            num = (self._expire_db + i) % N
+            db = self.databases[num]
+            if db._expires:
+                budget -= db._active_expire(now, budget)
+                if budget <= 0:
+                    self._expire_db = num
+                    return
+        self._expire_db = (self._expire_db + 1) % N
+
+    def _bpop_expire(self):
+        # Reply to clients blocked for longer than their timeout
+        expired = self._bpop_deadlines.pop_expired(self._loop.time())
+        self._bpop_timeouts += len(expired)
+        for _, client in expired:
+            client.blocked.unblock(client)
+
+    def _serve_blocked(self):
+        # Serve clients blocked on keys which received elements, one
+        # element to each client in the order they blocked, or entries of
+        # streams to all the clients they can serve. Keys which
+        # become ready while serving, the destination of BRPOPLPUSH, are
+        # queued and served by this same loop.
+        ready = self._ready_keys
+        try:
+            while ready:
+                db, key = ready[0]
+                waiters = db._blocking_keys.get(key)
+                value = db._peek(key)
+                if waiters and isinstance(value, self.list_type):
+                    # list pops, while the list has elements
+                    for client in list(waiters):
+                        blocked = client.blocked
+                        if not value:
+                            break
+                        elif blocked and blocked.data is None:
+                            blocked.unblock(client, key, value)
+                elif waiters and isinstance(value, self.stream_type):
+                    # stream reads, of all clients with new entries
+                    for client in list(waiters):
+                        blocked = client.blocked
+                        if (blocked and blocked.data is not None and
+                                self._stream_ready(blocked, key, value)):
+                            blocked.unblock(client, key, value)
+                ready.popleft()
+                self._ready_set.discard((db, key))
+        finally:
+            ready.clear()
+            self._ready_set.clear()
 
     def _set(self, client, key, value, seconds=0, milliseconds=0,
              nx=False, xx=False):
@@ -2142,10 +3508,11 @@ class Storage:
                 db.pop(key)
             if timeout > 0:
                 db._timer(timeout, key, bytearray(value))
-                self._signal(self.NOTIFY_STRING, db, 'expire', key)
             else:
                 db._data[key] = bytearray(value)
             self._signal(self.NOTIFY_STRING, db, 'set', key, 1)
+            if timeout > 0:
+                self._signal(self.NOTIFY_GENERIC, db, 'expire', key)
             return True
 
     def _incrby(self, client, name, key, value, type):
@@ -2196,9 +3563,13 @@ class Storage:
             if dest is not None:
                 dval.appendleft(elem)
                 self._signal(self.NOTIFY_LIST, db, 'lpush', dest, 1)
+                self._also(db, (b'rpoplpush', key, dest))
+            else:
+                self._also(db, (b'rpop', key))
         else:
             elem = value.popleft()
             self._signal(self.NOTIFY_LIST, db, 'lpop', key, 1)
+            self._also(db, (b'lpop', key))
         if not value:
             db.pop(key)
             self._signal(self.NOTIFY_GENERIC, db, 'del', key, 1)
@@ -2207,6 +3578,303 @@ class Storage:
         else:
             client.reply_bulk(elem)
 
+    def _stream_callback(self, client, blocked, key, value):
+        # Reply to a client blocked by XREAD or XREADGROUP on key
+        if blocked.command == 'xread':
+            count, ids = blocked.data
+            entries = self._stream_entries(value.after(ids[key], count))
+        else:
+            count, name, consumer_name, noack = blocked.data
+            group = self._stream_group(client, key, value, name)
+            if group is None:
+                return
+            entries = self._stream_read_group(client.db, key, value, name,
+                                              group, consumer_name, None,
+                                              count, noack)
+        client.reply_multi_bulk(((key, entries),))
+
+    def _stream_ready(self, blocked, key, value):
+        # Whether a client blocked by XREAD or XREADGROUP on key can be
+        # served, clients blocked on a destroyed group receive an error
+        if blocked.command == 'xread':
+            id = blocked.data[1][key]
+        else:
+            group = value.groups.get(blocked.data[1])
+            if group is None:
+                return True
+            id = group.last_id
+        return next(value.after(id, 1), None) is not None
+
+    def _stream_read_group(self, db, key, value, name, group, consumer_name,
+                           id, count, noack):
+        # Entries read by a consumer of a group: new entries, delivered to
+        # the consumer, when id is None or the pending entries of the
+        # consumer after id. Deliveries are propagated as XCLAIM commands
+        now = self._stream_time()
+        if consumer_name not in group.consumers:
+            self._also(db, (b'xgroup', b'createconsumer', key, name,
+                            consumer_name))
+        consumer = group.consumer(consumer_name, now)
+        result = []
+        if id is None:
+            for id, fields in value.after(group.last_id, count):
+                group.deliver(consumer, id, now, noack)
+                if not noack:
+                    self._also(db, self._stream_xclaim(key, name,
+                                                       consumer_name, id,
+                                                       now, 1))
+                result.append((format_stream_id(id), fields))
+            if result:
+                self._also(db, (b'xgroup', b'setid', key, name,
+                                format_stream_id(group.last_id),
+                                b'entriesread', group.entries_read))
+        else:
+            for id, pe in group.pending_range(id_after(id), MAX_ID, count,
+                                              consumer_name):
+                pe.delivery_time = now
+                pe.delivery_count += 1
+                self._also(db, self._stream_xclaim(key, name, consumer_name,
+                                                   id, now,
+                                                   pe.delivery_count))
+                result.append((format_stream_id(id), value.get(id)))
+        self._dirty += len(result)
+        return result
+
+    def _stream_xclaim(self, key, name, consumer, id, delivery_time, count):
+        # The command propagating the delivery of entry id to consumer
+        return (b'xclaim', key, name, consumer, 0, format_stream_id(id),
+                b'time', delivery_time, b'retrycount', count, b'force',
+                b'justid')
+
+    def _stream_group(self, client, key, value, name):
+        # The consumer group name of the stream at key, reply with an
+        # error when it does not exist
+        group = value.groups.get(name) if value is not None else None
+        if group is None:
+            client.reply_error("No such key '%s' or consumer group '%s'" %
+                               (key.decode('utf-8', 'replace'),
+                                name.decode('utf-8', 'replace')), 'NOGROUP')
+        return group
+
+    def _stream_group_id(self, value, id):
+        # The last delivered id of a group, the last id of the stream
+        # when "$"
+        if id == b'$':
+            return value.last_id if value is not None else MIN_ID
+        return self._stream_id(id)
+
+    def _stream_entries_read(self, value, last_id):
+        # Number of entries read by a group which delivered last_id,
+        # entries deleted before last_id count as read
+        if last_id >= value.last_id:
+            return value.entries_added
+        return value.entries_added - sum((1 for _ in value.after(last_id)))
+
+    def _stream_lag(self, value, group):
+        # Number of entries not yet delivered to group, unknown when
+        # entries which it did not read were deleted
+        if value.max_deleted_id > group.last_id:
+            return None
+        return max(value.entries_added - group.entries_read, 0)
+
+    def _stream_id(self, value, seq=0):
+        # Parse a ms-seq entry id, with sequence seq when missing
+        try:
+            ms, sep, s = value.partition(b'-')
+            ms, s = int(ms), int(s) if sep else seq
+        except ValueError:
+            raise CommandError(self.INVALID_STREAM_ID)
+        if not (0 <= ms <= MAX_ID[0] and 0 <= s <= MAX_ID[1]):
+            raise CommandError(self.INVALID_STREAM_ID)
+        return ms, s
+
+    def _stream_range_id(self, value, end=False):
+        # Parse the start, or the end, of a range of ids: "-", "+", an id
+        # or an exclusive id prefixed by "("
+        if value == b'-':
+            return MIN_ID
+        elif value == b'+':
+            return MAX_ID
+        seq = MAX_ID[1] if end else 0
+        if value[:1] != b'(':
+            return self._stream_id(value, seq)
+        id = self._stream_id(value[1:], seq)
+        if id == (MIN_ID if end else MAX_ID):
+            raise CommandError('invalid %s ID for the interval' %
+                               ('end' if end else 'start'))
+        return id_before(id) if end else id_after(id)
+
+    def _stream_new_id(self, stream, value):
+        # The id of an entry added by XADD: "*", "ms-*" or an explicit id
+        if value == b'*':
+            id = stream.next_id(max(self._stream_time(), stream.last_id[0]))
+        else:
+            ms, _, seq = value.partition(b'-')
+            if seq == b'*':
+                id = stream.next_id(self._stream_id(ms)[0])
+            else:
+                id = self._stream_id(value)
+                if id == MIN_ID:
+                    raise CommandError('The ID specified in XADD must be '
+                                       'greater than 0-0')
+                id = stream.next_id(*id)
+        if id is None:
+            raise CommandError('The ID specified in XADD is equal or smaller '
+                               'than the target stream top item')
+        return id
+
+    def _stream_entries(self, entries):
+        return [(format_stream_id(id), fields) for id, fields in entries]
+
+    def _stream_read_options(self, request, j, group=False):
+        # Parse the options of XREAD and XREADGROUP starting at j, the
+        # BLOCK timeout is returned in seconds
+        count = timeout = None
+        noack = False
+        N = len(request)
+        while j < N:
+            option = request[j].lower()
+            if option == b'streams':
+                args = request[j+1:]
+                if not args or len(args) % 2:
+                    raise CommandError(
+                        "Unbalanced '%s' list of streams: for each stream "
+                        "key an ID or '$' must be specified." % request[0])
+                half = len(args) // 2
+                return count, timeout, noack, args[:half], args[half:]
+            elif option in (b'count', b'block') and j + 1 < N:
+                try:
+                    value = int(request[j+1])
+                except ValueError:
+                    raise CommandError('value is not an integer or out of '
+                                       'range')
+                if option == b'count':
+                    count = value if value > 0 else None
+                elif value < 0:
+                    raise CommandError('timeout is negative')
+                else:
+                    timeout = 0.001*value
+                j += 2
+            elif option == b'noack' and group:
+                noack = True
+                j += 1
+            else:
+                break
+        raise CommandError(self.SYNTAX_ERROR)
+
+    def _stream_blocking(self, client, timeout):
+        # Stream reads block connections only, never scripts
+        return timeout is not None and isinstance(client, PulsarStoreClient)
+
+    def _stream_trim_options(self, request, j):
+        # Parse MAXLEN|MINID [=|~] threshold [LIMIT count] starting at j,
+        # return the options and the index of the next argument
+        N = len(request)
+        strategy = request[j].lower()
+        approx = False
+        j += 1
+        if j < N and request[j] in (b'=', b'~'):
+            approx = request[j] == b'~'
+            j += 1
+        if j >= N:
+            raise CommandError(self.SYNTAX_ERROR)
+        if strategy == b'maxlen':
+            try:
+                threshold = int(request[j])
+                if threshold < 0:
+                    raise ValueError
+            except ValueError:
+                raise CommandError('The MAXLEN argument must be >= 0.')
+        else:
+            threshold = self._stream_id(request[j])
+        j += 1
+        limit = 100*self.stream_type.node_size if approx else None
+        if j + 1 < N and request[j].lower() == b'limit':
+            if not approx:
+                raise CommandError('syntax error, LIMIT cannot be used '
+                                   'without the special ~ option')
+            try:
+                limit = int(request[j+1])
+                if limit < 0:
+                    raise ValueError
+            except ValueError:
+                raise CommandError('The LIMIT argument must be >= 0.')
+            limit = limit or None
+            j += 2
+        return (strategy, approx, threshold, limit), j
+
+    def _stream_trim(self, value, trim):
+        # Trim a stream, return the number of entries removed and the
+        # options of the exact trimming to propagate
+        strategy, approx, threshold, limit = trim
+        if strategy == b'maxlen':
+            removed = value.trim(maxlen=threshold, approx=approx, limit=limit)
+            threshold = ('%d' % (len(value) if approx else threshold))
+            threshold = threshold.encode('utf-8')
+        else:
+            removed = value.trim(minid=threshold, approx=approx, limit=limit)
+            if approx and value:
+                threshold = value.first()[0]
+            threshold = format_stream_id(threshold)
+        return removed, [strategy, b'=', threshold]
+
+    def _stream_time(self):
+        # Unix time in milliseconds of stream ids and deliveries
+        return int(1000*time.time())
+
+    def _scan_options(self, request, start, types=False):
+        # Parse cursor and options of scan commands
+        try:
+            cursor = int(request[start - 1])
+            if cursor < 0:
+                raise ValueError
+        except ValueError:
+            raise CommandError('invalid cursor')
+        match = None
+        count = 10
+        type_name = None
+        N = len(request)
+        j = start
+        while j < N:
+            name = request[j].lower()
+            if j + 1 == N:
+                raise CommandError(self.SYNTAX_ERROR)
+            value = request[j + 1]
+            if name == b'match':
+                pattern = value.decode('utf-8', 'ignore')
+                if pattern != '*':
+                    match = re.compile(redis_to_py_pattern(pattern)).match
+            elif name == b'count':
+                try:
+                    count = int(value)
+                    if count < 1:
+                        raise ValueError
+                except ValueError:
+                    raise CommandError(self.SYNTAX_ERROR)
+            elif name == b'type' and types:
+                type_name = value.decode('utf-8', 'ignore').lower()
+            else:
+                raise CommandError(self.SYNTAX_ERROR)
+            j += 2
+        return cursor, match, count, type_name
+
+    def _scan_collection(self, client, request, value, get=None):
+        # Collections in a compact encoding are returned in one reply, the
+        # cursor of larger ones is a position in their table of members,
+        # see Table.scan. ``get`` returns the value of a member of hashes
+        # and sorted sets
+        cursor, match, count, _ = self._scan_options(request, 3)
+        cursor, members = value.scan(cursor, count)
+        result = []
+        for member in members:
+            if match and not match(member.decode('utf-8', 'ignore')):
+                continue
+            if get is None:
+                result.append(member)
+            else:
+                result.extend((member, get(member)))
+        client.reply_multi_bulk((('%d' % cursor).encode('utf-8'), result))
+
     def _range_values(self, value, start, end):
         start = int(start)
         end = int(end)
@@ -2219,34 +3887,178 @@ class Storage:
                 end += 1
         return start, end
 
+    def _bit_range(self, value, args):
+        # The bit range [start, end) of BITCOUNT and BITPOS arguments
+        # start [end [BYTE|BIT]], with redis inclusive byte or bit indices
+        unit = 8
+        if len(args) > 2:
+            if args[2].lower() not in (b'byte', b'bit'):
+                raise CommandError(self.SYNTAX_ERROR)
+            unit = 1 if args[2].lower() == b'bit' else 8
+        try:
+            start = int(args[0])
+            end = int(args[1]) if len(args) > 1 else -1
+        except ValueError:
+            raise CommandError('value is not an integer or out of range')
+        size = 8*len(value) // unit
+        if start < 0:
+            start = max(size + start, 0)
+        if end < 0:
+            end = size + end
+        end = min(end, size - 1) + 1
+        if start >= end:
+            return 0, 0
+        return unit*start, unit*end
+
+    def _bitfield_operations(self, request, readonly=False):
+        # Parse the GET, SET, INCRBY and OVERFLOW subcommands of BITFIELD
+        # into (op, bits, signed, offset, argument) tuples, where op is
+        # either b'get' or the pair of a write operation and its overflow
+        # behaviour
+        operations = []
+        behaviour = b'wrap'
+        N = len(request)
+        j = 2
+        while j < N:
+            op = request[j].lower()
+            nargs = 2 if op == b'get' else 3
+            if op == b'overflow' and j + 1 < N and not readonly:
+                behaviour = request[j+1].lower()
+                if behaviour not in OVERFLOWS:
+                    raise CommandError('Invalid OVERFLOW type specified')
+                j += 2
+                continue
+            elif op not in (b'get', b'set', b'incrby') or j + nargs >= N:
+                raise CommandError(self.SYNTAX_ERROR)
+            elif readonly and op != b'get':
+                raise CommandError('BITFIELD_RO only supports the GET '
+                                   'subcommand')
+            type, offset = request[j+1:j+3]
+            signed = type[:1].lower() == b'i'
+            try:
+                if type[:1].lower() not in (b'i', b'u'):
+                    raise ValueError
+                bits = int(type[1:])
+                if not 0 < bits <= (64 if signed else 63):
+                    raise ValueError
+            except ValueError:
+                raise CommandError(self.INVALID_BITFIELD_TYPE)
+            try:
+                if offset[:1] == b'#':
+                    offset = bits*int(offset[1:])
+                else:
+                    offset = int(offset)
+                if offset < 0 or offset + bits > STRING_LIMIT:
+                    raise ValueError
+            except ValueError:
+                raise CommandError(self.INVALID_BIT_OFFSET)
+            arg = None
+            if op != b'get':
+                try:
+                    arg = int(request[j+3])
+                except ValueError:
+                    raise CommandError('value is not an integer or out of '
+                                       'range')
+                op = (op, behaviour)
+            operations.append((op, bits, signed, offset, arg))
+            j += nargs + 1
+        return operations
+
     def _close_transaction(self, client):
         client.transaction = None
         client.watched_keys = None
         client.flag &= ~self.DIRTY_CAS
         self._watching.discard(client)
 
-    def _flat_info(self):
+    def _flat_info(self, section='default'):
         info = self._server.info()
         info['server']['redis_version'] = self.version
         e = self._encode_info_value
         for k, values in info.items():
+            if section in ('all', 'everything'):
+                pass
+            elif section == 'default':
+                if k in INFO_EXTRA_SECTIONS:
+                    continue
+            elif k != section:
+                continue
             if isinstance(values, dict):
                 yield '#%s' % k
                 for key, value in values.items():
                     if isinstance(value, (list, tuple)):
                         value = ', '.join((e(v) for v in value))
                     elif isinstance(value, dict):
-                        value = ', '.join(('%s=%s' % (k, e(v))
-                                           for k, v in value.items()))
+                        value = ','.join(('%s=%s' % (k, e(v))
+                                          for k, v in value.items()))
                     else:
                         value = e(value)
                     yield '%s:%s' % (key, value)
 
     def _get_config(self, name):
-        return b''
+        name = name.lower()
+        if name == 'notify-keyspace-events':
+            return self._notify_events_string().encode('utf-8')
+        elif name == 'slowlog-log-slower-than':
+            return self._slowlog_slower_than
+        elif name == 'slowlog-max-len':
+            return self._slowlog.max_len
+        elif name == 'latency-monitor-threshold':
+            return self._latency_threshold
 
     def _set_config(self, name, value):
-        pass
+        if name == 'notify-keyspace-events':
+            self._notify_events(value)
+        elif name == 'slowlog-log-slower-than':
+            self._slowlog_slower_than = int(value)
+        elif name == 'slowlog-max-len':
+            self._slowlog.max_len = int(value)
+        elif name == 'latency-monitor-threshold':
+            self._latency_threshold = int(value)
+        else:
+            raise ValueError('Unsupported CONFIG parameter: %s' % name)
+
+    def _command_executed(self, client, name, request, duration):
+        # Record the execution of a command which took ``duration``
+        # seconds
+        usec = int(duration*1000000)
+        stats = self._commandstats.get(name)
+        if stats is None:
+            self._commandstats[name] = stats = CommandStats()
+        stats.add(usec)
+        if 0 <= self._slowlog_slower_than <= usec:
+            self._slowlog.add(client, request, usec)
+        threshold = self._latency_threshold
+        if threshold and usec >= 1000*threshold:
+            self._latency_monitor.add('command', usec // 1000)
+
+    def _notify_events(self, events):
+        # Set the keyspace events to publish from a string of flags
+        flags = 0
+        for c in events:
+            if c == 'A':
+                flags |= self.NOTIFY_ALL
+            elif c == 'K':
+                flags |= self.NOTIFY_KEYSPACE
+            elif c == 'E':
+                flags |= self.NOTIFY_KEYEVENT
+            elif c in NOTIFY_CLASSES:
+                flags |= self.NOTIFY_GENERIC << NOTIFY_CLASSES.index(c)
+            else:
+                raise ValueError('Invalid event class character %s' % c)
+        self._notify_flags = flags
+
+    def _notify_events_string(self):
+        flags = self._notify_flags
+        if flags & self.NOTIFY_ALL == self.NOTIFY_ALL:
+            events = 'A'
+        else:
+            events = ''.join((c for i, c in enumerate(NOTIFY_CLASSES)
+                              if flags & (self.NOTIFY_GENERIC << i)))
+        if flags & self.NOTIFY_KEYSPACE:
+            events += 'K'
+        if flags & self.NOTIFY_KEYEVENT:
+            events += 'E'
+        return events
 
     def _encode_info_value(self, value):
         return str(value).replace('=',
@@ -2280,22 +4092,25 @@ class Storage:
         return increment
 
     def _setoper(self, client, oper, keys, dest=None):
+        # ``dest`` is only used by the s*store commands
         db = client.db
-        result = None
+        sets = []
         for key in keys:
             value = db.get(key)
             if value is None:
-                value = set()
-            elif not isinstance(value, set):
+                value = self.set_type()
+            elif not isinstance(value, self.set_type):
                 return client.reply_wrongtype()
-            if result is None:
-                result = value
-            else:
-                result = getattr(result, oper)(value)
+            sets.append(value)
+        # all sets are given to the operation at once, so that it can
+        # choose the order. The result is always a new set
+        result = getattr(sets[0], oper)(*sets[1:])
         if dest is not None:
-            db.pop(dest)
+            if db.pop(dest) is not None:
+                self._signal(self.NOTIFY_GENERIC, db, 'del', dest, 1)
             if result:
                 db._data[dest] = result
+                self._signal(self.NOTIFY_SET, db, 'sadd', dest, len(result))
                 client.reply_int(len(result))
             else:
                 client.reply_zero()
@@ -2369,29 +4184,100 @@ class Storage:
             max_value = max_value[1:]
         return float(min_value), include_min, float(max_value), include_max
 
+    def _lex_values(self, min_value, max_value):
+        # Parse the ``-``, ``+``, ``[member`` and ``(member`` range items of
+        # lexicographical ranges, ``None`` when the range is empty
+        if min_value == b'+' or max_value == b'-':
+            return
+        minval, include_min = self._lex_value(min_value, b'-')
+        maxval, include_max = self._lex_value(max_value, b'+')
+        return minval, maxval, include_min, include_max
+
+    def _lex_value(self, value, unbounded):
+        if value == unbounded:
+            return None, True
+        elif value[:1] == b'[':
+            return value[1:], True
+        elif value[:1] == b'(':
+            return value[1:], False
+        raise ValueError
+
     def _info(self):
         keyspace = {}
         stats = {'keyspace_hits': self._hit_keys,
                  'keyspace_misses': self._missed_keys,
                  'expired_keys': self._expired_keys,
+                 'evicted_keys': self._evicted_keys,
                  'keys_changed': self._dirty,
                  'pubsub_channels': len(self._channels),
                  'pubsub_patterns': len(self._patterns),
-                 'blocked_clients': self._bpop_blocked_clients}
+                 'blocked_clients': self._bpop_blocked_clients,
+                 'blocked_keys': 0,
+                 'blocked_timeouts': self._bpop_timeouts}
+        saving = self._save_started is not None
+        current = int(time.time() - self._save_started) if saving else -1
         persistance = {'rdb_changes_since_last_save': self._dirty,
-                       'rdb_last_save_time': self._last_save}
+                       'rdb_bgsave_in_progress': int(saving),
+                       'rdb_last_save_time': self._last_save,
+                       'rdb_last_bgsave_status': self._last_save_status,
+                       'rdb_last_bgsave_time_sec': self._last_save_duration,
+                       'rdb_current_bgsave_time_sec': current,
+                       'rdb_save_mode': self.cfg.key_value_save_mode}
+        if self._aof:
+            persistance.update(self._aof.info())
+        else:
+            persistance['aof_enabled'] = 0
+        blocked = {}
         for db in self.databases.values():
             if len(db):
                 keyspace[str(db)] = db.info()
-        return {'keyspace': keyspace,
+            if db._blocking_keys:
+                stats['blocked_keys'] += len(db._blocking_keys)
+                blocked['blocked_%s' % db] = db.blocked_info()
+        memory = {'used_memory': self._used_memory,
+                  'used_memory_human': convert_bytes(self._used_memory),
+                  'maxmemory': self._maxmemory,
+                  'maxmemory_human': convert_bytes(self._maxmemory),
+                  'maxmemory_policy': self._eviction_pool.policy}
+        memory.update(self._scripting.info())
+        commandstats = {}
+        latencystats = {}
+        for name, command_stats in sorted(self._commandstats.items()):
+            commandstats['cmdstat_%s' % name] = command_stats.info()
+            latencystats['latency_percentiles_usec_%s' % name] = dict((
+                ('p%s' % p, command_stats.percentile(p))
+                for p in LATENCY_PERCENTILES))
+        info = {'keyspace': keyspace,
                 'stats': stats,
-                'persistance': persistance}
+                'memory': memory,
+                'persistance': persistance,
+                'blocked': blocked,
+                'commandstats': commandstats,
+                'latencystats': latencystats}
+        info['replication'] = self._replication.info()
+        if self._shards is not None:
+            info['cluster'] = self._shards.info()
+        return info
+
+    def _eval(self, client, sha, request, N):
+        try:
+            numkeys = int(request[2])
+        except ValueError:
+            raise CommandError('value is not an integer or out of range')
+        if numkeys > N - 2:
+            raise CommandError("Number of keys can't be greater than "
+                               "number of args")
+        elif numkeys < 0:
+            raise CommandError("Number of keys can't be negative")
+        keys = request[3:3+numkeys]
+        self._scripting.run(client, sha, keys, request[3+numkeys:])
 
     def _client_list(self, client):
         for client in client._producer._concurrent_connections:
             yield ' '.join(self._client_info(client))
 
     def _client_info(self, client):
+        yield 'id=%s' % client.id
         yield 'addr=%s:%s' % client._transport.get_extra_info('addr')
         yield 'fd=%s' % client._transport._sock_fd
         yield 'age=%s' % int(time.time() - client.started)
@@ -2404,59 +4290,380 @@ class Storage:
         writer = self._writer
         if writer and writer.is_alive():
             self.logger.warning('Cannot save, background saving in progress')
+        elif self._loading:
+            self.logger.warning('Cannot save, loading data')
         else:
-            from multiprocessing import Process
-            data = self._dbs()
-            self._dirty = 0
+            # changes are only forgotten once the save succeeded
+            self._dirty_saving = self._dirty
             self._last_save = int(time.time())
+            self._save_started = time.time()
             if async:
                 self.logger.debug('Saving database in background process')
-                self._writer = Process(target=save_data,
-                                       args=(self.cfg, self._filename, data))
+                if (self.cfg.key_value_save_mode == 'fork' and
+                        hasattr(os, 'fork')):
+                    self._writer = ForkSave(self._save_data)
+                else:
+                    from multiprocessing import Process
+                    dbs = [(num, list(records))
+                           for num, records in self._dbs()]
+                    self._writer = Process(target=save_data,
+                                           args=(self.cfg, self._filename,
+                                                 dbs))
                 self._writer.start()
             else:
                 self.logger.debug('Saving database')
-                save_data(self.cfg, self._filename, data)
+                self._writer = None
+                self._save_data()
+                self._save_done(0)
+
+    def _save_data(self):
+        save_data(self.cfg, self._filename, self._dbs())
+
+    def _check_save(self):
+        writer = self._writer
+        if writer and not writer.is_alive():
+            self._writer = None
+            self._save_done(writer.exitcode)
+
+    def _save_done(self, exitcode):
+        self._last_save_duration = int(time.time() - self._save_started)
+        self._save_started = None
+        if exitcode:
+            self._last_save_status = 'err'
+            self.logger.error('Background saving failed with exit code %s',
+                              exitcode)
+        else:
+            self._dirty = max(self._dirty - self._dirty_saving, 0)
+            self._last_save_status = 'ok'
+            self.logger.info('wrote data into "%s"', self._filename)
+
+    def _collection_type(self, base, **limits):
+        '''A subclass of the collection ``base`` with the class attributes
+        ``limits`` of this store, pickled as an instance of ``base``'''
+        def __reduce__(value):
+            return base, (), value.__getstate__()
+
+        limits.update(__slots__=(), __reduce__=__reduce__)
+        return type(base.__name__, (base,), limits)
+
+    def _adopt(self, value):
+        # Instance of the store type of the library collection ``value``
+        store_type = self._types.get(type(value))
+        if store_type is None:
+            return value
+        adopted = store_type.__new__(store_type)
+        adopted.__setstate__(value.__getstate__())
+        return adopted
 
     def _dbs(self):
-        data = [(db._num, db._data) for db in self.databases.values()
-                if len(db._data)]
-        return (1, data)
+        return [(db._num, self._db_records(db))
+                for db in self.databases.values() if len(db)]
+
+    def _db_records(self, db):
+        for key, value in db._data.items():
+            yield key, value, None
+        for key, value in db._expires.items():
+            yield key, value, self._unix_time_ms(db._deadlines.get(key))
 
     def _loaddb(self):
+        if self.cfg.key_value_appendonly:
+            aof = AppendOnlyFile(self, self.cfg.key_value_appendfilename,
+                                 self.cfg.key_value_appendfsync)
+            aof.load()
+            # set after loading so that replayed commands are not appended
+            self._aof = aof
+            self._dirty = 0
+            return
         filename = self._filename
         if self.cfg.key_value_save and os.path.isfile(filename):
             self.logger.info('loading data from "%s"', filename)
-            with open(filename, 'rb') as file:
-                data = pickle.load(file)
-            version, dbs = data
-            for num, data in dbs:
-                db = self.databases.get(num)
-                if db is not None:
-                    db._data = data
-
-    def _signal(self, type, db, command, key=None, dirty=0):
+            file = open(filename, 'rb')
+            try:
+                reader = SnapshotReader(file, self._types)
+            except SnapshotError:
+                file.close()
+                self._load_pickle(filename)
+            else:
+                self._loading.update(reader.databases)
+                self._load_snapshot(file, iter(reader))
+
+    def _load_snapshot(self, file, records):
+        # Load a chunk of keys and yield to the event loop, so that
+        # databases already loaded can serve clients
+        try:
+            now = time.time()
+            for _ in range(LOAD_KEYS_PER_ITERATION):
+                num, key, value, expire = next(records)
+                if key is None:
+                    self._loading.discard(num)
+                else:
+                    self._load_record(num, key, value, expire, now)
+        except StopIteration:
+            self.logger.info('loaded data from "%s"', file.name)
+        except Exception:
+            self.logger.exception('Could not load data from "%s"', file.name)
+        else:
+            self._loop.call_soon(self._load_snapshot, file, records)
+            return
+        file.close()
+        self._loading.clear()
+
+    def _load_record(self, num, key, value, expire, now):
+        # Add a key read from a snapshot
+        db = self.databases.get(num)
+        if db is None:
+            return
+        elif expire is None:
+            db._data[key] = value
+            db._account(key)
+        else:
+            timeout = 0.001*expire - now
+            if timeout > 0:
+                db._timer(timeout, key, value)
+                db._account(key)
+
+    def _load_pickle(self, filename):
+        # snapshots of previous versions
+        with open(filename, 'rb') as file:
+            data = pickle.load(file)
+        version, dbs = data
+        for num, data in dbs:
+            db = self.databases.get(num)
+            if db is not None:
+                db._data = data
+                for key in data:
+                    db._account(key)
+
+    def _is_loading(self, client, info):
+        if info.name in self.LOADING_ALL_COMMANDS:
+            return True
+        return (client.database in self._loading and
+                info.group not in self.LOADING_GROUPS and
+                info.name not in self.LOADING_COMMANDS)
+
+    def _propagate(self, db, info, request, dirty):
+        # Propagate a write command which changed the dataset followed by
+        # the commands added by the _also method during its execution
+        if self._aof is None and self._replication.backlog is None:
+            return
+        if (info.write and self._dirty != dirty and
+                info.name not in self.ALSO_COMMANDS):
+            feed = self._feed
+            name = info.name
+            if name in self.EXPIRE_COMMANDS:
+                when = db._deadlines.get(request[1])
+                if when is None:
+                    feed(db._num, (b'del', request[1]))
+                else:
+                    feed(db._num, (b'pexpireat', request[1],
+                                   self._unix_time_ms(when)))
+            else:
+                feed(db._num, request)
+                if name in self.TTL_COMMANDS:
+                    when = db._deadlines.get(request[1])
+                    if when is not None:
+                        feed(db._num, (b'pexpireat', request[1],
+                                       self._unix_time_ms(when)))
+        if self._also_propagate:
+            also, self._also_propagate = self._also_propagate, []
+            for num, request in also:
+                self._feed(num, request)
+
+    def _feed(self, num, request):
+        # Append a write command to the append only file and send it to
+        # the replicas
+        if self._aof is not None:
+            self._aof.feed(num, request)
+        if self._replication.backlog is not None:
+            self._replication.feed(num, request)
+
+    def _sync(self, client, replid=None, offset=None):
+        # Start sending the replication stream to client
+        if self._loading:
+            client.reply_error(self.LOADING, 'LOADING')
+        elif client.transaction is not None:
+            client.reply_error('SYNC not allowed inside a transaction')
+        else:
+            self._replication.sync(client, replid, offset)
+
+    def _free_memory(self):
+        # Evict keys until the used memory is below the limit, return
+        # False when not possible
+        if self._used_memory <= self._maxmemory:
+            return True
+        pool = self._eviction_pool
+        if pool.policy == 'noeviction':
+            return False
+        clock = lru_clock(self._loop.time())
+        while self._used_memory > self._maxmemory:
+            for db in self.databases.values():
+                if len(db):
+                    pool.populate(db, clock)
+            candidate = pool.pop(self.databases, clock)
+            if candidate is None:
+                return False
+            num, key = candidate
+            self._evict(self.databases[num], key)
+        return True
+
+    def _evict(self, db, key):
+        db.pop(key)
+        self._evicted_keys += 1
+        self._feed(db._num, (b'del', key))
+        self._signal(self.NOTIFY_EVICTED, db, 'del', key, 1, 'evicted')
+
+    def _also(self, db, request):
+        if self._aof is not None or self._replication.backlog is not None:
+            self._also_propagate.append((db._num, request))
+
+    def _unix_time_ms(self, when):
+        # Convert a deadline in loop time into unix time milliseconds
+        return int(1000*(time.time() + when - self._loop.time()))
+
+    def _signal(self, type, db, command, key=None, dirty=0, event=None):
         self._dirty += dirty
+        if key is not None:
+            db._account(key)
         self._event_handlers[type](db, key, COMMANDS_INFO[command])
+        # keyspace events are built only when enabled for this type of
+        # event and there is someone listening
+        if (type & self._notify_flags and key is not None and
+                (self._keyspace_channels or self._patterns)):
+            self._notify(db, event or command, key)
+
+    def _notify(self, db, event, key):
+        event = NOTIFY_EVENT_NAMES.get(event, event).encode('utf-8')
+        if self._notify_flags & self.NOTIFY_KEYSPACE:
+            self._publish(db._keyspace_prefix + key, event)
+        if self._notify_flags & self.NOTIFY_KEYEVENT:
+            self._publish(db._keyevent_prefix + event, key)
+
+    def _publish(self, channel, message):
+        # The message is encoded once for the subscribers of the channel
+        # and once for each pattern matching the channel
+        count = 0
+        clients = self._channels.get(channel)
+        if clients:
+            msg = self._parser.multi_bulk((b'message', channel, message))
+            failed = self._publish_clients(msg, clients)
+            count += len(clients) - len(failed)
+            for client in failed:
+                self._unsubscribe_channel(client, channel)
+        if self._patterns:
+            for p in list(self._patterns.match(channel)):
+                msg = self._parser.multi_bulk((b'pmessage', p.pattern,
+                                               channel, message))
+                failed = self._publish_clients(msg, p.clients)
+                count += len(p.clients) - len(failed)
+                for client in failed:
+                    self._unsubscribe_pattern(client, p.pattern)
+        return count
 
     def _publish_clients(self, msg, clients):
-        remove = set()
-        count = 0
+        # Send msg to clients and return the clients which failed
+        failed = []
         for client in clients:
             try:
-                client._transport.write(msg)
-                count += 1
+                client._send(msg)
             except Exception:
-                remove.add(client)
-        if remove:
-            clients.difference_update(remove)
-        return count
+                failed.append(client)
+        return failed
+
+    def _subscriptions(self, client):
+        return len(client.channels) + len(client.patterns)
+
+    def _unsubscribe_channel(self, client, channel):
+        clients = self._channels.get(channel)
+        if clients and client in clients:
+            client.channels.discard(channel)
+            clients.remove(client)
+            if not clients:
+                self._channels.pop(channel)
+                if channel.startswith(b'__key'):
+                    self._keyspace_channels -= 1
+            return True
+        return False
+
+    def _unsubscribe_pattern(self, client, pattern):
+        client.patterns.discard(pattern)
+        return self._patterns.discard(pattern, client)
 
     # EVENT HANDLERS
     def _modified_key(self, key):
         for client in self._watching:
             if key is None or key in client.watched_keys:
                 client.flag |= self.DIRTY_CAS
+        if self._tracking:
+            self._invalidate(self._tracking.invalidate(key), key)
+
+    def _track(self, client, info, request):
+        # Remember the keys read by a client with tracking enabled
+        if not client.tracking.bcast and info.group in TRACKING_GROUPS:
+            tracking = self._tracking
+            tracking.track(client, command_keys(info, request))
+            for key, ids in tracking.evict():
+                self._invalidate(ids, key)
+
+    def _invalidate(self, ids, key):
+        # Send the invalidation message of key, None for all keys, to the
+        # redirect connections of tracking clients with ``ids``. The
+        # message is sent once to connections shared by several clients
+        if not ids:
+            return
+        clients = self._tracking.clients
+        targets = set()
+        for i in ids:
+            target = self._clients.get(clients[i].tracking.redirect)
+            if target is not None:
+                targets.add(target)
+        if targets:
+            msg = self._parser.multi_bulk((b'message', INVALIDATE_CHANNEL,
+                                           None if key is None else (key,)))
+            for target in targets:
+                try:
+                    target._send(msg)
+                except Exception:
+                    self.logger.exception('Could not send invalidation')
+
+    def _client_tracking(self, client, request):
+        option = request[2].lower()
+        if option == b'off':
+            check_input(request, len(request) != 3)
+            self._tracking.disable(client)
+            return client.reply_ok()
+        elif option != b'on':
+            raise CommandError(self.SYNTAX_ERROR)
+        redirect = None
+        bcast = False
+        prefixes = []
+        args = iter(request[3:])
+        for arg in args:
+            arg = arg.lower()
+            try:
+                if arg == b'redirect':
+                    redirect = int(next(args))
+                elif arg == b'bcast':
+                    bcast = True
+                elif arg == b'prefix':
+                    prefixes.append(next(args))
+                else:
+                    raise CommandError(self.SYNTAX_ERROR)
+            except (StopIteration, ValueError):
+                raise CommandError(self.SYNTAX_ERROR)
+        if redirect is None:
+            # invalidation messages need the RESP3 protocol to be sent to
+            # the tracking connection itself
+            client.reply_error('Tracking requires a REDIRECT connection')
+        elif redirect not in self._clients:
+            client.reply_error('The client ID you want redirect to does not '
+                               'exist')
+        elif prefixes and not bcast:
+            client.reply_error('PREFIX option requires BCAST mode to be '
+                               'enabled')
+        else:
+            self._tracking.enable(client, Tracking(redirect, bcast,
+                                                   prefixes))
+            client.reply_ok()
 
     def _generic_event(self, db, key, command):
         if command.write:
@@ -2470,29 +4677,37 @@ class Storage:
     def _list_event(self, db, key, command):
         if command.write:
             self._modified_key(key)
+        self._ready_key(db, key)
+
+    _stream_event = _list_event
+
+    def _ready_key(self, db, key):
         # the key is blocking clients
-        if key in db._blocking_keys:
-            if key in db._data:
-                value = db._data[key]
-            elif key in self._expires:
-                value = db._expires[key]
-            else:
-                value = None
-            for client in db._blocking_keys.pop(key):
-                client.blocked.unblock(client, key, value)
+        if key in db._blocking_keys and (db, key) not in self._ready_set:
+            self._ready_set.add((db, key))
+            self._ready_keys.append((db, key))
+            if len(self._ready_keys) == 1:
+                self._serve_blocked()
+
+    def _close(self, _, **kw):
+        # The server has stopped serving
+        if self._aof:
+            self._aof.close()
+        self._replication.close()
 
     def _remove_connection(self, client, _, **kw):
         # Remove a client from the server
         self._monitors.discard(client)
         self._watching.discard(client)
-        for channel, clients in list(self._channels.items()):
-            clients.discard(client)
-            if not clients:
-                self._channels.pop(channel)
-        for pattern, p in list(self._patterns.items()):
-            p.clients.discard(client)
-            if not p.clients:
-                self._patterns.pop(pattern)
+        self._replication.remove(client)
+        self._clients.pop(client.id, None)
+        self._tracking.disable(client)
+        if client.blocked:
+            client.blocked.cancel(client)
+        for channel in list(client.channels):
+            self._unsubscribe_channel(client, channel)
+        for pattern in list(client.patterns):
+            self._unsubscribe_pattern(client, pattern)
 
     def _write_to_monitors(self, client, request):
         # addr = '%s:%s' % self._transport.get_extra_info('addr')
@@ -2501,7 +4716,7 @@ class Storage:
         remove = set()
         for m in self._monitors:
             try:
-                m._transport.write(message)
+                m._send(message)
             except Exception:
                 remove.add(m)
         if remove:
@@ -2510,6 +4725,14 @@ class Storage:
 
 class Db:
     '''A database.
+
+    Keys without a time to live are stored in ``_data``, keys with a time
+    to live in ``_expires`` and their deadlines in the ``_deadlines``
+    :class:`.ExpiryHeap`. Expired keys are removed lazily, when accessed,
+    and actively, in batches, by the :meth:`Storage._cron` task.
+    Estimated size and access information of keys, used for evicting
+    keys, are in the ``_keys_meta`` :class:`.KeyTable`, which also
+    provides the positional cursor of the ``scan`` command.
     '''
     def __init__(self, num, store):
         self.store = store
@@ -2517,8 +4740,12 @@ class Db:
         self._loop = store._loop
         self._data = {}
         self._expires = {}
+        self._deadlines = ExpiryHeap()
+        self._keys_meta = KeyTable()
         self._events = {}
         self._blocking_keys = {}
+        self._keyspace_prefix = ('__keyspace@%d__:' % num).encode('utf-8')
+        self._keyevent_prefix = ('__keyevent@%d__:' % num).encode('utf-8')
 
     def __repr__(self):
         return 'db%s' % self._num
@@ -2533,32 +4760,41 @@ class Db:
     # #########################################################################
     # #    INTERNALS
     def flush(self):
-        removed = len(self._data)
+        removed = len(self)
         self._data.clear()
-        [t.handle.cancel() for t in self._expires.values()]
         self._expires.clear()
+        self._deadlines.clear()
+        self.store._used_memory -= self._keys_meta.used_memory
+        self._keys_meta.clear()
         self.store._signal(self.store.NOTIFY_GENERIC, self, 'flushdb',
                            dirty=removed)
 
     def get(self, key, default=None):
         if key in self._data:
             self.store._hit_keys += 1
+            if self.store._maxmemory:
+                self._touch(key)
             return self._data[key]
-        elif key in self._expires:
+        elif key in self._expires and not self._expired(key):
             self.store._hit_keys += 1
-            return self._expires[key].value
+            if self.store._maxmemory:
+                self._touch(key)
+            return self._expires[key]
         else:
             self.store._missed_keys += 1
             return default
 
     def exists(self, key):
-        return key in self._data or key in self._expires
+        return key in self._data or (key in self._expires and
+                                     not self._expired(key))
 
     def expire(self, key, timeout):
-        if key in self._expires:
-            t = self._expires.pop(key)
-            t.handle.cancel()
-            value = t.value
+        if key in self._expires and not self._expired(key):
+            if timeout > 0:
+                self._deadlines.set(key, self._loop.time() + timeout)
+                return True
+            value = self._expires.pop(key)
+            self._deadlines.discard(key)
         elif key in self._data:
             value = self._data.pop(key)
         else:
@@ -2568,11 +4804,10 @@ class Db:
         return True
 
     def persist(self, key):
-        if key in self._expires:
+        if key in self._expires and not self._expired(key):
             self.store._hit_keys += 1
-            t = self._expires.pop(key)
-            t.handle.cancel()
-            self._data[key] = t.value
+            self._deadlines.discard(key)
+            self._data[key] = self._expires.pop(key)
             return True
         elif key in self._data:
             self.store._hit_keys += 1
@@ -2581,10 +4816,10 @@ class Db:
         return False
 
     def ttl(self, key, m=1):
-        if key in self._expires:
+        if key in self._expires and not self._expired(key):
             self.store._hit_keys += 1
-            t = self._expires[key]
-            return max(0, int(m*(t.when - self._loop.time())))
+            when = self._deadlines.get(key)
+            return max(0, int(m*(when - self._loop.time())))
         elif key in self._data:
             self.store._hit_keys += 1
             return -1
@@ -2596,48 +4831,99 @@ class Db:
         return {'Keys': len(self._data),
                 'expires': len(self._expires)}
 
+    def blocked_info(self):
+        # Number of blocked clients of the keys with most blocked clients
+        keys = nlargest(BLOCKED_INFO_KEYS, self._blocking_keys.items(),
+                        key=lambda item: len(item[1]))
+        return dict(((key.decode('utf-8', 'replace'), len(waiters))
+                     for key, waiters in keys))
+
     def pop(self, key, value=None):
         if not value:
             if key in self._data:
-                value = self._data.pop(key)
-                return value
+                self._forget(key)
+                return self._data.pop(key)
             elif key in self._expires:
-                t = self._expires.pop(key)
-                t.handle.cancel()
-                return t.value
+                self._forget(key)
+                self._deadlines.discard(key)
+                return self._expires.pop(key)
 
     def rem(self, key):
         if key in self._data:
             self.store._hit_keys += 1
+            self._forget(key)
             self._data.pop(key)
             self.store._signal(self.store.NOTIFY_GENERIC, self, 'del', key, 1)
             return 1
-        elif key in self._expires:
+        elif key in self._expires and not self._expired(key):
             self.store._hit_keys += 1
-            t = self._expires.pop(key)
-            t.handle.cancel()
+            self._forget(key)
+            self._deadlines.discard(key)
+            self._expires.pop(key)
             self.store._signal(self.store.NOTIFY_GENERIC, self, 'del', key, 1)
             return 1
         else:
             self.store._missed_keys += 1
             return 0
 
+    def _peek(self, key):
+        # The value at key, without checking expiry or updating statistics
+        value = self._data.get(key)
+        return self._expires.get(key) if value is None else value
+
+    def _expired(self, key):
+        # Lazy expiry of a key in the ``_expires`` dictionary
+        if self._deadlines.get(key) <= self._loop.time():
+            self._do_expire(key)
+            return True
+        return False
+
+    def _active_expire(self, now, limit):
+        # Remove at most ``limit`` keys with a deadline before ``now``
+        keys = self._deadlines.pop_expired(now, limit)
+        for key in keys:
+            self._do_expire(key)
+        return len(keys)
+
     def _do_expire(self, key):
         if key in self._expires:
-            t = self._expires.pop(key)
-            t.handle.cancel()
+            self._forget(key)
+            self._deadlines.discard(key)
+            self._expires.pop(key)
             self.store._expired_keys += 1
+            self.store._signal(self.store.NOTIFY_EXPIRED, self, 'del', key,
+                               event='expired')
 
     def _timer(self, timeout, key, value):
-        loop = self._loop
-        when = loop.time() + timeout
-        handle = loop.call_at(when, self._do_expire, key)
-        self._expires[key] = Timer(handle, value, when)
-
-
-class Timer:
-
-    def __init__(self, handle, value, when):
-        self.handle = handle
-        self.value = value
-        self.when = when
+        self._expires[key] = value
+        self._deadlines.set(key, self._loop.time() + timeout)
+
+    def _account(self, key):
+        # Update size and access time of a key after a write. Without a
+        # memory limit the table only tracks keys, for the scan cursor
+        value = self._peek(key)
+        table = self._keys_meta
+        used = table.used_memory
+        if value is None:
+            table.remove(key)
+        elif not self.store._maxmemory:
+            if key not in table:
+                table.set(key, 0)
+        else:
+            clock = lru_clock(self._loop.time())
+            table.set(key, access(table.get(key), clock,
+                                  estimate_size(key, value)))
+        self.store._used_memory += table.used_memory - used
+
+    def _touch(self, key):
+        # Update the access time of a key after a read
+        table = self._keys_meta
+        meta = table.get(key)
+        if meta is not None:
+            table.set(key, access(meta, lru_clock(self._loop.time())))
+
+    def _forget(self, key):
+        table = self._keys_meta
+        used = table.used_memory
+        table.remove(key)
+        self.store._used_memory += table.used_memory - used
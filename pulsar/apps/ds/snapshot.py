@@ -0,0 +1,303 @@
+'''Binary snapshot format of pulsar-ds.
+
+A snapshot is a stream of records written and read one key at a time,
+so that neither saving nor loading need the whole dataset serialized in
+memory::
+
+    header  := MAGIC version:H ndbs:I (db:I){ndbs}
+    record  := SELECTDB db:I
+             | [EXPIRETIME expire_ms:q] type:B key value
+    footer  := EOF crc32:I
+
+Strings (keys, values and members) are encoded as ``length:I`` followed
+by the bytes, collections as ``size:I`` followed by their elements and
+zset scores as big-endian doubles. Streams are followed by their
+metadata and consumer groups::
+
+    stream  := size:I (id fields:I (string string){fields}){size}
+               last_id entries_added:Q max_deleted_id
+               groups:I (string last_id entries_read:Q consumers:I
+                         consumer{consumers}){groups}
+    consumer:= string seen_time:q pending:I
+               (id delivery_time:q delivery_count:Q){pending}
+    id      := ms:Q seq:Q
+
+The checksum covers every byte before it, header included.
+'''
+from struct import Struct
+from zlib import crc32
+
+from pulsar.utils.structures import Hash, Set, Deque, Zset, Stream
+from pulsar.utils.structures.stream import (StreamGroup, StreamConsumer,
+                                            PendingEntry)
+
+from .parser import RedisError
+
+
+MAGIC = b'PULSARDS'
+VERSION = 3
+CHUNK_SIZE = 64*1024
+
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_HASH = 3
+TYPE_ZSET = 4
+TYPE_STREAM = 5
+OP_EXPIRETIME = 0xFC
+OP_SELECTDB = 0xFE
+OP_EOF = 0xFF
+
+uint8 = Struct('>B')
+uint16 = Struct('>H')
+uint32 = Struct('>I')
+int64 = Struct('>q')
+uint64 = Struct('>Q')
+stream_id = Struct('>QQ')
+pending_entry = Struct('>qQ')
+double = Struct('>d')
+
+
+class SnapshotError(RedisError):
+    pass
+
+
+def value_type(value):
+    '''The snapshot type code of ``value``'''
+    if isinstance(value, bytearray):
+        return TYPE_STRING
+    elif isinstance(value, Deque):
+        return TYPE_LIST
+    elif isinstance(value, Set):
+        return TYPE_SET
+    elif isinstance(value, Hash):
+        return TYPE_HASH
+    elif isinstance(value, Zset):
+        return TYPE_ZSET
+    elif isinstance(value, Stream):
+        return TYPE_STREAM
+    else:
+        raise SnapshotError('Cannot save values of type %s' % type(value))
+
+
+class SnapshotWriter:
+    '''Write a snapshot into a binary ``file``.
+    '''
+    def __init__(self, file, databases):
+        self._file = file
+        self._buffer = bytearray()
+        self._crc = 0
+        self._write(MAGIC + uint16.pack(VERSION) + uint32.pack(len(databases)))
+        for num in databases:
+            self._write(uint32.pack(num))
+
+    def select(self, num):
+        self._write(uint8.pack(OP_SELECTDB) + uint32.pack(num))
+
+    def add(self, key, value, expire=None):
+        '''Write ``key`` and its ``value``.
+
+        :param expire: optional unix time in milliseconds when the key
+            expires.
+        '''
+        write = self._write
+        if expire is not None:
+            write(uint8.pack(OP_EXPIRETIME) + int64.pack(expire))
+        vtype = value_type(value)
+        write(uint8.pack(vtype))
+        self._string(key)
+        if vtype == TYPE_STRING:
+            self._string(value)
+        elif vtype == TYPE_LIST or vtype == TYPE_SET:
+            write(uint32.pack(len(value)))
+            for item in value:
+                self._string(item)
+        elif vtype == TYPE_HASH:
+            write(uint32.pack(len(value)))
+            for field, item in value.items():
+                self._string(field)
+                self._string(item)
+        elif vtype == TYPE_ZSET:
+            write(uint32.pack(len(value)))
+            for score, member in value.items():
+                write(double.pack(score))
+                self._string(member)
+        else:
+            self._stream(value)
+        if len(self._buffer) >= CHUNK_SIZE:
+            self._flush()
+
+    def close(self):
+        self._write(uint8.pack(OP_EOF))
+        self._flush()
+        self._file.write(uint32.pack(self._crc))
+        self._file.flush()
+
+    def _string(self, value):
+        self._buffer.extend(uint32.pack(len(value)))
+        self._buffer.extend(value)
+
+    def _stream(self, value):
+        write = self._write
+        string = self._string
+        write(uint32.pack(len(value)))
+        for id, fields in value:
+            write(stream_id.pack(*id) + uint32.pack(len(fields) // 2))
+            for item in fields:
+                string(item)
+        write(stream_id.pack(*value.last_id) +
+              uint64.pack(value.entries_added) +
+              stream_id.pack(*value.max_deleted_id) +
+              uint32.pack(len(value.groups)))
+        for name, group in value.groups.items():
+            string(name)
+            write(stream_id.pack(*group.last_id) +
+                  uint64.pack(group.entries_read) +
+                  uint32.pack(len(group.consumers)))
+            for consumer in group.consumers.values():
+                string(consumer.name)
+                write(int64.pack(consumer.seen_time) +
+                      uint32.pack(len(consumer.pending)))
+                for id, pe in consumer.pending.items():
+                    write(stream_id.pack(*id) +
+                          pending_entry.pack(pe.delivery_time,
+                                             pe.delivery_count))
+
+    def _write(self, data):
+        self._buffer.extend(data)
+
+    def _flush(self):
+        if self._buffer:
+            self._crc = crc32(self._buffer, self._crc)
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+
+class SnapshotReader:
+    '''Read a snapshot from a binary ``file``, one record at a time.
+
+    .. attribute:: databases
+
+        List of database numbers stored in the snapshot, in the order
+        they are stored.
+
+    :param types: optional dictionary of the classes of the values read,
+        by the :class:`.Hash`, :class:`.Set`, :class:`.Zset` and
+        :class:`.Stream` classes they extend.
+    '''
+    def __init__(self, file, types=None):
+        self._file = file
+        types = types or {}
+        self._hash_type = types.get(Hash, Hash)
+        self._set_type = types.get(Set, Set)
+        self._zset_type = types.get(Zset, Zset)
+        self._stream_type = types.get(Stream, Stream)
+        self._data = b''
+        self._pos = 0
+        self._crc = 0
+        if file.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError('Not a pulsar-ds snapshot')
+        self._crc = crc32(MAGIC)
+        version = uint16.unpack(self._read(2))[0]
+        if version > VERSION:
+            raise SnapshotError('Cannot load snapshot version %s' % version)
+        N = self._uint32()
+        self.databases = [self._uint32() for _ in range(N)]
+
+    def __iter__(self):
+        '''Iterate over ``(db, key, value, expire)`` records.
+
+        The end of a database is signalled by a record with ``key`` set
+        to ``None``.
+        '''
+        num = None
+        expire = None
+        while True:
+            op = self._read(1)[0]
+            if op == OP_EOF:
+                if num is not None:
+                    yield num, None, None, None
+                break
+            elif op == OP_SELECTDB:
+                if num is not None:
+                    yield num, None, None, None
+                num = self._uint32()
+            elif op == OP_EXPIRETIME:
+                expire = int64.unpack(self._read(8))[0]
+            else:
+                key = self._string()
+                yield num, key, self._value(op), expire
+                expire = None
+        crc = self._crc
+        if uint32.unpack(self._read(4))[0] != crc:
+            raise SnapshotError('Snapshot checksum mismatch')
+
+    def _value(self, vtype):
+        string = self._string
+        if vtype == TYPE_STRING:
+            return bytearray(string())
+        N = self._uint32()
+        if vtype == TYPE_LIST:
+            return Deque((string() for _ in range(N)))
+        elif vtype == TYPE_SET:
+            return self._set_type((string() for _ in range(N)))
+        elif vtype == TYPE_HASH:
+            return self._hash_type(((string(), string())
+                                    for _ in range(N)))
+        elif vtype == TYPE_ZSET:
+            return self._zset_type(((double.unpack(self._read(8))[0],
+                                     string()) for _ in range(N)))
+        elif vtype == TYPE_STREAM:
+            return self._stream(N)
+        else:
+            raise SnapshotError('Unknown value type %s' % vtype)
+
+    def _stream(self, N):
+        string = self._string
+        value = self._stream_type()
+        for _ in range(N):
+            id = self._id()
+            value.add(id, [string() for _ in range(2*self._uint32())])
+        value.last_id = self._id()
+        value.entries_added = uint64.unpack(self._read(8))[0]
+        value.max_deleted_id = self._id()
+        for _ in range(self._uint32()):
+            name = string()
+            group = StreamGroup(self._id(), uint64.unpack(self._read(8))[0])
+            pending = []
+            for _ in range(self._uint32()):
+                consumer = StreamConsumer(string(),
+                                          int64.unpack(self._read(8))[0])
+                group.consumers[consumer.name] = consumer
+                for _ in range(self._uint32()):
+                    id = self._id()
+                    pe = PendingEntry(consumer.name, *pending_entry.unpack(
+                        self._read(16)))
+                    consumer.pending[id] = pe
+                    pending.append((id, pe))
+            group.pending.update(sorted(pending))
+            value.groups[name] = group
+        return value
+
+    def _id(self):
+        return stream_id.unpack(self._read(16))
+
+    def _uint32(self):
+        return uint32.unpack(self._read(4))[0]
+
+    def _string(self):
+        return self._read(self._uint32())
+
+    def _read(self, n):
+        end = self._pos + n
+        if end > len(self._data):
+            self._data = (self._data[self._pos:] +
+                          self._file.read(max(n, CHUNK_SIZE)))
+            self._pos = 0
+            end = n
+            if end > len(self._data):
+                raise SnapshotError('Unexpected end of snapshot')
+        data = self._data[self._pos:end]
+        self._pos = end
+        self._crc = crc32(data, self._crc)
+        return data
@@ -0,0 +1,167 @@
+'''Command statistics of pulsar-ds: call counts and latency histograms
+for ``INFO commandstats`` and ``LATENCY HISTOGRAM``, the slow log of
+``SLOWLOG`` and the latency events of ``LATENCY LATEST/HISTORY``.
+'''
+import time
+from collections import deque
+from itertools import count, islice
+
+
+# Latency buckets are powers of two microseconds, the last one collects
+# everything slower than about 35 minutes
+HISTOGRAM_BUCKETS = 32
+# Arguments of slow log entries are truncated to these sizes, as in redis
+SLOWLOG_MAX_ARGC = 32
+SLOWLOG_MAX_ARGLEN = 128
+# Samples kept for each latency event
+LATENCY_HISTORY_LEN = 160
+LATENCY_PERCENTILES = (50, 99, 99.9)
+
+
+class CommandStats:
+    '''Number of calls, total time and latency histogram of a command'''
+    __slots__ = ('calls', 'usec', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.usec = 0
+        self.histogram = [0]*HISTOGRAM_BUCKETS
+
+    def add(self, usec):
+        self.calls += 1
+        self.usec += usec
+        self.histogram[min(usec.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def info(self):
+        return {'calls': self.calls,
+                'usec': self.usec,
+                'usec_per_call': '%.2f' % (self.usec / self.calls)}
+
+    def buckets(self):
+        '''Iterator over the upper bound in microseconds and the
+        cumulative number of calls of non empty buckets'''
+        total = 0
+        for i, n in enumerate(self.histogram):
+            if n:
+                total += n
+                yield 1 << i, total
+
+    def percentile(self, p):
+        '''Upper bound in microseconds of the bucket of the ``p``
+        percentile'''
+        rank = self.calls * p / 100
+        for usec, total in self.buckets():
+            if total >= rank:
+                return usec
+        return 0
+
+
+class SlowLog:
+    '''Bounded log of the commands slower than a threshold, the most
+    recent first'''
+    def __init__(self, max_len):
+        self._entries = deque(maxlen=max(max_len, 0))
+        self._ids = count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def max_len(self):
+        return self._entries.maxlen
+
+    @max_len.setter
+    def max_len(self, max_len):
+        self._entries = deque(self._entries, maxlen=max(max_len, 0))
+
+    def add(self, client, request, usec):
+        argc = len(request)
+        if argc > SLOWLOG_MAX_ARGC:
+            args = list(request[:SLOWLOG_MAX_ARGC-1])
+            args.append(('... (%d more arguments)' %
+                         (argc - SLOWLOG_MAX_ARGC + 1)).encode('utf-8'))
+        else:
+            args = list(request)
+        for i, arg in enumerate(args):
+            if isinstance(arg, str):
+                args[i] = arg = arg.encode('utf-8')
+            if len(arg) > SLOWLOG_MAX_ARGLEN:
+                args[i] = arg[:SLOWLOG_MAX_ARGLEN] + (
+                    '... (%d more bytes)' %
+                    (len(arg) - SLOWLOG_MAX_ARGLEN)).encode('utf-8')
+        self._entries.appendleft((next(self._ids), int(time.time()), usec,
+                                  args, client_address(client), b''))
+
+    def get(self, num=None):
+        '''The ``num`` most recent entries, all when ``None``'''
+        if num is None or num < 0:
+            return list(self._entries)
+        return list(islice(self._entries, num))
+
+    def reset(self):
+        self._entries.clear()
+
+
+class LatencyMonitor:
+    '''Samples of events slower than a threshold, one per second with
+    the highest latency of that second'''
+    def __init__(self):
+        self._events = {}
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, event, msec):
+        ts = int(time.time())
+        samples = self._events.get(event)
+        if samples is None:
+            self._events[event] = samples = LatencySamples()
+        samples.add(ts, msec)
+
+    def latest(self):
+        '''Tuples of event name, time, latency and maximum latency of the
+        latest sample of each event'''
+        for event, samples in self._events.items():
+            ts, msec = samples.history[-1]
+            yield event, ts, msec, samples.max
+
+    def history(self, event):
+        samples = self._events.get(event)
+        return list(samples.history) if samples else []
+
+    def reset(self, events=None):
+        '''Remove samples of ``events``, all when ``None``, and return the
+        number of events removed'''
+        if events is None:
+            removed = len(self._events)
+            self._events.clear()
+            return removed
+        return sum((self._events.pop(event, None) is not None
+                    for event in events))
+
+
+class LatencySamples:
+    __slots__ = ('history', 'max')
+
+    def __init__(self):
+        self.history = deque(maxlen=LATENCY_HISTORY_LEN)
+        self.max = 0
+
+    def add(self, ts, msec):
+        history = self.history
+        if history and history[-1][0] == ts:
+            if history[-1][1] < msec:
+                history[-1] = (ts, msec)
+        else:
+            history.append((ts, msec))
+        self.max = max(self.max, msec)
+
+
+def client_address(client):
+    '''The ``host:port`` address of a client connection'''
+    transport = getattr(client, '_transport', None)
+    if transport is not None:
+        address = transport.get_extra_info('peername')
+        if isinstance(address, tuple):
+            return ('%s:%s' % address[:2]).encode('utf-8')
+    return b''
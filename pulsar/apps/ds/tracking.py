@@ -0,0 +1,100 @@
+'''Client side caching support of pulsar-ds, as in redis ``CLIENT TRACKING``.
+
+The server remembers the keys read by clients with tracking enabled and,
+when one of these keys is modified, sends the key on the
+``__redis__:invalidate`` channel to the connection the client redirected
+its invalidation messages to. Keys are forgotten once invalidated, a
+client is told again only after reading the key again.
+'''
+
+
+INVALIDATE_CHANNEL = b'__redis__:invalidate'
+
+
+class Tracking:
+    '''Tracking options of a client'''
+    __slots__ = ('redirect', 'bcast', 'prefixes')
+
+    def __init__(self, redirect, bcast=False, prefixes=None):
+        self.redirect = redirect
+        self.bcast = bcast
+        self.prefixes = prefixes or (b'',)
+
+
+class TrackingTable:
+    '''Client ids by key read and by prefix of broadcasting clients'''
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        # clients with tracking enabled by id
+        self.clients = {}
+        # ids of the clients which read a key
+        self._keys = {}
+        # ids of the clients in broadcasting mode by prefix
+        self._prefixes = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __bool__(self):
+        return bool(self.clients)
+
+    def enable(self, client, tracking):
+        self.disable(client)
+        client.tracking = tracking
+        self.clients[client.id] = client
+        if tracking.bcast:
+            for prefix in tracking.prefixes:
+                ids = self._prefixes.get(prefix)
+                if ids is None:
+                    self._prefixes[prefix] = ids = set()
+                ids.add(client.id)
+
+    def disable(self, client):
+        tracking = client.tracking
+        if tracking is not None:
+            client.tracking = None
+            self.clients.pop(client.id, None)
+            if tracking.bcast:
+                for prefix in tracking.prefixes:
+                    ids = self._prefixes[prefix]
+                    ids.discard(client.id)
+                    if not ids:
+                        self._prefixes.pop(prefix)
+
+    def track(self, client, keys):
+        '''Remember ``keys`` read by ``client``'''
+        table = self._keys
+        for key in keys:
+            ids = table.get(key)
+            if ids is None:
+                table[key] = ids = set()
+            ids.add(client.id)
+
+    def invalidate(self, key):
+        '''Ids of the clients to tell about a change of ``key``, all
+        the clients with tracking enabled when ``None``. The key is
+        forgotten.
+        '''
+        clients = self.clients
+        if key is None:
+            self._keys.clear()
+            return set(clients)
+        ids = self._keys.pop(key, None)
+        result = set((i for i in ids if i in clients)) if ids else set()
+        for prefix, ids in self._prefixes.items():
+            if key.startswith(prefix):
+                result.update(ids)
+        return result
+
+    def evict(self):
+        '''Forget the oldest keys above :attr:`max_keys`.
+
+        Iterator over the keys forgotten and the ids of the clients which
+        must be told they are no longer tracked.
+        '''
+        table = self._keys
+        clients = self.clients
+        while len(table) > self.max_keys > 0:
+            key = next(iter(table))
+            ids = table.pop(key)
+            yield key, [i for i in ids if i in clients]
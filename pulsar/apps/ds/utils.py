@@ -1,14 +1,80 @@
+import os
 import shutil
-import pickle
+import signal
 
+from .snapshot import SnapshotWriter
 
-def save_data(cfg, filename, data):
-    logger = cfg.configured_logger('pulsar.ds')
-    temp = 'temp_%s' % filename
+
+def save_data(cfg, filename, dbs):
+    '''Write a snapshot of ``dbs`` into ``filename``.
+
+    It runs in the saving child process and does not log, a logging lock
+    held by another thread when forking would never be released.
+
+    :param dbs: list of ``(num, records)`` pairs where ``records`` is an
+        iterable over ``(key, value, expire)`` triplets of the database
+        ``num``.
+    '''
+    path, name = os.path.split(filename)
+    temp = os.path.join(path, 'temp_%s' % name)
     with open(temp, 'wb') as file:
-        pickle.dump(data, file, protocol=2)
+        write_snapshot(file, dbs)
     shutil.move(temp, filename)
-    logger.info('wrote data into "%s"', filename)
+
+
+def write_snapshot(file, dbs):
+    '''Write a snapshot of ``dbs`` into the binary ``file``.
+    '''
+    writer = SnapshotWriter(file, [num for num, _ in dbs])
+    for num, records in dbs:
+        writer.select(num)
+        for key, value, expire in records:
+            writer.add(key, value, expire)
+    writer.close()
+
+
+class ForkSave:
+    '''Run ``target`` in a child process created with :func:`os.fork`.
+
+    The child shares the parent memory pages copy-on-write, so ``target``
+    serializes the databases without copying them first.
+    It exposes the same ``start``, ``is_alive`` and ``exitcode``
+    interface of :class:`multiprocessing.Process`.
+    '''
+    def __init__(self, target):
+        self.target = target
+        self.pid = None
+        self.exitcode = None
+
+    def start(self):
+        pid = os.fork()
+        if pid:
+            self.pid = pid
+        else:   # pragma    nocover
+            code = 1
+            try:
+                # signals must not wake up the parent event loop
+                signal.set_wakeup_fd(-1)
+                self.target()
+                code = 0
+            finally:
+                os._exit(code)
+
+    def is_alive(self):
+        if self.pid and self.exitcode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # reaped by someone else, its exit status is lost and
+                # the child cannot be assumed to have succeeded
+                self.exitcode = 1
+                return False
+            if pid:
+                if os.WIFEXITED(status):
+                    self.exitcode = os.WEXITSTATUS(status)
+                else:
+                    self.exitcode = -os.WTERMSIG(status)
+        return self.pid is not None and self.exitcode is None
 
 
 def sort_command(store, client, request, value):
@@ -169,30 +235,6 @@ class SortableDesc:
             return self.value > other.value
 
 
-def count_bytes(array):
-    '''Count the number of bits in a byte ``array``.
-
-    It uses the Hamming weight popcount algorithm
-    '''
-    # this algorithm can be rewritten as
-    # for i in array:
-    #     count += sum(b=='1' for b in bin(i)[2:])
-    # but this version is almost 2 times faster
-    count = 0
-    for i in array:
-        i = i - ((i >> 1) & 0x55555555)
-        i = (i & 0x33333333) + ((i >> 2) & 0x33333333)
-        count += (((i + (i >> 4)) & 0x0F0F0F0F) * 0x01010101) >> 24
-    return count
-
-
-def and_op(x, y):
-    return x & y
-
-
-def or_op(x, y):
-    return x | y
-
-
-def xor_op(x, y):
-    return x ^ y
+def format_stream_id(id):
+    '''The ``ms-seq`` bytes of a stream entry ``id``'''
+    return ('%d-%d' % id).encode('utf-8')
@@ -10,12 +10,12 @@ from pulsar.utils.log import WritelnDecorator
 from .events import EventHandler
 from .proxy import ActorProxy, ActorProxyMonitor, actor_identity
 from .mailbox import command_in_context
-from .access import get_actor
+from .access import get_actor, ensure_future
 from .cov import Coverage
 from .consts import ACTOR_STATES
 
 
-__all__ = ['is_actor', 'send', 'spawn',
+__all__ = ['is_actor', 'send', 'post', 'spawn',
            'Actor', 'get_stream']
 
 
@@ -60,6 +60,31 @@ def send(target, action, *args, **params):
         return actor.send(target, action, *args, **params)
 
 
+def post(target, action, *args, **params):
+    '''Send a :ref:`message <api-remote_commands>` to ``target`` without
+    waiting for a response.
+
+    Same parameters as :func:`send`, the ``action`` is performed by
+    ``target`` but no acknowledgement is sent back to the caller.
+
+    :return: ``None`` or, when the connection with ``target`` is applying
+        backpressure, an :class:`~asyncio.Future` called back once it can
+        accept more messages.
+
+    Typical usage in a coroutine sending many messages::
+
+        for sample in samples:
+            waiter = post(p, 'run', collect, sample)
+            if waiter:
+                await waiter
+    '''
+    actor = get_actor()
+    if not actor:
+        raise RuntimeError('No actor available, cannot send messages')
+    else:
+        return actor.post(target, action, *args, **params)
+
+
 def spawn(**kwargs):
     '''Spawn a new :class:`.Actor` and return an :class:`~asyncio.Future`.
 
@@ -286,23 +311,26 @@ class Actor(EventHandler, Coverage):
         Returns a coroutine or a Future.
         '''
         target = self.monitor if target == 'monitor' else target
-        mailbox = self.mailbox
-        if isinstance(target, ActorProxyMonitor):
-            mailbox = target.mailbox
-        else:
-            actor = self.get_actor(target)
-            if isinstance(actor, Actor):
-                # this occur when sending a message from arbiter to monitors or
-                # vice-versa.
-                return command_in_context(action, self, actor, args, kwargs)
-            elif isinstance(actor, ActorProxyMonitor):
-                mailbox = actor.mailbox
-        if hasattr(mailbox, 'request'):
-            # if not mailbox.closed:
-            return mailbox.request(action, self, target, args, kwargs)
+        mailbox = self._target_mailbox(action, target)
+        if isinstance(mailbox, Actor):
+            return command_in_context(action, self, mailbox, args, kwargs)
+        return mailbox.request(action, self, target, args, kwargs)
+
+    def post(self, target, action, *args, **kwargs):
+        '''Send a message to ``target`` to perform ``action`` without
+        waiting for a response.
+
+        Returns ``None`` or an :class:`~asyncio.Future` to wait for when
+        the connection with ``target`` has paused writing, see :func:`post`.
+        '''
+        target = self.monitor if target == 'monitor' else target
+        mailbox = self._target_mailbox(action, target)
+        if isinstance(mailbox, Actor):
+            ensure_future(command_in_context(action, self, mailbox, args,
+                                             kwargs),
+                          loop=self._loop)
         else:
-            raise CommandError('Cannot execute "%s" in %s. Unknown actor %s.'
-                               % (action, self, target))
+            return mailbox.post(action, self, target, args, kwargs)
 
     def spawn(self, **params):
         '''Spawn a new actor
@@ -414,6 +442,9 @@ class Actor(EventHandler, Coverage):
                  'process_id': self.pid,
                  'is_process': isp,
                  'age': self.impl.age}
+        peer_address = getattr(self.mailbox, 'peer_address', None)
+        if peer_address:
+            actor['peer_address'] = peer_address
         data = {'actor': actor,
                 'extra': self.extra}
         if isp:
@@ -440,3 +471,20 @@ class Actor(EventHandler, Coverage):
 
     def _remove_actor(self, actor, log=True):
         return self.__impl._remove_actor(self, actor, log=log)
+
+    def _target_mailbox(self, action, target):
+        # The mailbox sending messages to target, or the target actor when
+        # sending a message from arbiter to monitors or vice-versa
+        mailbox = self.mailbox
+        if isinstance(target, ActorProxyMonitor):
+            mailbox = target.mailbox
+        else:
+            actor = self.get_actor(target)
+            if isinstance(actor, Actor):
+                return actor
+            elif isinstance(actor, ActorProxyMonitor):
+                mailbox = actor.mailbox
+        if hasattr(mailbox, 'request'):
+            return mailbox
+        raise CommandError('Cannot execute "%s" in %s. Unknown actor %s.'
+                           % (action, self, target))
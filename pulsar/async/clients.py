@@ -1,4 +1,5 @@
 import logging
+import socket
 from functools import reduce
 
 from pulsar.utils.internet import is_socket_closed
@@ -261,6 +262,9 @@ class AbstractClient(Producer, ClientMixin):
 
     async def create_connection(self, address, protocol_factory=None, **kw):
         '''Helper method for creating a connection to an ``address``.
+
+        The ``address`` is a ``(host, port)`` tuple, the path of a Unix
+        domain socket or a connected :class:`socket.socket`.
         '''
         protocol_factory = protocol_factory or self.create_protocol
         if isinstance(address, tuple):
@@ -270,6 +274,16 @@ class AbstractClient(Producer, ClientMixin):
             _, protocol = await self._loop.create_connection(
                 protocol_factory, host, port, **kw)
             await protocol.event('connection_made')
+        elif isinstance(address, str):
+            if self.debug:
+                self.logger.debug('Create connection %s', address)
+            _, protocol = await self._loop.create_unix_connection(
+                protocol_factory, address, **kw)
+            await protocol.event('connection_made')
+        elif isinstance(address, socket.socket):
+            _, protocol = await self._loop.create_connection(
+                protocol_factory, sock=address, **kw)
+            await protocol.event('connection_made')
         else:
             raise NotImplementedError('Could not connect to %s' %
                                       str(address))
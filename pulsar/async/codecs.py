@@ -0,0 +1,367 @@
+'''Encoding and decoding of the messages exchanged by actor mailboxes.
+
+The body of a mailbox frame starts with a one byte tag identifying the
+:class:`MailboxCodec` which encoded it. Actors configured with different
+:ref:`mailbox codecs <setting-mailbox_codec>` understand each other and
+a codec falls back to :class:`PickleCodec` for messages it cannot
+encode.
+
+Callbacks, the replies to commands, are encoded with a compact header
+carrying the ``ack`` id, followed by the result encoded with the codec
+of the sender, or nothing when the result is ``None``.
+
+Out-of-band buffers larger than the
+:ref:`mailbox_shared_memory <setting-mailbox_shared_memory>` setting are
+copied into POSIX shared memory segments, files of the ``/dev/shm``
+memory file system, and only the name of the segment travels in the
+frame, see :func:`dumps_shared`. The receiving actor maps the segment
+with :mod:`mmap` without copying it and owns it from then on.
+
+Additional codecs are made available via :func:`register_codec`.
+'''
+import os
+import mmap
+import pickle
+from struct import Struct, unpack as struct_unpack
+
+from pulsar import ImproperlyConfigured
+
+if pickle.HIGHEST_PROTOCOL < 5:     # pragma    nocover
+    try:
+        import pickle5 as pickle
+    except ImportError:
+        pass
+
+try:
+    import msgpack
+except ImportError:     # pragma    nocover
+    msgpack = None
+
+# directory of POSIX shared memory segments, None when not available
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+__all__ = ['MailboxCodec', 'PickleCodec', 'MsgPackCodec', 'register_codec',
+           'get_codec', 'decode_message', 'SharedSegment']
+
+
+CALLBACK = b'c'
+OUT_OF_BAND = b'o'
+SHARED = b's'
+# kind of the buffers of shared frames
+INLINE_BUFFER = b'i'
+SHARED_BUFFER = b's'
+# buffers smaller than this are pickled in-band
+OUT_OF_BAND_SIZE = 4096
+CODECS = {}
+TAGS = {}
+
+count_header = Struct('>I')
+length_header = Struct('>Q')
+ack_header = Struct('>B')
+
+
+def register_codec(codec):
+    '''Register a :class:`MailboxCodec` subclass, available to the
+    ``mailbox_codec`` setting by its :attr:`~MailboxCodec.name`'''
+    tag = codec.tag
+    if (not isinstance(tag, bytes) or len(tag) != 1 or
+            tag in (CALLBACK, OUT_OF_BAND, SHARED)):
+        raise ImproperlyConfigured('Invalid mailbox codec tag %r' % tag)
+    if TAGS.get(tag, codec).name != codec.name:
+        raise ImproperlyConfigured('Mailbox codec tag %r already used' % tag)
+    CODECS[codec.name] = codec
+    TAGS[tag] = codec()
+    return codec
+
+
+def get_codec(name, shared_memory=0):
+    '''The :class:`MailboxCodec` registered as ``name``
+
+    :param shared_memory: optional :attr:`~MailboxCodec.shared_memory`
+        threshold, ignored when shared memory or pickle protocol 5 are
+        not available.
+    '''
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ImproperlyConfigured('Unknown mailbox codec "%s"' % name)
+    elif not codec.available():
+        raise ImproperlyConfigured('Mailbox codec "%s" is not available'
+                                   % name)
+    if (shared_memory and SHARED_MEMORY_DIR is not None and
+            pickle.HIGHEST_PROTOCOL >= 5):
+        return codec(shared_memory)
+    return TAGS[codec.tag]
+
+
+def decode_message(body):
+    '''Decode the ``body`` of a mailbox frame encoded by
+    :meth:`MailboxCodec.encode`'''
+    tag = body[:1]
+    view = memoryview(body)
+    if tag == CALLBACK:
+        n = view[1] + 2
+        ack = bytes(view[2:n]).decode('utf-8')
+        result = decode_message(view[n:]) if len(view) > n else None
+        return {'command': 'callback', 'ack': ack, 'result': result}
+    elif tag == OUT_OF_BAND:
+        return loads_out_of_band(view[1:])
+    elif tag == SHARED:
+        return loads_out_of_band(view[1:], shared=True)
+    codec = TAGS.get(tag)
+    if codec is None:
+        raise ValueError('unknown mailbox codec tag %r' % bytes(tag))
+    return codec.loads(view[1:])
+
+
+def dumps_out_of_band(data, buffers):
+    '''The pickle stream ``data`` followed by its out-of-band ``buffers``,
+    preceded by their number and lengths'''
+    chunks = [OUT_OF_BAND, count_header.pack(len(buffers)),
+              length_header.pack(len(data))]
+    chunks.extend((length_header.pack(len(b)) for b in buffers))
+    chunks.append(data)
+    chunks.extend(buffers)
+    return b''.join(chunks)
+
+
+def dumps_shared(data, buffers, threshold):
+    '''Same as :func:`dumps_out_of_band` but buffers of at least
+    ``threshold`` bytes are copied into new shared memory segments.
+
+    Each buffer is preceded by its kind, the bytes of inline buffers
+    follow while shared buffers are the size and name of their segment.
+    The sender does not unlink the segments, this is done by the
+    :class:`SharedSegment` of the receiver.
+    '''
+    entries = []
+    for buffer in buffers:
+        if buffer.nbytes >= threshold:
+            try:
+                name = share_buffer(buffer)
+            except OSError:
+                pass
+            else:
+                entries.append((SHARED_BUFFER,
+                                length_header.pack(buffer.nbytes) +
+                                name.encode('utf-8')))
+                continue
+        entries.append((INLINE_BUFFER, buffer))
+    chunks = [SHARED, count_header.pack(len(entries)),
+              length_header.pack(len(data))]
+    chunks.extend((length_header.pack(1 + len(e[1])) for e in entries))
+    chunks.append(data)
+    for entry in entries:
+        chunks.extend(entry)
+    return b''.join(chunks)
+
+
+def share_buffer(buffer):
+    '''Copy ``buffer`` into a new shared memory segment and return the
+    segment name'''
+    name = 'pulsar_%s' % os.urandom(8).hex()
+    path = os.path.join(SHARED_MEMORY_DIR, name)
+    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    try:
+        with open(fd, 'wb', closefd=False) as file:
+            file.write(buffer)
+    except Exception:
+        os.unlink(path)
+        raise
+    finally:
+        os.close(fd)
+    return name
+
+
+def loads_out_of_band(view, shared=False):
+    '''Unpickle the bytes of :func:`dumps_out_of_band`, or of
+    :func:`dumps_shared` when ``shared`` is ``True``, from a
+    ``memoryview``, buffers are views of it or of shared memory segments'''
+    n = count_header.unpack_from(view)[0] + 1
+    lengths = struct_unpack('>%dQ' % n, view[count_header.size:
+                                             count_header.size + 8*n])
+    offset = count_header.size + 8*n
+    chunks = []
+    for length in lengths:
+        chunks.append(view[offset:offset + length])
+        offset += length
+    buffers = chunks[1:]
+    if shared:
+        buffers = [shared_buffer(chunk) for chunk in buffers]
+    return pickle.loads(chunks[0], buffers=buffers)
+
+
+def shared_buffer(chunk):
+    '''The buffer of a :func:`dumps_shared` ``chunk``'''
+    kind = chunk[:1]
+    if kind == INLINE_BUFFER:
+        return chunk[1:]
+    elif kind == SHARED_BUFFER:
+        size = length_header.unpack_from(chunk, 1)[0]
+        name = bytes(chunk[1 + length_header.size:]).decode('utf-8')
+        segment = SharedSegment(name)
+        return segment.buf[:size]
+    raise ValueError('unknown shared buffer kind %r' % bytes(kind))
+
+
+class SharedSegment:
+    '''A shared memory segment received by an actor.
+
+    The segment is unlinked as soon as it is mapped, so that it is
+    released even if the actor dies. Closing it does not unmap it, the
+    memory stays mapped until the objects viewing :attr:`buf` are garbage
+    collected.
+    '''
+    def __init__(self, name):
+        if os.path.basename(name) != name:
+            raise ValueError('invalid shared memory segment %r' % name)
+        path = os.path.join(SHARED_MEMORY_DIR, name)
+        fd = os.open(path, os.O_RDWR)
+        try:
+            os.unlink(path)
+            self.size = os.fstat(fd).st_size
+            # the mapping does not need the file descriptor
+            self._mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.release()
+            self.buf = None
+        self._mmap = None
+
+
+class MailboxCodec:
+    '''Base class for the codecs of actor mailbox messages.
+
+    Messages are dictionaries of commands, arguments and results, subclasses
+    implement :meth:`dumps` and :meth:`loads`.
+    '''
+    name = None
+    '''Name of the codec, the value of the ``mailbox_codec`` setting'''
+    tag = None
+    '''One byte identifying the codec in a mailbox frame'''
+    errors = (TypeError, ValueError, OverflowError)
+    '''Exceptions raised by :meth:`dumps` for objects which the codec
+    cannot encode, these messages are pickled'''
+    shared_memory = 0
+    '''Out-of-band buffers of at least this number of bytes are passed in
+    shared memory segments, ``0`` disables shared memory'''
+
+    def __init__(self, shared_memory=0):
+        self.shared_memory = shared_memory
+
+    @classmethod
+    def available(cls):
+        '''Whether the codec can be used'''
+        return True
+
+    def encode(self, data):
+        '''Encode the message ``data`` into the body of a mailbox frame'''
+        if data.get('command') == 'callback':
+            ack = data['ack'].encode('utf-8')
+            if len(ack) < 256:
+                result = data.get('result')
+                return b''.join((CALLBACK, ack_header.pack(len(ack)), ack,
+                                 b'' if result is None else
+                                 self._encode(result)))
+        return self._encode(data)
+
+    def dumps(self, data):
+        '''Serialize ``data`` into bytes'''
+        raise NotImplementedError
+
+    def loads(self, view):
+        '''Deserialize the ``memoryview`` of bytes returned by
+        :meth:`dumps`'''
+        raise NotImplementedError
+
+    def _encode(self, obj):
+        try:
+            return self.tag + self.dumps(obj)
+        except self.errors:
+            if self.shared_memory:
+                return PickleCodec(self.shared_memory)._encode(obj)
+            return TAGS[PickleCodec.tag]._encode(obj)
+
+
+class PickleCodec(MailboxCodec):
+    '''Pickle messages with the highest protocol available.
+
+    With pickle protocol 5, available from python 3.8 or with the
+    pickle5_ backport installed, large buffers pickled as
+    :class:`pickle.PickleBuffer`, such as numpy arrays, are stored
+    out-of-band after the pickle stream rather than copied into it, and
+    they are unpickled from views of the frame body, see
+    :func:`dumps_out_of_band`, or of shared memory segments when larger
+    than :attr:`~MailboxCodec.shared_memory`, see :func:`dumps_shared`.
+    Messages with out-of-band buffers can only be decoded by actors
+    supporting protocol 5.
+
+    .. _pickle5: https://pypi.org/project/pickle5/
+    '''
+    name = 'pickle'
+    tag = b'p'
+    errors = ()
+
+    def dumps(self, data):
+        return pickle.dumps(data, -1)
+
+    def loads(self, view):
+        return pickle.loads(view)
+
+    def _encode(self, obj):
+        if pickle.HIGHEST_PROTOCOL < 5:     # pragma    nocover
+            return self.tag + pickle.dumps(obj, -1)
+        buffers = []
+        data = pickle.dumps(obj, -1,
+                            buffer_callback=self._out_of_band(buffers))
+        if buffers:
+            if self.shared_memory:
+                return dumps_shared(data, buffers, self.shared_memory)
+            return dumps_out_of_band(data, buffers)
+        return self.tag + data
+
+    def _out_of_band(self, buffers):
+        # The buffer callback of the pickler, a false value keeps the
+        # buffer out of the pickle stream
+        def callback(buffer):
+            try:
+                view = buffer.raw()
+            except BufferError:
+                return True
+            if view.nbytes < OUT_OF_BAND_SIZE:
+                return True
+            buffers.append(view)
+
+        return callback
+
+
+class MsgPackCodec(MailboxCodec):
+    '''Encode messages with msgpack_.
+
+    Faster and more compact than pickle for messages of python builtin
+    types, tuples are decoded as lists. Messages carrying other objects
+    are pickled.
+
+    .. _msgpack: https://msgpack.org/
+    '''
+    name = 'msgpack'
+    tag = b'm'
+
+    @classmethod
+    def available(cls):
+        return msgpack is not None
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, view):
+        return msgpack.unpackb(view, raw=False)
+
+
+register_codec(PickleCodec)
+register_codec(MsgPackCodec)
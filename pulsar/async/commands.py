@@ -78,6 +78,21 @@ def notify(request, info):
     return t
 
 
+@command()
+def peer_address(request, aid):
+    '''Address of the peer mailbox of actor ``aid``.
+
+    Executed by the arbiter, it returns ``None`` when messages to the actor
+    are routed through the arbiter and ``False`` when the actor has not
+    notified the arbiter yet.
+    '''
+    proxy = request.actor.get_actor(aid)
+    if isinstance(proxy, ActorProxyMonitor):
+        if not proxy.info:
+            return False
+        return proxy.info.get('actor', {}).get('peer_address')
+
+
 @command()
 def spawn(request, **kwargs):
     '''Spawn a new actor.'''
@@ -1,8 +1,10 @@
 import os
 import sys
+import socket
 import itertools
 import asyncio
 import pickle
+import multiprocessing
 from time import time
 from collections import OrderedDict
 from multiprocessing import Process, current_process
@@ -17,7 +19,8 @@ from pulsar.utils import autoreload
 from .proxy import ActorProxyMonitor, get_proxy, actor_proxy_future
 from .access import get_actor, set_actor, logger, EventLoopPolicy
 from .threads import Thread
-from .mailbox import MailboxClient, MailboxProtocol, ProxyMailbox, create_aid
+from .mailbox import (MailboxClient, MailboxProtocol, ProxyMailbox, create_aid,
+                      mailbox_address, unix_mailbox)
 from .futures import ensure_future, add_errback, chain_future, create_future
 from .protocols import TcpServer
 from .actor import Actor
@@ -65,6 +68,7 @@ class Concurrency:
     monitors = None
     managed_actors = None
     registered = None
+    mailbox_socket = None
     actor_class = Actor
 
     @classmethod
@@ -172,9 +176,16 @@ class Concurrency:
         return ActorProxyMonitor(self)
 
     def create_mailbox(self, actor, loop):
-        '''Create the mailbox for ``actor``.'''
-        client = MailboxClient(actor.monitor.address, actor, loop)
-        loop.call_soon_threadsafe(self.hand_shake, actor)
+        '''Create the mailbox for ``actor``.
+
+        The hand shake is performed once the peer mailbox is serving, so
+        that its address is sent to the monitor with the first
+        notification.
+        '''
+        client = MailboxClient(actor.monitor.address, actor, loop,
+                               sock=self.mailbox_socket)
+        serving = ensure_future(client.start_serving(), loop=loop)
+        serving.add_done_callback(lambda _: self.hand_shake(actor))
         return client
 
     def periodic_task(self, actor, **kw):
@@ -564,7 +575,7 @@ class ArbiterConcurrency(MonitorMixin, ProcessMixin, Concurrency):
         '''Override :meth:`.Concurrency.create_mailbox` to create the
         mailbox server.
         '''
-        mailbox = TcpServer(MailboxProtocol, loop, ('127.0.0.1', 0),
+        mailbox = TcpServer(MailboxProtocol, loop, mailbox_address(self.cfg),
                             name='mailbox')
         # when the mailbox stop, close the event loop too
         mailbox.bind_event('stop', lambda _, **kw: loop.stop())
@@ -744,7 +755,28 @@ class ActorThread(Concurrency, Thread):
 class ActorMultiProcess(ProcessMixin, Concurrency, Process):
     '''Actor on a Operative system process.
     Created using the python multiprocessing module.
+
+    When processes are forked and mailboxes use Unix domain sockets, the
+    actor is connected to the arbiter mailbox via a ``socketpair`` created
+    before forking.
     '''
+    _socketpair = None
+
+    def start(self):
+        if (unix_mailbox(self.cfg) and hasattr(socket, 'socketpair') and
+                multiprocessing.get_start_method() == 'fork'):
+            self._socketpair = socket.socketpair()
+            self.mailbox_socket = self._socketpair[1]
+        try:
+            super().start()
+        finally:
+            if self._socketpair:
+                parent, child = self._socketpair
+                self._socketpair = None
+                self.mailbox_socket = None
+                child.close()
+                self._accept_mailbox(parent)
+
     def run(self):  # pragma    nocover
         # The coverage for this process has not yet started
         try:
@@ -752,8 +784,22 @@ class ActorMultiProcess(ProcessMixin, Concurrency, Process):
             _set_running_loop(None)
         except ImportError:
             pass
+        if self._socketpair:
+            self._socketpair[0].close()
+            self._socketpair = None
         run_actor(self)
 
+    def _accept_mailbox(self, sock):
+        # Serve the arbiter end of the socketpair by the arbiter mailbox
+        mailbox = get_actor().mailbox
+        loop = mailbox._loop
+        if not self.is_alive():
+            sock.close()
+            return
+        accept = loop.connect_accepted_socket(mailbox.create_protocol, sock)
+        add_errback(ensure_future(accept, loop=loop),
+                    lambda exc: sock.close())
+
     def kill(self, sig):
         system.kill(self.pid, sig)
 
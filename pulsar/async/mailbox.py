@@ -19,14 +19,37 @@ The implementation details are outlined below:
 
 * The :class:`.Arbiter` :attr:`~pulsar.Actor.mailbox` is a :class:`.TcpServer`
   accepting connections from remote actors.
+* On POSIX systems, unless the
+  :ref:`mailbox_transport <setting-mailbox_transport>` setting is ``tcp``,
+  mailbox servers listen on Unix domain sockets rather than loopback TCP
+  sockets and process actors forked by the arbiter are connected to its
+  mailbox via a ``socketpair``.
 * The :attr:`.Actor.mailbox` is a :class:`.MailboxClient` of the arbiter
   mailbox server.
-* When an actor sends a message to another actor, the arbiter mailbox behaves
-  as a proxy server by routing the message to the targeted actor.
 * Communication is bidirectional and there is **only one connection** between
   the arbiter and any given actor.
+* Actors serve a peer mailbox, a :class:`.TcpServer` whose address is sent
+  to the arbiter with the :ref:`notify command <actor_info_command>`.
+  When an actor sends a message to another actor, it asks the arbiter for
+  the address of the peer mailbox of the target and sends the message,
+  and all the following ones, via a direct connection.
+* If the target has no peer mailbox, or the
+  :ref:`mailbox_routed <setting-mailbox_routed>` setting is on, the arbiter
+  mailbox behaves as a proxy server by routing the message to the targeted
+  actor.
 * Messages are encoded and decoded using the unmasked websocket protocol
-  implemented in :func:`.frame_parser`.
+  implemented in :func:`.frame_parser`, the body of frames is encoded by
+  the :ref:`mailbox codec <setting-mailbox_codec>` of the sender, as
+  described in :mod:`pulsar.async.codecs`. Large out-of-band buffers are
+  passed in shared memory segments rather than written on the connection.
+* Messages sent via the :func:`.post` function are not acknowledged by the
+  target. When the :ref:`mailbox_batch <setting-mailbox_batch>` setting is
+  on, messages written on a connection during the same event loop
+  iteration travel in one frame.
+* Connections pause writing when their write buffer goes over the
+  :ref:`mailbox_high_water <setting-mailbox_high_water>` mark, :func:`.post`
+  then returns a future called back once it drains below the
+  :ref:`mailbox_low_water <setting-mailbox_low_water>` mark.
 * If, for some reasons, the connection between an actor and the arbiter
   get broken, the actor will eventually stop running and garbaged collected.
 
@@ -50,8 +73,9 @@ Client
   :member-order: bysource
 
 '''
+import os
 import socket
-import pickle
+import tempfile
 from collections import namedtuple
 
 from pulsar import ProtocolError, CommandError
@@ -62,8 +86,9 @@ from pulsar.utils.string import gen_unique_id
 from .access import get_actor, isawaitable, create_future, ensure_future
 from .futures import task
 from .proxy import actor_identity, get_proxy, get_command, ActorProxy
-from .protocols import Protocol
+from .protocols import Protocol, TcpServer
 from .clients import AbstractClient
+from .codecs import get_codec, decode_message
 
 
 CommandRequest = namedtuple('CommandRequest', 'actor caller connection')
@@ -73,6 +98,24 @@ def create_aid():
     return gen_unique_id()[:8]
 
 
+def unix_mailbox(cfg):
+    '''``True`` if mailboxes use Unix domain sockets'''
+    transport = cfg.mailbox_transport
+    if transport == 'auto':
+        return os.name == 'posix' and hasattr(socket, 'AF_UNIX')
+    return transport == 'unix'
+
+
+def mailbox_address(cfg):
+    '''Address of a new mailbox server for the ``mailbox_transport`` of
+    ``cfg``.
+    '''
+    if unix_mailbox(cfg):
+        name = 'pulsar-%s-%s.sock' % (os.getpid(), create_aid())
+        return os.path.join(tempfile.gettempdir(), name)
+    return ('127.0.0.1', 0)
+
+
 async def command_in_context(command, caller, target, args, kwargs,
                              connection=None):
     cmnd = get_command(command)
@@ -124,18 +167,22 @@ class Message:
     __str__ = __repr__
 
     @classmethod
-    def command(cls, command, sender, target, args, kwargs):
+    def command(cls, command, sender, target, args, kwargs, ack=True):
+        '''A message for ``command``, when ``ack`` is ``False`` the message
+        has no :attr:`waiter` and no response is sent back'''
         command = get_command(command)
         data = {'command': command.__name__,
                 'sender': actor_identity(sender),
                 'target': actor_identity(target),
                 'args': args if args is not None else (),
                 'kwargs': kwargs if kwargs is not None else {}}
-        waiter = create_future()
-        if command.ack:
-            data['ack'] = create_aid()
-        else:
-            waiter.set_result(None)
+        waiter = None
+        if ack:
+            waiter = create_future()
+            if command.ack:
+                data['ack'] = create_aid()
+            else:
+                waiter.set_result(None)
         return cls(data, waiter)
 
     @classmethod
@@ -147,13 +194,23 @@ class Message:
 class MailboxProtocol(Protocol):
     '''The :class:`.Protocol` for internal message passing between actors.
 
-    Encoding and decoding uses the unmasked websocket protocol.
+    Encoding and decoding uses the unmasked websocket protocol, frame
+    bodies are encoded by the :class:`.MailboxCodec` of the actor
+    ``mailbox_codec`` setting.
+
+    Unlike other protocols, reading is not paused when writing is, so that
+    responses keep flowing while the write buffer drains.
     '''
     def __init__(self, **kw):
+        actor = get_actor()
+        kw.setdefault('low_limit', actor.cfg.mailbox_low_water)
+        kw.setdefault('high_limit', actor.cfg.mailbox_high_water)
         super().__init__(**kw)
         self._pending_responses = {}
-        self._parser = frame_parser(kind=2, pyparser=True)
-        actor = get_actor()
+        self._parser = frame_parser(kind=2)
+        self._codec = get_codec(actor.cfg.mailbox_codec,
+                                actor.cfg.mailbox_shared_memory)
+        self._batch = [] if actor.cfg.mailbox_batch else None
         if actor.is_arbiter():
             self.bind_event('connection_lost', self._connection_lost)
 
@@ -163,15 +220,52 @@ class MailboxProtocol(Protocol):
         self._start(req)
         return req.waiter
 
+    def post(self, command, sender, target, args, kwargs):
+        '''Send a message without acknowledgement.
+
+        Return ``None`` or, when writing is paused, a
+        :class:`~asyncio.Future` called back once the write buffer has
+        drained.
+        '''
+        self._start(Message.command(command, sender, target, args, kwargs,
+                                    ack=False))
+        return self.drain()
+
+    def drain(self):
+        '''``None`` or, when writing is paused, a :class:`~asyncio.Future`
+        called back once the write buffer has drained'''
+        if self._paused:
+            if self._write_waiter is None:
+                self._write_waiter = create_future(self._loop)
+            return self._write_waiter
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self, exc=None):
+        self._paused = False
+        waiter, self._write_waiter = self._write_waiter, None
+        if waiter is not None and not waiter.done():
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+        if self._batch:
+            self._loop.call_soon(self._flush)
+
     def data_received(self, data):
         # Feed data into the parser
         msg = self._parser.decode(data)
         while msg:
             try:
-                message = pickle.loads(msg.body)
+                message = decode_message(msg.body)
             except Exception as e:
                 raise ProtocolError('Could not decode message body: %s' % e)
-            ensure_future(self._on_message(message), loop=self._loop)
+            if message.get('command') == 'batch':
+                for message in message['messages']:
+                    ensure_future(self._on_message(message), loop=self._loop)
+            else:
+                ensure_future(self._on_message(message), loop=self._loop)
             msg = self._parser.decode()
 
     ########################################################################
@@ -219,9 +313,17 @@ class MailboxProtocol(Protocol):
                         raise CommandError(
                             "'%s' got message from unknown '%s'"
                             % (actor, message['sender']))
-                    result = await actor.send(target, command,
-                                              *message['args'],
-                                              **message['kwargs'])
+                    if ack:
+                        result = await actor.send(target, command,
+                                                  *message['args'],
+                                                  **message['kwargs'])
+                    else:
+                        waiter = actor.post(target, command,
+                                            *message['args'],
+                                            **message['kwargs'])
+                        if waiter:
+                            await waiter
+                        return
                 else:
                     result = await command_in_context(command, caller, target,
                                                       message['args'],
@@ -237,8 +339,23 @@ class MailboxProtocol(Protocol):
                 self._start(Message.callback(result, ack))
 
     def _write(self, req):
-        obj = pickle.dumps(req.data, protocol=2)
-        data = self._parser.encode(obj, opcode=2)
+        if self._batch is None:
+            self._write_data(req.data)
+        else:
+            self._batch.append(req.data)
+            if len(self._batch) == 1 and not self._paused:
+                self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        # Write the messages queued in the batch in one frame
+        batch, self._batch = self._batch, []
+        if len(batch) == 1:
+            self._write_data(batch[0])
+        elif batch:
+            self._write_data({'command': 'batch', 'messages': batch})
+
+    def _write_data(self, message):
+        data = self._parser.encode(self._codec.encode(message), opcode=2)
         try:
             self._transport.write(data)
         except (socket.error, RuntimeError):
@@ -249,18 +366,52 @@ class MailboxProtocol(Protocol):
 
 
 class MailboxClient(AbstractClient):
-    '''Used by actors to send messages to other actors via the arbiter.
+    '''Used by actors to send messages to other actors.
+
+    Messages to the arbiter and monitors travel on the connection with the
+    arbiter mailbox server.
+    Unless the ``mailbox_routed`` setting is on, the client serves the
+    peer mailbox of the actor and messages to other actors travel on direct
+    connections with their peer mailbox.
+
+    When ``sock`` is given, it is a socket connected with the arbiter
+    mailbox and it is used in place of ``address``.
+
+    .. attribute:: server
+
+        The :class:`.TcpServer` of the peer mailbox or ``None``.
+
+    .. attribute:: peers
+
+        Dictionary of :class:`~asyncio.Future` called back with the direct
+        connection with an actor, or ``None`` when messages to the actor are
+        routed through the arbiter.
     '''
     protocol_factory = MailboxProtocol
 
-    def __init__(self, address, actor, loop):
+    def __init__(self, address, actor, loop, sock=None):
         super().__init__(loop)
         self.address = address
+        self.sock = sock
         self.name = 'Mailbox for %s' % actor
+        self.server = None
+        self.peers = {}
         self._connection = None
+        self._posting = 0
+        if not actor.cfg.mailbox_routed:
+            self.server = TcpServer(MailboxProtocol, loop,
+                                    mailbox_address(actor.cfg),
+                                    name='peer mailbox')
+
+    @property
+    def peer_address(self):
+        '''Address of the peer mailbox or ``None``'''
+        if self.server:
+            return self.server.address
 
     def connect(self):
-        return self.create_connection(self.address)
+        sock, self.sock = self.sock, None
+        return self.create_connection(sock or self.address)
 
     def __repr__(self):
         return '%s %s' % (self.name, nice_address(self.address))
@@ -268,22 +419,127 @@ class MailboxClient(AbstractClient):
     @task
     async def request(self, command, sender, target, args, kwargs):
         # the request method
-        if self._connection is None:
-            self._connection = await self.connect()
-            self._connection.bind_event('connection_lost', self._lost)
+        connection = await self._get_connection(sender, target)
         req = Message.command(command, sender, target, args, kwargs)
-        self._connection._start(req)
+        connection._start(req)
         response = await req.waiter
         return response
 
+    def post(self, command, sender, target, args, kwargs):
+        '''Send a message without acknowledgement, see
+        :meth:`.MailboxProtocol.post`.
+
+        The message is written straight away when the connection with
+        ``target`` is available, otherwise it is written by a task
+        which is returned.
+        '''
+        connection = None
+        if not self._posting:
+            connection = self._connection
+            if connection is not None and self.server:
+                peer = self.peers.get(actor_identity(target))
+                if peer is None or not peer.done():
+                    connection = None
+                elif not peer.cancelled() and peer.result():
+                    connection = peer.result()
+        if connection is None:
+            return ensure_future(self._post(command, sender, target, args,
+                                            kwargs),
+                                 loop=self._loop)
+        return connection.post(command, sender, target, args, kwargs)
+
     def close(self):
         if self._connection:
             self._connection.close()
-
-    def start_serving(self):    # pragma    nocover
-        pass
+        for peer in self.peers.values():
+            if not peer.done():
+                peer.cancel()
+            elif not peer.cancelled() and peer.result():
+                peer.result().close()
+        self.peers.clear()
+        if self.server and self._loop.is_running():
+            ensure_future(self.server.close(), loop=self._loop)
+
+    async def start_serving(self):
+        '''Start serving the peer mailbox'''
+        if self.server:
+            try:
+                await self.server.start_serving()
+            except Exception:
+                self.logger.exception('Could not serve the peer mailbox, '
+                                      'messages are routed via the arbiter')
+                self.server = None
+
+    async def _get_connection(self, sender, target):
+        # The connection used to send messages to target
+        if self._connection is None:
+            self._connection = await self.connect()
+            self._connection.bind_event('connection_lost', self._lost)
+        connection = self._connection
+        if self.server:
+            connection = await self._peer(sender, target) or connection
+        return connection
+
+    async def _post(self, command, sender, target, args, kwargs):
+        # Keep messages in order while the connection is not available
+        self._posting += 1
+        try:
+            connection = await self._get_connection(sender, target)
+            waiter = connection.post(command, sender, target, args, kwargs)
+        finally:
+            self._posting -= 1
+        if waiter:
+            await waiter
 
     def _lost(self, _, exc=None):
         # When the connection is lost, stop the event loop
         if self._loop.is_running():
             self._loop.stop()
+
+    def _peer(self, sender, target):
+        # A future called back with the direct connection with target
+        aid = actor_identity(target)
+        peer = self.peers.get(aid)
+        if peer is None:
+            peer = ensure_future(self._connect_peer(sender, aid),
+                                 loop=self._loop)
+            self.peers[aid] = peer
+        return peer
+
+    async def _connect_peer(self, sender, aid):
+        if aid in ('arbiter', 'monitor', actor_identity(sender.monitor)):
+            return
+        req = Message.command('peer_address', sender, 'arbiter', (aid,), None)
+        self._connection._start(req)
+        try:
+            address = await req.waiter
+            if address:
+                if isinstance(address, list):
+                    address = tuple(address)
+                connection = await self.create_connection(address)
+                connection.bind_event('connection_lost',
+                                      self._peer_lost(aid, connection))
+                return connection
+        except Exception as exc:
+            self.logger.warning('Could not connect with the peer mailbox of '
+                                '%s: %s', aid, exc)
+            address = False
+        if address is False:
+            # try again with the next message
+            self.peers.pop(aid, None)
+
+    def _peer_lost(self, aid, connection):
+
+        def _(_, exc=None):
+            peer = self.peers.get(aid)
+            if (peer and peer.done() and not peer.cancelled() and
+                    peer.result() is connection):
+                self.peers.pop(aid)
+            responses = connection._pending_responses
+            for waiter in responses.values():
+                if not waiter.done():
+                    waiter.set_exception(
+                        CommandError('Lost connection with %s' % aid))
+            responses.clear()
+
+        return _
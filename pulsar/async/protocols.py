@@ -1,3 +1,4 @@
+import os
 import asyncio
 
 from pulsar.utils.internet import nice_address, format_address
@@ -605,6 +606,9 @@ class Producer(EventHandler):
 class TcpServer(Producer):
     """A :class:`.Producer` of server :class:`Connection` for TCP servers.
 
+    When ``address`` is a string, the server listens on a Unix domain
+    socket at that path, which is removed when the server is closed.
+
     .. attribute:: _server
 
         A :class:`.Server` managed by this Tcp wrapper.
@@ -616,6 +620,7 @@ class TcpServer(Producer):
                          'connection_lost')
     _server = None
     _started = None
+    _unix_path = None
 
     def __init__(self, protocol_factory, loop, address=None,
                  name=None, sockets=None, max_requests=None,
@@ -684,6 +689,11 @@ class TcpServer(Producer):
                                                  port=address[1],
                                                  backlog=backlog,
                                                  ssl=sslcontext)
+                elif isinstance(address, str):
+                    server = await self._loop.create_unix_server(
+                        self.create_protocol, path=address, backlog=backlog,
+                        ssl=sslcontext)
+                    self._unix_path = address
                 else:
                     raise NotImplementedError
             self._server = server
@@ -700,6 +710,12 @@ class TcpServer(Producer):
         if self._server:
             self._server.close()
             self._server = None
+            if self._unix_path:
+                try:
+                    os.unlink(self._unix_path)
+                except OSError:
+                    pass
+                self._unix_path = None
             coro = self._close_connections()
             if coro:
                 await coro
@@ -1000,6 +1000,114 @@ class StreamBuffer(Global):
     """
 
 
+class MailboxCodec(Global):
+    name = "mailbox_codec"
+    flags = ["--mailbox-codec"]
+    validator = validate_string
+    default = "pickle"
+    desc = """\
+        Codec of the messages exchanged by actors.
+
+        ``pickle`` uses the highest pickle protocol available, ``msgpack``
+        requires the msgpack package and pickles the messages it cannot
+        encode. Additional codecs are registered via
+        :func:`pulsar.async.codecs.register_codec`.
+        """
+
+
+class MailboxRouted(Global):
+    name = "mailbox_routed"
+    flags = ["--mailbox-routed"]
+    validator = validate_bool
+    action = "store_true"
+    default = False
+    desc = """\
+        Route all messages between actors through the arbiter.
+
+        By default actors serve a peer mailbox and send messages to other
+        actors via direct connections, the arbiter is only asked for the
+        address of the peer mailbox.
+        """
+
+
+class MailboxTransport(Global):
+    name = "mailbox_transport"
+    flags = ["--mailbox-transport"]
+    choices = ('auto', 'tcp', 'unix')
+    validator = validate_string
+    default = "auto"
+    desc = """\
+        Transport of the mailboxes used by actors to exchange messages.
+
+        ``unix`` serves mailboxes on Unix domain sockets and connects
+        actors forked by the arbiter with a ``socketpair``, ``tcp`` uses
+        loopback TCP sockets. ``auto`` selects ``unix`` on POSIX systems
+        and ``tcp`` elsewhere.
+        """
+
+
+class MailboxBatch(Global):
+    name = "mailbox_batch"
+    flags = ["--mailbox-batch"]
+    validator = validate_bool
+    action = "store_true"
+    default = False
+    desc = """\
+        Coalesce the messages written by a mailbox connection during the
+        same event loop iteration into one frame.
+
+        It reduces the number of frames and writes when actors send many
+        small messages, for example via :func:`.post`, at the cost of
+        delaying each message by one loop iteration.
+        """
+
+
+class MailboxHighWater(Global):
+    name = "mailbox_high_water"
+    flags = ["--mailbox-high-water"]
+    validator = validate_pos_int
+    type = int
+    default = 2 ** 20
+    desc = """\
+        Size in bytes of the write buffer of a mailbox connection above
+        which the connection pauses writing.
+
+        While paused, :func:`.post` returns a future which senders can wait
+        for before sending more messages.
+        """
+
+
+class MailboxLowWater(Global):
+    name = "mailbox_low_water"
+    flags = ["--mailbox-low-water"]
+    validator = validate_pos_int
+    type = int
+    default = 2 ** 18
+    desc = """\
+        Size in bytes of the write buffer of a paused mailbox connection
+        below which the connection resumes writing.
+        """
+
+
+class MailboxSharedMemory(Global):
+    name = "mailbox_shared_memory"
+    flags = ["--mailbox-shared-memory"]
+    validator = validate_pos_int
+    type = int
+    default = 2 ** 20
+    desc = """\
+        Size in bytes above which out-of-band buffers of mailbox messages
+        are passed in shared memory segments.
+
+        Buffers pickled out-of-band, such as numpy arrays or
+        :class:`pickle.PickleBuffer`, are copied into a POSIX shared
+        memory segment in ``/dev/shm`` and the receiving actor maps it
+        without copying it. Set to 0 to send all buffers via the
+        mailbox connection. Requires pickle protocol 5, from python 3.8
+        or the ``pickle5`` package, and a ``/dev/shm`` directory.
+        """
+
+
 ############################################################################
 #    Worker Processes
 section_docs['Worker Processes'] = """
@@ -38,6 +38,15 @@ Skiplist
    :member-order: bysource
 
 
+.. module:: pulsar.utils.structures.blocklist
+
+BlockList
+~~~~~~~~~~~~~~~
+.. autoclass:: BlockList
+   :members:
+   :member-order: bysource
+
+
 .. module:: pulsar.utils.structures.zset
 
 Zset
@@ -45,11 +54,56 @@ Zset
 .. autoclass:: Zset
    :members:
    :member-order: bysource
+
+
+.. module:: pulsar.utils.structures.compact
+
+Hash
+~~~~~~~~~~~~~~~
+.. autoclass:: Hash
+   :members:
+   :member-order: bysource
+
+
+Set
+~~~~~~~~~~~~~~~
+.. autoclass:: Set
+   :members:
+   :member-order: bysource
+
+
+.. module:: pulsar.utils.structures.stream
+
+Stream
+~~~~~~~~~~~~~~~
+.. autoclass:: Stream
+   :members:
+   :member-order: bysource
+
+
+StreamGroup
+~~~~~~~~~~~~~~~
+.. autoclass:: StreamGroup
+   :members:
+   :member-order: bysource
+
+
+.. module:: pulsar.utils.structures.expiry
+
+ExpiryHeap
+~~~~~~~~~~~~~~~
+.. autoclass:: ExpiryHeap
+   :members:
+   :member-order: bysource
 '''
 from collections import *       # noqa
 
 from .skiplist import Skiplist  # noqa
+from .blocklist import BlockList  # noqa
 from .zset import Zset          # noqa
+from .compact import Hash, Set  # noqa
+from .stream import Stream, StreamGroup  # noqa
+from .expiry import ExpiryHeap  # noqa
 from .misc import (MultiValueDict, AttributeDictionary, FrozenDict,  # noqa
                    Dict, Deque, merge_prefix, recursive_update,  # noqa
                    mapping_iterator, inverse_mapping, aslist)    # noqa
@@ -0,0 +1,347 @@
+'''Sorted collection of ``score``, ``value`` pairs stored in blocks.
+
+Each block holds the scores of its pairs in an ``array`` of doubles and
+their values in a parallel list, both sorted by score and then by value.
+Lookups bisect the last pair of each block to find the block and then the
+block itself, insertions and removals shift at most one block. A pair uses
+sixteen bytes besides its value, rather than the node and the per level
+lists of a skiplist.
+
+Ranks are resolved with a Fenwick tree over the block sizes, updated in
+O(log blocks) when a pair is added to or removed from a block and rebuilt
+only when blocks are split, merged or removed.
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+# Blocks are split when they hold twice this number of pairs and merged
+# with the next one when they hold less than half of it
+BLOCK_SIZE = 512
+
+
+class BlockList:
+    '''Sorted collection supporting O(log n) lookup and insertion
+    and removal in O(log n + block size).'''
+    __slots__ = ('_scores', '_values', '_maxes', '_offsets', '_size')
+    encoding = 'blocklist'
+
+    def __init__(self, data=None):
+        self.clear()
+        if data is not None:
+            self.extend(data)
+
+    def __repr__(self):
+        return list(self).__repr__()
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        'Iterate over ``score``, ``value`` pairs in sorted order'
+        for scores, values in zip(self._scores, self._values):
+            yield from zip(scores, values)
+
+    def clear(self):
+        '''Clear the container from all data.'''
+        self._scores = []
+        self._values = []
+        # the largest score of each block
+        self._maxes = []
+        # Fenwick tree of block sizes, None when it must be rebuilt
+        self._offsets = None
+        self._size = 0
+
+    def extend(self, iterable):
+        '''Extend this blocklist with an iterable over
+        ``score``, ``value`` pairs.
+        '''
+        i = self.insert
+        for score_values in iterable:
+            i(*score_values)
+    update = extend
+
+    def insert(self, score, value):
+        '''Insert a ``score``, ``value`` pair, which must not be in the
+        container already.'''
+        if score != score:
+            raise ValueError('Cannot insert score {0}'.format(score))
+        self._size += 1
+        if not self._scores:
+            self._scores.append(array('d', (score,)))
+            self._values.append([value])
+            self._maxes.append(score)
+            self._offsets = None
+            return
+        b = self._block(score, value)
+        if b == len(self._scores):
+            b -= 1
+        scores = self._scores[b]
+        values = self._values[b]
+        i = self._position(scores, values, score, value)
+        scores.insert(i, score)
+        values.insert(i, value)
+        if i == len(scores) - 1:
+            self._maxes[b] = score
+        if len(scores) > 2*BLOCK_SIZE:
+            self._scores.insert(b + 1, scores[BLOCK_SIZE:])
+            self._values.insert(b + 1, values[BLOCK_SIZE:])
+            self._maxes.insert(b + 1, self._maxes[b])
+            del scores[BLOCK_SIZE:]
+            del values[BLOCK_SIZE:]
+            self._maxes[b] = scores[-1]
+            self._offsets = None
+        else:
+            self._add_size(b, 1)
+
+    def remove(self, score, value):
+        '''Remove the ``score``, ``value`` pair.'''
+        b, i = self._locate(score, value)
+        if b < 0:
+            raise ValueError('%s not in blocklist' % value)
+        self._remove(b, i, i + 1)
+
+    def index(self, score, value):
+        '''The 0-based index (rank) of the ``score``, ``value`` pair, or
+        ``None`` if not available.'''
+        b, i = self._locate(score, value)
+        if b >= 0:
+            return self._offset(b) + i
+
+    def score_rank(self, score, right=False):
+        '''The number of pairs with score less than ``score``, or less than
+        or equal when ``right`` is ``True``'''
+        maxes = self._maxes
+        if right:
+            b = bisect_right(maxes, score)
+            if b == len(maxes):
+                return self._size
+            return self._offset(b) + bisect_right(self._scores[b], score)
+        else:
+            b = bisect_left(maxes, score)
+            if b == len(maxes):
+                return self._size
+            return self._offset(b) + bisect_left(self._scores[b], score)
+
+    def lex_rank(self, value, right=False):
+        '''The number of pairs with value less than ``value``, or less than
+        or equal when ``right`` is ``True``.
+
+        Values are only sorted when all scores are equal.
+        '''
+        blocks = self._values
+        bisect = bisect_right if right else bisect_left
+        lo, hi = 0, len(blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            last = blocks[mid][-1]
+            if last < value or (right and last == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(blocks):
+            return self._size
+        return self._offset(lo) + bisect(blocks[lo], value)
+
+    def range(self, start=0, end=None, scores=False):
+        '''Iterate over values, or ``score``, ``value`` pairs when
+        ``scores`` is ``True``, with rank between ``start`` and ``end``.
+        '''
+        start, end = self._bounds(start, end)
+        if start >= end:
+            return
+        b, i = self._find(start)
+        n = end - start
+        for bscores, values in zip(self._scores[b:], self._values[b:]):
+            j = min(i + n, len(values))
+            if scores:
+                yield from zip(bscores[i:j], values[i:j])
+            else:
+                yield from values[i:j]
+            n -= j - i
+            if not n:
+                break
+            i = 0
+
+    def range_by_score(self, minval, maxval, include_min=True,
+                       include_max=True, start=0, num=None, scores=False):
+        first = self.score_rank(minval, not include_min) + start
+        end = self.score_rank(maxval, include_max)
+        if num is not None:
+            end = min(end, first + num)
+        return self.range(first, end, scores)
+
+    def remove_range(self, start, end, callback=None):
+        '''Remove a range by rank.
+
+        This is equivalent to perform::
+
+            del l[start:end]
+
+        on a python list.
+        It returns the number of element removed.
+        '''
+        start, end = self._bounds(start, end)
+        if start >= end:
+            return 0
+        if callback:
+            for score, value in self.range(start, end, True):
+                callback(score, value)
+        removed = end - start
+        b, i = self._find(start)
+        first = b
+        while removed:
+            n = min(removed, len(self._values[b]) - i)
+            removed -= n
+            if self._remove(b, i, i + n, merge=False):
+                b += 1
+            i = 0
+        self._merge(first)
+        return end - start
+
+    def remove_range_by_score(self, minval, maxval, include_min=True,
+                              include_max=True, callback=None):
+        '''Remove a range with scores between ``minval`` and ``maxval``.
+        It returns the number of elements removed.
+        '''
+        return self.remove_range(self.score_rank(minval, not include_min),
+                                 self.score_rank(maxval, include_max),
+                                 callback)
+
+    def count(self, minval, maxval, include_min=True, include_max=True):
+        '''Returns the number of elements with a score between min and max.
+        '''
+        return max(self.score_rank(maxval, include_max) -
+                   self.score_rank(minval, not include_min), 0)
+
+    def flat(self):
+        return tuple(self._flat())
+
+    def _flat(self):
+        for score, value in self:
+            yield score
+            yield value
+
+    def _bounds(self, start, end):
+        N = self._size
+        if start < 0:
+            start = max(N + start, 0)
+        if end is None:
+            end = N
+        elif end < 0:
+            end = max(N + end, 0)
+        else:
+            end = min(end, N)
+        return start, end
+
+    def _block(self, score, value):
+        # index of the first block which may contain the pair
+        maxes = self._maxes
+        b = bisect_left(maxes, score)
+        N = len(maxes)
+        while b < N and maxes[b] == score and self._values[b][-1] < value:
+            b += 1
+        return b
+
+    def _position(self, scores, values, score, value):
+        # index of the pair in a block, or where it should be inserted
+        lo = bisect_left(scores, score)
+        hi = bisect_right(scores, score, lo)
+        return bisect_left(values, value, lo, hi)
+
+    def _locate(self, score, value):
+        b = self._block(score, value)
+        if b < len(self._scores):
+            values = self._values[b]
+            i = self._position(self._scores[b], values, score, value)
+            if i < len(values) and values[i] == value:
+                return b, i
+        return -1, -1
+
+    def _remove(self, b, i, j, merge=True):
+        # Remove pairs between positions i and j of block b. Return False
+        # if the block was removed
+        scores = self._scores[b]
+        values = self._values[b]
+        del scores[i:j]
+        del values[i:j]
+        self._size -= j - i
+        if not values:
+            del self._scores[b]
+            del self._values[b]
+            del self._maxes[b]
+            self._offsets = None
+            return False
+        self._add_size(b, i - j)
+        self._maxes[b] = scores[-1]
+        if merge:
+            self._merge(b)
+        return True
+
+    def _merge(self, b):
+        # Merge block b with the next one if it is too small
+        blocks = self._values
+        if b < len(blocks) - 1 and len(blocks[b]) < BLOCK_SIZE // 2:
+            self._scores[b].extend(self._scores.pop(b + 1))
+            blocks[b].extend(blocks.pop(b + 1))
+            self._maxes[b] = self._maxes.pop(b + 1)
+            self._offsets = None
+            if len(blocks[b]) > 2*BLOCK_SIZE:
+                self._scores.insert(b + 1, self._scores[b][BLOCK_SIZE:])
+                blocks.insert(b + 1, blocks[b][BLOCK_SIZE:])
+                self._maxes.insert(b + 1, self._maxes[b])
+                del self._scores[b][BLOCK_SIZE:]
+                del blocks[b][BLOCK_SIZE:]
+                self._maxes[b] = self._scores[b][-1]
+
+    def _get_offsets(self):
+        # Build the Fenwick tree in O(blocks): node k holds the number of
+        # pairs in the blocks k - (k & -k) to k - 1
+        tree = self._offsets
+        if tree is None:
+            tree = [0]
+            tree.extend(map(len, self._values))
+            N = len(tree)
+            for k in range(1, N):
+                parent = k + (k & -k)
+                if parent < N:
+                    tree[parent] += tree[k]
+            self._offsets = tree
+        return tree
+
+    def _add_size(self, b, delta):
+        # Add delta to the size of block b
+        tree = self._offsets
+        if tree is not None:
+            N = len(tree)
+            k = b + 1
+            while k < N:
+                tree[k] += delta
+                k += k & -k
+
+    def _offset(self, b):
+        # number of pairs before block b
+        tree = self._get_offsets()
+        offset = 0
+        while b:
+            offset += tree[b]
+            b -= b & -b
+        return offset
+
+    def _find(self, rank):
+        # block b and position in the block of the pair at rank, which
+        # must be less than the size of the container
+        tree = self._get_offsets()
+        N = len(tree)
+        b = 0
+        step = 1 << (N - 1).bit_length()
+        while step:
+            k = b + step
+            if k < N and tree[k] <= rank:
+                b = k
+                rank -= tree[k]
+            step >>= 1
+        return b, rank
@@ -0,0 +1,769 @@
+'''Hash and set with a compact encoding for small collections.
+
+Small collections are stored in a flat ``list``, the ``listpack``
+encoding, which uses a fraction of the memory of a ``dict`` or a ``set``
+and is fast enough to search for the few elements it holds. A collection
+is converted to the ``hashtable`` encoding once it holds more than
+``max_entries`` elements or an element longer than ``max_value`` bytes,
+and it is never converted back.
+
+Sets of integers use the ``intset`` encoding, a sorted ``array`` of 64 bits
+integers. Intersections, unions and differences of intsets are computed on
+the arrays, starting from the smallest set and searching the larger ones
+with a galloping binary search when their sizes are very different.
+Members larger than the maximum are appended to the array. Other members
+added to a large intset are kept in a pending set, merged into the array
+with a sort of the nearly sorted concatenation once it holds a fraction
+of the members or before the array is read, so that adding a member
+costs amortized constant time rather than a linear ``array.insert``.
+
+Members of the ``hashtable`` encoding are kept in a :class:`Table`, a list
+indexed by a dictionary, so that they can be picked at random and scanned
+with a stateless cursor.
+'''
+from array import array
+from bisect import bisect_left
+from random import randrange, sample, choices
+from sys import getsizeof
+
+from .misc import Mapping
+
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+# Search the larger of two sorted arrays with bisect when it is this many
+# times larger than the smaller one, otherwise use python sets
+GALLOP_RATIO = 8
+# Members are inserted directly into intsets smaller than this, larger
+# intsets keep up to one pending member every INTSET_PENDING_RATIO members
+INTSET_INSERT_SIZE = 4096
+INTSET_PENDING_RATIO = 32
+
+
+def too_long(value, size):
+    '''``True`` if ``value`` is longer than ``size``. Values without
+    length, such as numbers, are never too long.'''
+    try:
+        return len(value) > size
+    except TypeError:
+        return False
+
+
+def listpack_index(lp, value, parity=0):
+    '''Index of ``value`` in the flat list ``lp``, looking only at
+    positions with the given ``parity``. Return -1 if not found.'''
+    i = -1
+    try:
+        while True:
+            i = lp.index(value, i + 1)
+            if i % 2 == parity:
+                return i
+    except ValueError:
+        return -1
+
+
+def integer(value):
+    '''The integer represented by the bytes ``value`` if it is the canonical
+    representation of a 64 bits signed integer, otherwise ``None``.'''
+    if type(value) in (bytes, bytearray) and 0 < len(value) <= 20:
+        try:
+            n = int(value)
+        except ValueError:
+            return
+        if INT64_MIN <= n <= INT64_MAX and b'%d' % n == value:
+            return n
+
+
+def integers(values):
+    '''The list of integers represented by the list of bytes ``values``
+    if they are all canonical representations of 64 bits signed integers,
+    otherwise ``None``.'''
+    try:
+        ints = list(map(int, values))
+    except (TypeError, ValueError):
+        return
+    if (ints and INT64_MIN <= min(ints) and max(ints) <= INT64_MAX and
+            list(map(b'%d'.__mod__, ints)) == values):
+        return ints
+
+
+def intersect_sorted(small, large):
+    '''Intersection of the sorted arrays ``small`` and ``large``'''
+    if len(small)*GALLOP_RATIO < len(large):
+        result = array('q')
+        append = result.append
+        lo = 0
+        n = len(large)
+        for x in small:
+            lo = bisect_left(large, x, lo)
+            if lo == n:
+                break
+            if large[lo] == x:
+                append(x)
+        return result
+    return array('q', sorted(set(small).intersection(large)))
+
+
+def difference_sorted(first, other):
+    '''Elements of the sorted array ``first`` not in the sorted ``other``'''
+    if len(first)*GALLOP_RATIO < len(other):
+        result = array('q')
+        append = result.append
+        lo = 0
+        n = len(other)
+        for x in first:
+            lo = bisect_left(other, x, lo)
+            if lo == n or other[lo] != x:
+                append(x)
+        return result
+    return array('q', sorted(set(first).difference(other)))
+
+
+class Table:
+    '''Members of a collection in the ``hashtable`` encoding.
+
+    Members are stored in a list and a dictionary maps them to their
+    position in the list. Removing a member moves the last member into its
+    position, as in the key table of the data store.
+    '''
+    __slots__ = ('_index', '_keys')
+
+    def __init__(self):
+        self._index = {}
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + getsizeof(self._index) +
+                getsizeof(self._keys))
+
+    def keys(self, start, end):
+        '''The list of members between positions ``start`` and ``end``'''
+        return self._keys[start:end]
+
+    def random_keys(self, count, unique=True):
+        '''List of ``count`` random members, all different when ``unique``
+        is ``True``'''
+        if unique:
+            return sample(self._keys, count)
+        return choices(self._keys, k=count)
+
+    def scan(self, cursor, count):
+        '''The members at up to ``count`` positions before ``cursor``, or
+        before the end of the table when ``cursor`` is 0, and the cursor of
+        the next scan, 0 once the start of the table is reached.
+
+        Removing a member moves the last member into its position, so that
+        members not yet visited are never moved past the cursor and
+        members added during a scan are appended after it.
+        '''
+        keys = self._keys
+        if not cursor or cursor > len(keys):
+            cursor = len(keys)
+        start = max(cursor - count, 0)
+        return start, keys[start:cursor]
+
+    def _remove(self, pos):
+        keys = self._keys
+        key = keys.pop()
+        if pos < len(keys):
+            keys[pos] = key
+            self._index[key] = pos
+
+
+class SetTable(Table):
+    '''The :class:`Table` of members of a :class:`Set`'''
+    __slots__ = ()
+
+    def __init__(self, members=()):
+        super().__init__()
+        self.update(members)
+
+    def __getstate__(self):
+        return (self._keys,)
+
+    def __setstate__(self, state):
+        self._keys = state[0]
+        self._index = dict(zip(self._keys, range(len(self._keys))))
+
+    def add(self, member):
+        index = self._index
+        if member not in index:
+            index[member] = len(self._keys)
+            self._keys.append(member)
+
+    def update(self, members):
+        index = self._index
+        keys = self._keys
+        for member in members:
+            if member not in index:
+                index[member] = len(keys)
+                keys.append(member)
+
+    def discard(self, member):
+        pos = self._index.pop(member, None)
+        if pos is not None:
+            self._remove(pos)
+
+    def pop(self):
+        '''Remove and return a random member'''
+        keys = self._keys
+        if not keys:
+            raise KeyError('pop from an empty set')
+        member = keys[randrange(len(keys))]
+        self.discard(member)
+        return member
+
+    def copy(self):
+        table = self.__class__()
+        table._index = self._index.copy()
+        table._keys = self._keys[:]
+        return table
+
+
+class HashTable(Table):
+    '''The :class:`Table` of fields of a :class:`Hash`, or of members of a
+    sorted set, with their values in a list parallel to the fields'''
+    __slots__ = ('_values',)
+
+    def __init__(self, items=()):
+        super().__init__()
+        self._values = []
+        self.update(items)
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key, value):
+        pos = self._index.get(key)
+        if pos is None:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._values.append(value)
+        else:
+            self._values[pos] = value
+
+    def __getstate__(self):
+        return self._keys, self._values
+
+    def __setstate__(self, state):
+        self._keys, self._values = state
+        self._index = dict(zip(self._keys, range(len(self._keys))))
+
+    def __sizeof__(self):
+        return super().__sizeof__() + getsizeof(self._values)
+
+    def get(self, key, default=None):
+        pos = self._index.get(key)
+        return default if pos is None else self._values[pos]
+
+    def pop(self, key, *default):
+        pos = self._index.pop(key, None)
+        if pos is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self._values[pos]
+        self._remove(pos)
+        return value
+
+    def update(self, items):
+        '''Update with an iterable over key, value pairs'''
+        for key, value in items:
+            self[key] = value
+
+    def values(self):
+        return self._values[:]
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def flat(self):
+        result = [None]*(2*len(self._keys))
+        result[::2] = self._keys
+        result[1::2] = self._values
+        return result
+
+    def _remove(self, pos):
+        keys = self._keys
+        values = self._values
+        key = keys.pop()
+        value = values.pop()
+        if pos < len(keys):
+            keys[pos] = key
+            values[pos] = value
+            self._index[key] = pos
+
+
+class Hash:
+    '''Hash equivalent of redis hash.
+
+    In the ``listpack`` encoding fields and values alternate in a flat
+    list, in the ``hashtable`` encoding they are stored in a
+    :class:`HashTable`.
+    '''
+    __slots__ = ('_data',)
+    max_entries = 128
+    max_value = 64
+
+    def __init__(self, data=None):
+        self._data = []
+        if data:
+            self.update(data)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+    __str__ = __repr__
+
+    def __len__(self):
+        data = self._data
+        return len(data) // 2 if type(data) is list else len(data)
+
+    def __iter__(self):
+        data = self._data
+        return iter(data[::2]) if type(data) is list else iter(data)
+
+    def __contains__(self, field):
+        data = self._data
+        if type(data) is list:
+            return listpack_index(data, field) >= 0
+        return field in data
+
+    def __getitem__(self, field):
+        data = self._data
+        if type(data) is list:
+            i = listpack_index(data, field)
+            if i < 0:
+                raise KeyError(field)
+            return data[i + 1]
+        return data[field]
+
+    def __setitem__(self, field, value):
+        data = self._data
+        if type(data) is list:
+            i = listpack_index(data, field)
+            if too_long(value, self.max_value):
+                data = self._convert()
+            elif i >= 0:
+                data[i + 1] = value
+                return
+            elif (len(data) < 2*self.max_entries and
+                    not too_long(field, self.max_value)):
+                data.extend((field, value))
+                return
+            else:
+                data = self._convert()
+        data[field] = value
+
+    def __delitem__(self, field):
+        if self.pop(field, None) is None:
+            raise KeyError(field)
+
+    def __eq__(self, other):
+        if isinstance(other, Hash):
+            other = dict(other.items())
+        return isinstance(other, Mapping) and dict(self.items()) == other
+
+    def __getstate__(self):
+        return self._data
+
+    def __setstate__(self, state):
+        self._data = state
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + getsizeof(self._data)
+
+    @property
+    def encoding(self):
+        return 'listpack' if type(self._data) is list else 'hashtable'
+
+    def get(self, field, default=None):
+        data = self._data
+        if type(data) is list:
+            i = listpack_index(data, field)
+            return default if i < 0 else data[i + 1]
+        return data.get(field, default)
+
+    def pop(self, field, *default):
+        data = self._data
+        if type(data) is list:
+            i = listpack_index(data, field)
+            if i >= 0:
+                value = data[i + 1]
+                del data[i:i + 2]
+                return value
+            elif default:
+                return default[0]
+            raise KeyError(field)
+        return data.pop(field, *default)
+
+    def update(self, iterable):
+        '''Update with a mapping or an iterable over field, value pairs.'''
+        if isinstance(iterable, (Mapping, Hash)):
+            iterable = iterable.items()
+        iterable = iter(iterable)
+        data = self._data
+        if type(data) is list:
+            for field, value in iterable:
+                self[field] = value
+                if type(self._data) is not list:
+                    break
+            else:
+                return
+            data = self._data
+        data.update(iterable)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        data = self._data
+        return data[1::2] if type(data) is list else list(data.values())
+
+    def items(self):
+        data = self._data
+        if type(data) is list:
+            return zip(data[::2], data[1::2])
+        return data.items()
+
+    def mget(self, fields):
+        get = self.get
+        return [get(f) for f in fields]
+
+    def flat(self):
+        data = self._data
+        return list(data) if type(data) is list else data.flat()
+
+    def scan(self, cursor, count):
+        '''The cursor of the next scan and the fields of a scan of the
+        hash, see :meth:`Table.scan`. Listpacks are scanned at once.'''
+        data = self._data
+        if type(data) is list:
+            return 0, data[::2]
+        return data.scan(cursor, count)
+
+    def clear(self):
+        self._data = []
+
+    def _convert(self):
+        data = self._data
+        self._data = HashTable(zip(data[::2], data[1::2]))
+        return self._data
+
+
+class Set:
+    '''Set equivalent of redis set.
+
+    In the ``intset`` encoding members are integers in a sorted ``array``,
+    in the ``listpack`` encoding they are stored in a list and in the
+    ``hashtable`` encoding in a :class:`SetTable`. An intset is converted to a
+    listpack, or to a hashtable if it is too large, when a member which is
+    not an integer is added, and to a hashtable once it holds more than
+    :attr:`max_intset_entries` members.
+    '''
+    __slots__ = ('_data', '_pending')
+    max_entries = 128
+    max_value = 64
+    max_intset_entries = 512
+
+    def __init__(self, data=None):
+        self._data = array('q')
+        self._pending = None
+        if data:
+            self.update(data)
+
+    def __repr__(self):
+        return repr(set(self))
+    __str__ = __repr__
+
+    def __len__(self):
+        pending = self._pending
+        return len(self._data) + (len(pending) if pending else 0)
+
+    def __iter__(self):
+        data = self._data
+        if type(data) is array:
+            self._flush()
+            return map(b'%d'.__mod__, self._data)
+        return iter(data)
+
+    def __contains__(self, member):
+        data = self._data
+        if type(data) is array:
+            n = integer(member)
+            if n is None:
+                return False
+            i = bisect_left(data, n)
+            return ((i < len(data) and data[i] == n) or
+                    bool(self._pending and n in self._pending))
+        return member in data
+
+    def __eq__(self, other):
+        if isinstance(other, (Set, list, set, frozenset)):
+            return len(self) == len(other) and set(self) == set(other)
+        return False
+
+    def __getstate__(self):
+        self._flush()
+        return self._data
+
+    def __setstate__(self, state):
+        self._data = state
+        self._pending = None
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self) + getsizeof(self._data)
+        return size + getsizeof(self._pending) if self._pending else size
+
+    @property
+    def encoding(self):
+        data = self._data
+        if type(data) is array:
+            return 'intset'
+        return 'listpack' if type(data) is list else 'hashtable'
+
+    def add(self, member):
+        data = self._data
+        if type(data) is array:
+            n = integer(member)
+            if n is not None:
+                pending = self._pending
+                if pending and n in pending:
+                    return
+                elif not data or n > data[-1]:
+                    if len(self) < self.max_intset_entries:
+                        data.append(n)
+                        return
+                else:
+                    i = bisect_left(data, n)
+                    if data[i] == n:
+                        return
+                    if len(self) < self.max_intset_entries:
+                        if len(data) < INTSET_INSERT_SIZE:
+                            data.insert(i, n)
+                        elif pending:
+                            pending.add(n)
+                            if (len(pending)*INTSET_PENDING_RATIO >
+                                    len(data)):
+                                self._flush()
+                        else:
+                            self._pending = set((n,))
+                        return
+                data = self._convert()
+            elif (len(data) < self.max_entries and
+                    not too_long(member, self.max_value)):
+                self._data = list(self)
+                self._data.append(member)
+                return
+            else:
+                data = self._convert()
+        if type(data) is list:
+            if member in data:
+                return
+            if (len(data) < self.max_entries and
+                    not too_long(member, self.max_value)):
+                data.append(member)
+                return
+            data = self._convert()
+        data.add(member)
+
+    def update(self, members):
+        data = self._data
+        if type(data) is array:
+            members = list(members)
+            ints = integers(members)
+            if ints is not None:
+                self._merge(ints)
+                return
+            ints = []
+            members = iter(members)
+            for member in members:
+                n = integer(member)
+                if n is None:
+                    self._merge(ints)
+                    self.add(member)
+                    break
+                ints.append(n)
+            else:
+                self._merge(ints)
+                return
+            data = self._data
+        else:
+            members = iter(members)
+        if type(data) is list:
+            for member in members:
+                self.add(member)
+                if type(self._data) is not list:
+                    break
+            else:
+                return
+            data = self._data
+        data.update(members)
+
+    def discard(self, member):
+        data = self._data
+        if type(data) is array:
+            n = integer(member)
+            if n is not None:
+                i = bisect_left(data, n)
+                if i < len(data) and data[i] == n:
+                    del data[i]
+                elif self._pending:
+                    self._pending.discard(n)
+        elif type(data) is list:
+            if member in data:
+                data.remove(member)
+        else:
+            data.discard(member)
+
+    def remove(self, member):
+        if member not in self:
+            raise KeyError(member)
+        self.discard(member)
+
+    def difference_update(self, members):
+        discard = self.discard
+        for member in members:
+            discard(member)
+
+    def pop(self):
+        '''Remove and return a random member'''
+        if not self:
+            raise KeyError('pop from an empty set')
+        data = self._data
+        if type(data) is SetTable:
+            return data.pop()
+        self._flush()
+        data = self._data
+        member = data.pop(randrange(len(data)))
+        return b'%d' % member if type(data) is array else member
+
+    def random_members(self, count, unique=True):
+        '''List of ``count`` random members, all different when ``unique``
+        is ``True``, in which case ``count`` must not exceed the size of
+        the set'''
+        self._flush()
+        data = self._data
+        if type(data) is SetTable:
+            return data.random_keys(count, unique)
+        if unique:
+            members = [data[i] for i in sample(range(len(data)), count)]
+        else:
+            members = choices(data, k=count)
+        if type(data) is array:
+            return [b'%d' % member for member in members]
+        return members
+
+    def scan(self, cursor, count):
+        '''The cursor of the next scan and the members of a scan of the
+        set, see :meth:`Table.scan`. Intsets and listpacks are scanned at
+        once.'''
+        data = self._data
+        if type(data) is SetTable:
+            return data.scan(cursor, count)
+        return 0, list(self)
+
+    def clear(self):
+        self._data = array('q')
+        self._pending = None
+
+    def copy(self):
+        self._flush()
+        result = self.__class__()
+        data = self._data
+        result._data = data[:] if type(data) is not SetTable else data.copy()
+        return result
+
+    def union(self, *others):
+        if self._intsets(others):
+            # sorting the concatenation of sorted arrays merges them
+            ints = self._data[:]
+            for other in others:
+                ints.extend(other._data)
+            return self._from_ints(array('q', dict.fromkeys(sorted(ints))))
+        result = self.copy()
+        for other in others:
+            result.update(other)
+        return result
+
+    def intersection(self, *others):
+        sets = sorted((self,) + others, key=len)
+        if self._intsets(others):
+            ints = sets[0]._data
+            for other in sets[1:]:
+                if not ints:
+                    break
+                ints = intersect_sorted(ints, other._data)
+            return self._from_ints(array('q', ints))
+        members = list(sets[0])
+        for other in sets[1:]:
+            members = [m for m in members if m in other]
+        return self.__class__(members)
+
+    def difference(self, *others):
+        if self._intsets(others):
+            ints = self._data
+            for other in sorted(others, key=len, reverse=True):
+                if not ints:
+                    break
+                ints = difference_sorted(ints, other._data)
+            return self._from_ints(array('q', ints))
+        members = list(self)
+        for other in others:
+            members = [m for m in members if m not in other]
+        return self.__class__(members)
+
+    def _intsets(self, others):
+        # True if all sets are intsets, their arrays hold all members then
+        sets = (self,) + others
+        if all(type(s._data) is array for s in sets):
+            for s in sets:
+                s._flush()
+            return True
+        return False
+
+    def _from_ints(self, ints):
+        result = self.__class__()
+        if len(ints) > self.max_intset_entries:
+            result._data = SetTable(map(b'%d'.__mod__, ints))
+        else:
+            result._data = ints
+        return result
+
+    def _merge(self, ints):
+        # Add the list of integers ``ints`` to the intset
+        self._flush()
+        data = self._data
+        if len(ints)*GALLOP_RATIO < len(data):
+            for n in ints:
+                i = bisect_left(data, n)
+                if i == len(data) or data[i] != n:
+                    data.insert(i, n)
+        elif ints:
+            ints.extend(data)
+            data = self._data = array('q', sorted(set(ints)))
+        if len(data) > self.max_intset_entries:
+            self._convert()
+
+    def _flush(self):
+        # Merge the pending members into the sorted array, sorting the
+        # concatenation is linear for runs of sorted members
+        pending = self._pending
+        if pending:
+            self._pending = None
+            data = self._data
+            data.extend(pending)
+            self._data = array('q', sorted(data))
+
+    def _convert(self):
+        self._data = SetTable(self)
+        self._pending = None
+        return self._data
@@ -0,0 +1,105 @@
+from heapq import heappush, heappop, heapify
+from random import randrange
+
+
+COMPACT_MIN = 64
+
+
+class ExpiryHeap:
+    '''A collection of keys with a deadline, ordered by deadline.
+
+    Deadlines are stored in a dictionary and mirrored in a binary heap of
+    ``(deadline, key)`` pairs. Changing or removing a deadline does not
+    touch the heap, the stale entry is skipped when it reaches the top.
+    The heap is rebuilt once stale entries outnumber live ones, so memory
+    stays proportional to the number of keys with a deadline.
+    '''
+    __slots__ = ('_deadlines', '_heap')
+
+    def __init__(self):
+        self._deadlines = {}
+        self._heap = []
+
+    def __repr__(self):
+        return repr(self._deadlines)
+    __str__ = __repr__
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __iter__(self):
+        return iter(self._deadlines)
+
+    def get(self, key, default=None):
+        '''The deadline of ``key`` or ``default``'''
+        return self._deadlines.get(key, default)
+
+    def set(self, key, when):
+        '''Set the deadline of ``key`` to ``when``'''
+        self._deadlines[key] = when
+        heappush(self._heap, (when, key))
+        self._compact()
+
+    def discard(self, key):
+        '''Remove ``key`` and return its deadline, if available.'''
+        when = self._deadlines.pop(key, None)
+        if when is not None:
+            self._compact()
+        return when
+
+    def clear(self):
+        self._deadlines.clear()
+        self._heap = []
+
+    def next_deadline(self):
+        '''The earliest deadline or ``None`` if empty.'''
+        heap = self._heap
+        deadlines = self._deadlines
+        while heap:
+            when, key = heap[0]
+            if deadlines.get(key) == when:
+                return when
+            heappop(heap)
+
+    def pop_expired(self, now, limit=None):
+        '''Remove and return keys with a deadline not greater than ``now``.
+
+        :param limit: optional maximum number of keys to return. Use it to
+            bound the amount of work done in one event loop iteration.
+        '''
+        heap = self._heap
+        deadlines = self._deadlines
+        keys = []
+        while heap and heap[0][0] <= now:
+            if limit is not None and len(keys) >= limit:
+                break
+            when, key = heappop(heap)
+            if deadlines.get(key) == when:
+                deadlines.pop(key)
+                keys.append(key)
+        return keys
+
+    def sample(self, count):
+        '''Return at most ``count`` random ``(key, deadline)`` pairs.
+
+        Keys are picked from random positions of the heap, stale entries
+        are skipped so that fewer than ``count`` pairs may be returned.
+        '''
+        heap = self._heap
+        deadlines = self._deadlines
+        pairs = []
+        if heap:
+            for _ in range(count):
+                when, key = heap[randrange(len(heap))]
+                if deadlines.get(key) == when:
+                    pairs.append((key, when))
+        return pairs
+
+    def _compact(self):
+        if len(self._heap) > 2*len(self._deadlines) + COMPACT_MIN:
+            self._heap = [(when, key) for key, when
+                          in self._deadlines.items()]
+            heapify(self._heap)
@@ -22,8 +22,11 @@ inf = float('inf')
 
 class Skiplist(Sequence):
     '''Sorted collection supporting O(log n) insertion,
-    removal, and lookup by rank.'''
+    removal, and lookup by rank.
+
+    Pairs with the same score are sorted by value.'''
     __slots__ = ('_unique', '_size', '_head', '_level')
+    encoding = 'skiplist'
 
     def __init__(self, data=None, unique=False):
         self._unique = unique
@@ -88,12 +91,61 @@ class Skiplist(Sequence):
         else:
             return -2 - rank
 
+    def index(self, score, value):
+        '''The 0-based index (rank) of the ``score``, ``value`` pair, or
+        ``None`` if not available.'''
+        node = self._head
+        rank = 0
+        for i in range(self._level-1, -1, -1):
+            while node.next[i] and (node.next[i].score < score or
+                                    (node.next[i].score == score and
+                                     node.next[i].value < value)):
+                rank += node.width[i]
+                node = node.next[i]
+        node = node.next[0]
+        if node and node.score == score and node.value == value:
+            return rank
+
+    def remove(self, score, value):
+        '''Remove the ``score``, ``value`` pair.'''
+        index = self.index(score, value)
+        if index is None:
+            raise ValueError('%s not in skiplist' % value)
+        self.remove_range(index, index + 1)
+
+    def score_rank(self, score, right=False):
+        '''The number of pairs with score less than ``score``, or less than
+        or equal when ``right`` is ``True``'''
+        node = self._head
+        rank = 0
+        for i in range(self._level-1, -1, -1):
+            while node.next[i] and (node.next[i].score < score or
+                                    (right and node.next[i].score == score)):
+                rank += node.width[i]
+                node = node.next[i]
+        return rank
+
+    def lex_rank(self, value, right=False):
+        '''The number of pairs with value less than ``value``, or less than
+        or equal when ``right`` is ``True``.
+
+        Values are only sorted when all scores are equal.
+        '''
+        node = self._head
+        rank = 0
+        for i in range(self._level-1, -1, -1):
+            while node.next[i] and (node.next[i].value < value or
+                                    (right and node.next[i].value == value)):
+                rank += node.width[i]
+                node = node.next[i]
+        return rank
+
     def range(self, start=0, end=None, scores=False):
         N = len(self)
         if start < 0:
             start = max(N + start, 0)
         if start >= N:
-            raise StopIteration
+            return
         if end is None:
             end = N
         elif end < 0:
@@ -101,16 +153,16 @@ class Skiplist(Sequence):
         else:
             end = min(end, N)
         if start >= end:
-            raise StopIteration
-        node = self._head.next[0]
-        index = 0
-        while node:
-            if index >= start:
-                if index < end:
-                    yield (node.score, node.value) if scores else node.value
-                else:
-                    break
-            index += 1
+            return
+        node = self._head
+        index = -1
+        for i in range(self._level-1, -1, -1):
+            while node.next[i] and (index + node.width[i]) < start:
+                index += node.width[i]
+                node = node.next[i]
+        node = node.next[0]
+        for _ in range(end - start):
+            yield (node.score, node.value) if scores else node.value
             node = node.next[0]
 
     def range_by_score(self, minval, maxval, include_min=True,
@@ -148,7 +200,9 @@ class Skiplist(Sequence):
         for i in range(self._level-1, -1, -1):
             # store rank that is crossed to reach the insert position
             rank[i] = 0 if i == self._level-1 else rank[i+1]
-            while node.next[i] and node.next[i].score <= score:
+            while node.next[i] and (node.next[i].score < score or
+                                    (node.next[i].score == score and
+                                     node.next[i].value <= value)):
                 rank[i] += node.width[i]
                 node = node.next[i]
             chain[i] = node
@@ -266,17 +320,8 @@ class Skiplist(Sequence):
         '''Returns the number of elements in the skiplist with a score
         between min and max.
         '''
-        rank1 = self.rank(minval)
-        if rank1 < 0:
-            rank1 = -rank1 - 1
-        elif not include_min:
-            rank1 += 1
-        rank2 = self.rank(maxval)
-        if rank2 < 0:
-            rank2 = -rank2 - 1
-        elif include_max:
-            rank2 += 1
-        return max(rank2 - rank1, 0)
+        return max(self.score_rank(maxval, include_max) -
+                   self.score_rank(minval, not include_min), 0)
 
     def __iter__(self):
         'Iterate over values in sorted order'
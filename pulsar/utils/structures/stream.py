@@ -0,0 +1,439 @@
+'''Append only log of field-value entries, the equivalent of redis streams.
+
+Entry ids are ``(milliseconds, sequence)`` pairs of integers, strictly
+increasing. Entries are stored in nodes of up to :attr:`Stream.node_size`
+entries: the two parts of the ids in arrays of unsigned 64 bits integers,
+the field names and values in two lists of tuples. Entries with the same
+field names as the first entry of their node share its tuple of names,
+like the master entry of redis stream listpacks. Trimming removes whole
+nodes from the head of the stream.
+'''
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+MIN_ID = (0, 0)
+MAX_ID = ((1 << 64) - 1, (1 << 64) - 1)
+
+
+def id_after(id):
+    '''The smallest id greater than ``id``'''
+    ms, seq = id
+    return (ms, seq + 1) if seq < MAX_ID[1] else (ms + 1, 0)
+
+
+def id_before(id):
+    '''The greatest id smaller than ``id``'''
+    ms, seq = id
+    return (ms, seq - 1) if seq else (ms - 1, MAX_ID[1])
+
+
+class StreamNode:
+    __slots__ = ('ms', 'seq', 'names', 'values')
+
+    def __init__(self):
+        self.ms = array('Q')
+        self.seq = array('Q')
+        self.names = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getstate__(self):
+        return self.ms, self.seq, self.names, self.values
+
+    def __setstate__(self, state):
+        self.ms, self.seq, self.names, self.values = state
+
+    def first(self):
+        return self.ms[0], self.seq[0]
+
+    def last(self):
+        return self.ms[-1], self.seq[-1]
+
+    def position(self, id, right=False):
+        # Index of the first entry with id greater or equal than id, or
+        # greater when right is True
+        ms, seq = id
+        lo = bisect_left(self.ms, ms)
+        hi = bisect_right(self.ms, ms, lo)
+        bisect = bisect_right if right else bisect_left
+        return bisect(self.seq, seq, lo, hi)
+
+    def entry(self, i):
+        fields = []
+        for pair in zip(self.names[i], self.values[i]):
+            fields.extend(pair)
+        return (self.ms[i], self.seq[i]), fields
+
+    def remove(self, i, j):
+        del self.ms[i:j]
+        del self.seq[i:j]
+        del self.names[i:j]
+        del self.values[i:j]
+
+
+class Stream:
+    '''Entries of field-value pairs ordered by id.
+
+    .. attribute:: last_id
+
+        The id of the last entry added, which may have been removed.
+
+    .. attribute:: groups
+
+        Dictionary of :class:`StreamGroup` by name.
+    '''
+    __slots__ = ('_nodes', '_size', 'last_id', 'entries_added',
+                 'max_deleted_id', 'groups')
+    node_size = 100
+    encoding = 'stream'
+
+    def __init__(self):
+        self._nodes = []
+        self._size = 0
+        self.last_id = MIN_ID
+        self.entries_added = 0
+        self.max_deleted_id = MIN_ID
+        self.groups = {}
+
+    def __repr__(self):
+        return repr(list(self))
+    __str__ = __repr__
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        '''Iterator over ``id``, ``fields`` pairs'''
+        return self.range()
+
+    def __getstate__(self):
+        return (self._nodes, self._size, self.last_id, self.entries_added,
+                self.max_deleted_id, self.groups)
+
+    def __setstate__(self, state):
+        (self._nodes, self._size, self.last_id, self.entries_added,
+         self.max_deleted_id, self.groups) = state
+
+    @property
+    def nodes(self):
+        '''Number of nodes'''
+        return len(self._nodes)
+
+    def first(self):
+        '''The first ``id``, ``fields`` pair or ``None``'''
+        if self._nodes:
+            return self._nodes[0].entry(0)
+
+    def last(self):
+        '''The last ``id``, ``fields`` pair or ``None``'''
+        if self._nodes:
+            node = self._nodes[-1]
+            return node.entry(len(node) - 1)
+
+    def next_id(self, ms, seq=None):
+        '''The id of a new entry at time ``ms``, with sequence ``seq``
+        or the next sequence of ``ms`` when not given. Return ``None`` if
+        the id is not greater than :attr:`last_id`.'''
+        last_ms, last_seq = self.last_id
+        if seq is None:
+            if ms > last_ms:
+                seq = 0
+            elif ms == last_ms and last_seq < MAX_ID[1]:
+                seq = last_seq + 1
+            else:
+                return
+        id = (ms, seq)
+        if id > self.last_id:
+            return id
+
+    def add(self, id, fields):
+        '''Append the entry ``id`` with a flat sequence of field, value
+        pairs, ``id`` must be greater than :attr:`last_id`'''
+        if id <= self.last_id:
+            raise ValueError('Entry id must be greater than the last id')
+        names = tuple(fields[::2])
+        values = tuple(fields[1::2])
+        nodes = self._nodes
+        if not nodes or len(nodes[-1]) >= self.node_size:
+            nodes.append(StreamNode())
+        node = nodes[-1]
+        if node.names and node.names[0] == names:
+            names = node.names[0]
+        node.ms.append(id[0])
+        node.seq.append(id[1])
+        node.names.append(names)
+        node.values.append(values)
+        self._size += 1
+        self.entries_added += 1
+        self.last_id = id
+
+    def get(self, id):
+        '''The flat list of fields of entry ``id`` or ``None``'''
+        b, i = self._locate(id)
+        if b >= 0:
+            return self._nodes[b].entry(i)[1]
+
+    def range(self, start=MIN_ID, end=MAX_ID, count=None, reverse=False):
+        '''Iterator over ``id``, ``fields`` pairs with ids between
+        ``start`` and ``end`` included, from the last one when
+        ``reverse`` is ``True``.'''
+        if start > end or count == 0:
+            return
+        nodes = self._nodes
+        if reverse:
+            b = self._node(end, True)
+            if b == len(nodes):
+                b -= 1
+            i = nodes[b].position(end, True) - 1 if nodes else -1
+            while b >= 0:
+                node = nodes[b]
+                while i >= 0:
+                    id, fields = node.entry(i)
+                    if id < start:
+                        return
+                    yield id, fields
+                    if count is not None:
+                        count -= 1
+                        if not count:
+                            return
+                    i -= 1
+                b -= 1
+                i = len(nodes[b]) - 1
+        else:
+            b = self._node(start)
+            if b < len(nodes):
+                i = nodes[b].position(start)
+            while b < len(nodes):
+                node = nodes[b]
+                while i < len(node):
+                    id, fields = node.entry(i)
+                    if id > end:
+                        return
+                    yield id, fields
+                    if count is not None:
+                        count -= 1
+                        if not count:
+                            return
+                    i += 1
+                b += 1
+                i = 0
+
+    def after(self, id, count=None):
+        '''Iterator over the entries with id greater than ``id``'''
+        if id >= self.last_id:
+            return iter(())
+        return self.range(id_after(id), MAX_ID, count)
+
+    def remove(self, id):
+        '''Remove entry ``id``, return ``True`` if it was in the stream'''
+        b, i = self._locate(id)
+        if b < 0:
+            return False
+        node = self._nodes[b]
+        node.remove(i, i + 1)
+        if not node:
+            del self._nodes[b]
+        self._size -= 1
+        if id > self.max_deleted_id:
+            self.max_deleted_id = id
+        return True
+
+    def trim(self, maxlen=None, minid=None, approx=False, limit=None):
+        '''Remove the first entries until at most ``maxlen`` are left or
+        no entry has id less than ``minid``.
+
+        When ``approx`` is ``True`` only whole nodes are removed, at most
+        ``limit`` entries. Return the number of entries removed.
+        '''
+        nodes = self._nodes
+        removed = 0
+        while nodes:
+            node = nodes[0]
+            if maxlen is not None:
+                n = min(self._size - maxlen, len(node))
+            else:
+                n = node.position(minid)
+            if n <= 0:
+                break
+            if n < len(node):
+                if approx:
+                    break
+            elif approx and limit is not None and removed + n > limit:
+                break
+            last = (node.ms[n-1], node.seq[n-1])
+            if n == len(node):
+                nodes.pop(0)
+            else:
+                node.remove(0, n)
+            removed += n
+            self._size -= n
+            if last > self.max_deleted_id:
+                self.max_deleted_id = last
+        return removed
+
+    def _node(self, id, right=False):
+        # Index of the first node whose last id is greater or equal than
+        # id, or greater when right is True
+        nodes = self._nodes
+        lo, hi = 0, len(nodes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            last = nodes[mid].last()
+            if last < id or (right and last == id):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _locate(self, id):
+        nodes = self._nodes
+        b = self._node(id)
+        if b < len(nodes):
+            node = nodes[b]
+            i = node.position(id)
+            if i < len(node) and (node.ms[i], node.seq[i]) == id:
+                return b, i
+        return -1, -1
+
+
+class PendingEntry:
+    '''An entry delivered to a consumer and not yet acknowledged'''
+    __slots__ = ('consumer', 'delivery_time', 'delivery_count')
+
+    def __init__(self, consumer, delivery_time, delivery_count=1):
+        self.consumer = consumer
+        self.delivery_time = delivery_time
+        self.delivery_count = delivery_count
+
+    def __getstate__(self):
+        return self.consumer, self.delivery_time, self.delivery_count
+
+    def __setstate__(self, state):
+        self.consumer, self.delivery_time, self.delivery_count = state
+
+
+class StreamConsumer:
+    __slots__ = ('name', 'seen_time', 'pending')
+
+    def __init__(self, name, seen_time):
+        self.name = name
+        self.seen_time = seen_time
+        # pending entries by id
+        self.pending = OrderedDict()
+
+    def __getstate__(self):
+        return self.name, self.seen_time, self.pending
+
+    def __setstate__(self, state):
+        self.name, self.seen_time, self.pending = state
+
+
+class StreamGroup:
+    '''A consumer group of a :class:`Stream`.
+
+    Entries delivered to consumers are pending until acknowledged. The
+    pending entries of the group and of its consumers are ordered
+    dictionaries by id, sorted by id.
+    '''
+    __slots__ = ('last_id', 'entries_read', 'pending', 'consumers')
+
+    def __init__(self, last_id, entries_read=0):
+        self.last_id = last_id
+        self.entries_read = entries_read
+        self.pending = OrderedDict()
+        self.consumers = {}
+
+    def __getstate__(self):
+        return self.last_id, self.entries_read, self.pending, self.consumers
+
+    def __setstate__(self, state):
+        (self.last_id, self.entries_read, self.pending,
+         self.consumers) = state
+
+    def consumer(self, name, now):
+        '''The consumer ``name``, created if needed'''
+        consumer = self.consumers.get(name)
+        if consumer is None:
+            self.consumers[name] = consumer = StreamConsumer(name, now)
+        consumer.seen_time = now
+        return consumer
+
+    def deliver(self, consumer, id, now, noack=False):
+        '''Deliver the new entry ``id`` to ``consumer``, pending unless
+        ``noack`` is ``True``'''
+        if not noack:
+            pe = PendingEntry(consumer.name, now)
+            self.pending[id] = pe
+            consumer.pending[id] = pe
+            sort_pending(self.pending)
+            sort_pending(consumer.pending)
+        if id > self.last_id:
+            self.last_id = id
+        self.entries_read += 1
+
+    def ack(self, id):
+        '''Acknowledge entry ``id``, return ``True`` if it was pending'''
+        pe = self.pending.pop(id, None)
+        if pe is None:
+            return False
+        self.consumers[pe.consumer].pending.pop(id, None)
+        return True
+
+    def claim(self, id, consumer, now, delivery_count=None):
+        '''Assign the entry ``id`` to ``consumer``'''
+        pe = self.pending.get(id)
+        if pe is None:
+            pe = PendingEntry(consumer.name, now, 0)
+            self.pending[id] = pe
+            sort_pending(self.pending)
+        else:
+            self.consumers[pe.consumer].pending.pop(id, None)
+        pe.consumer = consumer.name
+        pe.delivery_time = now
+        if delivery_count is not None:
+            pe.delivery_count = delivery_count
+        consumer.pending[id] = pe
+        sort_pending(consumer.pending)
+        return pe
+
+    def remove_consumer(self, name):
+        '''Remove consumer ``name`` and its pending entries, return the
+        number of entries it had pending or ``None``'''
+        consumer = self.consumers.pop(name, None)
+        if consumer is not None:
+            for id in consumer.pending:
+                self.pending.pop(id, None)
+            return len(consumer.pending)
+
+    def pending_range(self, start, end, count, consumer=None, idle=None,
+                      now=0):
+        '''List of ``id``, :class:`PendingEntry` pairs with id between
+        ``start`` and ``end``'''
+        pending = self.pending
+        if consumer is not None:
+            consumer = self.consumers.get(consumer)
+            pending = consumer.pending if consumer else {}
+        result = []
+        for id, pe in pending.items():
+            if id > end or len(result) == count:
+                break
+            if id >= start and (idle is None or
+                                now - pe.delivery_time >= idle):
+                result.append((id, pe))
+        return result
+
+
+def sort_pending(pending):
+    '''Sort a dictionary of pending entries by id after the insertion of
+    its last entry'''
+    ids = reversed(pending)
+    last = next(ids, None)
+    previous = next(ids, None)
+    if previous is not None and previous > last:
+        items = sorted(pending.items())
+        pending.clear()
+        pending.update(items)
@@ -1,72 +1,152 @@
-from .skiplist import Skiplist
+from bisect import bisect_left, bisect_right
+from sys import getsizeof
+
+from .blocklist import BlockList
+from .compact import too_long, listpack_index, HashTable
 
 
 class Zset:
     '''Ordered-set equivalent of redis zset.
+
+    Members are ordered by score and members with the same score by
+    value. Small sorted sets use the ``listpack`` encoding, a flat list of
+    alternating scores and members. They are converted to the
+    :attr:`engine` encoding, a :class:`.BlockList` or a :class:`.Skiplist`
+    together with a :class:`.HashTable` of scores by member, once they hold
+    more than :attr:`max_entries` members or a member longer than
+    :attr:`max_value` bytes.
     '''
+    __slots__ = ('_sl', '_dict', '_lp')
+    max_entries = 128
+    max_value = 64
+    engine = BlockList
+
     def __init__(self, data=None):
-        self._sl = Skiplist()
-        self._dict = {}
+        self._sl = None
+        self._dict = None
+        self._lp = []
         if data:
             self.update(data)
 
     def __repr__(self):
-        return repr(self._sl)
+        return repr(list(self.items()))
     __str__ = __repr__
 
     def __len__(self):
-        return len(self._dict)
+        lp = self._lp
+        return len(self._dict) if lp is None else len(lp) // 2
 
     def __iter__(self):
-        for _, value in self._sl:
-            yield value
+        lp = self._lp
+        if lp is None:
+            return (value for _, value in self._sl)
+        return iter(lp[1::2])
+
+    def __contains__(self, member):
+        lp = self._lp
+        if lp is None:
+            return member in self._dict
+        return listpack_index(lp, member, 1) > 0
 
     def __getstate__(self):
-        return self._dict
+        return self._dict if self._lp is None else self._lp
 
     def __setstate__(self, state):
-        self._dict = state
-        self._sl = Skiplist(((score, member) for member, score
-                             in state.items()))
+        if isinstance(state, list):
+            self._sl = self._dict = None
+            self._lp = state
+        else:
+            self._lp = None
+            self._dict = state
+            self._sl = self.engine(((score, member) for member, score
+                                    in state.items()))
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self)
+        if self._lp is None:
+            return size + getsizeof(self._dict)
+        return size + getsizeof(self._lp)
 
     def __eq__(self, other):
         if isinstance(other, Zset):
-            return other._dict == self._dict
+            return other._scores() == self._scores()
         return False
 
+    @property
+    def encoding(self):
+        return 'listpack' if self._lp is not None else self._sl.encoding
+
     def items(self):
         '''Iterable over ordered score, value pairs of this :class:`zset`
         '''
-        return iter(self._sl)
+        lp = self._lp
+        if lp is None:
+            return iter(self._sl)
+        return zip(lp[::2], lp[1::2])
 
     def range(self, start, end, scores=False):
-        return self._sl.range(start, end, scores)
+        lp = self._lp
+        if lp is None:
+            return self._sl.range(start, end, scores)
+        start, end = self._bounds(start, end)
+        return self._lp_range(start, end, scores)
 
     def range_by_score(self, minval, maxval, include_min=True,
                        include_max=True, start=0, num=None, scores=False):
-        return self._sl.range_by_score(minval, maxval, start=start,
-                                       num=num, include_min=include_min,
-                                       include_max=include_max,
-                                       scores=scores)
+        lp = self._lp
+        if lp is None:
+            return self._sl.range_by_score(minval, maxval, start=start,
+                                           num=num, include_min=include_min,
+                                           include_max=include_max,
+                                           scores=scores)
+        first = self._bisect(minval, not include_min) + start
+        end = self._bisect(maxval, include_max)
+        if num is not None:
+            end = min(end, first + num)
+        return self._lp_range(first, end, scores)
 
     def score(self, member, default=None):
         '''The score of a given member'''
-        return self._dict.get(member, default)
+        lp = self._lp
+        if lp is None:
+            return self._dict.get(member, default)
+        i = listpack_index(lp, member, 1)
+        return default if i < 0 else lp[i - 1]
 
     def count(self, minval, maxval, include_min=True, include_max=True):
-        return self._sl.count(minval, maxval, include_min, include_max)
+        if self._lp is None:
+            return self._sl.count(minval, maxval, include_min, include_max)
+        return max(self._bisect(maxval, include_max) -
+                   self._bisect(minval, not include_min), 0)
 
     def add(self, score, val):
-        r = 1
-        if val in self._dict:
-            sc = self._dict[val]
-            if sc == score:
+        lp = self._lp
+        if lp is None:
+            r = 1
+            sc = self._dict.get(val)
+            if sc is not None:
+                if sc == score:
+                    return 0
+                # the member keeps its position in the table of scores
+                self._sl.remove(sc, val)
+                r = 0
+            self._dict[val] = score
+            self._sl.insert(score, val)
+            return r
+        if score != score:
+            raise ValueError('Cannot insert score {0}'.format(score))
+        i = listpack_index(lp, val, 1)
+        if i > 0:
+            if lp[i - 1] == score:
                 return 0
-            self.remove(val)
-            r = 0
-        self._dict[val] = score
-        self._sl.insert(score, val)
-        return r
+            del lp[i - 1:i + 1]
+        elif (len(lp) >= 2*self.max_entries or
+                too_long(val, self.max_value)):
+            self._convert()
+            return self.add(score, val)
+        j = 2*self._bisect_entry(score, val)
+        lp[j:j] = (score, val)
+        return 0 if i > 0 else 1
 
     def update(self, score_vals):
         '''Update the :class:`zset` with an iterable over pairs of
@@ -87,60 +167,98 @@ scores and values.'''
         '''Remove ``item`` for the :class:`zset` it it exists.
         If found it returns the score of the item removed.
         '''
+        lp = self._lp
+        if lp is not None:
+            i = listpack_index(lp, item, 1)
+            if i > 0:
+                score = lp[i - 1]
+                del lp[i - 1:i + 1]
+                return score
+            return
         score = self._dict.pop(item, None)
         if score is not None:
-            index = self._sl.rank(score)
-            assert index >= 0, 'could not find start range'
-            for i, v in enumerate(self._sl.range(index)):
-                if v == item:
-                    assert self._sl.remove_range(index + i, index+i + 1) == 1
-                    return score
-            assert False, 'could not find element'
+            self._sl.remove(score, item)
+            return score
 
     def remove_range(self, start, end):
-        '''Remove a range by score.
+        '''Remove a range by rank.
         '''
-        return self._sl.remove_range(
-            start, end, callback=lambda sc, value: self._dict.pop(value))
+        if self._lp is None:
+            return self._sl.remove_range(
+                start, end, callback=lambda sc, value: self._dict.pop(value))
+        start, end = self._bounds(start, end)
+        return self._lp_remove(start, end)
 
     def remove_range_by_score(self, minval, maxval,
                               include_min=True, include_max=True):
         '''Remove a range by score.
         '''
-        return self._sl.remove_range_by_score(
-            minval, maxval, include_min=include_min, include_max=include_max,
-            callback=lambda sc, value: self._dict.pop(value))
+        if self._lp is None:
+            return self._sl.remove_range_by_score(
+                minval, maxval, include_min=include_min,
+                include_max=include_max,
+                callback=lambda sc, value: self._dict.pop(value))
+        return self._lp_remove(self._bisect(minval, not include_min),
+                               self._bisect(maxval, include_max))
 
     def clear(self):
         '''Clear this :class:`zset`.'''
-        self._sl = Skiplist()
-        self._dict.clear()
+        self._sl = None
+        self._dict = None
+        self._lp = []
 
     def rank(self, item):
         '''Return the rank (index) of ``item`` in this :class:`zset`.'''
+        lp = self._lp
+        if lp is not None:
+            i = listpack_index(lp, item, 1)
+            if i > 0:
+                return i // 2
+            return
         score = self._dict.get(item)
         if score is not None:
-            return self._sl.rank(score)
+            return self._sl.index(score, item)
+
+    def range_by_lex(self, minval=None, maxval=None, include_min=True,
+                     include_max=True, start=0, num=None):
+        '''Members between ``minval`` and ``maxval``, ``None`` for no
+        limit. Members are sorted by value only when they all have the
+        same score.'''
+        first = self._lex_rank(minval, not include_min, 0) + start
+        end = self._lex_rank(maxval, include_max, len(self))
+        if num is not None:
+            end = min(end, first + num)
+        return self.range(first, max(first, end))
+
+    def lex_count(self, minval=None, maxval=None, include_min=True,
+                  include_max=True):
+        '''Number of members between ``minval`` and ``maxval``'''
+        return max(self._lex_rank(maxval, include_max, len(self)) -
+                   self._lex_rank(minval, not include_min, 0), 0)
 
     def flat(self):
-        return self._sl.flat()
+        lp = self._lp
+        return self._sl.flat() if lp is None else tuple(lp)
+
+    def scan(self, cursor, count):
+        '''The cursor of the next scan and the members of a scan of the
+        sorted set, see :meth:`.Table.scan`. Listpacks are scanned at
+        once.'''
+        lp = self._lp
+        if lp is None:
+            return self._dict.scan(cursor, count)
+        return 0, lp[1::2]
 
     @classmethod
     def union(cls, zsets, weights, oper):
-        result = None
+        result = cls()
         for zset, weight in zip(zsets, weights):
-            if result is None:
-                result = cls()
-                sl = result._sl
-                for score, value in zset._sl:
-                    result.add(score*weight, value)
-            else:
-                for score, value in zset._sl:
-                    score *= weight
-                    existing = sl.score(value)
-                    if existing is not None:
-                        score = oper(score, existing)
-                    result.add(score, value)
+            for score, value in zset.items():
+                score *= weight
+                existing = result.score(value)
+                if existing is not None:
+                    score = oper((score, existing))
+                result.add(score, value)
         return result
 
     @classmethod
@@ -156,13 +274,85 @@ scores and values.'''
         for zset, weight in zip(zsets, weights):
             if result is None:
                 result = cls()
-                for score, value in zset._sl:
+                for score, value in zset.items():
                     if value in values:
                         result.add(score*weight, value)
             else:
-                for score, value in zset._sl:
+                for score, value in zset.items():
                     if value in values:
                         existing = result.score(value)
                         score = oper((score*weight, existing))
                         result.add(score, value)
         return result
+
+    def _scores(self):
+        lp = self._lp
+        if lp is None:
+            return dict(self._dict.items())
+        return dict(zip(lp[1::2], lp[::2]))
+
+    def _bounds(self, start, end):
+        N = len(self)
+        if start < 0:
+            start = max(N + start, 0)
+        if end is None:
+            end = N
+        elif end < 0:
+            end = max(N + end, 0)
+        else:
+            end = min(end, N)
+        return start, end
+
+    def _lex_rank(self, value, right, default):
+        if value is None:
+            return default
+        lp = self._lp
+        if lp is None:
+            return self._sl.lex_rank(value, right)
+        bisect = bisect_right if right else bisect_left
+        return bisect(lp[1::2], value)
+
+    def _bisect_entry(self, score, member):
+        # Position where to insert the ``score``, ``member`` pair
+        lp = self._lp
+        lo, hi = 0, len(lp) // 2
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sc = lp[2*mid]
+            if sc < score or (sc == score and lp[2*mid + 1] < member):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _bisect(self, score, right=False):
+        # Number of members with score less than ``score``, or less than
+        # or equal when ``right`` is True
+        lp = self._lp
+        lo, hi = 0, len(lp) // 2
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sc = lp[2*mid]
+            if sc < score or (right and sc == score):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _lp_range(self, start, end, scores):
+        lp = self._lp
+        if scores:
+            return zip(lp[2*start:2*end:2], lp[2*start+1:2*end:2])
+        return iter(lp[2*start+1:2*end:2])
+
+    def _lp_remove(self, start, end):
+        if start >= end:
+            return 0
+        del self._lp[2*start:2*end]
+        return end - start
+
+    def _convert(self):
+        lp = self._lp
+        self._lp = None
+        self._dict = HashTable(zip(lp[1::2], lp[::2]))
+        self._sl = self.engine(zip(lp[::2], lp[1::2]))
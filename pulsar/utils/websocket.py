@@ -105,10 +105,11 @@ def frame_parser(version=None, kind=0, extensions=None, protocols=None,
     :param protocols: not used at the moment
     :param pyparser: if ``True`` (default ``False``) uses the python frame
         parser implementation rather than the much faster cython
-        implementation.
+        implementation. The python implementation is always used when the
+        cython extension is not available.
     '''
     version = get_version(version)
-    Parser = FrameParser if pyparser else CFrameParser
+    Parser = FrameParser if pyparser or not CFrameParser else CFrameParser
     # extensions, protocols
     return Parser(version, kind, ProtocolError, close_codes=CLOSE_CODES)
 
@@ -389,7 +390,7 @@ class FrameParser:
 
     def _chunk(self, length):
         chunk = bytes(self.buffer[:length])
-        self.buffer = self.buffer[length:]
+        del self.buffer[:length]
         return chunk
 
 
@@ -52,6 +52,20 @@ async def spawn_actor_from_actor(actor, name):
     return actor2.aid
 
 
+async def send_to_peer(actor, aid):
+    pong = await send(aid, 'ping')
+    peer = actor.mailbox.peers.get(aid)
+    return pong, bool(peer and peer.result())
+
+
+def append_posted(actor, value):
+    actor.extra.setdefault('posted', []).append(value)
+
+
+def get_posted(actor):
+    return actor.extra.get('posted')
+
+
 def cause_timeout(actor):
     if actor.next_periodic_task:
         actor.next_periodic_task.cancel()
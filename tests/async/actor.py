@@ -1,9 +1,10 @@
 import pulsar
 from pulsar.apps.test import ActorTestMixin
-from pulsar import send, async_while
+from pulsar import send, post, async_while
 
 from tests.async import (add, get_test, spawn_actor_from_actor, close_mailbox,
-                         wait_for_stop, check_environ)
+                         wait_for_stop, check_environ, send_to_peer,
+                         append_posted, get_posted)
 
 
 class ActorTest(ActorTestMixin):
@@ -68,6 +69,29 @@ class ActorTest(ActorTestMixin):
         is_alive = await async_while(3, proxy_monitor2.is_alive)
         self.assertFalse(is_alive)
 
+    async def test_peer_mailbox(self):
+        proxy1 = await self.spawn_actor(
+            name='actor-test-peer1-%s' % self.concurrency)
+        proxy2 = await self.spawn_actor(
+            name='actor-test-peer2-%s' % self.concurrency)
+        info = await send(proxy2, 'info')
+        self.assertTrue(info['actor']['peer_address'])
+        address = await send('arbiter', 'peer_address', proxy2.aid)
+        self.assertEqual(tuple(address), tuple(info['actor']['peer_address']))
+        pong, direct = await send(proxy1, 'run', send_to_peer, proxy2.aid)
+        self.assertEqual(pong, 'pong')
+        self.assertTrue(direct)
+
+    async def test_post(self):
+        proxy = await self.spawn_actor(
+            name='actor-test-post-%s' % self.concurrency)
+        for value in range(100):
+            waiter = post(proxy, 'run', append_posted, value)
+            if waiter:
+                await waiter
+        posted = await send(proxy, 'run', get_posted)
+        self.assertEqual(posted, list(range(100)))
+
     async def test_config_command(self):
         proxy = await self.spawn_actor(
             name='actor-test-config-%s' % self.concurrency)
@@ -1,10 +1,12 @@
 '''Tests for arbiter and monitors.'''
+import os
 import unittest
 import asyncio
 
 import pulsar
 from pulsar import send, spawn, ACTOR_ACTION_TIMEOUT
 from pulsar.apps.test import ActorTestMixin, test_timeout
+from pulsar.async.mailbox import unix_mailbox
 
 from tests.async import cause_timeout, cause_terminate, wait_for_stop
 
@@ -36,6 +38,15 @@ class TestArbiterProcess(ActorTestMixin, unittest.TestCase):
             mailbox = monitor.mailbox
             self.assertFalse(hasattr(mailbox, 'request'))
 
+    def test_arbiter_mailbox_transport(self):
+        arbiter = pulsar.get_actor()
+        address = arbiter.mailbox.address
+        if unix_mailbox(arbiter.cfg):
+            self.assertIsInstance(address, str)
+            self.assertTrue(os.path.exists(address))
+        else:
+            self.assertIsInstance(address, tuple)
+
     def test_registered(self):
         '''Test the arbiter in its process domain'''
         arbiter = pulsar.get_actor()
@@ -0,0 +1,108 @@
+import json
+import unittest
+
+from pulsar import ImproperlyConfigured
+from pulsar.async import codecs
+from pulsar.async.codecs import pickle
+
+
+class JsonCodec(codecs.MailboxCodec):
+    name = 'test-json'
+    tag = b'j'
+
+    def dumps(self, data):
+        return json.dumps(data).encode('utf-8')
+
+    def loads(self, view):
+        return json.loads(bytes(view).decode('utf-8'))
+
+
+class TestCodecs(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        codecs.register_codec(JsonCodec)
+
+    def message(self, *args):
+        return {'command': 'echo', 'sender': 'abc', 'target': 'arbiter',
+                'args': args, 'kwargs': {}, 'ack': 'ackid123'}
+
+    def test_pickle(self):
+        codec = codecs.get_codec('pickle')
+        message = self.message(1, 'foo', b'bar')
+        body = codec.encode(message)
+        self.assertEqual(body[:1], codecs.PickleCodec.tag)
+        self.assertEqual(codecs.decode_message(body), message)
+
+    def test_pickle_out_of_band(self):
+        codec = codecs.get_codec('pickle')
+        if pickle.HIGHEST_PROTOCOL < 5:
+            self.skipTest('out-of-band buffers require pickle protocol 5 '
+                          'or the pickle5 package')
+        data = bytes(range(256))*100
+        message = self.message(pickle.PickleBuffer(data),
+                               pickle.PickleBuffer(b'small'))
+        body = codec.encode(message)
+        self.assertEqual(body[:1], codecs.OUT_OF_BAND)
+        self.assertTrue(body.endswith(data))
+        decoded = codecs.decode_message(body)
+        self.assertEqual(decoded['args'][0], data)
+        self.assertEqual(decoded['args'][1], b'small')
+
+    def test_shared_memory(self):
+        if codecs.SHARED_MEMORY_DIR is None:
+            self.skipTest('shared memory requires /dev/shm')
+        if pickle.HIGHEST_PROTOCOL < 5:
+            self.skipTest('shared memory requires pickle protocol 5')
+        codec = codecs.get_codec('pickle', 10000)
+        self.assertEqual(codec.shared_memory, 10000)
+        self.assertEqual(codecs.get_codec('pickle').shared_memory, 0)
+        data = bytes(range(256))*100
+        message = self.message(pickle.PickleBuffer(data),
+                               pickle.PickleBuffer(b'small'*1000))
+        body = codec.encode(message)
+        self.assertEqual(body[:1], codecs.SHARED)
+        self.assertFalse(data in body)
+        decoded = codecs.decode_message(body)
+        self.assertEqual(decoded['args'][0], data)
+        self.assertEqual(decoded['args'][1], b'small'*1000)
+        # the segment was unlinked by the receiver
+        self.assertRaises(FileNotFoundError, codecs.decode_message, body)
+
+    def test_callback(self):
+        codec = codecs.get_codec('pickle')
+        body = codec.encode({'command': 'callback', 'ack': 'ackid123',
+                             'result': None})
+        self.assertEqual(body, b'c\x08ackid123')
+        self.assertEqual(codecs.decode_message(body),
+                         {'command': 'callback', 'ack': 'ackid123',
+                          'result': None})
+        message = {'command': 'callback', 'ack': 'ackid123',
+                   'result': {'info': [1, 2]}}
+        self.assertEqual(codecs.decode_message(codec.encode(message)),
+                         message)
+
+    def test_custom_codec(self):
+        codec = codecs.get_codec('test-json')
+        message = self.message(1, 'foo')
+        body = codec.encode(message)
+        self.assertEqual(body[:1], b'j')
+        self.assertEqual(codecs.decode_message(body)['args'], [1, 'foo'])
+        # messages the codec cannot encode are pickled
+        message = self.message(b'bytes')
+        body = codec.encode(message)
+        self.assertEqual(body[:1], codecs.PickleCodec.tag)
+        self.assertEqual(codecs.decode_message(body), message)
+
+    def test_errors(self):
+        self.assertRaises(ImproperlyConfigured, codecs.get_codec, 'foo')
+        if codecs.msgpack is None:
+            self.assertRaises(ImproperlyConfigured, codecs.get_codec,
+                              'msgpack')
+        bad = type('BadCodec', (JsonCodec,), {'name': 'bad'})
+        self.assertRaises(ImproperlyConfigured, codecs.register_codec, bad)
+        bad.tag = codecs.CALLBACK
+        self.assertRaises(ImproperlyConfigured, codecs.register_codec, bad)
+        bad.tag = codecs.SHARED
+        self.assertRaises(ImproperlyConfigured, codecs.register_codec, bad)
+        self.assertRaises(ValueError, codecs.decode_message, b'zdata')
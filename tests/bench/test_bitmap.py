@@ -0,0 +1,66 @@
+import os
+import unittest
+from functools import reduce
+from itertools import zip_longest
+
+from pulsar.apps.ds.bitmap import bit_count, bit_op, bit_pos
+
+
+SIZE = 1 << 20
+
+
+def loop_count(array):
+    # the byte by byte popcount pulsar-ds used before the bitmap module
+    count = 0
+    for i in array:
+        i = i - ((i >> 1) & 0x55555555)
+        i = (i & 0x33333333) + ((i >> 2) & 0x33333333)
+        count += (((i + (i >> 4)) & 0x0F0F0F0F) * 0x01010101) >> 24
+    return count
+
+
+def loop_and(values):
+    return bytearray(reduce(lambda x, y: x & y, v)
+                     for v in zip_longest(*values, fillvalue=0))
+
+
+def loop_pos(array, bit):
+    for i, byte in enumerate(array):
+        if byte != (0 if bit else 255):
+            for j in range(8):
+                if (byte >> (7 - j)) & 1 == bit:
+                    return 8*i + j
+    return -1
+
+
+class TestBitmap(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 10
+
+    @classmethod
+    def setUpClass(cls):
+        cls.a = bytearray(os.urandom(SIZE))
+        cls.b = bytearray(os.urandom(SIZE))
+        cls.sparse = bytearray(SIZE)
+        cls.sparse[-1] = 1
+
+    def test_bitcount(self):
+        self.assertTrue(bit_count(self.a) > 0)
+
+    def test_bitop(self):
+        self.assertEqual(len(bit_op(b'and', [self.a, self.b])), SIZE)
+
+    def test_bitpos(self):
+        self.assertEqual(bit_pos(self.sparse, 1), 8*SIZE - 1)
+
+
+class TestBitmapLoop(TestBitmap):
+
+    def test_bitcount(self):
+        self.assertTrue(loop_count(self.a) > 0)
+
+    def test_bitop(self):
+        self.assertEqual(len(loop_and([self.a, self.b])), SIZE)
+
+    def test_bitpos(self):
+        self.assertEqual(loop_pos(self.sparse, 1), 8*SIZE - 1)
@@ -0,0 +1,39 @@
+import unittest
+from random import randint
+
+from pulsar.utils.structures import Set
+
+
+SIZE = 100000
+
+
+class LargeIntset(Set):
+    max_intset_entries = 2*SIZE
+
+
+class TestIntset(unittest.TestCase):
+    '''Large sets of integers, which need a raised max_intset_entries'''
+    __benchmark__ = True
+    __number__ = 10
+    structure = LargeIntset
+
+    @classmethod
+    def setUpClass(cls):
+        cls.set = cls.structure(b'%d' % (2*i) for i in range(SIZE))
+        cls.other = cls.structure(b'%d' % (3*i) for i in range(SIZE))
+
+    def test_add_discard(self):
+        member = b'%d' % (2*randint(0, SIZE) + 1)
+        self.set.add(member)
+        assert member in self.set
+        self.set.discard(member)
+
+    def test_add(self):
+        self.set.add(b'%d' % randint(0, 2*SIZE))
+
+    def test_intersection(self):
+        assert self.set.intersection(self.other)
+
+
+class TestHashtableSet(TestIntset):
+    structure = Set
@@ -0,0 +1,95 @@
+import unittest
+import asyncio
+
+import pulsar
+from pulsar import send, post
+from pulsar.async.codecs import SHARED_MEMORY_DIR, pickle
+
+
+def large_payload(actor, size):
+    return pickle.PickleBuffer(bytearray(size))
+
+
+class TestMailbox(unittest.TestCase):
+    '''Throughput of messages between actors'''
+    __benchmark__ = True
+    __number__ = 10
+    _sizes = {'tiny': 10,
+              'small': 100,
+              'normal': 1000,
+              'big': 10000,
+              'huge': 100000}
+    concurrency = 'process'
+    proxy = None
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        cls.payload = bytearray(1 << 20)
+        cls.proxy = await pulsar.spawn(name='bench_mailbox',
+                                       concurrency=cls.concurrency)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.proxy is not None:
+            return send(cls.proxy, 'stop')
+
+    async def test_ping(self):
+        result = await asyncio.gather(*[send(self.proxy, 'ping')
+                                        for _ in range(self.size)])
+        self.assertEqual(len(result), self.size)
+
+    async def test_echo(self):
+        message = {'key': 'value', 'list': [1, 2, 3]}
+        result = await asyncio.gather(*[send(self.proxy, 'echo', message)
+                                        for _ in range(self.size)])
+        self.assertEqual(result[-1], message)
+
+    async def test_post(self):
+        for _ in range(self.size):
+            waiter = post(self.proxy, 'echo', 'hello')
+            if waiter:
+                await waiter
+        self.assertEqual(await send(self.proxy, 'ping'), 'pong')
+
+    async def test_echo_large(self):
+        result = await send(self.proxy, 'echo', self.payload)
+        self.assertEqual(len(result), len(self.payload))
+
+
+class TestMailboxThread(TestMailbox):
+    concurrency = 'thread'
+
+
+@unittest.skipUnless(SHARED_MEMORY_DIR and pickle.HIGHEST_PROTOCOL >= 5,
+                     'shared memory requires /dev/shm and pickle protocol 5')
+class TestSharedMemory(unittest.TestCase):
+    '''Large payloads between process actors, passed in shared memory
+    segments or written on the mailbox connection'''
+    __benchmark__ = True
+    __number__ = 10
+    size = 50 * 2**20
+    shared = None
+    socket = None
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.shared = await pulsar.spawn(name='bench_shared_memory',
+                                        concurrency='process')
+        cls.socket = await pulsar.spawn(name='bench_socket',
+                                        concurrency='process',
+                                        mailbox_shared_memory=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        return asyncio.gather(*[send(proxy, 'stop')
+                                for proxy in (cls.shared, cls.socket)
+                                if proxy is not None])
+
+    async def test_shared_memory(self):
+        result = await send(self.shared, 'run', large_payload, self.size)
+        self.assertEqual(len(result), self.size)
+
+    async def test_socket(self):
+        result = await send(self.socket, 'run', large_payload, self.size)
+        self.assertEqual(len(result), self.size)
@@ -0,0 +1,45 @@
+import unittest
+
+import pulsar
+from pulsar.apps.ds import PulsarDS
+from pulsar.apps.data import create_store
+
+
+class PulsarDsPipeline(unittest.TestCase):
+    '''Throughput of pipelined commands'''
+    __benchmark__ = True
+    __number__ = 10
+    _sizes = {'tiny': 10,
+              'small': 100,
+              'normal': 1000,
+              'big': 10000,
+              'huge': 100000}
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        cls.size = cls._sizes[cls.cfg.size]
+        server = PulsarDS(name='bench_pulsards', bind='127.0.0.1:0')
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.store = create_store('pulsar://%s:%s/9' % cls.app_cfg.addresses[0])
+        cls.client = cls.store.client()
+        await cls.client.set('bench', 'hello')
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def test_get(self):
+        pipe = self.client.pipeline()
+        for _ in range(self.size):
+            pipe.get('bench')
+        result = await pipe.commit()
+        self.assertEqual(len(result), self.size)
+
+    async def test_incr(self):
+        pipe = self.client.pipeline()
+        for _ in range(self.size):
+            pipe.incr('bench_counter')
+        result = await pipe.commit()
+        self.assertEqual(len(result), self.size)
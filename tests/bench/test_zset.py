@@ -0,0 +1,39 @@
+import unittest
+from random import random, randint
+
+from pulsar.utils.structures import Skiplist, BlockList
+
+
+SIZE = 100000
+
+
+class TestSkiplist(unittest.TestCase):
+    __benchmark__ = True
+    __number__ = 100
+    structure = Skiplist
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = [(random(), 'member%d' % i) for i in range(SIZE)]
+        cls.sl = cls.structure(cls.data)
+
+    def test_insert_remove(self):
+        score, value = self.data[randint(0, SIZE - 1)]
+        self.sl.remove(score, value)
+        self.sl.insert(score, value)
+
+    def test_index(self):
+        score, value = self.data[randint(0, SIZE - 1)]
+        assert self.sl.index(score, value) is not None
+
+    def test_range(self):
+        start = randint(0, SIZE - 100)
+        assert len(list(self.sl.range(start, start + 100))) == 100
+
+    def test_range_by_score(self):
+        minval = random()
+        assert list(self.sl.range_by_score(minval, minval + 0.001))
+
+
+class TestBlockList(TestSkiplist):
+    structure = BlockList
@@ -0,0 +1,128 @@
+import unittest
+
+import pulsar
+from pulsar.apps.ds import PulsarDS, ResponseError
+from pulsar.apps.ds.eviction import KeyTable, EvictionPool, access
+from pulsar.utils.structures import ExpiryHeap
+
+from tests.stores.test_pulsards import StoreMixin, Listener
+
+
+class EvictionMixin(StoreMixin):
+    app_cfg = None
+    policy = 'noeviction'
+    maxmemory = '200kb'
+
+    @classmethod
+    async def setUpClass(cls):
+        name = cls.__name__.lower()
+        server = PulsarDS(name=name,
+                          bind='127.0.0.1:0',
+                          key_value_maxmemory=cls.maxmemory,
+                          key_value_maxmemory_policy=cls.policy,
+                          key_value_notify_keyspace_events='Ee')
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        address = 'pulsar://%s:%s/9' % cls.app_cfg.addresses[0]
+        cls.store = cls.create_store(address)
+        cls.client = cls.store.client()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def fill(self, prefix, count, ex=None):
+        value = 'x'*1000
+        for i in range(count):
+            await self.client.set('%s%s' % (prefix, i), value, ex=ex)
+
+
+class TestNoEviction(EvictionMixin, unittest.TestCase):
+
+    async def test_oom(self):
+        c = self.client
+        info = await c.info()
+        self.assertEqual(info['maxmemory'], 200*1024)
+        self.assertEqual(info['maxmemory_policy'], 'noeviction')
+        await self.wait.assertRaises(ResponseError, self.fill, 'a', 400)
+        info = await c.info()
+        self.assertEqual(info['evicted_keys'], 0)
+        self.assertTrue(info['used_memory'] > 200*1024)
+        # reading and deleting is allowed
+        self.assertEqual(await c.get('a0'), b'x'*1000)
+        self.assertEqual(await c.delete('a0', 'a1'), 2)
+        self.assertEqual(await c.flushdb(), True)
+        info = await c.info()
+        self.assertEqual(info['used_memory'], 0)
+
+
+class TestAllKeysLru(EvictionMixin, unittest.TestCase):
+    policy = 'allkeys-lru'
+
+    async def test_evict(self):
+        c = self.client
+        pubsub = c.pubsub()
+        listener = Listener()
+        pubsub.add_client(listener)
+        await pubsub.subscribe('__keyevent@9__:evicted')
+        await self.fill('a', 400)
+        info = await c.info()
+        self.assertTrue(info['evicted_keys'] > 0)
+        # keys are evicted before executing commands
+        self.assertTrue(info['used_memory'] <= 202*1024)
+        self.assertTrue(await c.dbsize() < 400)
+        channel, key = await listener.get()
+        self.assertEqual(channel, '__keyevent@9__:evicted')
+        self.assertTrue(key.startswith(b'a'))
+        self.assertFalse(await c.exists(key))
+
+
+class TestVolatileTtl(EvictionMixin, unittest.TestCase):
+    policy = 'volatile-ttl'
+
+    async def test_evict(self):
+        c = self.client
+        await self.fill('p', 100)
+        await self.fill('v', 300, ex=1000)
+        info = await c.info()
+        self.assertTrue(info['evicted_keys'] > 0)
+        for i in range(100):
+            self.assertTrue(await c.exists('p%s' % i))
+        # only persistent keys left
+        await self.wait.assertRaises(ResponseError, self.fill, 'q', 300)
+
+
+class SampleDb:
+
+    def __init__(self, num=0):
+        self._num = num
+        self._deadlines = ExpiryHeap()
+        self._keys_meta = KeyTable()
+
+
+class TestEvictionPool(unittest.TestCase):
+
+    def test_rescore_lru(self):
+        db = SampleDb()
+        pool = EvictionPool('allkeys-lru', 100)
+        for key in (b'a', b'b', b'c'):
+            db._keys_meta.set(key, access(None, 100 + len(db._keys_meta)))
+        pool.populate(db, 200)
+        # the oldest key is accessed after sampling
+        db._keys_meta.set(b'a', access(db._keys_meta.get(b'a'), 200))
+        db._keys_meta.remove(b'b')
+        self.assertEqual(pool.pop({0: db}, 200), (0, b'c'))
+        self.assertEqual(pool.pop({0: db}, 200), (0, b'a'))
+        self.assertEqual(pool.pop({0: db}, 200), None)
+
+    def test_rescore_volatile(self):
+        db = SampleDb()
+        pool = EvictionPool('volatile-ttl', 100)
+        db._deadlines.set(b'a', 10)
+        db._deadlines.set(b'b', 20)
+        pool.populate(db, 0)
+        # a is persisted, b gets a shorter time to live
+        db._deadlines.discard(b'a')
+        db._deadlines.set(b'b', 5)
+        self.assertEqual(pool.pop({0: db}, 0), (0, b'b'))
+        self.assertEqual(pool.pop({0: db}, 0), None)
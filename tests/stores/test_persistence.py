@@ -0,0 +1,186 @@
+import io
+import os
+import asyncio
+import tempfile
+import unittest
+
+import pulsar
+from pulsar.apps.ds import PulsarDS
+from pulsar.apps.ds.snapshot import (SnapshotWriter, SnapshotReader,
+                                     SnapshotError)
+from pulsar.utils.structures import Hash, Set, Deque, Zset
+
+from tests.stores.test_pulsards import StoreMixin
+
+
+class PersistenceMixin(StoreMixin):
+    app_cfg = None
+    server_params = {}
+
+    @classmethod
+    def setUpClass(cls):
+        name = cls.__name__.lower()
+        cls.filename = os.path.join(tempfile.gettempdir(),
+                                    '%s_%s' % (cls.randomkey(6), name))
+        cls.counter = 0
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.isfile(cls.filename):
+            os.remove(cls.filename)
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def start_server(self):
+        '''Start a new server, stopping the running one'''
+        cls = type(self)
+        if cls.app_cfg is not None:
+            await pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+        cls.counter += 1
+        server = PulsarDS(name='%s%s' % (cls.__name__.lower(), cls.counter),
+                          bind='127.0.0.1:0',
+                          **self.server_params)
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        address = 'pulsar://%s:%s/9' % cls.app_cfg.addresses[0]
+        return self.create_store(address).client()
+
+    async def wait_info(self, client, name):
+        info = await client.info()
+        while info[name]:
+            await asyncio.sleep(0.05)
+            info = await client.info()
+        return info
+
+    async def populate(self, c):
+        eq = self.assertEqual
+        eq(await c.set('string', 'hello'), True)
+        eq(await c.set('volatile', 'foo', ex=1000), True)
+        eq(await c.append('string', ' world'), 11)
+        eq(await c.rpush('list', 'a', 'b', 'c'), 3)
+        eq(await c.lpop('list'), b'a')
+        eq(await c.sadd('set', 'a', 'b', 'c'), 3)
+        eq(await c.hmset('hash', {'a': '1', 'b': '2'}), True)
+        eq(await c.zadd('zset', 1.5, 'a', -2, 'b'), 2)
+        eq(await c.incr('counter'), 1)
+        eq(await c.expire('counter', 1000), True)
+        eq(await c.set('deleted', 'bla'), True)
+        eq(await c.delete('deleted'), 1)
+
+    async def check(self, c):
+        eq = self.assertEqual
+        eq(await c.get('string'), b'hello world')
+        eq(await c.get('volatile'), b'foo')
+        ttl = await c.ttl('volatile')
+        self.assertTrue(990 < ttl <= 1000)
+        eq(await c.lrange('list', 0, -1), [b'b', b'c'])
+        eq(await c.smembers('set'), set((b'a', b'b', b'c')))
+        eq(await c.hgetall('hash'), {b'a': b'1', b'b': b'2'})
+        zset = await c.zrange('zset', 0, -1, withscores=True)
+        eq(list(zset.items()), [(-2.0, b'b'), (1.5, b'a')])
+        eq(await c.get('counter'), b'1')
+        self.assertTrue(await c.ttl('counter') > 990)
+        eq(await c.exists('deleted'), False)
+
+
+class TestAppendOnlyFile(PersistenceMixin, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server_params = dict(key_value_appendonly=True,
+                                 key_value_appendfilename=cls.filename,
+                                 key_value_appendfsync='always')
+
+    async def test_replay_and_rewrite(self):
+        c = await self.start_server()
+        info = await c.info()
+        self.assertEqual(info['aof_enabled'], 1)
+        await self.populate(c)
+        # blocking pop served by a push
+        c2 = self.create_store(c.store.dns).client()
+        waiter = asyncio.ensure_future(c2.blpop('queue', 10))
+        await asyncio.sleep(0.1)
+        self.assertEqual(await c.rpush('queue', 'x', 'y'), 2)
+        self.assertEqual(await waiter, (b'queue', b'x'))
+        # the member popped is logged
+        members = set(('m%d' % i).encode('utf-8') for i in range(50))
+        self.assertEqual(await c.sadd('popset', *members), 50)
+        members.discard(await c.spop('popset'))
+        self.assertTrue(os.path.getsize(self.filename) > 0)
+        #
+        c = await self.start_server()
+        await self.check(c)
+        self.assertEqual(await c.lrange('queue', 0, -1), [b'y'])
+        self.assertEqual(await c.smembers('popset'), members)
+        #
+        size = os.path.getsize(self.filename)
+        self.assertEqual(await c.bgrewriteaof(),
+                         b'Background append only file rewriting started')
+        info = await self.wait_info(c, 'aof_rewrite_in_progress')
+        self.assertEqual(info['aof_last_bgrewrite_status'], 'ok')
+        self.assertTrue(os.path.getsize(self.filename) < size)
+        # commands received after the rewrite are kept
+        self.assertEqual(await c.rpush('queue', 'z'), 2)
+        #
+        c = await self.start_server()
+        await self.check(c)
+        self.assertEqual(await c.lrange('queue', 0, -1), [b'y', b'z'])
+
+
+class TestSnapshot(PersistenceMixin, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server_params = dict(key_value_save=[(3600, 1000000)],
+                                 key_value_filename=cls.filename)
+
+    async def test_save_and_load(self):
+        c = await self.start_server()
+        await self.populate(c)
+        self.assertEqual(await c.save(), True)
+        # save in a multiprocessing.Process
+        self.server_params['key_value_save_mode'] = 'process'
+        c = await self.start_server()
+        await self.check(c)
+        self.assertEqual(await c.set('process', 'yes'), True)
+        self.assertEqual(await c.bgsave(), True)
+        await self.wait_info(c, 'rdb_bgsave_in_progress')
+        #
+        c = await self.start_server()
+        await self.check(c)
+        self.assertEqual(await c.get('process'), b'yes')
+
+    def test_format(self):
+        stream = io.BytesIO()
+        writer = SnapshotWriter(stream, [0, 3])
+        writer.select(0)
+        writer.add(b'a', bytearray(b'foo'))
+        writer.add(b'b', Deque((b'x', b'y')), 1000)
+        writer.select(3)
+        writer.add(b'c', Zset(((1.5, b'x'), (-1, b'y'))))
+        writer.add(b'd', Hash(((b'x', b'1'),)))
+        writer.add(b'e', Set((b'x',)))
+        writer.close()
+        data = stream.getvalue()
+        reader = SnapshotReader(io.BytesIO(data))
+        self.assertEqual(reader.databases, [0, 3])
+        records = list(reader)
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[0], (0, b'a', bytearray(b'foo'), None))
+        self.assertEqual(records[1][3], 1000)
+        self.assertEqual(list(records[1][2]), [b'x', b'y'])
+        self.assertEqual(records[2], (0, None, None, None))
+        self.assertEqual(list(records[3][2].items()),
+                         [(-1.0, b'y'), (1.5, b'x')])
+        self.assertEqual(records[4][2], {b'x': b'1'})
+        self.assertEqual(records[5][2], set((b'x',)))
+        self.assertEqual(records[6], (3, None, None, None))
+        # corrupted data
+        data = bytearray(data)
+        data[20] ^= 1
+        reader = SnapshotReader(io.BytesIO(bytes(data)))
+        self.assertRaises(SnapshotError, list, reader)
+        reader = SnapshotReader(io.BytesIO(bytes(data[:40])))
+        self.assertRaises(SnapshotError, list, reader)
+        self.assertRaises(SnapshotError, SnapshotReader, io.BytesIO(b'foo'))
@@ -1,5 +1,7 @@
+import os
 import binascii
 import time
+import tempfile
 import json
 import unittest
 import asyncio
@@ -24,6 +26,18 @@ class Listener:
         return self._messages.get()
 
 
+class KeyListener(Listener):
+    '''Listener ignoring keyevent notifications of keys other than
+    ``key``, which other tests may change at the same time'''
+    def __init__(self, key):
+        super().__init__()
+        self.key = key.encode('utf-8')
+
+    def __call__(self, channel, message):
+        if not channel.startswith('__keyevent@') or message == self.key:
+            super().__call__(channel, message)
+
+
 class StringProtocol:
 
     def encode(self, message):
@@ -90,6 +104,21 @@ class RedisCommands(StoreMixin):
         eq(await c.restore(key+'2', 0, value), True)
         eq(await c.get(key+'2'), b'hello')
 
+    async def test_dump_restore_collections(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.hmset(key, {'a': '1', 'b': '2'}), True)
+        eq(await c.zadd(key+'z', 1, 'a', 2, 'b'), 2)
+        eq(await c.restore(key+'2', 0, await c.dump(key)), True)
+        eq(await c.restore(key+'z2', 0, await c.dump(key+'z')), True)
+        eq(await c.hgetall(key+'2'), {b'a': b'1', b'b': b'2'})
+        eq(await c.type(key+'2'), 'hash')
+        eq(await c.zrange(key+'z2', 0, -1), [b'a', b'b'])
+        eq(await c.type(key+'z2'), 'zset')
+        eq(await c.hset(key+'2', 'c', '3'), 1)
+        eq(await c.execute('object', 'encoding', key+'2'), b'listpack')
+
     async def test_exists(self):
         key = self.randomkey()
         c = self.client
@@ -129,6 +158,21 @@ class RedisCommands(StoreMixin):
         eq(await c.ttl(key), -1)
         eq(await c.persist(key), False)
 
+    async def test_expire_refresh(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.set(key, 1, px=50), True)
+        eq(await c.expire(key, 10), True)
+        await asyncio.sleep(0.1)
+        eq(await c.exists(key), True)
+        ttl = await c.ttl(key)
+        self.assertTrue(ttl > 0 and ttl <= 10)
+        eq(await c.pexpire(key, 10), True)
+        await asyncio.sleep(0.05)
+        eq(await c.exists(key), False)
+        eq(await c.ttl(key), -2)
+
     async def test_keys(self):
         key = self.randomkey()
         keya = '%s_a' % key
@@ -145,6 +189,38 @@ class RedisCommands(StoreMixin):
         self.assertEqual(set(k1), keys_with_underscores)
         self.assertEqual(set(k2), keys)
 
+    async def test_scan(self):
+        base = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        keys = set(('%s_%s' % (base, i)).encode('utf-8') for i in range(100))
+        for key in keys:
+            await c.set(key, 1)
+        await c.sadd('%sset' % base, 'a')
+        cursor, found = 0, set()
+        while True:
+            cursor, result = await c.scan(cursor, match='%s_*' % base,
+                                          count=7)
+            found.update(result)
+            # keys removed during the iteration
+            if found and len(found) < 50:
+                await c.delete(found.pop())
+            if not cursor:
+                break
+        remaining = set(await c.keys('%s_*' % base))
+        self.assertTrue(remaining.issubset(found))
+        self.assertTrue(len(remaining) > 50)
+        cursor, found = 0, set()
+        while True:
+            cursor, result = await c.scan(cursor, match='%s*' % base,
+                                          type='set')
+            found.update(result)
+            if not cursor:
+                break
+        eq(found, set((('%sset' % base).encode('utf-8'),)))
+        await self.wait.assertRaises(ResponseError, c.scan, 'bla')
+        await self.wait.assertRaises(ResponseError, c.scan, 0, count=0)
+
     async def test_move(self):
         key = self.randomkey()
         c = self.client
@@ -296,6 +372,50 @@ class RedisCommands(StoreMixin):
         self.assertEqual(int(binascii.hexlify(res2), 16), 0x0102FFFF)
         self.assertEqual(int(binascii.hexlify(res3), 16), 0x000000FF)
 
+    async def test_bitpos(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.execute('bitpos', key, 1), -1)
+        eq(await c.execute('bitpos', key, 0), 0)
+        eq(await c.set(key, b'\xff\xf0\x00'), True)
+        eq(await c.execute('bitpos', key, 0), 12)
+        eq(await c.execute('bitpos', key, 1, 1), 8)
+        eq(await c.execute('bitpos', key, 1, 2, -1), -1)
+        eq(await c.execute('bitpos', key, 1, 7, 15, 'bit'), 7)
+        eq(await c.set(key, b'\xff\xff'), True)
+        eq(await c.execute('bitpos', key, 0), 16)
+        eq(await c.execute('bitpos', key, 0, 0, -1), -1)
+        eq(await c.execute('bitcount', key, 5, 12, 'bit'), 8)
+        await self.wait.assertRaises(ResponseError, c.execute, 'bitpos',
+                                     key, 2)
+
+    async def test_bitfield(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+
+        async def bitfield(*args):
+            result = await c.execute('bitfield', key, *args)
+            return [None if v is None else int(v) for v in result]
+
+        eq(await bitfield('get', 'u8', 0), [0])
+        eq(await c.exists(key), False)
+        eq(await bitfield('set', 'i8', 0, -2, 'get', 'u8', 0), [0, 254])
+        eq(await bitfield('incrby', 'u2', 100, 1, 'overflow', 'sat',
+                          'incrby', 'u2', 102, 5), [1, 3])
+        eq(await bitfield('overflow', 'fail', 'incrby', 'u2', 100, 3,
+                          'overflow', 'wrap', 'incrby', 'u2', 100, 3),
+           [None, 0])
+        eq(await bitfield('set', 'u4', '#1', 17, 'get', 'u4', 4), [14, 1])
+        eq(await c.get(key), b'\xf1' + b'\x00'*11 + b'\x03')
+        await self.wait.assertRaises(ResponseError, c.execute, 'bitfield',
+                                     key, 'get', 'u64', 0)
+        await self.wait.assertRaises(ResponseError, c.execute, 'bitfield',
+                                     key, 'overflow', 'none')
+        await self.wait.assertRaises(ResponseError, c.execute,
+                                     'bitfield_ro', key, 'set', 'u8', 0, 1)
+
     async def test_decr(self):
         key = self.randomkey()
         c = self.client
@@ -592,6 +712,50 @@ class RedisCommands(StoreMixin):
         await self._remove_and_push(key)
         await self.wait.assertRaises(ResponseError, c.hsetnx, key, 'a', 'jk')
 
+    async def test_hscan(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.hscan(key), (0, {}))
+        data = dict((('f%s' % i).encode('utf-8'), str(i).encode('utf-8'))
+                    for i in range(30))
+        eq(await c.hmset(key, data), True)
+        cursor, found = 0, {}
+        while True:
+            cursor, result = await c.hscan(key, cursor, count=4)
+            found.update(result)
+            if not cursor:
+                break
+        eq(found, data)
+        cursor, result = await c.hscan(key, match='f1*', count=100)
+        eq(cursor, 0)
+        eq(set(result), set((b'f1',) + tuple(('f1%s' % i).encode('utf-8')
+                                             for i in range(10))))
+        await c.set(key, 1)
+        await self.wait.assertRaises(ResponseError, c.hscan, key)
+
+    async def test_hscan_hashtable(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        data = dict((('f%s' % i).encode('utf-8'), str(i).encode('utf-8'))
+                    for i in range(300))
+        eq(await c.hmset(key, data), True)
+        cursor, found, i = 0, {}, 0
+        while True:
+            cursor, result = await c.hscan(key, cursor, match='f*', count=30)
+            found.update(result)
+            await c.hdel(key, 'f%s' % i)
+            data.pop(('f%s' % i).encode('utf-8'))
+            await c.hmset(key, dict(('g%s-%s' % (i, j), j)
+                                    for j in range(100)))
+            i += 1
+            if not cursor:
+                break
+        eq(i, 10)
+        self.assertTrue(set(data).issubset(found))
+        self.assertFalse([f for f in found if f.startswith(b'g')])
+
     ###########################################################################
     #    LISTS
     async def test_blpop(self):
@@ -934,6 +1098,11 @@ class RedisCommands(StoreMixin):
         randoms = await c.srandmember(key, 2)
         self.assertEqual(len(randoms), 2)
         self.assertEqual(set(randoms).intersection(s), set(randoms))
+        # repeated members of the intset are picked at random
+        randoms = await c.srandmember(key, -50)
+        self.assertEqual(len(randoms), 50)
+        self.assertTrue(len(set(randoms)) > 1)
+        self.assertEqual(set(randoms).intersection(s), set(randoms))
 
     async def test_srem(self):
         key = self.randomkey()
@@ -968,6 +1137,44 @@ class RedisCommands(StoreMixin):
         eq(await c.sunionstore(des, key, key2), 4)
         eq(await c.smembers(des), set([b'1', b'2', b'3', b'4']))
 
+    async def test_sscan(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.sscan(key), (0, []))
+        members = set(('m%s' % i).encode('utf-8') for i in range(25))
+        eq(await c.sadd(key, *members), 25)
+        cursor, found = 0, set()
+        while True:
+            cursor, result = await c.sscan(key, cursor, match='m*', count=3)
+            found.update(result)
+            if not cursor:
+                break
+        eq(found, members)
+        await self.wait.assertRaises(ResponseError, c.sscan, key, 0,
+                                     count='x')
+
+    async def test_sscan_hashtable(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        members = set(('m%s' % i).encode('utf-8') for i in range(300))
+        eq(await c.sadd(key, *members), 300)
+        cursor, found, i = 0, set(), 0
+        while True:
+            cursor, result = await c.sscan(key, cursor, count=20)
+            found.update(result)
+            # removing and adding members does not cause others to be
+            # missed, nor the scan to take more calls
+            await c.srem(key, 'm%s' % i)
+            members.discard(('m%s' % i).encode('utf-8'))
+            await c.sadd(key, *('n%s-%s' % (i, j) for j in range(100)))
+            i += 1
+            if not cursor:
+                break
+        eq(i, 15)
+        self.assertTrue(members.issubset(found))
+
     ###########################################################################
     #    SORTED SETS
     async def test_zadd_zcard(self):
@@ -1079,6 +1286,22 @@ class RedisCommands(StoreMixin):
         eq(await c.zrangebyscore(key, 2, 4, withscores=True),
            Zset([(2.0, b'a2'), (3.0, b'a3'), (4.0, b'a4')]))
 
+    async def test_zrangebylex(self):
+        key = self.randomkey()
+        eq = self.assertEqual
+        c = self.client
+        eq(await c.zadd(key, 0, 'a', 0, 'b', 0, 'c', 0, 'd', 0, 'e'), 5)
+        eq(await c.zrangebylex(key, '-', '+'), [b'a', b'b', b'c', b'd', b'e'])
+        eq(await c.zrangebylex(key, '[b', '(d'), [b'b', b'c'])
+        eq(await c.zrangebylex(key, '(b', '+', 'limit', 1, 2), [b'd', b'e'])
+        eq(await c.zrangebylex(key, '+', '-'), [])
+        eq(await c.zlexcount(key, '-', '+'), 5)
+        eq(await c.zlexcount(key, '[aa', '[c'), 2)
+        await self.wait.assertRaises(ResponseError, c.zrangebylex, key,
+                                     'b', '+')
+        await self.wait.assertRaises(ResponseError, c.zlexcount, key,
+                                     '-', 'c')
+
     async def test_zrank(self):
         key = self.randomkey()
         eq = self.assertEqual
@@ -1120,6 +1343,43 @@ class RedisCommands(StoreMixin):
         eq(await c.zremrangebyscore(key, 2, 4), 0)
         eq(await c.zrange(key, 0, -1), [b'a1', b'a5'])
 
+    async def test_zscan(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.zadd(key, 1, 'a', 2, 'b', 3, 'c'), 3)
+        cursor, found = 0, []
+        while True:
+            cursor, result = await c.zscan(key, cursor, count=2)
+            found.extend(result)
+            if not cursor:
+                break
+        eq(sorted(found), [(b'a', 1.0), (b'b', 2.0), (b'c', 3.0)])
+
+    async def test_zscan_engine(self):
+        key = self.randomkey()
+        c = self.client
+        eq = self.assertEqual
+        members = dict(('m%s' % i, i) for i in range(200))
+        eq(await c.zadd(key, **members), 200)
+        cursor, found, i = 0, {}, 0
+        while True:
+            cursor, result = await c.zscan(key, cursor, count=20)
+            found.update(result)
+            # changing scores, removing and adding members does not cause
+            # others to be missed
+            await c.zincrby(key, 1000, 'm%s' % (199 - i))
+            await c.zrem(key, 'm%s' % i)
+            members.pop('m%s' % i)
+            await c.zadd(key, **dict(('n%s-%s' % (i, j), j)
+                                     for j in range(50)))
+            i += 1
+            if not cursor:
+                break
+        eq(i, 10)
+        self.assertTrue(set(m.encode('utf-8') for m in members)
+                        .issubset(found))
+
     ###########################################################################
     #    CONNECTION
     async def test_ping(self):
@@ -1242,8 +1502,11 @@ class TestPulsarStore(RedisCommands, unittest.TestCase):
 
     @classmethod
     async def setUpClass(cls):
-        server = PulsarDS(name=cls.__name__.lower(),
+        name = cls.__name__.lower()
+        cls.filename = os.path.join(tempfile.gettempdir(), '%s.rdb' % name)
+        server = PulsarDS(name=name,
                           bind='127.0.0.1:0',
+                          key_value_filename=cls.filename,
                           redis_py_parser=cls.redis_py_parser)
         cls.app_cfg = await pulsar.send('arbiter', 'run', server)
         cls.pulsards_uri = 'pulsar://%s:%s' % cls.app_cfg.addresses[0]
@@ -1252,6 +1515,8 @@ class TestPulsarStore(RedisCommands, unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        if os.path.isfile(cls.filename):
+            os.remove(cls.filename)
         if cls.app_cfg is not None:
             return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
 
@@ -1264,6 +1529,283 @@ class TestPulsarStore(RedisCommands, unittest.TestCase):
         self.assertEqual(store.encoding, 'utf-8')
         self.assertTrue(repr(store))
 
+    async def test_active_expire(self):
+        c = self.client
+        base = self.randomkey()
+        info = await c.info()
+        expired = info['expired_keys']
+        for i in range(50):
+            await c.set('%s_%s' % (base, i), i, px=10)
+        await asyncio.sleep(0.5)
+        info = await c.info()
+        self.assertTrue(info['expired_keys'] - expired >= 50)
+
+    async def test_object_encoding(self):
+        c = self.client
+        eq = self.assertEqual
+        key = self.randomkey()
+        eq(await c.execute('object', 'encoding', key), None)
+        eq(await c.hmset(key, {'a': '1', 'b': '2'}), True)
+        eq(await c.execute('object', 'encoding', key), b'listpack')
+        eq(await c.hmset(key, dict(('f%s' % i, i) for i in range(200))),
+           True)
+        eq(await c.execute('object', 'encoding', key), b'hashtable')
+        eq(await c.hget(key, 'f199'), b'199')
+        eq(await c.hlen(key), 202)
+        key = self.randomkey()
+        eq(await c.sadd(key, 'a', 'b'), 2)
+        eq(await c.execute('object', 'encoding', key), b'listpack')
+        eq(await c.sadd(key, 'x'*100), 1)
+        eq(await c.execute('object', 'encoding', key), b'hashtable')
+        eq(await c.smembers(key), set((b'a', b'b', b'x'*100)))
+        key = self.randomkey()
+        eq(await c.zadd(key, 1, 'a', 2, 'b'), 2)
+        eq(await c.execute('object', 'encoding', key), b'listpack')
+        eq(await c.zadd(key, *[v for i in range(200)
+                               for v in (i, 'm%s' % i)]), 200)
+        eq(await c.execute('object', 'encoding', key), b'blocklist')
+        eq(await c.zrange(key, 0, 2), [b'm0', b'a', b'm1'])
+        key = self.randomkey()
+        eq(await c.rpush(key, 'a'), 1)
+        eq(await c.execute('object', 'encoding', key), b'quicklist')
+        eq(await c.execute('object', 'refcount', key), 1)
+        await self.wait.assertRaises(ResponseError, c.execute, 'object',
+                                     'foo', key)
+
+    async def test_intset(self):
+        c = self.client
+        eq = self.assertEqual
+        key1, key2, des = self.randomkey(), self.randomkey(), self.randomkey()
+        eq(await c.sadd(key1, *range(0, 300, 3)), 100)
+        eq(await c.sadd(key2, *range(0, 300, 2)), 150)
+        eq(await c.execute('object', 'encoding', key1), b'intset')
+        eq(await c.sinter(key1, key2),
+           set(b'%d' % i for i in range(0, 300, 6)))
+        eq(await c.sinterstore(des, key1, key2), 50)
+        eq(await c.execute('object', 'encoding', des), b'intset')
+        eq(await c.sdiffstore(des, key1, key2), 50)
+        eq(await c.sismember(des, 3), True)
+        eq(await c.sismember(des, 6), False)
+        eq(await c.sunionstore(des, key1, key2), 200)
+        eq(await c.sadd(des, 'foo'), 1)
+        eq(await c.execute('object', 'encoding', des), b'hashtable')
+        eq(await c.scard(des), 201)
+
+    async def test_blocked_fifo(self):
+        c = self.client
+        eq = self.assertEqual
+        key = self.randomkey()
+        clients = [self.create_store('%s/9' % self.pulsards_uri).client()
+                   for _ in range(3)]
+        waiters = []
+        for client in clients:
+            waiters.append(asyncio.ensure_future(client.brpop(key, 10)))
+            await asyncio.sleep(0.05)
+        # other tests block clients at the same time
+        self.assertFalse(any(waiter.done() for waiter in waiters))
+        info = await c.info()
+        self.assertTrue(info['blocked_clients'] >= 3)
+        self.assertTrue(info['blocked_keys'] >= 1)
+        # two elements wake the two clients which blocked first
+        eq(await c.lpush(key, 'a', 'b'), 2)
+        bkey = key.encode('utf-8')
+        eq(await waiters[0], (bkey, b'a'))
+        eq(await waiters[1], (bkey, b'b'))
+        self.assertFalse(waiters[2].done())
+        eq(await c.rpush(key, 'c'), 1)
+        eq(await waiters[2], (bkey, b'c'))
+        eq(await c.exists(key), False)
+
+    async def test_streams(self):
+        c = self.client
+        eq = self.assertEqual
+        key = self.randomkey()
+        eq(await c.execute('xadd', key, '1-1', 'a', '1'), b'1-1')
+        eq(await c.execute('xadd', key, '1-*', 'b', '2'), b'1-2')
+        id = await c.execute('xadd', key, 'maxlen', '2', '*', 'c', '3')
+        eq(await c.execute('xlen', key), 2)
+        eq(await c.type(key), 'stream')
+        entries = await c.execute('xrange', key, '-', '+')
+        eq(entries, [[b'1-2', [b'b', b'2']], [id, [b'c', b'3']]])
+        eq(await c.execute('xrevrange', key, '+', '-', 'count', 1),
+           entries[1:])
+        eq(await c.execute('xgroup', 'create', key, 'g', '0'), b'OK')
+        eq(await c.execute('xreadgroup', 'group', 'g', 'x', 'count', 1,
+                           'streams', key, '>'),
+           [[key.encode('utf-8'), entries[:1]]])
+        pending = await c.execute('xpending', key, 'g')
+        eq(pending[0], b'1')
+        eq(pending[3], [[b'x', b'1']])
+        eq(await c.execute('xack', key, 'g', entries[0][0]), 1)
+        eq((await c.execute('xpending', key, 'g'))[0], b'0')
+        eq(await c.execute('xdel', key, entries[0][0]), 1)
+        eq(await c.execute('xtrim', key, 'maxlen', 0), 1)
+        eq(await c.execute('xlen', key), 0)
+        eq(await c.execute('xgroup', 'destroy', key, 'g'), 1)
+        await self.wait.assertRaises(ResponseError, c.execute, 'xadd', key,
+                                     '1-1', 'a', '1')
+        await self.wait.assertRaises(ResponseError, c.execute, 'xreadgroup',
+                                     'group', 'h', 'x', 'streams', key, '>')
+
+    async def test_blocked_xread(self):
+        c = self.client
+        eq = self.assertEqual
+        key = self.randomkey()
+        bkey = key.encode('utf-8')
+        eq(await c.execute('xgroup', 'create', key, 'g', '$', 'mkstream'),
+           b'OK')
+        client = self.create_store('%s/9' % self.pulsards_uri).client()
+        other = self.create_store('%s/9' % self.pulsards_uri).client()
+        read = asyncio.ensure_future(
+            client.execute('xread', 'block', 0, 'streams', key, '$'))
+        await asyncio.sleep(0.05)
+        group = asyncio.ensure_future(
+            other.execute('xreadgroup', 'group', 'g', 'x', 'block', 0,
+                          'streams', key, '>'))
+        await asyncio.sleep(0.05)
+        # other tests block clients at the same time
+        self.assertFalse(read.done() or group.done())
+        self.assertTrue((await c.info())['blocked_clients'] >= 2)
+        eq(await c.execute('xadd', key, '5-1', 'a', '1'), b'5-1')
+        eq(await read, [[bkey, [[b'5-1', [b'a', b'1']]]]])
+        eq(await group, [[bkey, [[b'5-1', [b'a', b'1']]]]])
+        eq(await c.execute('xread', 'block', 10, 'streams', key, '$'), None)
+
+    async def test_keyspace_notifications(self):
+        c = self.client
+        eq = self.assertEqual
+        key = self.randomkey()
+        pubsub = c.pubsub()
+        listener = KeyListener(key)
+        pubsub.add_client(listener)
+        await pubsub.subscribe('__keyspace@9__:%s' % key,
+                               '__keyevent@9__:expired')
+        eq(await c.execute('config', 'get', 'notify-keyspace-events'),
+           [b'notify-keyspace-events', b''])
+        eq(await c.set(key, 'a'), True)
+        eq(await c.execute('config', 'set', 'notify-keyspace-events', 'KEA'),
+           b'OK')
+        try:
+            eq(await c.execute('config', 'get', 'notify-keyspace-events'),
+               [b'notify-keyspace-events', b'AKE'])
+            eq(await c.rpush(key + 'x', 1), 1)
+            eq(await c.delete(key), 1)
+            eq(await listener.get(), ('__keyspace@9__:%s' % key, b'del'))
+            eq(await c.set(key, 'b', px=10), True)
+            eq(await listener.get(), ('__keyspace@9__:%s' % key, b'set'))
+            eq(await listener.get(), ('__keyspace@9__:%s' % key, b'expire'))
+            await asyncio.sleep(0.05)
+            eq(await c.exists(key), False)
+            eq(await listener.get(),
+               ('__keyspace@9__:%s' % key, b'expired'))
+            eq(await listener.get(),
+               ('__keyevent@9__:expired', key.encode('utf-8')))
+            await self.wait.assertRaises(ResponseError, c.execute, 'config',
+                                         'set', 'notify-keyspace-events', 'Q')
+        finally:
+            await c.execute('config', 'set', 'notify-keyspace-events', '')
+            await pubsub.unsubscribe()
+
+    async def test_slowlog(self):
+        c = self.client
+        eq = self.assertEqual
+        key = self.randomkey()
+        eq(await c.execute('slowlog', 'reset'), b'OK')
+        eq(await c.execute('config', 'set', 'slowlog-log-slower-than', '0'),
+           b'OK')
+        try:
+            eq(await c.set(key, 'x'*200), True)
+            entries = await self._slowlog_entries(key)
+            eq(len(entries), 1)
+            eq(entries[0][3], [b'set', key.encode('utf-8'),
+                               b'x'*128 + b'... (72 more bytes)'])
+            self.assertTrue(await c.execute('slowlog', 'len') >= 1)
+        finally:
+            await c.execute('config', 'set', 'slowlog-log-slower-than',
+                            '10000')
+        eq(await c.execute('slowlog', 'reset'), b'OK')
+        eq(await c.get(key), b'x'*200)
+        eq(await self._slowlog_entries(key), [])
+
+    async def _slowlog_entries(self, key):
+        # entries of the slow log for commands on ``key``, other tests
+        # may be running at the same time
+        key = key.encode('utf-8')
+        entries = await self.client.execute('slowlog', 'get', '128')
+        return [e for e in entries if len(e[3]) > 1 and e[3][1] == key]
+
+    async def test_commandstats(self):
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.get(self.randomkey()), None)
+        info = await c.execute('info', 'commandstats')
+        self.assertTrue(info['cmdstat_get']['calls'] >= 1)
+        self.assertTrue('usec_per_call' in info['cmdstat_get'])
+        self.assertFalse('cmdstat_get' in await c.execute('info'))
+        histogram = await c.execute('latency', 'histogram', 'get', 'nope')
+        eq(len(histogram), 2)
+        eq(histogram[0], b'get')
+        eq(histogram[1][0], b'calls')
+        eq(histogram[1][2], b'histogram_usec')
+
+    async def test_client_tracking(self):
+        eq = self.assertEqual
+        store = self.create_store('%s/9' % self.pulsards_uri, pool_size=1,
+                                  client_cache=10)
+        try:
+            key = self.randomkey()
+            cache = store.cache
+            c = store.client()
+            other = self.client
+            eq(await c.set(key, 'a'), True)
+            eq(await c.get(key), b'a')
+            eq(await c.get(key), b'a')
+            eq((cache.hits, cache.misses), (1, 1))
+            eq(len(cache), 1)
+            await self.wait.assertRaises(ResponseError, c.execute, 'client',
+                                         'tracking', 'on', 'redirect', -5)
+            eq(await other.set(key, 'b'), True)
+            await asyncio.sleep(0.05)
+            eq(len(cache), 0)
+            eq(await c.get(key), b'b')
+            eq(await c.set(key, 'c'), True)
+            eq(len(cache), 0)
+            eq(await c.get(key), b'c')
+            eq(await other.delete(key), 1)
+            await asyncio.sleep(0.05)
+            eq(len(cache), 0)
+            eq(await c.get(key), None)
+        finally:
+            await store.close()
+
+    async def test_pipelined_replies(self):
+        host, port = self.app_cfg.addresses[0]
+        reader, writer = await asyncio.open_connection(
+            host, port, loop=pulsar.get_event_loop())
+        parser = redis_parser()()
+        writer.write(b''.join((parser.pack_command(('PING',)),
+                               parser.pack_command(('SELECT', 9)),
+                               parser.pack_command(('PING',)),
+                               parser.pack_command(('QUIT',)))))
+        data = await reader.read()
+        self.assertEqual(data, b'+PONG\r\n+OK\r\n+PONG\r\n+OK\r\n')
+        writer.close()
+
+    async def test_bgsave(self):
+        c = self.client
+        eq = self.assertEqual
+        eq(await c.set(self.randomkey(), 'hello'), True)
+        eq(await c.bgsave(), True)
+        info = await c.info()
+        eq(info['rdb_save_mode'], 'fork')
+        while info['rdb_bgsave_in_progress']:
+            await asyncio.sleep(0.05)
+            info = await c.info()
+        eq(info['rdb_last_bgsave_status'], 'ok')
+        eq(info['rdb_current_bgsave_time_sec'], -1)
+        self.assertTrue(info['rdb_last_bgsave_time_sec'] >= 0)
+        self.assertTrue(os.path.isfile(self.filename))
+
 
 @unittest.skipUnless(pulsar.HAS_C_EXTENSIONS, 'Requires cython extensions')
 class TestPulsarStorePyParser(TestPulsarStore):
@@ -0,0 +1,173 @@
+import asyncio
+import unittest
+from itertools import chain
+
+import pulsar
+from pulsar.apps.ds import PulsarDS, ResponseError, redis_parser
+from pulsar.apps.ds.replication import Backlog, request_size
+from pulsar.apps.test import sequential
+
+from tests.stores.test_pulsards import StoreMixin
+
+
+def drop_link(monitor, name):
+    '''Close the connection of the replica ``name`` with its primary'''
+    store = monitor.servers[name]._key_value_store
+    store._replication.master._writer.close()
+
+
+class TestBacklog(unittest.TestCase):
+
+    def test_circular_buffer(self):
+        backlog = Backlog(10)
+        self.assertEqual(backlog.since(0), b'')
+        backlog.append(b'abcdef')
+        self.assertEqual(backlog.offset, 6)
+        self.assertEqual(backlog.since(2), b'cdef')
+        backlog.append(b'ghijkl')
+        self.assertEqual(backlog.offset, 12)
+        self.assertEqual(len(backlog), 10)
+        self.assertEqual(backlog.since(2), b'cdefghijkl')
+        self.assertEqual(backlog.since(9), b'jkl')
+        self.assertEqual(backlog.since(1), None)
+        self.assertEqual(backlog.since(13), None)
+        backlog.append(b'0123456789ABC')
+        self.assertEqual(backlog.since(15), b'3456789ABC')
+        self.assertEqual(backlog.since(14), None)
+
+    def test_request_size(self):
+        pack = redis_parser()().pack_command
+        for request in ((b'set', b'foo', b'bar'),
+                        (b'select', b'12'),
+                        (b'rpush', b'a'*1000, b'', b'b'*10)):
+            self.assertEqual(request_size(request), len(pack(request)))
+
+
+@sequential
+class TestReplication(StoreMixin, unittest.TestCase):
+    primary_cfg = None
+    replica_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        name = cls.__name__.lower()
+        server = PulsarDS(name='%s_primary' % name, bind='127.0.0.1:0',
+                          key_value_scripting='python')
+        cls.primary_cfg = await pulsar.send('arbiter', 'run', server)
+        address = '%s:%s' % cls.primary_cfg.addresses[0]
+        server = PulsarDS(name='%s_replica' % name, bind='127.0.0.1:0',
+                          key_value_replicaof=address)
+        cls.replica_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.primary = cls.create_store('pulsar://%s/9' % address).client()
+        cls.replica = cls.create_store(
+            'pulsar://%s:%s/9' % cls.replica_cfg.addresses[0]).client()
+
+    @classmethod
+    async def tearDownClass(cls):
+        for cfg in (cls.replica_cfg, cls.primary_cfg):
+            if cfg is not None:
+                await pulsar.send('arbiter', 'kill_actor', cfg.name)
+
+    async def wait_for(self, command, *args, value=None):
+        for _ in range(100):
+            try:
+                result = await getattr(self.replica, command)(*args)
+            except ResponseError as exc:
+                # the replica is loading the snapshot of the primary
+                if not str(exc).startswith('Pulsar is loading'):
+                    raise
+            else:
+                if result == value:
+                    break
+            await asyncio.sleep(0.05)
+        self.assertEqual(result, value)
+
+    async def test_replication(self):
+        p = self.primary
+        self.assertEqual(await p.set('rstring', 'hello'), True)
+        self.assertEqual(await p.rpush('rlist', 'a', 'b'), 2)
+        self.assertEqual(await p.sadd('rset', 'a', 'b'), 2)
+        self.assertEqual(await p.hset('rhash', 'a', 1), True)
+        self.assertEqual(await p.zadd('rzset', 3, 'a'), 1)
+        self.assertEqual(await p.set('rvolatile', 'foo', ex=1000), True)
+        self.assertEqual(await p.incr('rcounter'), 1)
+        self.assertEqual(await p.incr('rcounter'), 2)
+        # scripts are replicated by the commands they execute
+        await p.eval("return redis.call('incr', KEYS[0])", ['rcounter'])
+        await self.wait_for('get', 'rcounter', value=b'3')
+        r = self.replica
+        self.assertEqual(await r.get('rstring'), b'hello')
+        self.assertEqual(await r.lrange('rlist', 0, -1), [b'a', b'b'])
+        self.assertEqual(await r.smembers('rset'), set((b'a', b'b')))
+        self.assertEqual(await r.hgetall('rhash'), {b'a': b'1'})
+        self.assertEqual(await r.zscore('rzset', 'a'), 3)
+        self.assertTrue(990 < await r.ttl('rvolatile') <= 1000)
+        self.assertEqual(await p.delete('rstring'), 1)
+        await self.wait_for('exists', 'rstring', value=False)
+        # replicas are read only
+        await self.wait.assertRaises(ResponseError, r.set, 'rstring', 'foo')
+        info = await r.info()
+        self.assertEqual(info['role'], 'slave')
+        self.assertEqual(info['master_link_status'], 'up')
+        info = await p.info()
+        self.assertEqual(info['role'], 'master')
+        self.assertEqual(info['connected_slaves'], 1)
+        self.assertTrue(info['master_repl_offset'] > 0)
+        role = await p.execute('role')
+        self.assertEqual(role[0], b'master')
+
+    async def test_partial_resync(self):
+        p = self.primary
+        self.assertEqual(await p.set('partial', 'a'), True)
+        await self.wait_for('get', 'partial', value=b'a')
+        info = await p.info()
+        full = info['sync_full']
+        await pulsar.send(self.replica_cfg.name, 'run', drop_link,
+                          self.replica_cfg.name)
+        self.assertEqual(await p.set('partial', 'b'), True)
+        self.assertEqual(await p.rpush('partial_list', 'x'), 1)
+        await self.wait_for('lrange', 'partial_list', 0, -1, value=[b'x'])
+        self.assertEqual(await self.replica.get('partial'), b'b')
+        info = await p.info()
+        self.assertEqual(info['sync_full'], full)
+        self.assertTrue(info['sync_partial_ok'] >= 1)
+
+    async def test_spop(self):
+        p = self.primary
+        members = ['m%s' % i for i in range(50)]
+        self.assertEqual(await p.sadd('rspop', *members), 50)
+        await p.spop('rspop')
+        remaining = await p.smembers('rspop')
+        self.assertEqual(len(remaining), 49)
+        # the member popped is replicated, not the pop
+        await self.wait_for('smembers', 'rspop', value=remaining)
+
+    async def test_ack(self):
+        p = self.primary
+        self.assertEqual(await p.set('ack', 'a'), True)
+        await self.wait_for('get', 'ack', value=b'a')
+        # replicas acknowledge the offset they processed
+        for _ in range(50):
+            _, offset, replicas = await p.execute('role')
+            if replicas and replicas[0][2] == offset:
+                break
+            await asyncio.sleep(0.1)
+        self.assertEqual(replicas[0][2], offset)
+
+    async def test_full_resync(self):
+        p = self.primary
+        r = self.replica
+        address = self.primary_cfg.addresses[0]
+        value = 'x'*200000
+        self.assertEqual(await p.set('rfull_big', value), True)
+        for i in range(0, 2500, 500):
+            await p.mset(*chain.from_iterable(('rfull%s' % j, j) for j
+                                              in range(i, i + 500)))
+        info = await p.info()
+        full = info['sync_full']
+        self.assertEqual(await r.execute('replicaof', 'no', 'one'), b'OK')
+        self.assertEqual(await r.execute('replicaof', *address), b'OK')
+        await self.wait_for('get', 'rfull2499', value=b'2499')
+        self.assertEqual(await r.get('rfull_big'), value.encode('utf-8'))
+        info = await p.info()
+        self.assertEqual(info['sync_full'], full + 1)
@@ -0,0 +1,191 @@
+import unittest
+
+import pulsar
+from pulsar.apps.ds import PulsarDS, ResponseError, NoScriptError
+from pulsar.apps.ds.scripting import lupa, sha1hex
+
+from tests.stores.test_pulsards import StoreMixin
+from tests.stores.lock import RedisLockTests
+
+
+class ScriptingMixin(StoreMixin):
+    app_cfg = None
+    language = 'lua'
+
+    @classmethod
+    async def setUpClass(cls):
+        server = PulsarDS(name=cls.__name__.lower(),
+                          bind='127.0.0.1:0',
+                          key_value_scripting=cls.language)
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.store = cls.create_store('pulsar://%s:%s/9' %
+                                     cls.app_cfg.addresses[0])
+        cls.client = cls.store.client()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def test_script_load_exists_flush(self):
+        c = self.client
+        script = self.scripts['one']
+        sha = await c.execute('script', 'load', script)
+        self.assertEqual(sha, sha1hex(script).encode('utf-8'))
+        self.assertEqual(await c.execute('script', 'exists', sha, 'foo'),
+                         [1, 0])
+        self.assertEqual(await c.evalsha(sha), 1)
+        self.assertEqual(await c.execute('script', 'flush'), b'OK')
+        self.assertEqual(await c.execute('script', 'exists', sha), [0])
+        await self.wait.assertRaises(NoScriptError, c.evalsha, sha)
+        self.assertEqual(await c.eval(script), 1)
+        info = await c.info()
+        self.assertTrue(info['number_of_cached_scripts'] >= 1)
+        self.assertEqual(info['scripting_engine'], self.language)
+
+    async def test_keys_and_args(self):
+        c = self.client
+        key = self.randomkey()
+        self.assertEqual(await c.eval(self.scripts['keys_args'],
+                                      keys=[key, 'b'], args=['x', 'y']),
+                         [key.encode('utf-8'), b'b', b'x', b'y'])
+        await self.wait.assertRaises(ResponseError, c.execute, 'eval',
+                                     self.scripts['one'], 3, 'a')
+        await self.wait.assertRaises(ResponseError, c.execute, 'eval',
+                                     self.scripts['one'], -1)
+
+    async def test_call(self):
+        c = self.client
+        key = self.randomkey()
+        self.assertEqual(await c.eval(self.scripts['incr'], keys=[key],
+                                      args=[5]), 6)
+        self.assertEqual(await c.get(key), b'6')
+        self.assertEqual(await c.eval(self.scripts['incr'], keys=[key],
+                                      args=[5]), 18)
+        self.assertEqual(await c.eval(self.scripts['status'], keys=[key]),
+                         b'OK')
+        self.assertEqual(await c.get(key), b'bar')
+
+    async def test_errors(self):
+        c = self.client
+        key = self.randomkey()
+        await c.sadd(key, 'a')
+        await self.wait.assertRaises(ResponseError, c.eval,
+                                     self.scripts['wrongtype'], keys=[key])
+        self.assertEqual(await c.eval(self.scripts['pcall'], keys=[key]),
+                         b'WRONGTYPE')
+        await self.wait.assertRaises(ResponseError, c.eval,
+                                     self.scripts['syntax'])
+        await self.wait.assertRaises(ResponseError, c.eval,
+                                     self.scripts['not_allowed'])
+        await self.wait.assertRaises(ResponseError, c.eval,
+                                     self.scripts['error_reply'])
+
+    async def test_transaction(self):
+        c = self.client
+        key = self.randomkey()
+        pipe = c.pipeline()
+        pipe.eval(self.scripts['incr'], keys=[key], args=[2])
+        pipe.eval(self.scripts['incr'], keys=[key], args=[2])
+        self.assertEqual(await pipe.commit(), [3, 9])
+
+
+@unittest.skipUnless(lupa, 'Requires lupa')
+class TestLuaScripting(ScriptingMixin, RedisLockTests, unittest.TestCase):
+    scripts = {
+        'one': 'return 1',
+        'keys_args': '''
+            local result = {}
+            for _, key in ipairs(KEYS) do table.insert(result, key) end
+            for _, arg in ipairs(ARGV) do table.insert(result, arg) end
+            return result
+            ''',
+        'incr': '''
+            local value = redis.call('incr', KEYS[1])
+            return redis.call('incrby', KEYS[1], value + ARGV[1] - 1)
+            ''',
+        'status': "return redis.call('set', KEYS[1], 'bar')",
+        'wrongtype': "return redis.call('get', KEYS[1])",
+        'pcall': '''
+            local reply = redis.pcall('get', KEYS[1])
+            return string.sub(reply.err, 1, 9)
+            ''',
+        'syntax': 'return (',
+        'not_allowed': "return redis.call('multi')",
+        'error_reply': "return redis.error_reply('ERR custom')"}
+
+    async def test_conversions(self):
+        c = self.client
+        key = self.randomkey()
+        await c.rpush(key, 'a', 'b')
+        self.assertEqual(await c.eval(
+            "return {1, 2.7, 'x', false, 'y', nil, 'z'}"),
+            [1, 2, b'x', None, b'y'])
+        self.assertEqual(await c.eval(
+            "return {redis.call('lrange', KEYS[1], 0, -1), "
+            "redis.call('get', KEYS[1] .. 'missing')}", keys=[key]),
+            [[b'a', b'b'], None])
+        self.assertEqual(await c.eval('return true'), 1)
+        self.assertEqual(await c.eval('return false'), None)
+        self.assertEqual(await c.eval("return redis.sha1hex('')"),
+                         sha1hex('').encode('utf-8'))
+
+    async def test_sandbox(self):
+        c = self.client
+        for name in ('os', 'io', 'python', 'require', 'loadfile'):
+            self.assertEqual(await c.eval('return type(%s)' % name), b'nil')
+
+
+class TestPythonScripting(ScriptingMixin, unittest.TestCase):
+    language = 'python'
+    scripts = {
+        'one': 'return 1',
+        'keys_args': 'return KEYS + ARGV',
+        'incr': '''
+            value = redis.call('incr', KEYS[0])
+            return redis.call('incrby', KEYS[0], value + int(ARGV[0]) - 1)
+            ''',
+        'status': "return redis.call('set', KEYS[0], 'bar')",
+        'wrongtype': "return redis.call('get', KEYS[0])",
+        'pcall': "return redis.pcall('get', KEYS[0]).value[:9]",
+        'syntax': 'return (',
+        'not_allowed': "return redis.call('multi')",
+        'error_reply': "return redis.error_reply('ERR custom')"}
+
+    async def test_restrictions(self):
+        c = self.client
+        escape = '''
+            gen = (x for x in ())
+            return gen.gi_frame.f_back.f_builtins['__import__']('os')
+            '''
+        for script in ('import os', 'open("foo")',
+                       'return ().__class__', 'return __builtins__',
+                       escape):
+            await self.wait.assertRaises(ResponseError, c.eval, script)
+
+
+@unittest.skipIf(lupa, 'Requires lupa not installed')
+class TestScriptingDisabled(StoreMixin, unittest.TestCase):
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        server = PulsarDS(name=cls.__name__.lower(), bind='127.0.0.1:0')
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.store = cls.create_store('pulsar://%s:%s/9' %
+                                     cls.app_cfg.addresses[0])
+        cls.client = cls.store.client()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    async def test_disabled(self):
+        c = self.client
+        # lua scripts are never executed as python code
+        await self.wait.assertRaises(ResponseError, c.eval, 'return 1')
+        await self.wait.assertRaises(ResponseError, c.execute, 'script',
+                                     'load', 'return 1')
+        info = await c.info()
+        self.assertEqual(info['scripting_engine'], 'disabled')
@@ -0,0 +1,190 @@
+import unittest
+
+import pulsar
+from pulsar.apps.ds import PulsarDS, ResponseError, COMMANDS_INFO
+from pulsar.apps.ds.cluster import (key_slot, slot_range, command_keys,
+                                    shard_filename, SLOTS)
+
+from tests.stores.test_pulsards import StoreMixin
+
+
+class TestSlots(unittest.TestCase):
+
+    def test_key_slot(self):
+        # same values as redis CLUSTER KEYSLOT
+        self.assertEqual(key_slot(b'foo'), 12182)
+        self.assertEqual(key_slot(b'123456789'), 12739)
+        self.assertEqual(key_slot(b'{user1000}.following'),
+                         key_slot(b'{user1000}.followers'))
+        self.assertEqual(key_slot(b'foo{}{bar}'), key_slot(b'foo{}{bar}'))
+        self.assertNotEqual(key_slot(b'foo{}{bar}'), key_slot(b'bar'))
+        self.assertEqual(key_slot(b'foo{{bar}}zap'), key_slot(b'{bar'))
+
+    def test_slot_range(self):
+        self.assertEqual(slot_range(0, 1), (0, SLOTS - 1))
+        ranges = [slot_range(i, 3) for i in range(3)]
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[2][1], SLOTS - 1)
+        self.assertEqual(ranges[0][1] + 1, ranges[1][0])
+        self.assertEqual(ranges[1][1] + 1, ranges[2][0])
+        for index, (start, end) in enumerate(ranges):
+            self.assertEqual(start*3 // SLOTS, index)
+            self.assertEqual(end*3 // SLOTS, index)
+
+    def test_command_keys(self):
+        def keys(*request):
+            return command_keys(COMMANDS_INFO[request[0]], list(request))
+        self.assertEqual(keys('get', b'a'), [b'a'])
+        self.assertEqual(keys('mget', b'a', b'b'), [b'a', b'b'])
+        self.assertEqual(keys('mset', b'a', b'1', b'b', b'2'), [b'a', b'b'])
+        self.assertEqual(keys('blpop', b'a', b'b', b'0'), [b'a', b'b'])
+        self.assertEqual(keys('bitop', b'and', b'c', b'a', b'b'),
+                         [b'c', b'a', b'b'])
+        self.assertEqual(keys('zunionstore', b'c', b'2', b'a', b'b',
+                              b'weights', b'1', b'2'), [b'c', b'a', b'b'])
+        self.assertEqual(keys('sort', b'a', b'limit', b'0', b'5',
+                              b'store', b'b'), [b'a', b'b'])
+        self.assertEqual(keys('ping'), ())
+        self.assertEqual(keys('scan', b'0'), ())
+        self.assertEqual(keys('dbsize'), ())
+
+    def test_shard_filename(self):
+        self.assertEqual(shard_filename('pulsards.rdb', 2), 'pulsards-2.rdb')
+        self.assertEqual(shard_filename('data', 0), 'data-0')
+
+
+class TestShards(StoreMixin, unittest.TestCase):
+    app_cfg = None
+
+    @classmethod
+    async def setUpClass(cls):
+        server = PulsarDS(name=cls.__name__.lower(),
+                          bind='127.0.0.1:0',
+                          concurrency='process',
+                          key_value_shards=2,
+                          key_value_scripting='python')
+        cls.app_cfg = await pulsar.send('arbiter', 'run', server)
+        cls.address = 'pulsar://%s:%s/9' % cls.app_cfg.addresses[0]
+        cls.store = cls.create_store(cls.address, pool_size=6)
+        cls.client = cls.store.client()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app_cfg is not None:
+            return pulsar.send('arbiter', 'kill_actor', cls.app_cfg.name)
+
+    def keys(self, prefix, number=20):
+        return ['%s%s' % (prefix, i) for i in range(number)]
+
+    async def test_info(self):
+        info = await self.client.info()
+        self.assertEqual(info['shards'], 2)
+        self.assertTrue(info['shard_index'] in (-1, 0, 1))
+
+    async def test_routing(self):
+        c = self.client
+        keys = self.keys('routing')
+        for i, key in enumerate(keys):
+            self.assertEqual(await c.set(key, i), True)
+        # any connection sees all keys
+        c2 = self.create_store(self.address, pool_size=1).client()
+        for i, key in enumerate(keys):
+            self.assertEqual(await c2.get(key), str(i).encode('utf-8'))
+            self.assertEqual(await c2.incr(key), i + 1)
+        self.assertEqual(await c.get(keys[3]), b'4')
+
+    async def test_mget_mset_del(self):
+        c = self.client
+        keys = self.keys('mget')
+        data = []
+        for key in keys:
+            data.extend((key, key.upper()))
+        self.assertEqual(await c.mset(*data), True)
+        values = await c.mget(*(keys + ['mget_missing']))
+        self.assertEqual(values[:-1], [key.upper().encode('utf-8')
+                                       for key in keys])
+        self.assertEqual(values[-1], None)
+        self.assertEqual(await c.delete(*(keys + ['mget_missing'])), 20)
+        self.assertEqual(await c.mget(*keys), [None]*20)
+        # wrong type
+        await c.sadd('mget_set', 'a')
+        await self.wait.assertRaises(ResponseError, c.mget, 'mget_set',
+                                     *keys)
+
+    async def test_sets(self):
+        c = self.client
+        self.assertEqual(await c.sadd('{a}s1', 1, 2, 3), 3)
+        self.assertEqual(await c.sadd('{b}s2', 3, 4), 2)
+        self.assertEqual(await c.sadd('{c}s3', 3, 5), 2)
+        keys = ('{a}s1', '{b}s2', '{c}s3')
+        self.assertEqual(await c.sunion(*keys),
+                         set((b'1', b'2', b'3', b'4', b'5')))
+        self.assertEqual(await c.sinter(*keys), set((b'3',)))
+        self.assertEqual(await c.sdiff(*keys), set((b'1', b'2')))
+        self.assertEqual(await c.sunionstore('{d}s4', *keys), 5)
+        self.assertEqual(await c.scard('{d}s4'), 5)
+        self.assertEqual(await c.sinterstore('{d}s4', *keys), 1)
+        self.assertEqual(await c.smembers('{d}s4'), set((b'3',)))
+        # hash tags keep keys in the same shard
+        self.assertEqual(await c.sadd('{a}s5', 2, 7), 2)
+        self.assertEqual(await c.smove('{a}s1', '{a}s5', 1), True)
+        self.assertEqual(await c.smembers('{a}s5'), set((b'1', b'2', b'7')))
+
+    async def test_crossslot(self):
+        c = self.client
+        keys = [key for key in self.keys('cross', 50)
+                if key_slot(key.encode('utf-8')) < SLOTS // 2][:1] + [
+                key for key in self.keys('cross', 50)
+                if key_slot(key.encode('utf-8')) >= SLOTS // 2][:1]
+        self.assertEqual(len(keys), 2)
+        await c.set(keys[0], 'foo')
+        await self.wait.assertRaises(ResponseError, c.rename, *keys)
+        self.assertEqual(await c.rename(keys[0], '{%s}x' % keys[0]), True)
+
+    async def test_transaction(self):
+        c = self.client
+        pipe = c.pipeline()
+        pipe.set('{tx}a', 1)
+        pipe.incr('{tx}a')
+        pipe.get('{tx}a')
+        self.assertEqual(await pipe.commit(), [True, 2, b'2'])
+        pipe = c.pipeline()
+        pipe.set('txa', 1)
+        pipe.set('txb', 1)
+        pipe.set('txc', 1)
+        await self.wait.assertRaises(ResponseError, pipe.commit)
+
+    async def test_dbsize_keys_scan(self):
+        store = self.create_store('pulsar://%s:%s/8' %
+                                  self.app_cfg.addresses[0])
+        c = store.client()
+        keys = self.keys('scan', 30)
+        for key in keys:
+            await c.set(key, 1)
+        self.assertEqual(await c.dbsize(), 30)
+        self.assertEqual(sorted(await c.keys('scan*')),
+                         sorted((key.encode('utf-8') for key in keys)))
+        found = []
+        cursor = 0
+        while True:
+            cursor, values = await c.scan(cursor, count=7)
+            found.extend(values)
+            if not cursor:
+                break
+        self.assertEqual(sorted(found),
+                         sorted((key.encode('utf-8') for key in keys)))
+        self.assertEqual(await c.flushdb(), True)
+        self.assertEqual(await c.dbsize(), 0)
+
+    async def test_scripting(self):
+        c = self.client
+        script = "return redis.call('incrby', KEYS[0], ARGV[0])"
+        sha = await c.execute('script', 'load', script)
+        # the script is loaded by all shards
+        for key in self.keys('script'):
+            self.assertEqual(await c.evalsha(sha, [key], [3]), 3)
+            self.assertEqual(await c.get(key), b'3')
+        keys = self.keys('script')
+        keys = [min(keys, key=lambda k: key_slot(k.encode('utf-8'))),
+                max(keys, key=lambda k: key_slot(k.encode('utf-8')))]
+        await self.wait.assertRaises(ResponseError, c.eval, script, keys, [3])
@@ -1,7 +1,10 @@
+import os
 import re
 import unittest
 
 from pulsar.apps.ds import redis_to_py_pattern
+from pulsar.apps.ds.pubsub import PatternIndex, literal_prefix
+from pulsar.apps.ds.utils import ForkSave
 
 
 class TestUtils(unittest.TestCase):
@@ -33,3 +36,55 @@ class TestUtils(unittest.TestCase):
         self.match(c, 'hello')
         self.match(c, 'hallo')
         self.not_match(c, 'hollo')
+        #
+        p = redis_to_py_pattern('user.*')
+        c = re.compile(p)
+        self.match(c, 'user.1')
+        self.not_match(c, 'userX1')
+
+    def test_pattern_index(self):
+        index = PatternIndex()
+        self.assertTrue(index.add(b'news.*', 1))
+        self.assertFalse(index.add(b'news.*', 1))
+        self.assertTrue(index.add(b'news.*', 2))
+        self.assertTrue(index.add(b'news.sport', 1))
+        self.assertTrue(index.add(b'*', 3))
+        self.assertTrue(index.add(b'n?ws.[st]*', 4))
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.subscriptions, 5)
+
+        def matched(channel):
+            return sorted(p.pattern for p in index.match(channel))
+
+        self.assertEqual(matched(b'news.sport'),
+                         [b'*', b'n?ws.[st]*', b'news.*', b'news.sport'])
+        self.assertEqual(matched(b'news.art'), [b'*', b'news.*'])
+        self.assertEqual(matched(b'news.sports'),
+                         [b'*', b'n?ws.[st]*', b'news.*'])
+        self.assertEqual(matched(b'newsXsport'), [b'*'])
+        self.assertEqual(matched(b''), [b'*'])
+        self.assertTrue(index.discard(b'news.*', 1))
+        self.assertFalse(index.discard(b'news.*', 1))
+        self.assertEqual(len(index), 4)
+        self.assertTrue(index.discard(b'news.*', 2))
+        self.assertFalse(b'news.*' in index)
+        self.assertEqual(index.subscriptions, 3)
+        self.assertEqual(matched(b'news.art'), [b'*'])
+        self.assertTrue(index.discard(b'*', 3))
+        self.assertEqual(matched(b'news.art'), [])
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix(b'foo'), b'foo')
+        self.assertEqual(literal_prefix(b'foo.*'), b'foo.')
+        self.assertEqual(literal_prefix(b'f\\*o'), b'f')
+        self.assertEqual(literal_prefix(b'[ab]c'), b'')
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_fork_save_reaped(self):
+        writer = ForkSave(lambda: None)
+        writer.start()
+        os.waitpid(writer.pid, 0)
+        # the child was reaped elsewhere, it is not alive anymore and
+        # its lost exit status counts as a failure
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(writer.exitcode, 1)
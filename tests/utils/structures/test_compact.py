@@ -0,0 +1,275 @@
+import unittest
+import pickle
+from random import randint
+
+from pulsar.utils.structures import Hash, Set
+from pulsar.utils.structures.compact import SetTable, HashTable
+
+
+class SmallHash(Hash):
+    __slots__ = ()
+    max_entries = 4
+    max_value = 8
+
+
+class SmallSet(Set):
+    __slots__ = ()
+    max_entries = 4
+    max_value = 8
+    max_intset_entries = 200
+
+
+class LargeSet(Set):
+    __slots__ = ()
+    max_intset_entries = 100000
+
+
+class TestHash(unittest.TestCase):
+
+    def test_listpack(self):
+        h = SmallHash()
+        h[b'a'] = b'1'
+        h[b'b'] = b'a'
+        self.assertEqual(h.encoding, 'listpack')
+        self.assertEqual(len(h), 2)
+        self.assertEqual(h[b'b'], b'a')
+        self.assertEqual(h.get(b'1'), None)
+        self.assertTrue(b'a' in h)
+        self.assertFalse(b'1' in h)
+        h[b'a'] = b'2'
+        self.assertEqual(h.mget((b'a', b'c')), [b'2', None])
+        self.assertEqual(h.flat(), [b'a', b'2', b'b', b'a'])
+        self.assertEqual(h.pop(b'a'), b'2')
+        self.assertEqual(h.pop(b'a', None), None)
+        self.assertRaises(KeyError, h.pop, b'a')
+        self.assertEqual(h, {b'b': b'a'})
+
+    def test_convert_entries(self):
+        h = SmallHash((b'f%d' % i, i) for i in range(4))
+        self.assertEqual(h.encoding, 'listpack')
+        h.update({b'f3': 5, b'f4': 4, b'f5': 5})
+        self.assertEqual(h.encoding, 'hashtable')
+        self.assertEqual(len(h), 6)
+        self.assertEqual(h[b'f3'], 5)
+        self.assertEqual(sorted(h.values()), [0, 1, 2, 4, 5, 5])
+
+    def test_convert_value(self):
+        h = SmallHash({b'a': b'1'})
+        h[b'a'] = b'x'*9
+        self.assertEqual(h.encoding, 'hashtable')
+        self.assertEqual(h, {b'a': b'x'*9})
+        h = SmallHash({b'x'*9: b'1'})
+        self.assertEqual(h.encoding, 'hashtable')
+
+    def test_pickle(self):
+        # test classes cannot be pickled by the test runner
+        for h in (Hash({b'a': b'1'}), Hash({b'a': b'x'*100})):
+            h2 = pickle.loads(pickle.dumps(h))
+            self.assertEqual(h2.encoding, h.encoding)
+            self.assertEqual(h2, h)
+
+
+class TestSet(unittest.TestCase):
+
+    def test_listpack(self):
+        s = SmallSet((b'a', b'b', b'a'))
+        self.assertEqual(s.encoding, 'listpack')
+        self.assertEqual(len(s), 2)
+        self.assertEqual(s, set((b'a', b'b')))
+        s.remove(b'a')
+        self.assertRaises(KeyError, s.remove, b'a')
+        self.assertEqual(s.pop(), b'b')
+        self.assertRaises(KeyError, s.pop)
+
+    def test_convert(self):
+        s = SmallSet((b'a', b'b', b'c', b'd'))
+        self.assertEqual(s.encoding, 'listpack')
+        s.update((b'a', b'e', b'f'))
+        self.assertEqual(s.encoding, 'hashtable')
+        self.assertEqual(len(s), 6)
+        s = SmallSet((b'x'*9,))
+        self.assertEqual(s.encoding, 'hashtable')
+
+    def test_operations(self):
+        s1 = SmallSet((b'a', b'b', b'c'))
+        s2 = SmallSet((b'b', b'c', b'd', b'e', b'f'))
+        self.assertEqual(s2.encoding, 'hashtable')
+        self.assertEqual(s1.union(s2),
+                         set((b'a', b'b', b'c', b'd', b'e', b'f')))
+        self.assertEqual(s1.intersection(s2), set((b'b', b'c')))
+        self.assertEqual(s1.difference(s2), set((b'a',)))
+        self.assertEqual(s1.intersection(s2).encoding, 'listpack')
+        s1.difference_update((b'a', b'b'))
+        self.assertEqual(s1, set((b'c',)))
+
+    def test_pickle(self):
+        for s in (Set((b'a', b'b')), Set(b'a%d' % i for i in range(200))):
+            s2 = pickle.loads(pickle.dumps(s))
+            self.assertEqual(s2.encoding, s.encoding)
+            self.assertEqual(s2, s)
+            s2.add(b'c')
+            self.assertTrue(b'c' in s2)
+
+
+class TestIntset(unittest.TestCase):
+
+    def test_intset(self):
+        s = SmallSet((b'3', b'-1', b'20', b'3'))
+        self.assertEqual(s.encoding, 'intset')
+        self.assertEqual(list(s), [b'-1', b'3', b'20'])
+        self.assertTrue(b'3' in s)
+        self.assertFalse(b'03' in s)
+        self.assertFalse(b'a' in s)
+        s.discard(b'3')
+        s.discard(b'4')
+        self.assertEqual(s, set((b'-1', b'20')))
+        member = s.pop()
+        self.assertTrue(member in (b'-1', b'20'))
+        self.assertEqual(s, set((b'-1', b'20')) - set((member,)))
+
+    def test_not_integers(self):
+        for member in (b'01', b'+1', b' 1', b'1.0', b'1_0'):
+            s = SmallSet((b'1', b'2'))
+            s.add(member)
+            self.assertEqual(s.encoding, 'listpack')
+            self.assertEqual(s, set((b'1', b'2', member)))
+        s = SmallSet((b'1', b'a'))
+        self.assertEqual(s.encoding, 'listpack')
+        s = SmallSet((b'1', b'2', b'3', b'4'))
+        s.add(b'a')
+        self.assertEqual(s.encoding, 'hashtable')
+
+    def test_convert(self):
+        s = SmallSet(b'%d' % i for i in range(200))
+        self.assertEqual(s.encoding, 'intset')
+        s.add(b'200')
+        self.assertEqual(s.encoding, 'hashtable')
+        self.assertEqual(len(s), 201)
+        self.assertTrue(b'200' in s)
+        s = SmallSet(b'%d' % i for i in range(201))
+        self.assertEqual(s.encoding, 'hashtable')
+
+    def test_operations(self):
+        s1 = SmallSet(b'%d' % i for i in range(0, 300, 3))
+        s2 = SmallSet(b'%d' % i for i in range(0, 300, 2))
+        s3 = SmallSet((b'6', b'7', b'12'))
+        self.assertEqual(s1.encoding, 'intset')
+        r = s1.intersection(s2, s3)
+        self.assertEqual(r.encoding, 'intset')
+        self.assertEqual(list(r), [b'6', b'12'])
+        r = s1.intersection(s2)
+        self.assertEqual(list(r), [b'%d' % i for i in range(0, 300, 6)])
+        r = s3.union(s1)
+        self.assertEqual(len(r), 101)
+        self.assertEqual(list(r)[:4], [b'0', b'3', b'6', b'7'])
+        r = s3.difference(s1, s2)
+        self.assertEqual(list(r), [b'7'])
+        r = s1.difference(s3)
+        self.assertEqual(len(r), 98)
+        self.assertEqual(s1.intersection(SmallSet((b'a', b'6'))),
+                         set((b'6',)))
+        self.assertEqual(s3.union(SmallSet((b'a',))),
+                         set((b'6', b'7', b'12', b'a')))
+
+    def test_large(self):
+        s = LargeSet()
+        members = set()
+        pending = False
+        for _ in range(20000):
+            n = randint(-10000, 10000)
+            s.add(b'%d' % n)
+            members.add(b'%d' % n)
+            if n % 7 == 0:
+                s.discard(b'%d' % (n + 1))
+                members.discard(b'%d' % (n + 1))
+            self.assertEqual(len(s), len(members))
+            pending = pending or bool(s._pending)
+        self.assertEqual(s.encoding, 'intset')
+        self.assertTrue(pending)
+        for n in range(-10000, 10000):
+            self.assertEqual(b'%d' % n in s, b'%d' % n in members)
+        self.assertEqual(s.intersection(LargeSet(members)), members)
+        self.assertEqual(list(s), sorted(members, key=int))
+        s2 = LargeSet()
+        s2.__setstate__(s.__getstate__())
+        self.assertEqual(s2, members)
+        for _ in range(100):
+            members.remove(s.pop())
+        self.assertEqual(s, members)
+
+    def test_random_members(self):
+        for members in ((b'%d' % i for i in range(100)),
+                        (b'a%d' % i for i in range(4)),
+                        (b'a%d' % i for i in range(100))):
+            s = Set(members)
+            size = len(s)
+            sample = s.random_members(size // 2)
+            self.assertEqual(len(set(sample)), size // 2)
+            self.assertTrue(all(member in s for member in sample))
+            repeated = s.random_members(50, False)
+            self.assertEqual(len(repeated), 50)
+            self.assertTrue(len(set(repeated)) > 1)
+            self.assertEqual(len(s), size)
+        s = Set(b'%d' % i for i in range(100))
+        popped = [s.pop() for _ in range(10)]
+        self.assertNotEqual(popped, [b'%d' % i for i in range(99, 89, -1)])
+        self.assertEqual(len(s), 90)
+        self.assertFalse(any(member in s for member in popped))
+
+    def test_pickle(self):
+        s = Set((b'1', b'2'))
+        s2 = pickle.loads(pickle.dumps(s))
+        self.assertEqual(s2.encoding, 'intset')
+        self.assertEqual(s2, s)
+
+
+class TestTable(unittest.TestCase):
+
+    def scan(self, table, count, change=None):
+        cursor, found = 0, []
+        while True:
+            cursor, keys = table.scan(cursor, count)
+            found.extend(keys)
+            if not cursor:
+                return found
+            if change:
+                change()
+
+    def test_remove(self):
+        t = HashTable((b'f%d' % i, i) for i in range(5))
+        self.assertEqual(t.pop(b'f1'), 1)
+        self.assertEqual(list(t), [b'f0', b'f4', b'f2', b'f3'])
+        self.assertEqual(t.flat(), [b'f0', 0, b'f4', 4, b'f2', 2, b'f3', 3])
+        self.assertEqual(t.pop(b'f3'), 3)
+        self.assertEqual(t.pop(b'f3', None), None)
+        self.assertRaises(KeyError, t.pop, b'f3')
+        self.assertEqual(t[b'f4'], 4)
+        t[b'f4'] = 5
+        self.assertEqual(dict(t.items()), {b'f0': 0, b'f2': 2, b'f4': 5})
+
+    def test_scan(self):
+        t = SetTable(b'm%d' % i for i in range(100))
+        self.assertEqual(sorted(self.scan(t, 7)), sorted(t))
+        self.assertEqual(t.scan(200, 7), t.scan(0, 7))
+        self.assertEqual(t.scan(5, 7), (0, [b'm%d' % i for i in range(5)]))
+
+    def test_scan_changes(self):
+        # members present during the whole scan are returned
+        t = SetTable(b'm%d' % i for i in range(100))
+        members = set(t)
+        added = iter(range(1000))
+
+        def change():
+            member = t.pop()
+            members.discard(member)
+            t.update(b'n%d' % next(added) for _ in range(20))
+
+        found = self.scan(t, 5, change)
+        self.assertTrue(members.issubset(found))
+
+    def test_pickle(self):
+        t = HashTable((b'f%d' % i, i) for i in range(5))
+        t2 = pickle.loads(pickle.dumps(t))
+        self.assertEqual(t2.flat(), t.flat())
+        t2.pop(b'f0')
+        self.assertEqual(list(t2), [b'f4', b'f1', b'f2', b'f3'])
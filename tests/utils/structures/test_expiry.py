@@ -0,0 +1,64 @@
+import unittest
+
+from pulsar.utils.structures import ExpiryHeap
+
+
+class TestExpiryHeap(unittest.TestCase):
+
+    def test_set_get(self):
+        h = ExpiryHeap()
+        self.assertEqual(len(h), 0)
+        h.set('a', 3)
+        h.set('b', 1)
+        self.assertEqual(len(h), 2)
+        self.assertTrue('a' in h)
+        self.assertEqual(h.get('a'), 3)
+        self.assertEqual(h.get('c'), None)
+        self.assertEqual(h.next_deadline(), 1)
+
+    def test_pop_expired(self):
+        h = ExpiryHeap()
+        for i in range(10):
+            h.set(i, i)
+        self.assertEqual(h.pop_expired(4.5), [0, 1, 2, 3, 4])
+        self.assertEqual(len(h), 5)
+        self.assertEqual(h.pop_expired(20, 2), [5, 6])
+        self.assertEqual(h.next_deadline(), 7)
+
+    def test_refresh(self):
+        h = ExpiryHeap()
+        h.set('a', 1)
+        h.set('a', 5)
+        self.assertEqual(len(h), 1)
+        self.assertEqual(h.pop_expired(2), [])
+        self.assertEqual(h.next_deadline(), 5)
+        self.assertEqual(h.pop_expired(5), ['a'])
+        self.assertEqual(len(h), 0)
+        self.assertEqual(h.next_deadline(), None)
+
+    def test_discard(self):
+        h = ExpiryHeap()
+        h.set('a', 1)
+        self.assertEqual(h.discard('a'), 1)
+        self.assertEqual(h.discard('a'), None)
+        self.assertEqual(h.pop_expired(2), [])
+
+    def test_compact(self):
+        h = ExpiryHeap()
+        for i in range(1000):
+            h.set('a', i)
+        self.assertEqual(len(h), 1)
+        self.assertTrue(len(h._heap) < 100)
+        self.assertEqual(h.pop_expired(1000), ['a'])
+
+    def test_sample(self):
+        h = ExpiryHeap()
+        self.assertEqual(h.sample(5), [])
+        for i in range(10):
+            h.set(i, i)
+        h.discard(3)
+        pairs = h.sample(20)
+        self.assertTrue(pairs)
+        for key, when in pairs:
+            self.assertEqual(key, when)
+            self.assertNotEqual(key, 3)
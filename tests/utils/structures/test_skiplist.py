@@ -1,7 +1,7 @@
-from random import randint
+from random import randint, shuffle
 import unittest
 
-from pulsar.utils.structures import Skiplist
+from pulsar.utils.structures import Skiplist, BlockList
 from pulsar.apps.test import populate
 
 
@@ -89,3 +89,58 @@ class TestSkiplist(unittest.TestCase):
         self.assertEqual(sl.remove_range_by_score(0, 3), 0)
         sl.insert(1, 'bla')
         self.assertEqual(sl.remove_range_by_score(0, 3), 1)
+
+
+class TestBlockList(TestSkiplist):
+    skiplist = BlockList
+
+    def test_many_blocks(self):
+        data = [(randint(0, 100), 'v%d' % i) for i in range(5000)]
+        sl = self.skiplist(data)
+        data.sort()
+        self.assertEqual(list(sl), data)
+        self.assertTrue(len(sl._values) > 1)
+        for i in (0, 1, 1023, 1024, 2500, 4999):
+            self.assertEqual(sl.index(*data[i]), i)
+        self.assertEqual(list(sl.range(1000, 3000, True)), data[1000:3000])
+        self.assertEqual(sl.remove_range(100, 4000), 3900)
+        del data[100:4000]
+        self.assertEqual(list(sl), data)
+        self.assertEqual(sl.count(10, 50),
+                         len([s for s, _ in data if 10 <= s <= 50]))
+
+    def test_remove(self):
+        data = [(i % 7, 'v%d' % i) for i in range(3000)]
+        sl = self.skiplist(data)
+        shuffle(data)
+        for score, value in data[:2990]:
+            sl.remove(score, value)
+        self.assertEqual(list(sl), sorted(data[2990:]))
+        self.assertEqual(sl.index(*data[0]), None)
+        self.assertRaises(ValueError, sl.remove, *data[0])
+
+    def test_interleaved_ranks(self):
+        sl = self.skiplist((i, 'v%d' % i) for i in range(0, 6000, 2))
+        data = list(sl)
+        for n in range(200):
+            if n % 3:
+                pair = (randint(0, 3000)*2 + 1, 'w%d' % n)
+                if pair not in data:
+                    sl.insert(*pair)
+                    data.append(pair)
+                    data.sort()
+            else:
+                pair = data.pop(randint(0, len(data) - 1))
+                sl.remove(*pair)
+            i = randint(0, len(data) - 1)
+            self.assertEqual(sl.index(*data[i]), i)
+            self.assertEqual(list(sl.range(i, i + 3, True)), data[i:i + 3])
+        self.assertEqual(sl.score_rank(3000),
+                         len([s for s, _ in data if s < 3000]))
+        self.assertEqual(list(sl), data)
+
+    def test_lex_rank(self):
+        sl = self.skiplist((0, v) for v in ('a', 'b', 'c'))
+        self.assertEqual(sl.lex_rank('b'), 1)
+        self.assertEqual(sl.lex_rank('b', True), 2)
+        self.assertEqual(sl.lex_rank('z'), 3)
@@ -0,0 +1,148 @@
+import unittest
+import pickle
+
+from pulsar.utils.structures import Stream, StreamGroup
+from pulsar.utils.structures.stream import MAX_ID, id_after, id_before
+
+
+class SmallStream(Stream):
+    __slots__ = ()
+    node_size = 4
+
+
+def fill(n, stream=None):
+    if stream is None:
+        stream = SmallStream()
+    for i in range(1, n + 1):
+        stream.add((i, 0), [b'f', str(i).encode('utf-8')])
+    return stream
+
+
+class TestStream(unittest.TestCase):
+
+    def test_add(self):
+        s = fill(10)
+        self.assertEqual(len(s), 10)
+        self.assertEqual(s.nodes, 3)
+        self.assertEqual(s.last_id, (10, 0))
+        self.assertEqual(s.entries_added, 10)
+        self.assertEqual(s.first(), ((1, 0), [b'f', b'1']))
+        self.assertEqual(s.last(), ((10, 0), [b'f', b'10']))
+        self.assertEqual(s.get((4, 0)), [b'f', b'4'])
+        self.assertEqual(s.get((4, 1)), None)
+        self.assertRaises(ValueError, s.add, (10, 0), [b'f', b'x'])
+        # field names are shared with the first entry of the node
+        node = s._nodes[0]
+        self.assertTrue(node.names[1] is node.names[0])
+
+    def test_next_id(self):
+        s = Stream()
+        self.assertEqual(s.next_id(5), (5, 0))
+        s.add((5, 0), [b'a', b'1'])
+        self.assertEqual(s.next_id(5), (5, 1))
+        self.assertEqual(s.next_id(4), None)
+        self.assertEqual(s.next_id(5, 0), None)
+        self.assertEqual(s.next_id(5, 3), (5, 3))
+        self.assertEqual(id_after((1, MAX_ID[1])), (2, 0))
+        self.assertEqual(id_before((2, 0)), (1, MAX_ID[1]))
+
+    def test_range(self):
+        s = fill(10)
+
+        def ids(entries):
+            return [id[0] for id, _ in entries]
+
+        self.assertEqual(ids(s), list(range(1, 11)))
+        self.assertEqual(ids(s.range((3, 0), (8, 0))), [3, 4, 5, 6, 7, 8])
+        self.assertEqual(ids(s.range((3, 1), (8, 0), 2)), [4, 5])
+        self.assertEqual(ids(s.range((3, 0), (8, 0), reverse=True)),
+                         [8, 7, 6, 5, 4, 3])
+        self.assertEqual(ids(s.range((3, 0), (7, 5), 2, True)), [7, 6])
+        self.assertEqual(ids(s.range(end=(20, 0), reverse=True)),
+                         list(range(10, 0, -1)))
+        self.assertEqual(ids(s.range((8, 0), (3, 0))), [])
+        self.assertEqual(ids(s.range(count=0)), [])
+        self.assertEqual(ids(s.after((8, 0))), [9, 10])
+        self.assertEqual(ids(s.after((10, 0))), [])
+        self.assertEqual(ids(Stream().range(reverse=True)), [])
+
+    def test_remove(self):
+        s = fill(10)
+        self.assertTrue(s.remove((4, 0)))
+        self.assertFalse(s.remove((4, 0)))
+        for i in (1, 2, 3):
+            s.remove((i, 0))
+        self.assertEqual(s.nodes, 2)
+        self.assertEqual(len(s), 6)
+        self.assertEqual(s.max_deleted_id, (4, 0))
+        self.assertEqual([id[0] for id, _ in s], [5, 6, 7, 8, 9, 10])
+
+    def test_trim(self):
+        s = fill(10)
+        self.assertEqual(s.trim(maxlen=7, approx=True), 0)
+        self.assertEqual(s.trim(maxlen=6, approx=True), 4)
+        self.assertEqual(s.trim(maxlen=3), 3)
+        self.assertEqual(s.first()[0], (8, 0))
+        self.assertEqual(s.max_deleted_id, (7, 0))
+        s = fill(10)
+        self.assertEqual(s.trim(minid=(6, 0)), 5)
+        self.assertEqual(s.trim(minid=(10, 0), approx=True), 3)
+        self.assertEqual(len(s), 2)
+        s = fill(20)
+        self.assertEqual(s.trim(maxlen=0, approx=True, limit=10), 8)
+        self.assertEqual(s.trim(maxlen=0), 12)
+        self.assertEqual(s.nodes, 0)
+        self.assertEqual(s.last_id, (20, 0))
+
+    def test_pickle(self):
+        # test classes cannot be pickled by the test runner
+        s = fill(250, Stream())
+        self.assertTrue(s.nodes > 1)
+        s.groups[b'g'] = group = StreamGroup((0, 0))
+        group.deliver(group.consumer(b'c', 1), (1, 0), 1)
+        s2 = pickle.loads(pickle.dumps(s))
+        self.assertEqual(list(s2), list(s))
+        self.assertEqual(s2.last_id, s.last_id)
+        self.assertEqual(list(s2.groups[b'g'].pending), [(1, 0)])
+
+
+class TestStreamGroup(unittest.TestCase):
+
+    def test_deliver_ack(self):
+        group = StreamGroup((0, 0))
+        c1 = group.consumer(b'c1', 100)
+        c2 = group.consumer(b'c2', 100)
+        group.deliver(c1, (1, 0), 100)
+        group.deliver(c2, (2, 0), 101)
+        group.deliver(c1, (3, 0), 102, noack=True)
+        self.assertEqual(group.last_id, (3, 0))
+        self.assertEqual(group.entries_read, 3)
+        self.assertEqual(list(group.pending), [(1, 0), (2, 0)])
+        self.assertEqual(list(c1.pending), [(1, 0)])
+        self.assertTrue(group.ack((1, 0)))
+        self.assertFalse(group.ack((1, 0)))
+        self.assertEqual(list(c1.pending), [])
+        self.assertEqual(group.remove_consumer(b'c2'), 1)
+        self.assertEqual(group.remove_consumer(b'c2'), None)
+        self.assertEqual(len(group.pending), 0)
+
+    def test_claim(self):
+        group = StreamGroup((0, 0))
+        c1 = group.consumer(b'c1', 100)
+        c2 = group.consumer(b'c2', 100)
+        for i in range(1, 5):
+            group.deliver(c1, (i, 0), 100)
+        group.deliver(c2, (5, 0), 100)
+        pe = group.claim((3, 0), c2, 200, 4)
+        self.assertEqual(pe.consumer, b'c2')
+        self.assertEqual(pe.delivery_count, 4)
+        self.assertEqual(list(c2.pending), [(3, 0), (5, 0)])
+        self.assertEqual(list(c1.pending), [(1, 0), (2, 0), (4, 0)])
+        # claiming an entry not pending adds it to the group
+        group.claim((0, 5), c2, 200)
+        self.assertEqual(list(group.pending)[0], (0, 5))
+        self.assertEqual(list(c2.pending)[0], (0, 5))
+        pending = group.pending_range((2, 0), (4, 0), 10)
+        self.assertEqual([id for id, _ in pending], [(2, 0), (3, 0), (4, 0)])
+        pending = group.pending_range((0, 0), MAX_ID, 10, b'c2', 100, 250)
+        self.assertEqual([id for id, _ in pending], [(5, 0)])
@@ -1,7 +1,7 @@
 import unittest
 from random import randint
 
-from pulsar.utils.structures import Zset
+from pulsar.utils.structures import Zset, Skiplist
 from pulsar.apps.test import populate
 
 
@@ -93,3 +93,67 @@ class TestZset(unittest.TestCase):
                        (4, 'b'), (5, 'c')])
         self.assertEqual(s.remove_range(1, 4), 3)
         self.assertEqual(s, self.zset([(1.2, 'bla'), (5, 'c')]))
+
+    def test_same_score_order(self):
+        s = self.zset([(3, 'foo'), (1, 'x'), (3, 'bla'), (3, 'pippo')])
+        self.assertEqual(list(s), ['x', 'bla', 'foo', 'pippo'])
+        self.assertEqual(s.rank('foo'), 2)
+        s.add(3, 'a')
+        self.assertEqual(s.rank('a'), 1)
+        self.assertEqual(s.rank('pippo'), 4)
+
+    def test_range_by_lex(self):
+        s = self.zset((0, v) for v in 'abcdefg')
+        self.assertEqual(list(s.range_by_lex()), list('abcdefg'))
+        self.assertEqual(list(s.range_by_lex('b', 'e')), list('bcde'))
+        self.assertEqual(list(s.range_by_lex('b', 'e', False, False)),
+                         list('cd'))
+        self.assertEqual(list(s.range_by_lex('c')), list('cdefg'))
+        self.assertEqual(list(s.range_by_lex(None, 'bb')), list('ab'))
+        self.assertEqual(list(s.range_by_lex('b', None, start=1, num=2)),
+                         list('cd'))
+        self.assertEqual(list(s.range_by_lex('e', 'b')), [])
+        self.assertEqual(s.lex_count(), 7)
+        self.assertEqual(s.lex_count('b', 'e', include_max=False), 3)
+        self.assertEqual(s.lex_count('e', 'b'), 0)
+
+    def test_encoding(self):
+        s = self.zset([(1, 'a'), (2, 'b')])
+        self.assertEqual(s.encoding, 'listpack')
+        s.add(3, 'c'*100)
+        self.assertEqual(s.encoding, 'blocklist')
+        self.assertEqual(list(s), ['a', 'b', 'c'*100])
+        self.assertEqual(s.rank('b'), 1)
+
+    def test_scan(self):
+        s = self.zset((i, 'm%d' % i) for i in range(50))
+        cursor, found = 0, []
+        while True:
+            cursor, members = s.scan(cursor, 7)
+            found.extend(members)
+            if not cursor:
+                break
+            # changing the score of members does not move them in the scan
+            for member in list(s):
+                s.add(s.score(member) + 100, member)
+        self.assertEqual(sorted(found), sorted(s))
+
+
+class BlockListZset(Zset):
+    max_entries = 0
+
+
+class TestZsetBlockList(TestZset):
+    zset = BlockListZset
+
+    def test_encoding(self):
+        s = self.zset([(1, 'a')])
+        self.assertEqual(s.encoding, self.zset.engine.encoding)
+
+
+class SkiplistZset(BlockListZset):
+    engine = Skiplist
+
+
+class TestZsetSkiplist(TestZsetBlockList):
+    zset = SkiplistZset